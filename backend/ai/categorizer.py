@@ -0,0 +1,412 @@
+import argparse
+import array
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database import models
+from database.search import tokenize
+
+"""
+Expense categorizer: multinomial naive Bayes over hashed features, trained
+per deployment on the (description, category_id) pairs already stored.
+
+Features are word unigrams, word bigrams and character trigrams of each
+word (so "coffe" and "coffees" still look like "coffee"), hashed into
+N_FEATURES buckets with crc32, which is stable across processes.
+
+The model file holds raw counts, not probabilities, so it can be updated
+incrementally. Workers memory-map it read-only and look at the file's
+stat at most every CHECK_INTERVAL seconds, so a retrained model (written
+to a temp file and renamed over the old one) is picked up without a
+restart. Only the pages of the features a description hits are read.
+
+Training:
+
+    python -m ai.categorizer train            # incremental: new expenses and corrections
+    python -m ai.categorizer train --full     # from scratch
+    python -m ai.categorizer evaluate         # accuracy on a sample of stored expenses
+
+Incremental training adds expenses newer than the model's expense
+watermark and replays category_corrections rows (written by
+crud.update_expense): the description is removed from the old category
+and added to the new one. The API also starts an incremental retrain in
+the background once CATEGORY_RETRAIN_AFTER corrections are pending.
+"""
+
+logger = logging.getLogger("spendsense.categorizer")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATEGORY_MODEL_PATH = os.getenv("CATEGORY_MODEL_PATH", os.path.join(BASE_DIR, "category_model.bin"))
+# Suggestions below this probability are not used to fill a missing category
+CATEGORIZER_MIN_CONFIDENCE = float(os.getenv("CATEGORIZER_MIN_CONFIDENCE", "0.6"))
+CATEGORY_RETRAIN_AFTER = int(os.getenv("CATEGORY_RETRAIN_AFTER", "50"))
+
+N_FEATURES = 1 << 18
+ALPHA = 0.1  # additive smoothing
+CHECK_INTERVAL = 5.0
+TRAIN_BATCH_SIZE = 10_000
+
+# magic, format version, n_features, n_classes, expense watermark, correction watermark, documents
+_HEADER = struct.Struct("<4sIIIqqd")
+_MAGIC = b"SSNB"
+_FORMAT = 1
+
+Suggestion = Tuple[int, float]  # (category_id, probability)
+
+
+def features(description: Optional[str]) -> Counter:
+    "Hashed feature counts of a description."
+    tokens = [token for token in tokenize(description or "") if not token.isdigit()]
+    grams = [f"w:{token}" for token in tokens]
+    grams += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"<{token}>"
+        grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return Counter(zlib.crc32(gram.encode("utf-8")) & (N_FEATURES - 1) for gram in grams)
+
+
+#  Model file
+
+class Counts:
+    """Writable model state: per-class document and token totals and a class-major count matrix."""
+
+    def __init__(self, class_ids: Sequence[int] = (), class_docs: Sequence[float] = (),
+                 class_tokens: Sequence[float] = (), counts: Optional[array.array] = None,
+                 expense_watermark: int = 0, correction_watermark: int = 0, documents: float = 0.0):
+        self.class_ids = list(class_ids)
+        self.class_docs = list(class_docs)
+        self.class_tokens = list(class_tokens)
+        self.counts = counts if counts is not None else array.array("f")
+        self.expense_watermark = expense_watermark
+        self.correction_watermark = correction_watermark
+        self.documents = documents
+        self._index = {category_id: i for i, category_id in enumerate(self.class_ids)}
+
+    def class_index(self, category_id: int) -> int:
+        index = self._index.get(category_id)
+        if index is None:
+            index = self._index[category_id] = len(self.class_ids)
+            self.class_ids.append(category_id)
+            self.class_docs.append(0.0)
+            self.class_tokens.append(0.0)
+            self.counts.frombytes(bytes(4 * N_FEATURES))
+        return index
+
+    def add(self, description: Optional[str], category_id: int, weight: float = 1.0) -> None:
+        "Count a description (weight=-1 removes it again, e.g. for a correction)."
+        index = self.class_index(category_id)
+        base = index * N_FEATURES
+        total = 0
+        for feature, n in features(description).items():
+            self.counts[base + feature] = max(0.0, self.counts[base + feature] + weight * n)
+            total += n
+        self.class_tokens[index] = max(0.0, self.class_tokens[index] + weight * total)
+        self.class_docs[index] = max(0.0, self.class_docs[index] + weight)
+        self.documents = max(0.0, self.documents + weight)
+
+    def save(self, path: str) -> None:
+        n_classes = len(self.class_ids)
+        # A unique temp file next to the model, so concurrent saves never write into the same file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _FORMAT, N_FEATURES, n_classes,
+                                     self.expense_watermark, self.correction_watermark, self.documents))
+                f.write(struct.pack(f"<{n_classes}q", *self.class_ids))
+                f.write(struct.pack(f"<{n_classes}d", *self.class_docs))
+                f.write(struct.pack(f"<{n_classes}d", *self.class_tokens))
+                f.write(self.counts.tobytes())
+            os.chmod(tmp, 0o644)  # mkstemp creates it 0600
+            # Readers keep their mapping of the old file until they reload
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class Model:
+    """Read-only view of a model file through mmap."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_features, n_classes, expense_watermark, correction_watermark, documents = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _FORMAT or n_features != N_FEATURES:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a categorizer model this version can read")
+        offset = _HEADER.size
+        self.class_ids = list(struct.unpack_from(f"<{n_classes}q", self._mmap, offset))
+        offset += 8 * n_classes
+        self.class_docs = list(struct.unpack_from(f"<{n_classes}d", self._mmap, offset))
+        offset += 8 * n_classes
+        self.class_tokens = list(struct.unpack_from(f"<{n_classes}d", self._mmap, offset))
+        offset += 8 * n_classes
+        self.counts = memoryview(self._mmap)[offset:offset + 4 * N_FEATURES * n_classes].cast("f")
+        self.expense_watermark = expense_watermark
+        self.correction_watermark = correction_watermark
+        self.documents = documents
+
+        self.log_prior = [math.log((docs + 1) / (documents + n_classes)) for docs in self.class_docs]
+        self.log_denominator = [math.log(tokens + ALPHA * N_FEATURES) for tokens in self.class_tokens]
+
+    def probabilities(self, feature_counts: Dict[int, int]) -> List[float]:
+        scores = list(self.log_prior)
+        counts = self.counts
+        for c in range(len(scores)):
+            base = c * N_FEATURES
+            denominator = self.log_denominator[c]
+            scores[c] += sum(n * (math.log(counts[base + f] + ALPHA) - denominator) for f, n in feature_counts.items())
+        top = max(scores)
+        exp = [math.exp(score - top) for score in scores]
+        total = sum(exp)
+        return [value / total for value in exp]
+
+    def predict(self, description: Optional[str]) -> Optional[Suggestion]:
+        feature_counts = features(description)
+        if not feature_counts or not self.class_ids:
+            return None
+        probabilities = self.probabilities(feature_counts)
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.class_ids[best], round(probabilities[best], 4)
+
+    def to_counts(self) -> Counts:
+        counts = array.array("f")
+        counts.frombytes(self.counts.cast("B"))
+        return Counts(self.class_ids, self.class_docs, self.class_tokens, counts,
+                      self.expense_watermark, self.correction_watermark, self.documents)
+
+    def close(self) -> None:
+        self.counts.release()
+        self._mmap.close()
+
+
+#  Training
+
+# One training run per process at a time: requests that trigger a retrain and the
+# scheduler's categorizer job would otherwise all read the old model and save over each other
+_training = threading.Lock()
+
+
+def train(db: Session, path: str = CATEGORY_MODEL_PATH, full: bool = False) -> dict:
+    """
+    Train (incrementally unless full, or when there is no model yet) and save
+    the model. Skipped when another training run in this process is going.
+    """
+    if not _training.acquire(blocking=False):
+        return {"path": path, "skipped": "training already running"}
+    try:
+        return _train(db, path, full)
+    finally:
+        _training.release()
+
+
+def _train(db: Session, path: str, full: bool) -> dict:
+    counts = None
+    if not full and os.path.exists(path):
+        model = Model(path)
+        counts = model.to_counts()
+        model.close()
+    if counts is None:
+        counts = Counts()
+    started = time.perf_counter()
+    previous_watermark = counts.expense_watermark
+
+    # Upper bounds first, so rows written while training are left for the next run
+    max_expense = db.execute(select(func.max(models.Expense.expense_id))).scalar() or 0
+    max_correction = db.execute(select(func.max(models.CategoryCorrection.id))).scalar() or 0
+
+    # Identical (description, category) pairs are counted once and weighted
+    pairs = db.execute(
+        select(models.Expense.description, models.Expense.category_id, func.count())
+        .where(
+            models.Expense.expense_id > previous_watermark,
+            models.Expense.expense_id <= max_expense,
+            models.Expense.deleted_at.is_(None),
+            models.Expense.description.is_not(None),
+        )
+        .group_by(models.Expense.description, models.Expense.category_id)
+        .execution_options(yield_per=TRAIN_BATCH_SIZE)
+    )
+    expenses = 0
+    for description, category_id, n in pairs:
+        counts.add(description, category_id, weight=n)
+        expenses += n
+
+    # Corrections of expenses the model already counted under their old category
+    corrections = db.execute(
+        select(models.CategoryCorrection.description, models.CategoryCorrection.old_category_id,
+               models.CategoryCorrection.new_category_id)
+        .where(
+            models.CategoryCorrection.id > counts.correction_watermark,
+            models.CategoryCorrection.id <= max_correction,
+            models.CategoryCorrection.expense_id <= previous_watermark,
+        )
+        .order_by(models.CategoryCorrection.id)
+    ).all()
+    for description, old_category_id, new_category_id in corrections:
+        counts.add(description, old_category_id, weight=-1)
+        counts.add(description, new_category_id)
+
+    counts.expense_watermark = max_expense
+    counts.correction_watermark = max_correction
+    counts.save(path)
+    return {
+        "path": path,
+        "incremental": previous_watermark > 0,
+        "expenses": expenses,
+        "corrections": len(corrections),
+        "classes": len(counts.class_ids),
+        "documents": counts.documents,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+#  Process-wide categorizer
+
+class Categorizer:
+    def __init__(self, path: str = CATEGORY_MODEL_PATH, check_interval: float = CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._model: Optional[Model] = None
+        self._stat = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def model(self) -> Optional[Model]:
+        "The current model, reloaded when the file on disk was replaced."
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._model
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                key = None
+            if key != self._stat:
+                # The old mapping is left to the garbage collector: a request
+                # on another thread may still be reading it
+                self._model = Model(self.path) if key else None
+                self._stat = key
+        return self._model
+
+    def suggest(self, descriptions: Sequence[Optional[str]]) -> List[Optional[Suggestion]]:
+        "(category_id, probability) per description, or None without a model or usable words."
+        model = self.model()
+        if model is None:
+            return [None] * len(descriptions)
+        # Batches repeat descriptions a lot; classify each distinct one once
+        cache: Dict[str, Optional[Suggestion]] = {}
+        suggestions = []
+        for description in descriptions:
+            key = (description or "").strip().lower()
+            if key not in cache:
+                cache[key] = model.predict(key)
+            suggestions.append(cache[key])
+        return suggestions
+
+    def fill(self, descriptions: Sequence[Optional[str]]) -> List[Optional[int]]:
+        "Category ids for descriptions the model is confident about, else None."
+        return [
+            suggestion[0] if suggestion and suggestion[1] >= CATEGORIZER_MIN_CONFIDENCE else None
+            for suggestion in self.suggest(descriptions)
+        ]
+
+    def maybe_retrain(self, db: Session) -> bool:
+        "Start an incremental retrain in the background once enough corrections are pending."
+        from database import sharding
+        model = self.model()
+        # Training reads one database, so sharded deployments retrain with the CLI instead
+        if _training.locked() or model is None or sharding.enabled():
+            return False
+        pending = db.execute(
+            select(func.count()).where(models.CategoryCorrection.id > model.correction_watermark)
+        ).scalar()
+        if pending < CATEGORY_RETRAIN_AFTER:
+            return False
+        # Several requests (and the scheduler's job) can get here at once; one of them trains
+        if not _training.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._retrain, name="categorizer-retrain", daemon=True).start()
+        return True
+
+    def _retrain(self) -> None:
+        # Runs with _training held by maybe_retrain
+        from database.database import SessionLocal
+        try:
+            with SessionLocal() as db:
+                result = _train(db, self.path, full=False)
+            logger.info("Categorizer retrained: %s", result)
+            self._checked_at = 0.0
+        except Exception:
+            logger.warning("Categorizer retrain failed", exc_info=True)
+        finally:
+            _training.release()
+
+
+categorizer = Categorizer()
+
+
+#  CLI
+
+def evaluate(db: Session, path: str = CATEGORY_MODEL_PATH, sample: int = 5000) -> dict:
+    "Accuracy and coverage on the newest stored expenses (optimistic: they were trained on)."
+    rows = db.execute(
+        select(models.Expense.description, models.Expense.category_id)
+        .where(models.Expense.deleted_at.is_(None), models.Expense.description.is_not(None))
+        .order_by(models.Expense.expense_id.desc())
+        .limit(sample)
+    ).all()
+    model_categorizer = Categorizer(path, check_interval=0)
+    started = time.perf_counter()
+    suggestions = model_categorizer.suggest([description for description, _ in rows])
+    seconds = time.perf_counter() - started
+    confident = [(s, c) for s, (_, c) in zip(suggestions, rows) if s and s[1] >= CATEGORIZER_MIN_CONFIDENCE]
+    return {
+        "sample": len(rows),
+        "accuracy": round(sum(1 for s, (_, c) in zip(suggestions, rows) if s and s[0] == c) / max(1, len(rows)), 4),
+        "coverage": round(len(confident) / max(1, len(rows)), 4),
+        "confident_accuracy": round(sum(1 for s, c in confident if s[0] == c) / max(1, len(confident)), 4),
+        "descriptions_per_second": round(len(rows) / seconds) if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the expense categorizer")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_parser = sub.add_parser("train")
+    train_parser.add_argument("--full", action="store_true", help="retrain from scratch")
+    train_parser.add_argument("--path", default=CATEGORY_MODEL_PATH)
+    evaluate_parser = sub.add_parser("evaluate")
+    evaluate_parser.add_argument("--path", default=CATEGORY_MODEL_PATH)
+    evaluate_parser.add_argument("--sample", type=int, default=5000)
+    args = parser.parse_args()
+
+    from database.database import SessionLocal
+    with SessionLocal() as db:
+        if args.command == "train":
+            result = train(db, args.path, full=args.full)
+        else:
+            if not os.path.exists(args.path):
+                sys.exit(f"no model at {args.path}, run `python -m ai.categorizer train` first")
+            result = evaluate(db, args.path, args.sample)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ from .schemas import IntentType, ParsedIntent, QueryType, TimeRange
 
 # Mapping of IntentType to trigger keywords/phrases
 INTENT_KEYWORDS: Dict[IntentType, List[str]] = {
+    # First: "how much do i spend on subscriptions" is about subscriptions, not the monthly total
+    IntentType.recurring_charges: ["subscription", "recurring", "repeat charges", "regular payments"],
     IntentType.monthly_total: ["total spend", "monthly total", "how much did i spend", "total spending"],
     IntentType.category_breakdown: ["category breakdown", "spending by category", "how is my spending divided"],
     IntentType.spending_trend: ["spending trend", "spending over time", "how has my spending changed", "pattern"],
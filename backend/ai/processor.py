@@ -1,7 +1,9 @@
+import math
 import re
+import time
 from typing import Any, Dict, Optional, List
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
 from datetime import datetime, timedelta
 from statistics import mean, stdev
 from collections import defaultdict
@@ -15,11 +17,27 @@ from .schemas import (
 )
 
 from database import crud as db_crud
+from database.category_cache import catalogue
+from database import stats as expense_stats
+from database import cold
+from .categorizer import categorizer
+from . import recurring
+from monitoring import metrics, profiling
 
 
 # Main entry point to process AI queries
 def process_ai_query(parsed_intent: ParsedIntent, db: Session, user_id: int) -> AIResponse:
     """Process the AI query based on the parsed intent and return an appropriate response."""
+    start = time.perf_counter()
+    response = _dispatch_intent(parsed_intent, db, user_id)
+    metrics.INTENT_DURATION.observe(
+        time.perf_counter() - start, parsed_intent.intent.value, response.execution_status or "unknown"
+    )
+    profiling.tag(intent=parsed_intent.intent.value, execution_status=response.execution_status)
+    return response
+
+
+def _dispatch_intent(parsed_intent: ParsedIntent, db: Session, user_id: int) -> AIResponse:
     if parsed_intent.intent == IntentType.advice:
         return AIResponse(
             response="You could reduce expenses by setting category limits and reviewing recurring charges.",
@@ -57,17 +75,16 @@ def process_ai_query(parsed_intent: ParsedIntent, db: Session, user_id: int) ->
 
         elif parsed_intent.intent == IntentType.highest_expense:
             return highest_expense(parsed_intent, db, user_id)
+
+        elif parsed_intent.intent == IntentType.recurring_charges:
+            return recurring_charges(parsed_intent, db, user_id)
         
         elif parsed_intent.intent == IntentType.budget_check:
             return check_budget_alerts(db, user_id)
         elif parsed_intent.intent == IntentType.suggest_budget:
             category_id = None
             if parsed_intent.category:
-                category = db.query(models.Category).filter(
-                    models.Category.name.ilike(f"%{parsed_intent.category}%")
-                ).first()
-                if category:
-                    category_id = category.category_id
+                category_id = catalogue.match(db, parsed_intent.category)
             return suggest_budget_from_history(db, user_id, category_id)
         else :
             return AIResponse(
@@ -296,10 +313,15 @@ def spending_trend(parsed_intent: ParsedIntent, db: Session, user_id: int) -> AI
         func.extract('month', models.Expense.created_at)
     )
 
-    results = query.all()
+    totals = defaultdict(float)
+    for year, month, total_amount in query.all():
+        totals[(int(year), int(month))] += float(total_amount)
+    # Months in the cold tier come from their rollups (by expense month)
+    for key, total_amount in cold.month_totals(db, user_id, start_date, end_date).items():
+        totals[key] += total_amount
     trend = [
-        {"year": int(year), "month": int(month), "total_amount": float(total_amount)}
-        for year, month, total_amount in results
+        {"year": year, "month": month, "total_amount": total_amount}
+        for (year, month), total_amount in sorted(totals.items())
     ]
 
     if not trend:
@@ -344,16 +366,20 @@ def forecast_spending(parsed_intent: ParsedIntent, db: Session, user_id: int) ->
         func.extract('month', models.Expense.expense_date)
     )
 
-    results = query.all()
+    totals = defaultdict(float)
+    for year, month, total_amount in query.all():
+        totals[(int(year), int(month))] += float(total_amount)
+    for key, total_amount in cold.month_totals(db, user_id, start_date, end_date).items():
+        totals[key] += total_amount
 
-    if len(results) < 3:
+    if len(totals) < 3:
         return AIResponse(
             response="Not enough historical data for accurate forecasting. Need at least 3 months of expense data.",
             execution_status="failed"
         )
 
     # Extract spending amounts
-    historical_spending = [float(r.total_amount) for r in results]
+    historical_spending = [total for _, total in sorted(totals.items())]
     
     # Calculate trend
     if len(historical_spending) >= 2:
@@ -412,98 +438,107 @@ def forecast_spending(parsed_intent: ParsedIntent, db: Session, user_id: int) ->
 
 # Detect anomalies
 def detect_anomalies(parsed_intent: ParsedIntent, db: Session, user_id: int) -> AIResponse:
-    """Detect spending anomalies in the user's expenses using IQR(Interquartile Range) Method."""
+    """Detect spending anomalies in the user's expenses using IQR(Interquartile Range) Method.
+    Quartiles and averages come from the running per-category statistics (database/stats.py),
+    so only the expenses above a category's bound are read."""
     end_date = datetime.now()
     start_date = end_date - timedelta(days=180)
-    
-    expenses = db.query(models.Expense).filter(
-        models.Expense.user_id == user_id,
-        models.Expense.deleted_at.is_(None),
-        models.Expense.expense_date >= start_date
-    ).all()
 
-    if not expenses:
+    category_stats = expense_stats.get_stats(db, user_id)
+    if not category_stats:
         return AIResponse(
             response="No expenses found to analyze for anomalies.",
             execution_status="failed"
         )
 
-    # Simple anomaly: >2 standard deviations from category average
-    category_data = defaultdict(list)
+    # (medium, high) thresholds: Q3 + 1.5 IQR and Q3 + 3 IQR
+    bounds = {category_id: s.bounds() for category_id, s in category_stats.items()}
+    bounds = {category_id: b for category_id, b in bounds.items() if b}
+
+    expenses = db.query(models.Expense).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.deleted_at.is_(None),
+        models.Expense.expense_date >= start_date,
+        or_(*[
+            and_(models.Expense.category_id == category_id, models.Expense.amount > upper_bound)
+            for category_id, (upper_bound, _) in bounds.items()
+        ])
+    ).all() if bounds else []
+
+    anomalies = []
     for exp in expenses:
-        category_data[exp.category_id].append({
-            'amount': float(exp.amount),
-            'date': exp.expense_date,
-            'description': exp.description,
-            'expense_id': exp.expense_id
+        amount = float(exp.amount)
+        avg_amount = category_stats[exp.category_id].mean
+        deviation_pct = ((amount - avg_amount) / avg_amount * 100) if avg_amount > 0 else 0
+        anomalies.append({
+            "expense_id": exp.expense_id,
+            "category_id": exp.category_id,
+            "amount": amount,
+            "description": exp.description,
+            "date": exp.expense_date.isoformat(),
+            "category_average": round(avg_amount, 2),
+            "deviation_percent": round(deviation_pct, 1),
+            "severity": "high" if amount > bounds[exp.category_id][1] else "medium"
         })
 
-    anomalies = []
+    anomalies.sort(key=lambda x: (x['severity'] == 'high', x['amount']), reverse=True)
 
-    for category_id, transactions in category_data.items():
-        if len(transactions) < 5:
-            continue
-        
-        amounts = [t['amount'] for t in transactions]
-        sorted_amounts = sorted(amounts)
-        
-        # Calculate IQR
-        n = len(sorted_amounts)
-        q1_idx = n // 4
-        q3_idx = (3 * n) // 4
-        q1 = sorted_amounts[q1_idx]
-        q3 = sorted_amounts[q3_idx]
-        iqr = q3 - q1
-        
-        upper_bound = q3 + 1.5 * iqr
-        avg_amount = mean(amounts)
-        
-        # Find anomalies
-        for transaction in transactions:
-            amount = transaction['amount']
-            
-            if amount > upper_bound and iqr > 0:
-                if avg_amount > 0:
-                    deviation_pct = ((amount - avg_amount) / avg_amount * 100)
-                else:
-                    deviation_pct = 0
-                
-                severity = "high" if amount > q3 + 3 * iqr else "medium"
-                
-                anomalies.append({
-                    "expense_id": transaction['expense_id'],
-                    "category_id": category_id,
-                    "amount": amount,
-                    "description": transaction['description'],
-                    "date": transaction['date'].isoformat(),
-                    "category_average": round(avg_amount, 2),
-                    "deviation_percent": round(deviation_pct, 1),
-                    "severity": severity
-                })
-        
-        anomalies.sort(key=lambda x: (x['severity'] == 'high', x['amount']), reverse=True)
-    
-        if not anomalies:
-            return AIResponse(
+    if not anomalies:
+        return AIResponse(
             response="No unusual spending patterns detected. Your expenses look consistent!",
             data={"anomalies": []},
             execution_status="success"
-            )
-        
-        top = anomalies[0]
-        response_text = f"Found {len(anomalies)} unusual transactions. "
-        response_text += f"Most significant: ${top['amount']:.2f} for '{top['description']}' "
-        response_text += f"({top['deviation_percent']:+.0f}% vs usual)."
+        )
+    
+    top = anomalies[0]
+    response_text = f"Found {len(anomalies)} unusual transactions. "
+    response_text += f"Most significant: ${top['amount']:.2f} for '{top['description']}' "
+    response_text += f"({top['deviation_percent']:+.0f}% vs usual)."
+
+    return AIResponse(
+        response=response_text,
+        data={"anomalies": anomalies[:10], "total_anomalies": len(anomalies)},
+        execution_status="success"
+    )
 
+# Recurring charges
+def recurring_charges(parsed_intent: ParsedIntent, db: Session, user_id: int) -> AIResponse:
+    """List the user's subscriptions and other recurring charges found by the batch detector (ai/recurring.py)."""
+    charges = recurring.list_recurring(db, user_id)
+    if not charges:
         return AIResponse(
-            response=response_text,
-            data={"anomalies": anomalies[:10], "total_anomalies": len(anomalies)},
+            response="I haven't found any recurring charges or subscriptions in your expenses.",
+            data={"recurring_charges": [], "monthly_total": 0},
             execution_status="success"
-            )
+        )
+
+    monthly_total = sum(c["monthly_cost"] for c in charges)
+    upcoming = charges[0]
+    response_text = f"You have {len(charges)} recurring charges costing about ${monthly_total:.2f}/month. "
+    response_text += f"Next up: {upcoming['description']} (${upcoming['amount']:.2f}) around {upcoming['next_expected']:%b %d}."
+
+    return AIResponse(
+        response=response_text,
+        data={
+            "recurring_charges": [
+                {**c, "first_seen": c["first_seen"].isoformat(), "last_seen": c["last_seen"].isoformat(),
+                 "next_expected": c["next_expected"].isoformat()}
+                for c in charges
+            ],
+            "monthly_total": round(monthly_total, 2)
+        },
+        execution_status="success"
+    )
 
 # Smart categorize
-def smart_categorize(expense_description: str) -> str:
-    """Basic keyword-based categorization."""
+def smart_categorize(expense_description: str, db: Optional[Session] = None) -> str:
+    """Category name for a description: the trained categorizer (ai/categorizer.py)
+    when a db is given and the model is confident, else keyword-based."""
+    if db is not None:
+        category_id = categorizer.fill([expense_description])[0]
+        name = catalogue.name_for(db, category_id) if category_id is not None else None
+        if name:
+            return name.lower()
     categories = ["food", "entertainment", "transportation", "utilities", "health", "shopping"]
     expense_description = expense_description.lower()
     for cat in categories:
@@ -523,6 +558,7 @@ def budget_suggestions(parsed_intent: ParsedIntent, db: Session, user_id: int) -
         models.Category.name,
         models.Category.category_id,
         func.sum(models.Expense.amount).label('total_amount'),
+        func.count(models.Expense.expense_id).label('expense_count'),
         func.extract('month', models.Expense.expense_date).label('month'),
         func.extract('year', models.Expense.expense_date).label('year')
     ).join(
@@ -547,8 +583,13 @@ def budget_suggestions(parsed_intent: ParsedIntent, db: Session, user_id: int) -
 
     # Organize data by category
     category_spending = defaultdict(list)
-    for cat_name, cat_id, total, month, year in query:
+    category_counts = defaultdict(int)
+    category_ids = {}
+    for cat_name, cat_id, total, expense_count, month, year in query:
         category_spending[cat_name].append(float(total))
+        category_counts[cat_name] += expense_count
+        category_ids[cat_name] = cat_id
+    category_stats = expense_stats.get_stats(db, user_id)
 
     suggestions = []
     total_potential_savings = 0
@@ -565,10 +606,11 @@ def budget_suggestions(parsed_intent: ParsedIntent, db: Session, user_id: int) -
         else:
             trend = 0
         
-        if len(monthly_amounts) > 1:
-            volatility = stdev(monthly_amounts)
-        else:
-            volatility = 0
+        # Monthly volatility implied by the spread of single expenses (running
+        # statistics): a month of n expenses has a standard deviation of sqrt(n) * stdev
+        stats = category_stats.get(category_ids[category])
+        expenses_per_month = category_counts[category] / len(monthly_amounts)
+        volatility = stats.stdev * math.sqrt(expenses_per_month) if stats else 0
         
         advice_items = []
         potential_savings = 0
@@ -703,8 +745,15 @@ def generate_personalized_advice(db: Session, user_id: int) -> AIResponse:
     advice_points.extend([
         "Track expenses consistently for better insights",
         "Set category-specific budgets to control spending",
-        "Review your subscriptions monthly for potential savings"
     ])
+    subscriptions = recurring.list_recurring(db, user_id)
+    if subscriptions:
+        monthly_subscriptions = sum(c["monthly_cost"] for c in subscriptions)
+        advice_points.append(
+            f"Review your {len(subscriptions)} recurring charges (about ${monthly_subscriptions:.2f}/month) for potential savings"
+        )
+    else:
+        advice_points.append("Review your subscriptions monthly for potential savings")
     
     response_text = "Here are some personalized tips based on your spending: " + ". ".join(advice_points)
     
@@ -721,7 +770,7 @@ def generate_personalized_advice(db: Session, user_id: int) -> AIResponse:
 def check_budget_alerts(db: Session, user_id: int) -> AIResponse:
     "Check if user is approaching or exceeding their budgets. Returns alerts and recommendations."
 
-    statuses = db_crud.get_all_budget_statuses
+    statuses = db_crud.get_all_budget_statuses(db, user_id)
 
     if not statuses:
         return AIResponse(
@@ -814,8 +863,7 @@ def suggest_budget_from_history(db: Session, user_id: int, category_id: Optional
     
     if category_id:
         query = query.filter(models.Expense.category_id == category_id)
-        category = db_crud.get_category_by_id(db, category_id)
-        category_name = category.name if category else "Unknown"
+        category_name = catalogue.name_for(db, category_id) or "Unknown"
     else:
         category_name = "Overall"
     
@@ -867,9 +915,9 @@ def budget_suggestions_with_limits(parsed_intent: ParsedIntent, db: Session, use
     
     for budget in budgets:
         if budget.category_id:
-            category = db_crud.get_category_by_id(db, budget.category_id)
-            if category:
-                budget_by_category[category.name] = {
+            category_name = catalogue.name_for(db, budget.category_id)
+            if category_name:
+                budget_by_category[category_name] = {
                     "budget_amount": budget.amount,
                     "period": budget.period
                 }
@@ -0,0 +1,376 @@
+import argparse
+import os
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from database import columnar, models
+from database.search import tokenize
+
+"""
+Recurring charge detection: subscriptions, bills and other charges that
+come back with the same description and a similar amount at a regular
+interval.
+
+For each user the expenses of the last LOOKBACK_DAYS are grouped by
+merchant key (the description lowercased, without numbers or punctuation,
+so "NETFLIX.COM 0423" and "Netflix.com 0523" match). In every group with
+at least MIN_OCCURRENCES charges:
+
+1. charges further than AMOUNT_TOLERANCE from the group's median amount
+   are set aside (a one-off bigger order at the same shop),
+2. the rest are sorted by date and each gap between consecutive charges
+   is put in a histogram over CADENCES,
+3. the most common cadence wins; confidence is the share of gaps that fit
+   it times the share of charges with the typical amount.
+
+Groups above MIN_CONFIDENCE are stored in recurring_charges with the
+expected date of the next charge. Sorting is the only super-linear step,
+so a pass is O(n log n) in the user's expenses.
+
+    python -m ai.recurring detect          # users with expenses newer than the last run
+    python -m ai.recurring detect --full   # every user
+    python -m ai.recurring detect --full --snapshot --workers 4
+
+The incremental run reads the expense_id watermark in batch_watermarks and
+re-detects only the merchant keys that got new charges, reading just the
+rows whose description contains one of those merchants' first words. Edits and deletes
+of older expenses are picked up by the next run that touches the same
+merchant, or by --full, which the scheduler runs nightly (recurring-full).
+
+With --snapshot a full run refreshes the column snapshot
+(database/columnar.py) and reads the users' rows from its memory-mapped
+files instead of the table, split across --workers processes. Its
+watermark is the snapshot's highest expense_id, so rows written since are
+left for the next incremental run.
+"""
+
+LOOKBACK_DAYS = int(os.getenv("RECURRING_LOOKBACK_DAYS", "400"))
+MIN_OCCURRENCES = 3
+AMOUNT_TOLERANCE = 0.15
+MIN_CONFIDENCE = 0.6
+MAX_KEY_TOKENS = 4
+WATERMARK = "recurring_charges"
+SCAN_BATCH_SIZE = 50_000
+USERS_PER_QUERY = 500  # incremental runs read the affected users in chunks
+
+# (name, typical interval in days, tolerance in days)
+CADENCES = (
+    ("weekly", 7, 1),
+    ("biweekly", 14, 2),
+    ("monthly", 30.44, 3.5),
+    ("quarterly", 91.31, 7),
+    ("yearly", 365.25, 12),
+)
+_MAX_GAP = int(CADENCES[-1][1] + CADENCES[-1][2]) + 1
+# Cadence index per whole-day gap, so the histogram is a list lookup per gap
+_CADENCE_OF_GAP = [
+    next((i for i, (_, days, tolerance) in enumerate(CADENCES) if abs(gap - days) <= tolerance), None)
+    for gap in range(_MAX_GAP + 1)
+]
+
+
+class Charge(NamedTuple):
+    expense_id: int
+    expense_date: datetime
+    amount: float
+    category_id: int
+    description: Optional[str]
+
+
+@lru_cache(maxsize=65_536)
+def merchant_key(description: Optional[str]) -> str:
+    tokens = [token for token in tokenize(description or "") if not any(ch.isdigit() for ch in token)]
+    return " ".join(tokens[:MAX_KEY_TOKENS])
+
+
+def detect(key: str, charges: List[Charge]) -> Optional[dict]:
+    "A recurring charge found in one merchant's charges, or None."
+    if len(charges) < MIN_OCCURRENCES:
+        return None
+    typical = statistics.median(charge.amount for charge in charges)
+    regular = sorted(
+        (charge for charge in charges if abs(charge.amount - typical) <= AMOUNT_TOLERANCE * abs(typical)),
+        key=lambda charge: charge.expense_date,
+    )
+    if len(regular) < MIN_OCCURRENCES:
+        return None
+
+    gaps = [(b.expense_date - a.expense_date).total_seconds() / 86400 for a, b in zip(regular, regular[1:])]
+    histogram = Counter(_CADENCE_OF_GAP[round(gap)] for gap in gaps if gap <= _MAX_GAP)
+    histogram.pop(None, None)
+    if not histogram:
+        return None
+    cadence, hits = histogram.most_common(1)[0]
+    confidence = hits / len(gaps) * len(regular) / len(charges)
+    if confidence < MIN_CONFIDENCE:
+        return None
+
+    name, typical_days, tolerance = CADENCES[cadence]
+    interval = statistics.median(gap for gap in gaps if abs(gap - typical_days) <= tolerance + 0.5)
+    last = regular[-1]
+    return {
+        "merchant_key": key,
+        "description": last.description,
+        "category_id": last.category_id,
+        "amount": round(typical, 2),
+        "cadence": name,
+        "interval_days": round(interval, 2),
+        "occurrences": len(regular),
+        "first_seen": regular[0].expense_date,
+        "last_seen": last.expense_date,
+        "next_expected": last.expense_date + timedelta(days=interval),
+        "confidence": round(confidence, 3),
+    }
+
+
+def detect_user(charges: Iterable[Charge], keys: Optional[Set[str]] = None) -> List[dict]:
+    "Recurring charges among one user's charges (only the given merchant keys, if any)."
+    groups: Dict[str, List[Charge]] = defaultdict(list)
+    for charge in charges:
+        key = merchant_key(charge.description)
+        if key and (keys is None or key in keys):
+            groups[key].append(charge)
+    return [found for key, group in groups.items() if (found := detect(key, group))]
+
+
+#  Batch pass
+
+def _charges_stmt(since: datetime):
+    return (
+        select(models.Expense.user_id, models.Expense.expense_id, models.Expense.expense_date,
+               models.Expense.amount, models.Expense.category_id, models.Expense.description)
+        .where(models.Expense.deleted_at.is_(None), models.Expense.expense_date >= since)
+    )
+
+
+def _prefilter(keys: Set[str]) -> list:
+    "SQL filters that keep the rows that can have one of the merchant keys (a superset)."
+    words = {key.split()[0] for key in keys if key}
+    if not words or not all(word.isascii() for word in words):
+        # lower() in SQL doesn't strip accents the way tokenize() does
+        return []
+    return [or_(*[models.Expense.description.ilike(f"%{word}%") for word in words])]
+
+
+def _user_batches(rows):
+    "(user_id, charges) per user from rows ordered by user_id."
+    for user_id, user_rows in groupby(rows, key=lambda row: row[0]):
+        yield user_id, [Charge(*row[1:]) for row in user_rows]
+
+
+def _snapshot_batches(snapshot, first: int, last: int, since: int) -> List[Tuple[int, int, List[dict]]]:
+    "(user_id, charges read, recurring charges) of the snapshot's users[first:last] (run in map_users workers)."
+    dates = snapshot.columns["expense_date"]
+    results = []
+    for index in range(first, last):
+        rows = snapshot.rows_at(index)
+        # A user's rows are sorted by date, so the lookback window is a suffix
+        rows = slice(rows.start + int(dates[rows].searchsorted(since)), rows.stop)
+        if rows.start == rows.stop:
+            continue
+        charges = list(map(
+            Charge,
+            snapshot.columns["expense_id"][rows].tolist(),
+            dates[rows].astype("datetime64[us]").tolist(),
+            snapshot.columns["amount"][rows].tolist(),
+            snapshot.columns["category_id"][rows].tolist(),
+            snapshot.texts(rows),
+        ))
+        results.append((int(snapshot.users[index]), len(charges), detect_user(charges)))
+    return results
+
+
+def _up_to(high: int, id_range: Optional[Tuple[int, int]]):
+    "Rows up to the run's upper bound; in a shard, also rows copied in from other shards' id ranges."
+    if id_range is None:
+        return models.Expense.expense_id <= high
+    return or_(models.Expense.expense_id <= high, models.Expense.expense_id >= id_range[1])
+
+
+def _affected_batches(db: Session, since: datetime, up_to, affected: Dict[int, Set[str]]):
+    "Charges of the affected users, USERS_PER_QUERY users per statement."
+    users = sorted(affected)
+    for start in range(0, len(users), USERS_PER_QUERY):
+        chunk = users[start:start + USERS_PER_QUERY]
+        rows = db.connection().execute(
+            _charges_stmt(since)
+            .where(models.Expense.user_id.in_(chunk), up_to,
+                   *_prefilter(set().union(*(affected[user_id] for user_id in chunk))))
+            .order_by(models.Expense.user_id)
+        )
+        yield from _user_batches(rows)
+
+
+def _save(db: Session, user_id: int, found: List[dict], keys: Optional[Set[str]] = None) -> None:
+    "Replace the user's stored charges for the given merchant keys (all of them on a full run) with `found`."
+    if keys is not None:
+        db.execute(delete(models.RecurringCharge).where(
+            models.RecurringCharge.user_id == user_id, models.RecurringCharge.merchant_key.in_(keys),
+        ))
+    if found:
+        now = datetime.utcnow()
+        db.execute(insert(models.RecurringCharge), [{**row, "user_id": user_id, "updated_at": now} for row in found])
+
+
+def _set_watermark(db: Session, expense_id: int) -> None:
+    state = db.get(models.BatchWatermark, WATERMARK)
+    if state is None:
+        db.add(models.BatchWatermark(name=WATERMARK, expense_id=expense_id))
+    else:
+        state.expense_id = expense_id
+
+
+def run(db: Session, full: bool = False, now: Optional[datetime] = None,
+        id_range: Optional[Tuple[int, int]] = None, snapshot=None, workers: int = 1) -> dict:
+    """Detect recurring charges, incrementally unless `full`. Returns counters for logging.
+    `id_range` is the (start, end) of the expense ids a shard allocates (database/sharding.py):
+    rows a rebalance copied in keep their ids from another range and are never new.
+    A full run reads the users' rows from `snapshot` (a database.columnar.Snapshot) when given."""
+    started = time.perf_counter()
+    since = (now or datetime.utcnow()) - timedelta(days=LOOKBACK_DAYS)
+    state = db.get(models.BatchWatermark, WATERMARK)
+    watermark = 0 if full or state is None else state.expense_id
+    if snapshot is not None:
+        # Every row up to the snapshot's last one is in it
+        watermark, high = 0, snapshot.info["max_expense_id"]
+    else:
+        # Upper bound first, so rows written during the pass are left for the next run
+        own = [models.Expense.expense_id < id_range[1]] if id_range else []
+        high = db.execute(select(func.max(models.Expense.expense_id)).where(*own)).scalar() or 0
+    up_to = _up_to(high, id_range)
+
+    # Users and merchant keys with new charges (every user on a full run)
+    affected: Optional[Dict[int, Set[str]]] = None
+    if watermark:
+        affected = defaultdict(set)
+        new = db.execute(
+            select(models.Expense.user_id, models.Expense.description)
+            .where(models.Expense.expense_id > watermark, models.Expense.expense_id <= high)
+        )
+        for user_id, description in new:
+            affected[user_id].add(merchant_key(description))
+
+    results = []
+    users = rows = 0
+    if snapshot is not None:
+        epoch_us = (since - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+        for user_id, count, found in columnar.map_users(snapshot, _snapshot_batches, workers, epoch_us):
+            results.append((user_id, found, None))
+            users += 1
+            rows += count
+        batches = ()
+    elif affected is None:
+        # One scan in user order; each user's charges are grouped and sorted in memory
+        # Core rows through the session's connection: the ORM result layer costs more than detection
+        scan = db.connection().execution_options(yield_per=SCAN_BATCH_SIZE).execute(
+            _charges_stmt(since).where(up_to)
+            .order_by(models.Expense.user_id)
+        )
+        batches = _user_batches(scan)
+    else:
+        batches = _affected_batches(db, since, up_to, affected)
+
+    for user_id, charges in batches:
+        keys = affected[user_id] if affected is not None else None
+        results.append((user_id, detect_user(charges, keys), keys))
+        users += 1
+        rows += len(charges)
+
+    # Written after the scan, so the write lock is held only briefly
+    if affected is None:
+        db.execute(delete(models.RecurringCharge))
+    for user_id, found, keys in results:
+        _save(db, user_id, found, keys)
+    _set_watermark(db, high)
+    db.commit()
+    return {
+        "full": affected is None,
+        "users": users,
+        "expenses": rows,
+        "recurring_charges": sum(len(found) for _, found, _ in results),
+        "watermark": high,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+#  Reads
+
+def status(charge, now: Optional[datetime] = None) -> str:
+    "active, or lapsed once a charge is overdue by more than its cadence tolerance."
+    tolerance = next((days for name, _, days in CADENCES if name == charge.cadence), 0)
+    overdue = (now or datetime.utcnow()) - charge.next_expected
+    return "lapsed" if overdue > timedelta(days=2 * tolerance + 1) else "active"
+
+
+def monthly_cost(charge) -> float:
+    return charge.amount * CADENCES[2][1] / charge.interval_days
+
+
+def list_recurring(db: Session, user_id: int, include_lapsed: bool = False, now: Optional[datetime] = None) -> List[dict]:
+    "The user's stored recurring charges, next due first."
+    charges = db.execute(
+        select(models.RecurringCharge)
+        .where(models.RecurringCharge.user_id == user_id)
+        .order_by(models.RecurringCharge.next_expected)
+    ).scalars().all()
+    result = []
+    for charge in charges:
+        charge_status = status(charge, now)
+        if charge_status == "lapsed" and not include_lapsed:
+            continue
+        result.append({
+            "id": charge.id,
+            "description": charge.description,
+            "merchant_key": charge.merchant_key,
+            "category_id": charge.category_id,
+            "amount": charge.amount,
+            "cadence": charge.cadence,
+            "interval_days": charge.interval_days,
+            "occurrences": charge.occurrences,
+            "first_seen": charge.first_seen,
+            "last_seen": charge.last_seen,
+            "next_expected": charge.next_expected,
+            "confidence": charge.confidence,
+            "monthly_cost": round(monthly_cost(charge), 2),
+            "status": charge_status,
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect recurring charges")
+    sub = parser.add_subparsers(dest="command", required=True)
+    detect_parser = sub.add_parser("detect")
+    detect_parser.add_argument("--full", action="store_true", help="re-detect every user, not only users with new expenses")
+    detect_parser.add_argument("--as-of", type=datetime.fromisoformat, help="end of the lookback window (default now)")
+    detect_parser.add_argument("--snapshot", action="store_true",
+                               help="with --full, read the rows from the refreshed column snapshot")
+    detect_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                               help="processes for a --snapshot run")
+    args = parser.parse_args()
+
+    from database.database import SessionLocal, engine
+    snapshot = None
+    if args.snapshot:
+        if not args.full:
+            parser.error("--snapshot needs --full")
+        if not columnar.available():
+            parser.exit(1, "the column snapshot needs numpy to be installed\n")
+        columnar.build(engine)
+        snapshot = columnar.open_snapshot()
+    with SessionLocal() as db:
+        result = run(db, full=args.full, now=args.as_of, snapshot=snapshot, workers=args.workers)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
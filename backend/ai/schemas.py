@@ -53,6 +53,7 @@ class IntentType(str, Enum):
     budget_suggestions = "budget_suggestions"
     highest_expense = "highest_expense"
     advice = "advice"
+    recurring_charges = "recurring_charges"
 
 class QueryType(str, Enum):
     summary = "summary"
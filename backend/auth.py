@@ -1,8 +1,7 @@
 import re
 import os
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from functools import lru_cache
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
@@ -37,11 +36,15 @@ def validate_password(password: str):
         raise HTTPException(status_code=400, detail="Password must contain at least one special character")
     return True
 
-# Password hashing context
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto"
-)
+# Password hashing context, created on first use: passlib and jose together
+# add ~30 ms to worker startup and only login/signup/token paths need them
+@lru_cache(maxsize=None)
+def _pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto"
+    )
 
 # JWT Config
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -51,22 +54,26 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Comma-separated emails allowed to use the /admin endpoints
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
 # OAuth2 scheme for token extraction
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 
 # hashing password
 def hash_password(password: str) -> str:
     """Hash a plaintext password."""
-    return pwd_context.hash(password)
+    return _pwd_context().hash(password)
 
 
 # password verification
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify plaintext password against hashed password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return _pwd_context().verify(plain_password, hashed_password)
 
 # create access token
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + (
         expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -85,6 +92,7 @@ def decode_access_token(token: str) -> dict | None:
     """
     Decode & validate JWT token
     """
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(
             token,
@@ -101,6 +109,7 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     Extract and validate the current user from JWT token.
     Used as a dependency in protected routes.
     """
+    from jose import JWTError
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -136,4 +145,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             db.close()
             
     except JWTError:
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+
+# get current admin from token
+def get_current_admin(current_user: dict = Depends(get_current_user)):
+    """
+    Require the current user to be listed in ADMIN_EMAILS.
+    Used as a dependency in /admin routes.
+    """
+    if current_user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
@@ -0,0 +1,189 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import synthetic
+from benchmarks.suite import _git_commit, _summary
+from database import analytics, cold, models
+from database.migrate import migrate
+
+"""
+The cross-user spending report (database/analytics.py) on SQLite and on
+DuckDB over a Parquet snapshot, side by side, with an equivalence check.
+
+The dataset is copied to a temporary directory and its expenses older than
+--horizon-days are moved to the cold tier first, so both halves of each
+path are exercised. Right after the snapshot both backends see the same
+data, so the reports must match: every month's total, expense count,
+active users and per-category totals (to the cent, summation order aside).
+
+  report.<months>m     GET /admin/reports/spending?months=<months>
+  user_months.<user>   one user's monthly totals, the shape of the
+                       ai/processor.py trend and forecast queries, which
+                       stay on SQLite; timed on both to show why
+
+Run from the backend directory:
+    python -m benchmarks.bench_analytics --dataset bench.db --rows 1000000
+    python -m benchmarks.bench_analytics --dataset bench.db --check   # exit 1 when the reports differ
+"""
+
+_expenses = models.Expense.__table__
+
+
+def _differences(expected: dict, actual: dict) -> list:
+    "Months where the two reports disagree."
+    def close(a, b):
+        return math.isclose(a, b, abs_tol=0.011)
+
+    left = {(m["year"], m["month"]): m for m in expected["months"]}
+    right = {(m["year"], m["month"]): m for m in actual["months"]}
+    differences = []
+    for key in sorted(left.keys() | right.keys()):
+        a, b = left.get(key), right.get(key)
+        if a is None or b is None or (a["expenses"], a["active_users"]) != (b["expenses"], b["active_users"]) \
+                or not close(a["total"], b["total"]) or a["by_category"].keys() != b["by_category"].keys() \
+                or not all(close(a["by_category"][name], b["by_category"][name]) for name in a["by_category"]):
+            differences.append({"month": f"{key[0]}-{key[1]:02d}", "sqlite": a, "duckdb": b})
+    return differences
+
+
+def _user_months_sqlite(db, user_id: int, start: datetime, end: datetime):
+    month = func.strftime("%Y-%m", _expenses.c.expense_date)
+    return db.execute(
+        select(month, func.sum(_expenses.c.amount))
+        .where(_expenses.c.user_id == user_id, _expenses.c.deleted_at.is_(None),
+               _expenses.c.expense_date >= start, _expenses.c.expense_date < end)
+        .group_by(month)
+    ).all()
+
+
+def _user_months_duckdb(manifest: dict, user_id: int, start: datetime, end: datetime):
+    cursor = analytics._cursor()
+    try:
+        return cursor.execute(
+            "SELECT strftime(expense_date, '%Y-%m'), sum(amount) FROM read_parquet(?) "
+            "WHERE user_id = ? AND expense_date >= ? AND expense_date < ? GROUP BY ALL",
+            [os.path.join(analytics.ANALYTICS_DIR, manifest["hot"]), user_id, start, end],
+        ).fetchall()
+    finally:
+        cursor.close()
+
+
+def _time(call, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return _summary(timings[1:], 0, 1)
+
+
+def run(args) -> dict:
+    if not os.path.exists(args.dataset):
+        print(f"Generating {args.rows:,} expense rows into {args.dataset}", file=sys.stderr)
+        synthetic.generate(args.dataset, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(args.dataset) or {}
+    anchor = datetime.fromisoformat(meta["anchor"]) if meta.get("anchor") else datetime.utcnow()
+    users = {"heavy": meta.get("heavy_user_id", 1), "typical": meta.get("typical_user_id", 1)}
+
+    workdir = tempfile.mkdtemp(prefix="spendsense-analytics-")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        shutil.copyfile(args.dataset, path)
+        cold.COLD_STORE_DIR = os.path.join(workdir, "cold_store")
+        analytics.ANALYTICS_DIR = os.path.join(workdir, "analytics")
+        engine = create_engine(f"sqlite:///{path}")
+        migrate(engine)
+        Session = sessionmaker(bind=engine)
+
+        moved = cold.run(engine, args.horizon_days, now=anchor)
+        print(f"moved {moved['expenses']:,} expenses to the cold tier", file=sys.stderr)
+        snapshot = analytics.snapshot(engine)
+        print(f"snapshot of {snapshot['rows']:,} hot rows in {snapshot['seconds']:.1f} s", file=sys.stderr)
+        manifest = analytics.load_manifest()
+
+        results, differences = {}, {}
+        with Session() as db:
+            for months in args.months:
+                start, end = analytics.month_window(months, anchor)
+                reports = {}
+                for backend in ("sqlite", "duckdb"):
+                    reports[backend] = analytics.spending_report(db, start, end, requested=backend)
+                    results.setdefault(f"report.{months}m", {"group": "analytics"})[backend] = _time(
+                        lambda: analytics.spending_report(db, start, end, requested=backend), args.repeat)
+                if reports["duckdb"]["source"] != "snapshot":
+                    sys.exit("the DuckDB report fell back to SQLite; see the log")
+                differences[f"report.{months}m"] = _differences(reports["sqlite"], reports["duckdb"])
+
+            start, end = analytics.month_window(6, anchor)
+            for label, user_id in users.items():
+                name = f"user_months.{label}"
+                expected = sorted(_user_months_sqlite(db, user_id, start, end))
+                actual = sorted(_user_months_duckdb(manifest, user_id, start, end))
+                differences[name] = [] if [m for m, _ in expected] == [m for m, _ in actual] and all(
+                    math.isclose(a, b, abs_tol=0.011) for (_, a), (_, b) in zip(expected, actual)
+                ) else [{"sqlite": expected, "duckdb": actual}]
+                results[name] = {
+                    "group": "analytics",
+                    "sqlite": _time(lambda: _user_months_sqlite(db, user_id, start, end), args.repeat),
+                    "duckdb": _time(lambda: _user_months_duckdb(manifest, user_id, start, end), args.repeat),
+                }
+        engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": {k: meta.get(k) for k in ("rows", "users", "seed", "anchor")},
+            "repeat": args.repeat,
+            "horizon_days": args.horizon_days,
+        },
+        "move": moved,
+        "snapshot": snapshot,
+        "results": results,
+        "differences": differences,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-user report on SQLite and on DuckDB over Parquet snapshots")
+    parser.add_argument("--dataset", default="bench_analytics.db", help="SQLite dataset; generated if it does not exist")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="expense rows when generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--horizon-days", type=int, default=365, help="move whole years older than this to the cold tier")
+    parser.add_argument("--months", type=int, nargs="+", default=[3, 12, 24], help="report windows to time")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="exit 1 when the backends disagree")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if not analytics.available():
+        sys.exit("the DuckDB backend needs duckdb and pyarrow to be installed")
+    results = run(args)
+    for name, result in results["results"].items():
+        sqlite, duckdb = result["sqlite"]["median_ms"], result["duckdb"]["median_ms"]
+        status = "ok" if not results["differences"][name] else "DIFFERENT"
+        print(f"{name:<22} sqlite {sqlite:>9.2f} ms   duckdb {duckdb:>9.2f} ms   x{sqlite / duckdb:>6.2f}   {status}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.check and any(results["differences"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
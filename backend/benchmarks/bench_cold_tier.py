@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import synthetic
+from benchmarks.suite import _git_commit, _summary
+from database import cold, crud, reads
+from database.migrate import migrate
+
+"""
+Hot database size and read latency before and after moving aged expenses
+to the cold tier (database/cold.py).
+
+The dataset is copied to a temporary directory first, so it is never
+changed. Each read path is timed for the heavy and the typical user of the
+dataset:
+
+  list.first_page    first 50 expenses (GET /expenses order)
+  list.last_page     last 50, which is in the cold tier after the move
+  export.recent      every expense of the last 90 days
+  export.all         every expense, hot and cold
+  summary.recent     monthly summary of the anchor's month
+  summary.old        monthly summary of the oldest month
+
+Sizes are of the database file after a VACUUM, so free pages don't count.
+
+Run from the backend directory:
+    python -m benchmarks.bench_cold_tier --dataset bench.db --rows 1000000 --horizon-days 365
+"""
+
+
+def _vacuumed_size(path: str) -> int:
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def _cases(anchor: datetime, oldest: datetime):
+    def count(batches):
+        return sum(len(batch) for batch in batches)
+
+    return {
+        "list.first_page": lambda db, user_id: reads.list_expenses(db, user_id, limit=50),
+        "list.last_page": lambda db, user_id: reads.list_expenses(
+            db, user_id, limit=50, offset=max(count(reads.iter_expense_batches(db, user_id, 5000)) - 50, 0)),
+        "export.recent": lambda db, user_id: count(
+            reads.iter_expense_batches(db, user_id, 5000, start_date=anchor - timedelta(days=90))),
+        "export.all": lambda db, user_id: count(reads.iter_expense_batches(db, user_id, 5000)),
+        "summary.recent": lambda db, user_id: crud.get_monthly_expense_summary(db, user_id, anchor.month, anchor.year),
+        "summary.old": lambda db, user_id: crud.get_monthly_expense_summary(db, user_id, oldest.month, oldest.year),
+    }
+
+
+def _measure(Session, cases, users, repeat: int) -> dict:
+    results = {}
+    with Session() as db:
+        for name, case in cases.items():
+            for label, user_id in users.items():
+                timings = []
+                for _ in range(repeat + 1):
+                    started = time.perf_counter()
+                    case(db, user_id)
+                    timings.append(time.perf_counter() - started)
+                results[f"{name}.{label}"] = _summary(timings[1:], 0, 1)
+    return results
+
+
+def run(args) -> dict:
+    if not os.path.exists(args.dataset):
+        print(f"Generating {args.rows:,} expense rows into {args.dataset}", file=sys.stderr)
+        synthetic.generate(args.dataset, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(args.dataset) or {}
+    anchor = datetime.fromisoformat(meta["anchor"]) if meta.get("anchor") else datetime.utcnow()
+    oldest = anchor - timedelta(days=30 * meta.get("months", 24) - 30)
+    users = {"heavy": meta.get("heavy_user_id", 1), "typical": meta.get("typical_user_id", 1)}
+
+    workdir = tempfile.mkdtemp(prefix="spendsense-cold-")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        shutil.copyfile(args.dataset, path)
+        cold.COLD_STORE_DIR = os.path.join(workdir, "cold_store")
+        engine = create_engine(f"sqlite:///{path}")
+        migrate(engine)
+        Session = sessionmaker(bind=engine)
+        cases = _cases(anchor, oldest)
+
+        size_before = _vacuumed_size(path)
+        before = _measure(Session, cases, users, args.repeat)
+        print(f"hot database {size_before / 1e6:.1f} MB, moving expenses before "
+              f"{cold.boundary(anchor, args.horizon_days).date()}", file=sys.stderr)
+        moved = cold.run(engine, args.horizon_days, now=anchor)
+        engine.dispose()
+        size_after = _vacuumed_size(path)
+        cold_bytes = sum(os.path.getsize(os.path.join(directory, name))
+                         for directory, _, names in os.walk(cold.COLD_STORE_DIR) for name in names)
+        after = _measure(Session, cases, users, args.repeat)
+        engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": {k: meta.get(k) for k in ("rows", "users", "seed", "anchor")},
+            "repeat": args.repeat,
+            "horizon_days": args.horizon_days,
+        },
+        "move": moved,
+        "size": {"hot_before_bytes": size_before, "hot_after_bytes": size_after, "cold_bytes": cold_bytes},
+        "results": {name: {"group": "cold", "before": before[name], "after": after[name]} for name in before},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot database size and read latency before and after the cold tier")
+    parser.add_argument("--dataset", default="bench_cold.db", help="SQLite dataset; generated if it does not exist")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="expense rows when generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--horizon-days", type=int, default=365, help="move whole years older than this")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if not cold.available():
+        sys.exit("the cold tier needs pyarrow to be installed")
+    results = run(args)
+    size = results["size"]
+    print(f"hot database {size['hot_before_bytes'] / 1e6:.1f} MB -> {size['hot_after_bytes'] / 1e6:.1f} MB, "
+          f"cold files {size['cold_bytes'] / 1e6:.1f} MB ({results['move']['expenses']:,} expenses "
+          f"in {results['move']['seconds']:.1f} s)")
+    for name, result in results["results"].items():
+        print(f"{name:<28} median {result['before']['median_ms']:>9.2f} ms -> {result['after']['median_ms']:>9.2f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+from ai import recurring
+from benchmarks import synthetic
+from benchmarks.suite import _git_commit, _summary
+from database import columnar, models
+from database.migrate import migrate
+
+"""
+Build and refresh times of the column snapshot (database/columnar.py) and
+the recurring charge full pass on it against the same pass on the table.
+
+The dataset is copied to a temporary directory first. Steps:
+
+  columnar.full          build from scratch
+  columnar.refresh       refresh after --changes edits, inserts, soft deletes
+                         and hard deletes (a cold-tier move or a purge)
+  recurring.table        full recurring pass reading the expenses table
+  recurring.snapshot     the same pass on the snapshot, --workers processes
+
+Two equivalence checks: the refreshed snapshot must equal a full build of
+the same table, and both recurring passes must store the same charges.
+--check exits 1 when either fails.
+
+Run from the backend directory:
+    python -m benchmarks.bench_columnar --dataset bench.db --rows 1000000 --workers 4
+"""
+
+
+def _change(Session, rng: random.Random, count: int, anchor: datetime) -> None:
+    "Edit, add, soft-delete and hard-delete `count` expenses each."
+    with Session() as db:
+        high = db.execute(select(func.max(models.Expense.expense_id))).scalar()
+        now = datetime.utcnow()
+        ids = rng.sample(range(1, high + 1), 3 * count)
+        for expense_id in ids[:count]:
+            db.execute(update(models.Expense).where(models.Expense.expense_id == expense_id)
+                       .values(amount=round(rng.uniform(1, 500), 2), description="Edited charge", updated_at=now))
+        db.execute(update(models.Expense).where(models.Expense.expense_id.in_(ids[count:2 * count]))
+                   .values(deleted_at=now, updated_at=now))
+        db.execute(delete(models.Expense).where(models.Expense.expense_id.in_(ids[2 * count:])))
+        max_user = db.execute(select(func.max(models.User.user_id))).scalar()
+        db.execute(insert(models.Expense), [
+            {"user_id": rng.randint(1, max_user), "category_id": 1, "amount": 9.99, "description": "Bench weekly box",
+             "expense_date": anchor - timedelta(days=7 * (i % 8)), "created_at": now, "updated_at": now}
+            for i in range(count)
+        ])
+        db.commit()
+
+
+def _same_snapshot(first: columnar.Snapshot, second: columnar.Snapshot) -> bool:
+    np = columnar._numpy()
+    arrays = ("descriptions", "description_offsets", "users", "user_offsets")
+    return all(np.array_equal(first.columns[name], second.columns[name]) for name in columnar.COLUMNS) and all(
+        np.array_equal(getattr(first, name), getattr(second, name)) for name in arrays)
+
+
+def _stored_charges(Session) -> list:
+    charges = models.RecurringCharge.__table__
+    columns = [column for column in charges.c if column.name not in ("id", "updated_at")]
+    with Session() as db:
+        return sorted(tuple(row) for row in db.execute(select(*columns)))
+
+
+def run(args) -> dict:
+    if not os.path.exists(args.dataset):
+        print(f"Generating {args.rows:,} expense rows into {args.dataset}", file=sys.stderr)
+        synthetic.generate(args.dataset, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(args.dataset) or {}
+    anchor = datetime.fromisoformat(meta["anchor"]) if meta.get("anchor") else datetime.utcnow()
+    rng = random.Random(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="spendsense-columnar-")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        shutil.copyfile(args.dataset, path)
+        engine = create_engine(f"sqlite:///{path}")
+        migrate(engine)
+        Session = sessionmaker(bind=engine)
+        directory, fresh = os.path.join(workdir, "columnar"), os.path.join(workdir, "columnar-fresh")
+
+        full = columnar.build(engine, full=True, directory=directory)
+        print(f"full build {full['seconds']:.2f}s ({full['rows']:,} rows)", file=sys.stderr)
+        _change(Session, rng, args.changes, anchor)
+        refresh = columnar.build(engine, directory=directory)
+        print(f"refresh {refresh['seconds']:.2f}s ({refresh['changed']:,} changed, {refresh['removed']:,} removed)",
+              file=sys.stderr)
+        columnar.build(engine, full=True, directory=fresh)
+        refresh_matches = _same_snapshot(columnar.open_snapshot(directory), columnar.open_snapshot(fresh))
+
+        passes, charges = {}, {}
+        snapshot = columnar.open_snapshot(directory)
+        for name, options in (("recurring.table", {}), ("recurring.snapshot", {"snapshot": snapshot, "workers": args.workers})):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                with Session() as db:
+                    passes[name] = recurring.run(db, full=True, now=anchor, **options)
+                timings.append(time.perf_counter() - started)
+            charges[name] = _stored_charges(Session)
+            passes[name]["timing"] = _summary(timings, 0, 1)
+            print(f"{name} {passes[name]['seconds']:.2f}s ({passes[name]['expenses']:,} expenses, "
+                  f"{passes[name]['recurring_charges']:,} found)", file=sys.stderr)
+        engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "columnar.full": {"group": "columnar", **_summary([full["seconds"]], 0, 1), "rows": full["rows"]},
+        "columnar.refresh": {"group": "columnar", **_summary([refresh["seconds"]], 0, 1),
+                             "changed": refresh["changed"], "removed": refresh["removed"]},
+    }
+    for name, result in passes.items():
+        results[name] = {"group": "recurring", **result["timing"], "expenses": result["expenses"],
+                         "recurring_charges": result["recurring_charges"]}
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "dataset": {k: meta.get(k) for k in ("rows", "users", "seed", "anchor")},
+            "repeat": args.repeat,
+            "changes": args.changes,
+            "workers": args.workers,
+        },
+        "results": results,
+        "checks": {
+            "refresh_matches_full_build": refresh_matches,
+            "recurring_matches": charges["recurring.table"] == charges["recurring.snapshot"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Column snapshot build times and the recurring pass on it")
+    parser.add_argument("--dataset", default="bench_columnar.db", help="SQLite dataset; generated if it does not exist")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="expense rows when generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--changes", type=int, default=1000, help="expenses of each kind changed before the refresh")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the snapshot pass")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--check", action="store_true", help="exit 1 when an equivalence check fails")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if not columnar.available():
+        sys.exit("the column snapshot needs numpy to be installed")
+    results = run(args)
+    for name, result in results["results"].items():
+        print(f"{name:<22} median {result['median_ms'] / 1000:>8.2f} s")
+    for name, ok in results["checks"].items():
+        print(f"{name:<28} {'ok' if ok else 'FAILED'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.check and not all(results["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from benchmarks import synthetic
+from benchmarks.loadtest import Client, Stats, percentile, start_server
+from database.migrate import migrate
+
+"""
+GET /events (sse.py) under many idle streams, against a real uvicorn.
+
+Opens --streams streams spread over --users dataset users, each with an
+overall budget, then writes --writes expenses through POST /expenses at
+random users and times how long each takes to reach every stream of its
+user as a budget_status event. With --workers above 1 most streams sit in
+another worker than the write, so delivery goes through the event log.
+
+Reported: time to open the streams, server memory per open stream (Linux),
+delivery latency percentiles and events missed. Two checks: every stream
+gets every event of its user, and a stream resumed from the Last-Event-ID
+it had before the writes replays the same events.
+
+Run from the backend directory:
+    python -m benchmarks.bench_events --workers 2 --users 50 --streams 2000 --writes 200
+"""
+
+
+class Stream:
+    "A raw HTTP/1.1 GET /events, parsed into (event_id, kind, data, received_at) tuples."
+
+    def __init__(self, port: int, token: str, user_id: int, last_event_id: int = None):
+        self.port, self.token, self.user_id, self.last_event_id = port, token, user_id, last_event_id
+        self.events = []
+        self.opened = asyncio.Event()
+        self.writer = None
+
+    async def run(self) -> None:
+        reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port, limit=2 ** 20)
+        resume = f"Last-Event-ID: {self.last_event_id}\r\n" if self.last_event_id is not None else ""
+        self.writer.write(f"GET /events HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {self.token}\r\n"
+                          f"Accept: text/event-stream\r\n{resume}\r\n".encode())
+        status = await reader.readline()
+        if b" 200 " not in status:
+            raise RuntimeError(f"GET /events: {status!r}")
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        # Chunked transfer encoding: size line, data, CRLF
+        buffer = b""
+        while True:
+            size = int((await reader.readline()).strip() or b"0", 16)
+            if size == 0:
+                return
+            buffer += await reader.readexactly(size + 2)
+            buffer = buffer[:-2] if buffer.endswith(b"\r\n") else buffer
+            while b"\n\n" in buffer:
+                frame, buffer = buffer.split(b"\n\n", 1)
+                self._parse(frame.decode())
+
+    def _parse(self, frame: str) -> None:
+        fields = dict(line.split(": ", 1) for line in frame.split("\n") if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            event_id = int(fields["id"]) if "id" in fields else None
+            self.events.append((event_id, fields["event"], fields["data"], time.perf_counter()))
+            self.opened.set()
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+def _rss_kb(pid: int) -> int:
+    "Resident memory of a process and its children (uvicorn workers), 0 where /proc is missing."
+    total = 0
+    for candidate in [pid] + _children(pid):
+        try:
+            with open(f"/proc/{candidate}/status", encoding="utf-8") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+async def _measure(args, port: int, tokens: dict, budgets: dict) -> dict:
+    rng = random.Random(args.seed)
+    users = list(tokens)
+    streams = [Stream(port, tokens[users[i % len(users)]], users[i % len(users)]) for i in range(args.streams)]
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(stream.run()) for stream in streams]
+    await asyncio.wait_for(asyncio.gather(*(stream.opened.wait() for stream in streams)), 300)
+    open_seconds = time.perf_counter() - started
+    await asyncio.sleep(1)
+    snapshots = {stream.user_id: stream.events[0][0] for stream in streams}
+
+    # Writes from a thread, so timing the deliveries isn't held up by the blocking client
+    sent = []
+
+    def write() -> None:
+        client = Client("127.0.0.1", port, Stats())
+        for _ in range(args.writes):
+            user_id = rng.choice(users)
+            client.token = tokens[user_id]
+            sent.append((user_id, time.perf_counter()))
+            client.request("POST", "/expenses", "/expenses",
+                           json_body={"user_id": user_id, "category_id": 1, "amount": 1.0, "description": "Bench event"})
+            time.sleep(args.interval)
+        client.close()
+
+    await asyncio.get_running_loop().run_in_executor(None, write)
+    await asyncio.sleep(args.settle)
+
+    latencies, missed = [], 0
+    for stream in streams:
+        # Dataset users have budgets of their own; one event per write is of the bench budget
+        received = [event for event in stream.events[1:] if event[1] == "budget_status"
+                    and json.loads(event[2])["budget_id"] == budgets[stream.user_id]]
+        expected = [moment for user_id, moment in sent if user_id == stream.user_id]
+        missed += max(0, len(expected) - len(received))
+        latencies.extend(event[3] - moment for moment, event in zip(expected, received))
+
+    # A reconnect from before the writes must replay what the live stream got
+    user_id = users[0]
+    live = next(stream for stream in streams if stream.user_id == user_id)
+    resumed = Stream(port, tokens[user_id], user_id, last_event_id=snapshots[user_id])
+    resume_task = asyncio.ensure_future(resumed.run())
+    await asyncio.sleep(2)
+    resume_matches = [event[:3] for event in resumed.events] == [event[:3] for event in live.events[1:]]
+
+    for stream in streams + [resumed]:
+        stream.close()
+    for task in tasks + [resume_task]:
+        task.cancel()
+    await asyncio.gather(*tasks, resume_task, return_exceptions=True)
+    latencies.sort()
+    return {
+        "open_seconds": round(open_seconds, 2),
+        "deliveries": len(latencies),
+        "missed": missed,
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "latency_max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "resume_matches": resume_matches,
+    }
+
+
+def run(args) -> dict:
+    if not os.path.exists(args.dataset):
+        print(f"Generating {args.rows:,} expense rows into {args.dataset}", file=sys.stderr)
+        synthetic.generate(args.dataset, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(args.dataset) or {}
+    workdir = tempfile.mkdtemp(prefix="spendsense-events-")
+    server = log = None
+    try:
+        database = os.path.join(workdir, "bench.db")
+        shutil.copyfile(args.dataset, database)
+        migrate(create_engine(f"sqlite:///{database}"))
+        port = args.port
+        if not port:
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+        server, log = start_server(workdir, database, args.workers, port, os.path.join(workdir, "server.log"),
+                                   extra_env={"WARMUP": "off"})
+        baseline_kb = _rss_kb(server.pid)
+
+        tokens, budgets = {}, {}
+        client = Client("127.0.0.1", port, Stats())
+        for user_id in range(1, min(args.users, meta.get("users", args.users)) + 1):
+            client.token = None
+            login = client.request("POST", "/users/login", "/users/login",
+                                   form={"username": f"user{user_id}@example.com", "password": synthetic.BENCH_PASSWORD})
+            client.token = tokens[user_id] = login["access_token"]
+            budgets[user_id] = client.request("POST", "/budgets", "/budgets", json_body={
+                "user_id": user_id, "amount": 1_000_000.0, "period": "monthly"})["budget_id"]
+        client.close()
+
+        result = asyncio.run(_measure(args, port, tokens, budgets))
+        result["rss_per_stream_kb"] = round((_rss_kb(server.pid) - baseline_kb) / args.streams, 1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if log is not None:
+            log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "cpus": os.cpu_count(),
+            "dataset": {k: meta.get(k) for k in ("rows", "users", "seed")},
+            **{key: getattr(args, key) for key in ("workers", "users", "streams", "writes", "interval")},
+        },
+        "results": result,
+        "checks": {"no_missed_events": result["missed"] == 0, "resume_matches": result["resume_matches"]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GET /events delivery latency under many idle streams")
+    parser.add_argument("--dataset", default="bench_events.db", help="SQLite dataset; generated if it does not exist")
+    parser.add_argument("--rows", type=int, default=20_000, help="expense rows when generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    parser.add_argument("--users", type=int, default=20, help="dataset users the streams belong to")
+    parser.add_argument("--streams", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between writes")
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait for the last deliveries")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a check fails")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    r = results["results"]
+    print(f"{args.streams} streams opened in {r['open_seconds']} s, {r['rss_per_stream_kb']} KB each")
+    print(f"{r['deliveries']} deliveries: p50 {r['latency_p50_ms']} ms  p95 {r['latency_p95_ms']} ms  "
+          f"p99 {r['latency_p99_ms']} ms  max {r['latency_max_ms']} ms  ({r['missed']} missed)")
+    for name, ok in results["checks"].items():
+        print(f"{name:<20} {'ok' if ok else 'FAILED'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.check and not all(results["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from rate_limit import SQLiteStorage
+
+"""
+Measures the per-request overhead of the shared SQLite rate limit storage
+against slowapi's default in-memory storage, and checks that a limit is
+enforced once across several worker processes instead of once per process.
+
+Run from the backend directory:
+    python -m benchmarks.bench_rate_limit --iterations 5000 --workers 4
+"""
+
+
+def time_hits(limiter: SlidingWindowCounterRateLimiter, iterations: int) -> float:
+    # Average microseconds per hit() over distinct keys, like distinct clients
+    item = parse("1000000/minute")
+    start = time.perf_counter()
+    for i in range(iterations):
+        limiter.hit(item, f"user:{i % 500}")
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def _worker(uri: str, attempts: int, results):
+    limiter = SlidingWindowCounterRateLimiter(SQLiteStorage(uri))
+    item = parse("50/minute")
+    allowed = sum(1 for _ in range(attempts) if limiter.hit(item, "ip:shared"))
+    results.put(allowed)
+
+
+def check_shared_limit(uri: str, workers: int, attempts: int) -> int:
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker, args=(uri, attempts, results)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return sum(results.get() for _ in processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limit storage overhead")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f"sqlite:///{os.path.join(tmp, 'ratelimit.db')}"
+
+        memory_us = time_hits(SlidingWindowCounterRateLimiter(MemoryStorage()), args.iterations)
+        sqlite_us = time_hits(SlidingWindowCounterRateLimiter(SQLiteStorage(uri)), args.iterations)
+        print(f"memory storage: {memory_us:8.1f} us/request")
+        print(f"sqlite storage: {sqlite_us:8.1f} us/request")
+        print(f"overhead:       {sqlite_us - memory_us:8.1f} us/request")
+
+        allowed = check_shared_limit(uri, args.workers, attempts=40)
+        print(f"{args.workers} workers x 40 attempts against 50/minute -> {allowed} allowed (expected 50)")
+
+
+if __name__ == "__main__":
+    main()
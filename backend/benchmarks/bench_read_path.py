@@ -0,0 +1,66 @@
+import argparse
+import time
+import tracemalloc
+
+from database import models, schemas, reads
+from benchmarks.common import temp_database, seed_expenses
+
+"""
+Compares the ORM read path for /expenses (query().all() + from_orm per row)
+with the Core read path in database/reads.py (select() rows validated
+straight into ExpenseResponse).
+
+Run from the backend directory:
+    python -m benchmarks.bench_read_path --rows 10000
+"""
+
+
+def orm_path(session):
+    expenses = (
+        session.query(models.Expense)
+        .filter(models.Expense.user_id == 1, models.Expense.deleted_at.is_(None))
+        .order_by(models.Expense.expense_date.desc())
+        .all()
+    )
+    return [schemas.ExpenseResponse.from_orm(e) for e in expenses]
+
+
+def core_path(session):
+    return [schemas.ExpenseResponse.model_validate(row) for row in reads.list_expenses(session, 1)]
+
+
+def measure(fn, Session, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        session = Session()
+        start = time.perf_counter()
+        fn(session)
+        timings.append(time.perf_counter() - start)
+        session.close()
+
+    session = Session()
+    tracemalloc.start()
+    fn(session)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.close()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ORM vs Core read path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with temp_database() as Session:
+        with Session() as session:
+            seed_expenses(session, args.rows)
+
+        for name, fn in (("orm", orm_path), ("core", core_path)):
+            seconds, peak = measure(fn, Session, args.repeat)
+            print(f"{name:5s} {args.rows} rows: {seconds * 1000:8.1f} ms  peak {peak / 1024 / 1024:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
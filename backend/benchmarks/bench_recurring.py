@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from ai import recurring
+from benchmarks import synthetic
+from benchmarks.suite import _git_commit, _summary
+from database import models
+from database.migrate import migrate
+
+"""
+Throughput of the recurring charge detector (ai/recurring.py) on a
+synthetic dataset:
+
+  recurring.full         full pass over every user
+  recurring.incremental  pass after --new expenses were added for random users
+
+Each result also reports expenses scanned per second. The full pass is
+O(n log n) per user; the incremental pass should scale with the users
+that got new expenses, not with the table.
+
+Run from the backend directory (the dataset is generated on first use and
+reused afterwards; the detector only writes its own tables):
+    python -m benchmarks.bench_recurring --dataset bench10m.db --rows 10000000
+"""
+
+
+def _new_expenses(Session, rng: random.Random, count: int, anchor: datetime) -> None:
+    "Add `count` expenses, half of them a weekly charge, for random users."
+    with Session() as db:
+        max_user = db.execute(select(func.max(models.User.user_id))).scalar()
+        rows = []
+        for i in range(count):
+            user_id = rng.randint(1, max_user)
+            day = anchor - timedelta(days=7 * (i % 4))
+            description, amount = ("Bench weekly box", 24.0) if i % 2 else (rng.choice(("Coffee", "Groceries")), round(rng.uniform(3, 80), 2))
+            rows.append({"user_id": user_id, "category_id": 1, "amount": amount, "description": description,
+                         "expense_date": day, "created_at": day, "updated_at": day})
+        db.execute(insert(models.Expense), rows)
+        db.commit()
+
+
+def run(args) -> dict:
+    if not os.path.exists(args.dataset):
+        print(f"Generating {args.rows:,} expense rows into {args.dataset}", file=sys.stderr)
+        synthetic.generate(args.dataset, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(args.dataset) or {}
+    anchor = datetime.fromisoformat(meta["anchor"]) if meta.get("anchor") else datetime.utcnow()
+
+    engine = create_engine(f"sqlite:///{args.dataset}")
+    migrate(engine)
+    Session = sessionmaker(bind=engine)
+    rng = random.Random(args.seed)
+
+    passes = {"recurring.full": [], "recurring.incremental": []}
+    for i in range(args.warmup + args.repeat):
+        with Session() as db:
+            full = recurring.run(db, full=True, now=anchor)
+        _new_expenses(Session, rng, args.new, anchor)
+        with Session() as db:
+            incremental = recurring.run(db, now=anchor)
+        if i >= args.warmup:
+            passes["recurring.full"].append(full)
+            passes["recurring.incremental"].append(incremental)
+        print(f"full {full['seconds']:.2f}s ({full['expenses']:,} expenses, {full['recurring_charges']:,} found)  "
+              f"incremental {incremental['seconds']:.3f}s ({incremental['users']:,} users)", file=sys.stderr)
+    engine.dispose()
+
+    results = {}
+    for name, runs in passes.items():
+        seconds = [r["seconds"] for r in runs]
+        scanned = sum(r["expenses"] for r in runs) / len(runs)
+        results[name] = {
+            "group": "recurring",
+            **_summary(seconds, 0, 1),
+            "expenses_scanned": round(scanned),
+            "users": round(sum(r["users"] for r in runs) / len(runs)),
+            "recurring_charges": runs[-1]["recurring_charges"],
+            "expenses_per_second": round(scanned / (sum(seconds) / len(seconds))) if sum(seconds) else None,
+        }
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": {k: meta.get(k) for k in ("rows", "users", "seed", "anchor")},
+            "repeat": args.repeat,
+            "new_expenses": args.new,
+            "lookback_days": recurring.LOOKBACK_DAYS,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recurring charge detector throughput")
+    parser.add_argument("--dataset", default="bench_recurring.db", help="SQLite dataset; generated if it does not exist")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="expense rows when generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--new", type=int, default=10_000, help="expenses added before each incremental pass")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, result in results["results"].items():
+        print(f"{name:<24} median {result['median_ms'] / 1000:>8.2f} s  "
+              f"{result['expenses_scanned']:>12,} expenses  {result['expenses_per_second']:>10,} expenses/s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
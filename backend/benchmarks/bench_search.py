@@ -0,0 +1,102 @@
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks.common import temp_database
+from benchmarks.suite import _summary
+from benchmarks.synthetic import DESCRIPTIONS
+from database import models, search
+
+"""
+GET /expenses/search (database/search.py) for one user with many expenses,
+against the request's latency budget of 10 ms.
+
+The user's expenses are written in date order with --backdated of them
+given an earlier date, as when expenses are entered after the fact.
+Descriptions come from the synthetic dataset's vocabulary, so common words
+("coffee") match tens of thousands of rows and rare phrases a few.
+
+Run from the backend directory:
+    python -m benchmarks.bench_search --rows 1000000
+    python -m benchmarks.bench_search --rows 1000000 --check   # exit 1 over budget
+"""
+
+QUERIES = [
+    ("word", "coffee", {}),
+    ("prefix", "sup*", {}),
+    ("or", "gift OR books", {}),
+    ("rare", "fuel", {}),
+    ("phrase", '"bus pass"', {}),
+    ("word+category", "coffee", {"category_id": 1}),
+]
+
+
+def _seed(Session, rows: int, backdated: float, seed: int) -> None:
+    rng = random.Random(seed)
+    descriptions = [(index, description) for index, names in enumerate(DESCRIPTIONS.values(), 1) for description in names]
+    start = datetime(2020, 1, 1)
+    step = timedelta(days=5 * 365) / rows
+    with Session() as db:
+        db.execute(insert(models.User), [{"user_id": 1, "name": "bench", "email": "bench@example.com", "password": "x"}])
+        db.execute(insert(models.Category), [{"category_id": i, "name": name} for i, name in enumerate(DESCRIPTIONS, 1)])
+        for offset in range(0, rows, 50_000):
+            batch = []
+            for i in range(offset, min(offset + 50_000, rows)):
+                category_id, description = rng.choice(descriptions)
+                date = start + step * i
+                if rng.random() < backdated:
+                    date -= timedelta(days=rng.randint(1, 60))
+                batch.append({"user_id": 1, "category_id": category_id, "amount": round(rng.uniform(2, 200), 2),
+                              "description": description, "expense_date": date, "created_at": date, "updated_at": date})
+            db.execute(insert(models.Expense), batch)
+        db.commit()
+
+
+def run(args) -> dict:
+    results = {}
+    with temp_database() as Session:
+        print(f"Seeding {args.rows:,} expenses", file=sys.stderr)
+        _seed(Session, args.rows, args.backdated, args.seed)
+        # Filled in one pass after the load rather than row by row through the triggers
+        search.install(Session.kw["bind"])
+        with Session() as db:
+            for name, query, filters in QUERIES:
+                for sort in ("relevance", "recent"):
+                    timings = []
+                    for _ in range(args.repeat + 1):
+                        started = time.perf_counter()
+                        result = search.search_expenses(db, 1, query, sort=sort, **filters)
+                        timings.append(time.perf_counter() - started)
+                    results[name if sort == "relevance" else f"{name}.recent"] = {
+                        **_summary(timings[1:], 0, 1), "query": query, "matches": result["matches"]}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search latency for one large user")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--backdated", type=float, default=0.02, help="share of expenses dated before earlier ones")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--budget-ms", type=float, default=10.0, help="median latency each query must stay under")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a query is over budget")
+    args = parser.parse_args()
+
+    results = run(args)
+    over = []
+    for name, result in results.items():
+        status = "ok" if result["median_ms"] <= args.budget_ms else "OVER BUDGET"
+        if status != "ok":
+            over.append(name)
+        print(f"{name:<21} {result['query']:<16} median {result['median_ms']:>7.2f} ms  "
+              f"p95 {result['p95_ms']:>7.2f} ms  {result['matches']:>4} ranked  {status}")
+    if args.check and over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
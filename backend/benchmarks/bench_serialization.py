@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import serialization
+from database import schemas, reads
+from benchmarks.common import temp_database, seed_expenses
+
+"""
+Serializes a 100k-expense user three ways and reports throughput and peak RSS:
+
+  default  validate into ExpenseResponse, jsonable_encoder, json.dumps
+           (what FastAPI does for a response_model list)
+  fast     Core rows encoded in one go by serialization.dumps
+  stream   Core rows from the cursor through serialization.iter_json_array
+
+Each mode runs in its own process so the peak RSS numbers don't mix.
+
+Run from the backend directory:
+    python -m benchmarks.bench_serialization --rows 100000
+"""
+
+MODES = ("default", "fast", "stream")
+
+
+def run_mode(mode: str, db_path: str) -> dict:
+    engine = create_engine(f"sqlite:///{db_path}")
+    session = sessionmaker(bind=engine)()
+    start = time.perf_counter()
+
+    if mode == "default":
+        models = [schemas.ExpenseResponse.model_validate(row) for row in reads.list_expenses(session, 1)]
+        size = len(json.dumps(jsonable_encoder(models)).encode("utf-8"))
+    elif mode == "fast":
+        size = len(serialization.dumps(reads.list_expenses(session, 1)))
+    else:
+        size = sum(len(chunk) for chunk in serialization.iter_json_array(reads.iter_expenses(session, 1)))
+
+    seconds = time.perf_counter() - start
+    session.close()
+    engine.dispose()
+    return {
+        "mode": mode,
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_sec": size / seconds / 1024 / 1024,
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON serialization throughput and peak RSS")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--mode", choices=MODES)
+    parser.add_argument("--db")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.db)))
+        return
+
+    print(f"encoder: {serialization.JSON_ENCODER}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        with temp_database(db_path) as Session:
+            with Session() as session:
+                seed_expenses(session, args.rows)
+
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_serialization", "--mode", mode, "--db", db_path],
+                capture_output=True, text=True, check=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{mode:8s} {result['bytes'] / 1024 / 1024:7.1f} MiB in {result['seconds']:6.2f}s "
+                f"= {result['mb_per_sec']:7.1f} MiB/s, peak RSS {result['peak_rss_mb']:7.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.suite import _git_commit, _summary, compare, _load
+
+"""
+Worker startup benchmark based on `python -X importtime`.
+
+Each iteration imports the app in a fresh interpreter (WARMUP=off, against
+an empty temporary database) and records:
+
+  startup.process        wall time of `python -c "import mainmenu"`
+  startup.import         cumulative import time of mainmenu (-X importtime)
+  startup.create_app     building one more app with mainmenu.create_app()
+  startup.module.<name>  cumulative import time of the TRACKED modules;
+                         status is "lazy" when startup did not import them
+
+Results use the benchmark suite's JSON format, so they can be compared
+with `python -m benchmarks.suite compare` or --compare here. The slowest
+modules by self time are printed after the run.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup --output startup.json
+    python -m benchmarks.bench_startup --compare startup.json --fail-on-regression
+
+--backend-dir measures another checkout (e.g. a git worktree of main).
+"""
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Subsystems whose import cost is worth watching
+TRACKED = (
+    "fastapi",
+    "pydantic",
+    "sqlalchemy",
+    "sqlalchemy.orm",
+    "slowapi",
+    "auth",
+    "passlib.context",
+    "jose.jwt",
+    "export",
+    "pyarrow",
+    "ai.processor",
+    "ai.intents",
+    "database.crud",
+    "monitoring.metrics",
+)
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+# Checkouts from before the app factory have no create_app (printed as -1)
+PROBE = (
+    "import time; start = time.perf_counter(); import mainmenu; imported = time.perf_counter(); "
+    "factory = getattr(mainmenu, 'create_app', None); factory and factory(); "
+    "print(imported - start, time.perf_counter() - imported if factory else -1)"
+)
+
+
+def parse_importtime(stderr: str):
+    "Return {module: (self_us, cumulative_us)} from -X importtime output."
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def run_once(backend_dir: str, env: dict) -> dict:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import mainmenu"], cwd=backend_dir, env=env,
+                   check=True, capture_output=True)
+    process = time.perf_counter() - start
+
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=backend_dir, env=env,
+                         check=True, capture_output=True, text=True)
+    _, create_app = (float(value) for value in out.stdout.split()[-2:])
+    return {"process": process, "create_app": create_app, "modules": parse_importtime(out.stderr)}
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+            "RATE_LIMIT_STORAGE_URI": f"sqlite:///{os.path.join(workdir, 'ratelimit.db')}",
+            "WARMUP": "off",
+        })
+
+        runs = []
+        for i in range(args.warmup + args.repeat):
+            result = run_once(args.backend_dir, env)
+            if i >= args.warmup:
+                runs.append(result)
+
+    seconds = lambda us: us / 1_000_000
+    timings = {
+        "startup.process": [r["process"] for r in runs],
+        "startup.import": [seconds(r["modules"]["mainmenu"][1]) for r in runs],
+        "startup.create_app": [r["create_app"] for r in runs if r["create_app"] >= 0],
+    }
+    results = {
+        name: {"group": "startup", **_summary(values, 0, 1)} if values else {"group": "startup", "skipped": "no app factory"}
+        for name, values in timings.items()
+    }
+    for name in TRACKED:
+        values = [seconds(r["modules"][name][1]) for r in runs if name in r["modules"]]
+        if values:
+            results[f"startup.module.{name}"] = {"group": "startup", **_summary(values, 0, 1), "status": "imported"}
+        else:
+            results[f"startup.module.{name}"] = {"group": "startup", "skipped": "lazy"}
+
+    self_times = defaultdict(list)
+    for r in runs:
+        for module, (self_us, _) in r["modules"].items():
+            self_times[module].append(self_us)
+    slowest = sorted(((statistics.median(v), m) for m, v in self_times.items()), reverse=True)[:args.top]
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "backend_dir": args.backend_dir,
+            "slowest_modules": [{"module": m, "self_ms": round(us / 1000, 3)} for us, m in slowest],
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpendSense worker startup benchmark")
+    parser.add_argument("--backend-dir", default=BACKEND_DIR, help="checkout to measure")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, result in results["results"].items():
+        if "median_ms" in result:
+            print(f"{name:<40} median {result['median_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms")
+        else:
+            print(f"{name:<40} {result['skipped']}")
+    print("\nslowest modules (self time, median):")
+    for entry in results["meta"]["slowest_modules"]:
+        print(f"  {entry['self_ms']:>8.1f} ms  {entry['module']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    regressions = compare(_load(args.compare), results, args.threshold) if args.compare else 0
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+import webhook_delivery
+from benchmarks.common import temp_database
+from benchmarks.loadtest import percentile
+from benchmarks.suite import _git_commit
+from database import crud, models, webhooks
+
+"""
+Webhook delivery (webhook_delivery.py) against a local stand-in receiver:
+asyncio HTTP/1.1 servers on 127.0.0.1, in a thread, a port per kind of endpoint.
+
+  /ok/N      200
+  /slow/N    200 after --slow-ms
+  /flaky/N   503 for the first --flaky-failures attempts of each delivery, then 200
+  /dead/N    500, always
+  /gone/N    410 Gone
+
+Every response, and the first request of every connection, waits
+--rtt-ms more, as over a network where a new connection costs a TCP (and
+TLS) handshake.
+
+Three phases on a fresh database:
+
+  backlog    --backlog deliveries queued to the /ok webhooks, then sent until
+             none is due; reported as deliveries per second and connections opened
+  baseline   the same number of POSTs sent one after another on a new
+             connection each (urllib), with no queue bookkeeping at all
+  live       --writes expenses through crud.create_expense at --rate per second
+             while the deliverer runs, so each write queues a budget_status
+             delivery for every webhook of its user; reported as latency from the
+             event to the receiver. Retry backoff is shortened to --retry-base.
+
+Checks: every signature verifies, every /ok, /slow and /flaky delivery
+arrives, /flaky ones after their failures, /dead ones end in the dead
+letters after MAX_ATTEMPTS attempts, /gone webhooks are deactivated by their
+first delivery, which is dead-lettered, and the queue is empty at the end.
+
+Run from the backend directory:
+    python -m benchmarks.bench_webhooks --backlog 5000 --writes 500 --rate 100
+"""
+
+KINDS = ("ok", "slow", "flaky", "dead", "gone")
+
+
+class Receiver:
+    "A stand-in for users' endpoints, keeping every request it gets."
+
+    def __init__(self, slow_ms: float, flaky_failures: int, rtt_ms: float = 0.0):
+        self.slow_ms, self.flaky_failures, self.rtt = slow_ms, flaky_failures, rtt_ms / 1000
+        self.requests = []  # (path, headers, body, status, received_at)
+        self.connections = 0
+        self.attempts = Counter()
+        self.loop = asyncio.new_event_loop()
+        self.servers, self.ports = [], {}
+
+    def start(self) -> None:
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        # A port per kind, so each is an endpoint with connections of its own
+        for kind in KINDS + ("baseline",):
+            server = asyncio.run_coroutine_threadsafe(
+                asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=1024), self.loop).result()
+            self.servers.append(server)
+            self.ports[kind] = server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        # The loop's thread is a daemon and ends with the process
+        for server in self.servers:
+            self.loop.call_soon_threadsafe(server.close)
+
+    async def _status(self, path: str, headers: dict) -> int:
+        kind = path.split("/")[1]
+        if kind == "slow":
+            await asyncio.sleep(self.slow_ms / 1000)
+        elif kind == "flaky":
+            self.attempts[headers.get("x-spendsense-delivery")] += 1
+            if self.attempts[headers.get("x-spendsense-delivery")] <= self.flaky_failures:
+                return 503
+        return {"dead": 500, "gone": 410}.get(kind, 200)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            if self.rtt:
+                await asyncio.sleep(self.rtt)  # the handshake of a new connection
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                path = head[0].split(" ")[1]
+                headers = {name.lower(): value for name, value in (line.split(": ", 1) for line in head[1:] if ": " in line)}
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                status = await self._status(path, headers)
+                if self.rtt:
+                    await asyncio.sleep(self.rtt)
+                self.requests.append((path, headers, body, status, datetime.utcnow()))
+                writer.write(f"HTTP/1.1 {status} Bench\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class BenchDeliverer(webhook_delivery.Deliverer):
+    "The deliverer on the benchmark's database instead of DATABASE_URL."
+
+    def __init__(self, engine):
+        super().__init__(owner="bench")
+        self.engine = engine
+
+    def _engines(self) -> list:
+        return [self.engine]
+
+
+def _setup(Session, receiver: Receiver, users: int, per_kind: int) -> dict:
+    "Users with an overall budget, and webhooks of every kind spread over them. Returns {path: secret}."
+    secrets = {}
+    with Session() as db:
+        db.execute(insert(models.Category), [{"category_id": 1, "name": "Food"}])
+        db.execute(insert(models.User), [
+            {"user_id": u, "name": "bench", "email": f"bench{u}@example.com", "password": "x"} for u in range(1, users + 1)])
+        db.commit()
+        for u in range(1, users + 1):
+            crud.create_budget(db, u, amount=1_000_000.0, period="monthly")
+        for kind in KINDS:
+            for n in range(per_kind):
+                path = f"/{kind}/{n}"
+                webhook = webhooks.create(db, n % users + 1, f"http://127.0.0.1:{receiver.ports[kind]}{path}",
+                                          ["budget_alert", "budget_status"])
+                secrets[path] = webhook.secret
+    return secrets
+
+
+def _queue_backlog(Session, count: int) -> list:
+    "Queue `count` deliveries to the /ok webhooks. Returns their delivery ids."
+    with Session() as db:
+        hooks = db.query(models.Webhook).filter(models.Webhook.url.contains("/ok/")).all()
+        payload = json.dumps({"budget_id": 0, "level": "over", "previous_level": "approaching"})
+        for i in range(count):
+            hook = hooks[i % len(hooks)]
+            db.execute(insert(models.WebhookDelivery), {
+                "webhook_id": hook.webhook_id, "user_id": hook.user_id, "event_id": i + 1, "kind": "budget_alert",
+                "payload": payload, "attempts": 0, "next_attempt_at": datetime.utcnow(), "created_at": datetime.utcnow()})
+        db.commit()
+        return [row.delivery_id for row in db.query(models.WebhookDelivery.delivery_id)]
+
+
+def _baseline(port: int, count: int) -> float:
+    "Seconds for `count` sequential POSTs, a new connection each."
+    body = json.dumps({"delivery_id": 0, "type": "budget_alert", "data": {}}).encode()
+    started = time.perf_counter()
+    for i in range(count):
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/baseline", data=body, method="POST", headers={
+            "Content-Type": "application/json", "X-SpendSense-Delivery": f"baseline-{i}",
+            "X-SpendSense-Signature": webhook_delivery.sign("baseline", int(time.time()), body)})
+        urllib.request.urlopen(request).read()
+    return time.perf_counter() - started
+
+
+async def _once(deliverer) -> dict:
+    try:
+        return await deliverer.run_once()
+    finally:
+        deliverer.close()
+
+
+async def _live(Session, engine, deliverer, args, rng: random.Random) -> float:
+    "Write expenses while the deliverer runs; returns seconds until the queue was empty."
+    stop = asyncio.Event()
+    task = asyncio.ensure_future(deliverer.run_forever(stop))
+
+    def write() -> None:
+        with Session() as db:
+            for _ in range(args.writes):
+                crud.create_expense(db, rng.randint(1, args.users), 1, 1.0, "Bench webhook")
+                deliverer.notify()
+                time.sleep(1 / args.rate)
+
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, write)
+    deadline = time.perf_counter() + args.timeout
+    while webhooks.status(engine)["queued"] and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    seconds = time.perf_counter() - started
+    stop.set()
+    await task
+    return seconds
+
+
+def run(args) -> dict:
+    logging.getLogger("spendsense.webhooks").setLevel(logging.ERROR)  # the /dead and /gone give-ups
+    receiver = Receiver(args.slow_ms, args.flaky_failures, args.rtt_ms)
+    receiver.start()
+    webhook_delivery.ALLOW_HTTP = webhook_delivery.ALLOW_PRIVATE = True
+    webhook_delivery.RETRY_BASE_SECONDS, webhook_delivery.RETRY_MAX_SECONDS = args.retry_base, args.retry_base * 8
+    webhook_delivery.POLL_SECONDS = 0.05
+    rng = random.Random(args.seed)
+    try:
+        with temp_database() as Session:
+            engine = Session.kw["bind"]
+            secrets = _setup(Session, receiver, args.users, args.webhooks)
+
+            backlog_ids = set(_queue_backlog(Session, args.backlog))
+            deliverer = BenchDeliverer(engine)
+            started = time.perf_counter()
+            counts = asyncio.run(_once(deliverer))
+            backlog_seconds = time.perf_counter() - started
+            backlog_connections = receiver.connections
+            backlog_received = {int(r[1]["x-spendsense-delivery"]) for r in receiver.requests}
+
+            before = receiver.connections
+            baseline_seconds = _baseline(receiver.ports["baseline"], args.backlog)
+            baseline_connections = receiver.connections - before
+            receiver.requests = [r for r in receiver.requests if r[0] != "/baseline"]
+
+            mark = len(receiver.requests)
+            live_seconds = asyncio.run(_live(Session, engine, BenchDeliverer(engine), args, rng))
+            live = receiver.requests[mark:]
+
+            with Session() as db:
+                dead = db.execute(select(models.WebhookDeadLetter.__table__)).all()
+                hooks = {h.webhook_id: h for h in db.query(models.Webhook)}
+                expected = Counter(hooks[r.webhook_id].url.split("/")[3] for r in db.execute(
+                    select(models.BudgetEvent.event_id, models.Webhook.webhook_id)
+                    .join(models.Webhook, models.Webhook.user_id == models.BudgetEvent.user_id)))
+            queue = webhooks.status(engine)
+    finally:
+        receiver.stop()
+
+    signatures_valid = all(webhook_delivery.verify(secrets[path], headers["x-spendsense-signature"], body)
+                           for path, headers, body, status, _ in receiver.requests)
+    delivered = Counter(path.split("/")[1] for path, headers, body, status, _ in live if 200 <= status < 300)
+    unique = {(path, headers["x-spendsense-delivery"]) for path, headers, body, status, _ in live if 200 <= status < 300}
+    latencies = sorted(
+        (received - datetime.fromisoformat(json.loads(body)["created_at"].rstrip("Z"))).total_seconds()
+        for path, headers, body, status, received in live if 200 <= status < 300 and path.split("/")[1] == "ok")
+    dead_kinds = Counter(hooks[row.webhook_id].url.split("/")[3] for row in dead)
+    flaky_attempts = Counter(n for key, n in receiver.attempts.items())
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **{key: getattr(args, key) for key in ("users", "webhooks", "backlog", "writes", "rate", "rtt_ms", "slow_ms",
+                                                   "flaky_failures", "retry_base", "seed")},
+            "batch_size": webhook_delivery.BATCH_SIZE,
+            "connections_per_endpoint": webhook_delivery.CONNECTIONS_PER_ENDPOINT,
+            "max_attempts": webhooks.MAX_ATTEMPTS,
+        },
+        "results": {
+            "backlog": {
+                "deliveries": counts.get("delivered", 0),
+                "seconds": round(backlog_seconds, 3),
+                "per_second": round(counts.get("delivered", 0) / backlog_seconds) if backlog_seconds else None,
+                "connections": backlog_connections,
+            },
+            "baseline": {
+                "deliveries": args.backlog,
+                "seconds": round(baseline_seconds, 3),
+                "per_second": round(args.backlog / baseline_seconds) if baseline_seconds else None,
+                "connections": baseline_connections,
+            },
+            "live": {
+                "seconds": round(live_seconds, 2),
+                "delivered": dict(delivered),
+                "expected": dict(expected),
+                "duplicates": sum(delivered.values()) - len(unique),
+                "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "dead_letters": dict(dead_kinds),
+                "connections": receiver.connections - backlog_connections - baseline_connections,
+            },
+        },
+        "checks": {
+            "signatures_valid": signatures_valid,
+            "backlog_delivered": backlog_received >= backlog_ids,
+            "ok_delivered": all(len({d for p, d in unique if p.split("/")[1] == kind}) == expected[kind]
+                                for kind in ("ok", "slow", "flaky")),
+            "flaky_retried": not flaky_attempts or min(flaky_attempts) == args.flaky_failures + 1,
+            "dead_lettered": dead_kinds["dead"] == expected["dead"]
+                             and all(row.attempts == webhooks.MAX_ATTEMPTS for row in dead
+                                     if hooks[row.webhook_id].url.split("/")[3] == "dead"),
+            "gone_deactivated": dead_kinds["gone"] > 0
+                                and not any(h.is_active for h in hooks.values() if "/gone/" in h.url),
+            "queue_drained": queue["queued"] == 0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook delivery throughput, latency and retries against a local receiver")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--webhooks", type=int, default=4, help="webhooks of each kind (ok, slow, flaky, dead, gone)")
+    parser.add_argument("--backlog", type=int, default=2000, help="deliveries queued before the backlog phase")
+    parser.add_argument("--writes", type=int, default=200, help="expense writes in the live phase")
+    parser.add_argument("--rate", type=float, default=50, help="writes per second in the live phase")
+    parser.add_argument("--rtt-ms", type=float, default=5,
+                        help="receiver delay per response and per new connection, a stand-in for the network")
+    parser.add_argument("--slow-ms", type=float, default=200)
+    parser.add_argument("--flaky-failures", type=int, default=2)
+    parser.add_argument("--retry-base", type=float, default=0.1, help="retry backoff base in seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the queue to drain")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--check", action="store_true", help="exit 1 when a check fails")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    r = results["results"]
+    for name in ("backlog", "baseline"):
+        print(f"{name:<9} {r[name]['deliveries']:>6} deliveries in {r[name]['seconds']:>7.2f} s  "
+              f"{r[name]['per_second']:>6}/s  {r[name]['connections']} connections")
+    live = r["live"]
+    print(f"live      p50 {live['latency_p50_ms']} ms  p95 {live['latency_p95_ms']} ms  p99 {live['latency_p99_ms']} ms  "
+          f"drained in {live['seconds']} s, {live['duplicates']} duplicates, {live['connections']} connections")
+    print(f"          delivered {live['delivered']}  dead letters {live['dead_letters']}")
+    for name, ok in results["checks"].items():
+        print(f"{name:<20} {'ok' if ok else 'FAILED'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.check and not all(results["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
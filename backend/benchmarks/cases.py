@@ -0,0 +1,399 @@
+import itertools
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, insert, select
+
+import auth
+from ai import processor
+from ai.intents import parse_intent_from_query
+from ai.parser import parse_intent
+from ai.schemas import IntentType, ParsedIntent, TimeRange
+from ai import recurring
+from ai.categorizer import categorizer, train
+from benchmarks.synthetic import BENCH_PASSWORD, DESCRIPTIONS, SAMPLE_QUERIES
+from database import crud, models, search
+
+"""
+Benchmark cases for benchmarks/suite.py, grouped as crud, ai, parse and
+http. Imported by the suite only after DATABASE_URL points at the dataset,
+because the app modules bind their engine at import time.
+
+A case is `fn(ctx, db, arg)`. `arg` comes from the optional `setup(ctx, db)`,
+which runs untimed before every iteration (e.g. to create the row a delete
+benchmark removes). The return value is recorded as the case's status.
+Reads run against the dataset's heaviest user; writes go to a separate
+runner user so they do not shift the numbers of later read cases.
+"""
+
+
+class Case:
+    def __init__(self, name: str, group: str, fn: Callable, setup: Optional[Callable] = None,
+                 ops: int = 1, max_rows: Optional[int] = None):
+        self.name = name
+        self.group = group
+        self.fn = fn
+        self.setup = setup
+        self.ops = ops
+        self.max_rows = max_rows
+
+
+CASES: List[Case] = []
+
+
+def case(name: str, group: str, setup: Optional[Callable] = None, ops: int = 1, max_rows: Optional[int] = None):
+    def register(fn):
+        CASES.append(Case(f"{group}.{name}", group, fn, setup, ops, max_rows))
+        return fn
+    return register
+
+
+class Context:
+    """Ids and clients shared by the cases, resolved once per run."""
+
+    def __init__(self, Session, meta: dict):
+        self.Session = Session
+        self.meta = meta
+        self.rows = meta.get("rows") or 0
+        self.counter = itertools.count()
+        with Session() as db:
+            self.user_id = meta.get("heavy_user_id") or db.execute(
+                select(models.Expense.user_id).group_by(models.Expense.user_id)
+                .order_by(func.count().desc()).limit(1)
+            ).scalar()
+            self.user_email = crud.get_user_by_id(db, self.user_id).email
+            self.category_id = db.execute(select(func.min(models.Category.category_id))).scalar()
+            self.expense_id = db.execute(
+                select(func.max(models.Expense.expense_id)).where(models.Expense.user_id == self.user_id)
+            ).scalar()
+            self.budget_id = db.execute(
+                select(models.Budget.budget_id).where(
+                    models.Budget.user_id == self.user_id,
+                    models.Budget.is_active == 1,
+                    models.Budget.deleted_at.is_(None),
+                ).limit(1)
+            ).scalar()
+            anchor = meta.get("anchor")
+            self.anchor = datetime.fromisoformat(anchor) if anchor else db.execute(
+                select(func.max(models.Expense.expense_date))
+            ).scalar()
+
+            # Runner user: target of the write benchmarks, with a known password
+            runner = crud.create_user(db, "Benchmark Runner", f"runner-{datetime.utcnow():%Y%m%d%H%M%S%f}@example.com", BENCH_PASSWORD)
+            self.runner_id = runner.user_id
+            self.runner_email = runner.email
+            self.password_hash = runner.password
+        self.headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': self.user_email})}"}
+        self.runner_headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': self.runner_email})}"}
+        self._client = None
+
+    def unique(self, prefix: str) -> str:
+        return f"{prefix} {next(self.counter)}"
+
+    @property
+    def client(self):
+        if self._client is None:
+            from fastapi.testclient import TestClient
+            from mainmenu import app
+            self._client = TestClient(app)
+        return self._client
+
+
+# Setup helpers (untimed)
+def _new_user(ctx: Context, db) -> int:
+    user_id = db.execute(insert(models.User).returning(models.User.user_id), [{
+        "name": "Scratch", "email": f"{ctx.unique('scratch').replace(' ', '-')}-{datetime.utcnow():%H%M%S%f}@example.com",
+        "password": ctx.password_hash,
+    }]).scalar_one()
+    db.commit()
+    return user_id
+
+
+def _new_expense(ctx: Context, db) -> int:
+    expense_id = db.execute(insert(models.Expense).returning(models.Expense.expense_id), [{
+        "user_id": ctx.runner_id, "category_id": ctx.category_id, "amount": 12.5,
+        "description": "Scratch", "expense_date": ctx.anchor,
+    }]).scalar_one()
+    db.commit()
+    return expense_id
+
+
+def _new_budget(ctx: Context, db) -> int:
+    budget_id = db.execute(insert(models.Budget).returning(models.Budget.budget_id), [{
+        "user_id": ctx.runner_id, "category_id": ctx.category_id, "amount": 300.0,
+        "period": "monthly", "start_date": ctx.anchor - timedelta(days=60), "is_active": 1,
+    }]).scalar_one()
+    db.commit()
+    return budget_id
+
+
+def _new_category(ctx: Context, db) -> int:
+    return crud.create_category(db, ctx.unique("Scratch category")).category_id
+
+
+#  CRUD
+
+@case("create_user", "crud")
+def _(ctx, db, arg):
+    crud.create_user(db, "Bench", f"{ctx.unique('new').replace(' ', '-')}-{datetime.utcnow():%H%M%S%f}@example.com", BENCH_PASSWORD)
+
+@case("update_user", "crud")
+def _(ctx, db, arg):
+    crud.update_user(db, ctx.runner_id, name=ctx.unique("Runner"))
+
+@case("soft_delete_user", "crud", setup=_new_user)
+def _(ctx, db, user_id):
+    crud.soft_delete_user(db, user_id)
+
+@case("get_user_by_email", "crud")
+def _(ctx, db, arg):
+    crud.get_user_by_email(db, ctx.user_email)
+
+@case("get_user_by_id", "crud")
+def _(ctx, db, arg):
+    crud.get_user_by_id(db, ctx.user_id)
+
+@case("verify_user_credentials", "crud")
+def _(ctx, db, arg):
+    return "ok" if crud.verify_user_credentials(db, ctx.runner_email, BENCH_PASSWORD) else "rejected"
+
+@case("get_category_by_name", "crud")
+def _(ctx, db, arg):
+    crud.get_category_by_name(db, "Food")
+
+@case("get_category_by_id", "crud")
+def _(ctx, db, arg):
+    crud.get_category_by_id(db, ctx.category_id)
+
+@case("create_category", "crud")
+def _(ctx, db, arg):
+    crud.create_category(db, ctx.unique("Bench category"))
+
+@case("update_category", "crud", setup=_new_category)
+def _(ctx, db, category_id):
+    crud.update_category(db, category_id, ctx.unique("Renamed category"))
+
+@case("delete_category", "crud", setup=_new_category)
+def _(ctx, db, category_id):
+    crud.delete_category(db, category_id)
+
+@case("category_exists", "crud")
+def _(ctx, db, arg):
+    crud.category_exists(db, ctx.category_id)
+
+@case("get_budget_category_name", "crud")
+def _(ctx, db, arg):
+    crud.get_budget_category_name(db, ctx.category_id)
+
+@case("create_expense", "crud")
+def _(ctx, db, arg):
+    crud.create_expense(db, ctx.runner_id, ctx.category_id, 9.99, "Bench expense", expense_date=ctx.anchor)
+
+@case("get_expense_by_id", "crud")
+def _(ctx, db, arg):
+    crud.get_expense_by_id(db, ctx.expense_id)
+
+@case("update_expense", "crud", setup=_new_expense)
+def _(ctx, db, expense_id):
+    crud.update_expense(db, expense_id, amount=15.0, description="Updated")
+
+@case("soft_delete_expense", "crud", setup=_new_expense)
+def _(ctx, db, expense_id):
+    crud.soft_delete_expense(db, expense_id)
+
+# Loads every expense of every user into memory; skipped on large datasets
+@case("get_expenses", "crud", max_rows=1_000_000)
+def _(ctx, db, arg):
+    crud.get_expenses(db)
+
+@case("get_monthly_expense_summary", "crud")
+def _(ctx, db, arg):
+    crud.get_monthly_expense_summary(db, ctx.user_id, ctx.anchor.month, ctx.anchor.year)
+
+def _search(query: str, **filters):
+    def run(ctx, db, arg):
+        search.search_expenses(db, ctx.user_id, query, **filters)
+    return run
+
+
+# Full-text search shapes: word, prefix, phrase, OR, and a word with a category filter
+for _name, _query, _filters in [
+    ("word", "coffee", {}),
+    ("prefix", "gro*", {}),
+    ("phrase", '"train ticket"', {}),
+    ("or", "cinema OR museum", {}),
+    ("word+category", "coffee", {"category_id": 1}),
+]:
+    case(f"search_expenses.{_name}", "crud")(_search(_query, **_filters))
+
+@case("create_budget", "crud")
+def _(ctx, db, arg):
+    crud.create_budget(db, ctx.runner_id, ctx.category_id, 250.0, start_date=ctx.anchor)
+
+@case("get_budget_by_id", "crud")
+def _(ctx, db, arg):
+    crud.get_budget_by_id(db, ctx.budget_id)
+
+@case("get_user_budgets", "crud")
+def _(ctx, db, arg):
+    crud.get_user_budgets(db, ctx.user_id)
+
+@case("get_budget_by_category", "crud")
+def _(ctx, db, arg):
+    crud.get_budget_by_category(db, ctx.user_id, None)
+
+@case("update_budget", "crud", setup=_new_budget)
+def _(ctx, db, budget_id):
+    crud.update_budget(db, budget_id, amount=320.0, alert_threshold=0.9)
+
+@case("soft_delete_budget", "crud", setup=_new_budget)
+def _(ctx, db, budget_id):
+    crud.soft_delete_budget(db, budget_id)
+
+@case("deactivate_budget", "crud", setup=_new_budget)
+def _(ctx, db, budget_id):
+    crud.deactivate_budget(db, budget_id)
+
+@case("activate_budget", "crud", setup=_new_budget)
+def _(ctx, db, budget_id):
+    crud.activate_budget(db, budget_id)
+
+@case("get_budget_period_dates", "crud", setup=lambda ctx, db: crud.get_budget_by_id(db, ctx.budget_id))
+def _(ctx, db, budget):
+    crud.get_budget_period_dates(budget)
+
+@case("get_budget_status", "crud")
+def _(ctx, db, arg):
+    crud.get_budget_status(db, ctx.budget_id)
+
+@case("get_all_budget_statuses", "crud")
+def _(ctx, db, arg):
+    return len(crud.get_all_budget_statuses(db, ctx.user_id))
+
+
+#  AI
+
+def _intent_case(intent: IntentType):
+    def run(ctx, db, arg):
+        parsed = ParsedIntent(
+            intent=intent,
+            time=TimeRange(month=ctx.anchor.month, year=ctx.anchor.year),
+            category="food",
+            raw_query=f"benchmark {intent.value}",
+        )
+        return processor.process_ai_query(parsed, db, ctx.user_id).execution_status
+    case(f"intent.{intent.value}", "ai")(run)
+
+
+for _intent in IntentType:
+    _intent_case(_intent)
+
+# Handlers that are not reachable through an IntentType yet
+@case("check_budget_alerts", "ai")
+def _(ctx, db, arg):
+    return processor.check_budget_alerts(db, ctx.user_id).execution_status
+
+@case("suggest_budget_from_history", "ai")
+def _(ctx, db, arg):
+    return processor.suggest_budget_from_history(db, ctx.user_id, ctx.category_id).execution_status
+
+@case("budget_suggestions_with_limits", "ai")
+def _(ctx, db, arg):
+    parsed = ParsedIntent(intent=IntentType.budget_suggestions, raw_query="budget suggestions")
+    return processor.budget_suggestions_with_limits(parsed, db, ctx.user_id).execution_status
+
+@case("generate_personalized_advice", "ai")
+def _(ctx, db, arg):
+    return processor.generate_personalized_advice(db, ctx.user_id).execution_status
+
+@case("smart_categorize", "ai", ops=len(SAMPLE_QUERIES))
+def _(ctx, db, arg):
+    for query in SAMPLE_QUERIES:
+        processor.smart_categorize(query)
+
+# 1000 distinct descriptions, so the per-batch memo doesn't hide the model cost
+CATEGORIZE_BATCH = [
+    f"{description} {word} {i}x" for i, (description, word) in enumerate(itertools.islice(itertools.cycle(itertools.product(
+        itertools.chain.from_iterable(DESCRIPTIONS.values()), ("store", "online", "weekly", "order", "card"),
+    )), 1000))
+]
+
+@case("categorizer.suggest", "ai", ops=len(CATEGORIZE_BATCH))
+def _(ctx, db, arg):
+    return "model" if all(categorizer.suggest(CATEGORIZE_BATCH)) else "no model"
+
+@case("recurring.detect_incremental", "ai", setup=_new_expense)
+def _(ctx, db, arg):
+    return recurring.run(db, now=ctx.anchor)["recurring_charges"]
+
+@case("categorizer.train_incremental", "ai", setup=_new_expense)
+def _(ctx, db, arg):
+    return train(db, categorizer.path)["expenses"]
+
+
+#  PARSING
+
+@case("parse_intent", "parse", ops=len(SAMPLE_QUERIES))
+def _(ctx, db, arg):
+    for query in SAMPLE_QUERIES:
+        parse_intent(query)
+
+@case("parse_intent_from_query", "parse", ops=len(SAMPLE_QUERIES))
+def _(ctx, db, arg):
+    for query in SAMPLE_QUERIES:
+        parse_intent_from_query(query)
+
+
+#  HTTP
+
+def _get(path: str, auth_required: bool = True):
+    def run(ctx, db, arg):
+        response = ctx.client.get(path.format(ctx=ctx), headers=ctx.headers if auth_required else None)
+        return response.status_code
+    return run
+
+
+for _name, _path, _auth in [
+    ("GET /", "/", False),
+    ("GET /categories", "/categories", False),
+    ("GET /users/me", "/users/me", True),
+    ("GET /users/{id}/chat", "/users/{ctx.user_id}/chat", True),
+    ("GET /budgets", "/budgets", True),
+    ("GET /budgets/status", "/budgets/status", True),
+    ("GET /budgets/{id}", "/budgets/{ctx.budget_id}", True),
+    ("GET /expenses", "/expenses", True),
+    ("GET /expenses/summary", "/expenses/summary?month={ctx.anchor.month}&year={ctx.anchor.year}", True),
+    ("GET /users/{id}/expenses/summary", "/users/{ctx.user_id}/expenses/summary?month={ctx.anchor.month}&year={ctx.anchor.year}", False),
+    ("GET /expenses/export?format=csv", "/expenses/export?format=csv", True),
+    ("GET /expenses/search", "/expenses/search?q=coffee", True),
+    ("GET /expenses/search?sort=recent", "/expenses/search?q=gro*&sort=recent", True),
+]:
+    case(_name, "http")(_get(_path, _auth))
+
+@case("POST /expenses", "http")
+def _(ctx, db, arg):
+    return ctx.client.post("/expenses", json={
+        "user_id": ctx.runner_id, "category_id": ctx.category_id, "amount": 4.5, "description": "Bench coffee",
+    }).status_code
+
+@case("POST /expenses (auto category)", "http")
+def _(ctx, db, arg):
+    return ctx.client.post("/expenses", json={
+        "user_id": ctx.runner_id, "amount": 4.5, "description": "Bench coffee",
+    }).status_code
+
+@case("POST /expenses/import", "http", ops=len(CATEGORIZE_BATCH))
+def _(ctx, db, arg):
+    return ctx.client.post("/expenses/import", headers=ctx.runner_headers, json={"expenses": [
+        {"amount": 4.5, "description": description, "expense_date": ctx.anchor.isoformat()}
+        for description in CATEGORIZE_BATCH
+    ]}).status_code
+
+@case("POST /ai/query", "http", ops=len(SAMPLE_QUERIES))
+def _(ctx, db, arg):
+    codes = {ctx.client.post("/ai/query", json={"user_id": ctx.user_id, "query": query}).status_code for query in SAMPLE_QUERIES}
+    return ",".join(str(code) for code in sorted(codes))
+
+@case("POST /users/login", "http")
+def _(ctx, db, arg):
+    return ctx.client.post("/users/login", data={"username": ctx.runner_email, "password": BENCH_PASSWORD}).status_code
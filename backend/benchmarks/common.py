@@ -0,0 +1,47 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import models
+
+"""Shared helpers for the benchmark scripts."""
+
+
+@contextmanager
+def temp_database(path: str = None):
+    """
+    Yield a sessionmaker bound to a fresh SQLite file with every table
+    created. The file is removed afterwards unless an explicit path is given.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{path or os.path.join(tmp, 'bench.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        try:
+            yield sessionmaker(bind=engine)
+        finally:
+            engine.dispose()
+
+
+def seed_expenses(session, rows: int, user_id: int = 1, batch_size: int = 10_000):
+    "Insert one user, one category and `rows` expenses for that user."
+    session.execute(insert(models.User), [{"user_id": user_id, "name": "bench", "email": f"bench{user_id}@example.com", "password": "x"}])
+    session.execute(insert(models.Category), [{"category_id": 1, "name": "Food"}])
+    start = datetime(2024, 1, 1)
+    for offset in range(0, rows, batch_size):
+        session.execute(insert(models.Expense), [
+            {
+                "user_id": user_id,
+                "category_id": 1,
+                "amount": 5 + i % 200,
+                "description": f"expense {i}",
+                "expense_date": start + timedelta(minutes=i),
+                "created_at": start,
+                "updated_at": start,
+            }
+            for i in range(offset, min(offset + batch_size, rows))
+        ])
+    session.commit()
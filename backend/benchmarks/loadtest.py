@@ -0,0 +1,439 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlencode
+
+from benchmarks import synthetic
+
+"""
+Closed-loop load test against a real uvicorn server.
+
+Starts `uvicorn mainmenu:app --workers N` on a copy of a synthetic dataset
+and runs virtual users. Each virtual user is a thread with its own
+keep-alive connection. It runs scripted journeys back to back, waiting for
+each response and an exponential think time before the next request. New
+virtual users start at --spawn-rate per second until --users are running.
+
+Journeys:
+- new user: signup, login, add expenses, open the dashboard, ask the AI,
+  create a budget, check budgets
+- returning user: login as an existing dataset user, open the dashboard,
+  add an expense, ask the AI, check budgets
+- browse: dashboard and budget checks only, with an already issued token
+
+Reported per endpoint (route template): request count, error rate, p50,
+p95 and p99 latency. For SQLite lock contention, a probe thread times how
+long `BEGIN IMMEDIATE` waits for the write lock on the same database
+file, and the server log is scanned for "database is locked" errors.
+
+Everything runs locally; no network access is needed.
+
+Run from the backend directory:
+    python -m benchmarks.loadtest --workers 4 --users 32 --duration 60
+"""
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOURNEY_WEIGHTS = {"new_user": 1, "returning_user": 4, "browse": 5}
+LOCK_PROBE_INTERVAL = 0.1
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = defaultdict(list)
+        self.journeys = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool, detail: str = None):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+                if detail and len(self.error_samples[endpoint]) < 3:
+                    self.error_samples[endpoint].append(detail)
+
+    def journey_done(self, name: str):
+        with self._lock:
+            self.journeys[name] += 1
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class Client:
+    """One keep-alive HTTP connection per virtual user."""
+
+    def __init__(self, host: str, port: int, stats: Stats, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.timeout = timeout
+        self.token = None
+        self.conn = None
+        self.last_status = None
+
+    def request(self, method: str, path: str, endpoint: str, json_body=None, form=None, expect=(200,)):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        start = time.perf_counter()
+        try:
+            try:
+                status, payload = self._send(method, path, body, headers)
+            except (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected):
+                # The server closed an idle keep-alive connection; retry once on a new one
+                self.close()
+                start = time.perf_counter()
+                status, payload = self._send(method, path, body, headers)
+        except (OSError, http.client.HTTPException) as exc:
+            self.close()
+            self.last_status = None
+            self.stats.record(f"{method} {endpoint}", time.perf_counter() - start, False, f"{type(exc).__name__}: {exc}")
+            return None
+        elapsed = time.perf_counter() - start
+        self.last_status = status
+        ok = status in expect
+        self.stats.record(f"{method} {endpoint}", elapsed, ok, None if ok else f"{status} {payload[:200]!r}")
+        if not ok:
+            return None
+        try:
+            return json.loads(payload) if payload else None
+        except ValueError:
+            return None
+
+    def _send(self, method: str, path: str, body, headers):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index: int, client: Client, meta: dict, args, stop: threading.Event, stats: Stats):
+        super().__init__(name=f"vu-{index}", daemon=True)
+        self.index = index
+        self.client = client
+        self.meta = meta
+        self.args = args
+        self.stop = stop
+        self.stats = stats
+        self.rng = random.Random(f"{args.seed}:{index}")
+        self.user_id = None
+        self.journey_count = 0
+
+    def think(self):
+        if self.args.think_time > 0:
+            self.stop.wait(self.rng.expovariate(1.0 / self.args.think_time))
+
+    def run(self):
+        journeys = list(JOURNEY_WEIGHTS)
+        weights = [JOURNEY_WEIGHTS[name] for name in journeys]
+        while not self.stop.is_set():
+            name = self.rng.choices(journeys, weights=weights)[0]
+            if name == "browse" and self.client.token is None:
+                name = "returning_user"
+            getattr(self, name)()
+            self.stats.journey_done(name)
+            self.journey_count += 1
+        self.client.close()
+
+    # Steps
+    def login(self, email: str) -> bool:
+        result = self.client.request("POST", "/users/login", "/users/login",
+                                     form={"username": email, "password": synthetic.BENCH_PASSWORD})
+        if not result:
+            return False
+        self.client.token = result["access_token"]
+        me = self.client.request("GET", "/users/me", "/users/me")
+        self.user_id = me["user_id"] if me else None
+        return self.user_id is not None
+
+    def dashboard(self):
+        now = datetime.now()
+        self.client.request("GET", "/categories", "/categories")
+        self.client.request("GET", f"/expenses/summary?month={now.month}&year={now.year}", "/expenses/summary")
+        self.client.request("GET", "/budgets/status", "/budgets/status")
+        self.think()
+
+    def add_expenses(self, count: int):
+        for _ in range(count):
+            name, _, median, sigma, _ = self.rng.choice(synthetic.CATEGORY_PROFILES)
+            self.client.request("POST", "/expenses", "/expenses", json_body={
+                "user_id": self.user_id,
+                "category_id": 1 + [p[0] for p in synthetic.CATEGORY_PROFILES].index(name),
+                "amount": round(self.rng.lognormvariate(0.0, sigma) * median, 2),
+                "description": self.rng.choice(synthetic.DESCRIPTIONS[name]),
+            })
+            self.think()
+
+    def ask_ai(self, count: int):
+        for _ in range(count):
+            self.client.request("POST", "/ai/query", "/ai/query",
+                                json_body={"user_id": self.user_id, "query": self.rng.choice(synthetic.SAMPLE_QUERIES)})
+            self.think()
+
+    def check_budgets(self):
+        budgets = self.client.request("GET", "/budgets", "/budgets") or []
+        if budgets:
+            self.client.request("GET", f"/budgets/{budgets[0]['budget_id']}", "/budgets/{budget_id}")
+        self.client.request("GET", "/budgets/status", "/budgets/status")
+        self.think()
+
+    # Journeys
+    def new_user(self):
+        email = f"load-{self.args.seed}-{self.index}-{self.journey_count}-{time.time_ns()}@example.com"
+        created = self.client.request("POST", "/users", "/users", json_body={
+            "name": f"Load User {self.index}", "email": email, "password": synthetic.BENCH_PASSWORD,
+        })
+        self.think()
+        if not created or not self.login(email):
+            return
+        self.add_expenses(self.rng.randint(2, 5))
+        self.dashboard()
+        self.ask_ai(self.rng.randint(1, 2))
+        self.client.request("POST", "/budgets", "/budgets", json_body={
+            "user_id": self.user_id, "amount": round(self.rng.uniform(300, 1500), 2), "period": "monthly",
+        })
+        self.check_budgets()
+
+    def returning_user(self):
+        user_id = self.rng.randint(1, self.meta["users"])
+        if not self.login(f"user{user_id}@example.com"):
+            return
+        self.dashboard()
+        self.add_expenses(1)
+        self.ask_ai(self.rng.randint(1, 3))
+        self.check_budgets()
+
+    def browse(self):
+        self.dashboard()
+        self.check_budgets()
+
+
+class LockProbe(threading.Thread):
+    """Time how long a writer waits for SQLite's write lock while under load."""
+
+    def __init__(self, path: str, stop: threading.Event, interval: float = LOCK_PROBE_INTERVAL):
+        super().__init__(name="lock-probe", daemon=True)
+        self.path = path
+        self.stop = stop
+        self.interval = interval
+        self.waits = []
+        self.timeouts = 0
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        while not self.stop.wait(self.interval):
+            start = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                self.timeouts += 1
+                continue
+            self.waits.append(time.perf_counter() - start)
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, database: str, workers: int, port: int, log_path: str, extra_env=None,
+                 backend_dir: str = BACKEND_DIR):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{database}",
+        "RATE_LIMIT_STORAGE_URI": f"sqlite:///{os.path.join(workdir, 'ratelimit.db')}",
+    })
+    env.setdefault("RATE_LIMIT_ENABLED", "0")
+    # Warm every worker before the readiness check below succeeds
+    env.setdefault("WARMUP", "blocking")
+    env.update(extra_env or {})
+    log = open(log_path, "w", encoding="utf-8")
+    # The app no longer creates tables on import; older checkouts still do
+    if os.path.exists(os.path.join(backend_dir, "database", "migrate.py")):
+        subprocess.run([sys.executable, "-m", "database.migrate"], cwd=backend_dir, env=env,
+                       stdout=log, stderr=subprocess.STDOUT, check=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "mainmenu:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=backend_dir,
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with {server.returncode}, see {log_path}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return server, log
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 60s")
+
+
+def report(stats: Stats, probe: LockProbe, lock_errors: int, elapsed: float, args) -> dict:
+    endpoints = {}
+    total = errors = 0
+    for endpoint in sorted(stats.latencies):
+        values = sorted(stats.latencies[endpoint])
+        count, failed = len(values), stats.errors.get(endpoint, 0)
+        total += count
+        errors += failed
+        endpoints[endpoint] = {
+            "count": count,
+            "rps": round(count / elapsed, 2),
+            "error_rate": round(failed / count, 4),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+        if stats.error_samples.get(endpoint):
+            endpoints[endpoint]["error_samples"] = stats.error_samples[endpoint]
+    waits = sorted(probe.waits)
+    return {
+        "config": {key: getattr(args, key) for key in ("workers", "users", "spawn_rate", "think_time", "duration", "rows", "seed")},
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "journeys": dict(stats.journeys),
+        "endpoints": endpoints,
+        "db_lock": {
+            "probes": len(waits) + probe.timeouts,
+            "wait_p50_ms": round(percentile(waits, 0.50) * 1000, 3),
+            "wait_p95_ms": round(percentile(waits, 0.95) * 1000, 3),
+            "wait_p99_ms": round(percentile(waits, 0.99) * 1000, 3),
+            "wait_max_ms": round(waits[-1] * 1000, 3) if waits else 0.0,
+            "probe_timeouts": probe.timeouts,
+            "server_lock_errors": lock_errors,
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{result['requests']} requests in {result['elapsed_s']}s, {result['throughput_rps']} req/s, "
+          f"error rate {result['error_rate']:.2%}, journeys {result['journeys']}")
+    print(f"{'endpoint':<28} {'count':>7} {'rps':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, row in result["endpoints"].items():
+        print(f"{endpoint:<28} {row['count']:>7} {row['rps']:>7} {row['error_rate']:>7.2%} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+    lock = result["db_lock"]
+    print(f"DB write lock wait: p50 {lock['wait_p50_ms']} ms  p95 {lock['wait_p95_ms']} ms  p99 {lock['wait_p99_ms']} ms  "
+          f"max {lock['wait_max_ms']} ms  ({lock['probes']} probes, {lock['probe_timeouts']} timed out); "
+          f"'database is locked' errors in server log: {lock['server_lock_errors']}")
+    for endpoint, row in result["endpoints"].items():
+        for sample in row.get("error_samples", []):
+            print(f"  error {endpoint}: {sample}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop load test against a local uvicorn")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--spawn-rate", type=float, default=4.0, help="virtual users started per second")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean think time between steps (s), 0 for none")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load after the first user starts")
+    parser.add_argument("--dataset", help="synthetic dataset to copy; generated if missing")
+    parser.add_argument("--rows", type=int, default=20_000, help="expense rows when generating the dataset")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--server-log", help="keep the uvicorn log (tracebacks of 500s) at this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = args.dataset or os.path.join(workdir, "dataset.db")
+        if not os.path.exists(source):
+            print(f"Generating {args.rows:,} expense rows", file=sys.stderr)
+            synthetic.generate(source, args.rows, seed=args.seed)
+        meta = synthetic.load_meta(source) or {}
+        if not meta.get("users"):
+            parser.error("the dataset has no <dataset>.json metadata; generate it with benchmarks.synthetic")
+        database = os.path.join(workdir, "load.db")
+        shutil.copyfile(source, database)
+
+        port = args.port or _free_port()
+        log_path = os.path.join(workdir, "server.log")
+        server, log = start_server(workdir, database, args.workers, port, log_path)
+        stats, stop = Stats(), threading.Event()
+        probe = LockProbe(database, stop)
+        users = []
+        probe.start()
+        started = time.perf_counter()
+        try:
+            for index in range(args.users):
+                user = VirtualUser(index, Client("127.0.0.1", port, stats), meta, args, stop, stats)
+                user.start()
+                users.append(user)
+                if args.spawn_rate > 0 and stop.wait(1.0 / args.spawn_rate):
+                    break
+            stop.wait(max(0.0, args.duration - (time.perf_counter() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            elapsed = time.perf_counter() - started
+            for user in users:
+                user.join(timeout=35)
+            probe.join()
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            lock_errors = len(re.findall(r"database is locked", f.read()))
+        if args.server_log:
+            shutil.copyfile(log_path, args.server_log)
+        result = report(stats, probe, lock_errors, elapsed, args)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
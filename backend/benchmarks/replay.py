@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
+
+from benchmarks import synthetic
+from benchmarks.loadtest import Client, Stats, _free_port, percentile, start_server
+
+"""
+Replay a recorded request trace against two builds and diff them.
+
+Record a trace with the app's opt-in recorder (monitoring/recorder.py):
+
+    REQUEST_RECORDING_PATH=trace.jsonl uvicorn mainmenu:app
+
+then replay it against a baseline and a candidate build:
+
+    python -m benchmarks.replay trace.jsonl --baseline ../../spendsense-main/backend \\
+        --candidate . --dataset bench.db --speed 4
+
+A build is either a backend directory, which is started with uvicorn on
+its own copy of the dataset, or the URL of a server that is already
+running against a synthetic dataset. Both builds must honour DATABASE_URL.
+The builds are replayed one after the other, so they do not compete for
+CPU.
+
+Recorded users are pseudonyms. Each one is mapped to a fixed dataset user,
+which logs in with the synthetic dataset password. Requests are sent at
+their recorded offsets divided by --speed (0 sends them as fast as
+--concurrency allows). Concurrent writes can interleave differently from
+run to run. Use --concurrency 1 for a strictly ordered replay when
+checking equivalence.
+
+The report has three parts:
+- per endpoint p50/p95/p99 latency for both builds, and the change
+- requests whose status differs between the builds
+- an equivalence check of every /ai/query response (text, status and data,
+  ignoring timestamps)
+"""
+
+AI_ROUTE = "/ai/query"
+
+
+def load_trace(path: str):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [r for r in records if r.get("route") and r["route"] != "unmatched"]
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def dataset_user(pseudonym, users: int) -> int:
+    return int(pseudonym[1:], 16) % users + 1 if pseudonym else 1
+
+
+def _materialize(value, key, users: int, unique):
+    "Turn an anonymized body back into a valid request for the dataset."
+    if isinstance(value, dict):
+        return {k: _materialize(v, k, users, unique) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_materialize(v, key, users, unique) for v in value]
+    if key == "user_id" and isinstance(value, str) and value.startswith("u"):
+        return dataset_user(value, users)
+    if key == "email":
+        return f"replay-{unique()}@example.com"
+    return value
+
+
+def build_request(record: dict, users: int, unique):
+    "(method, path, json body, form body, pseudonym whose token to send)"
+    path_params = {
+        name: dataset_user(value, users) if name == "user_id" else value
+        for name, value in (record.get("path_params") or {}).items()
+    }
+    path = re.sub(r"\{(\w+)\}", lambda m: str(path_params.get(m.group(1), m.group(0))), record["route"])
+    if record.get("query"):
+        path = f"{path}?{urlencode(record['query'])}"
+
+    body, form = record.get("body"), None
+    if record["route"] == "/users/login":
+        username = (body or {}).get("username")
+        form, body = {"username": f"user{dataset_user(username, users)}@example.com", "password": synthetic.BENCH_PASSWORD}, None
+    elif record["route"] == "/users" and record["method"] == "POST":
+        body = {"name": "Replay User", "email": f"replay-{unique()}@example.com", "password": synthetic.BENCH_PASSWORD}
+    elif isinstance(body, dict):
+        body = _materialize(body, None, users, unique)
+    else:
+        body = None
+    return record["method"], path, body, form, record.get("user")
+
+
+def normalize_ai(response):
+    "AI response without volatile fields, floats rounded so formatting noise is ignored."
+    def clean(value):
+        if isinstance(value, float):
+            return round(value, 2)
+        if isinstance(value, dict):
+            return {k: clean(v) for k, v in value.items() if k != "timestamp"}
+        if isinstance(value, list):
+            return [clean(v) for v in value]
+        return value
+    return clean(response)
+
+
+class Target:
+    """A build to replay against: a running server URL or a backend directory to start."""
+
+    def __init__(self, name: str, spec: str):
+        self.name = name
+        self.spec = spec
+        self.server = None
+        self.log = None
+        if spec.startswith(("http://", "https://")):
+            url = urlparse(spec)
+            self.host, self.port = url.hostname, url.port or 80
+        elif os.path.isdir(spec):
+            self.host, self.port = "127.0.0.1", None
+        else:
+            raise ValueError(f"{name}: {spec} is neither a URL nor a backend directory")
+
+    def start(self, workdir: str, dataset: str, workers: int):
+        if self.port is not None:
+            return
+        database = os.path.join(workdir, f"{self.name}.db")
+        shutil.copyfile(dataset, database)
+        self.port = _free_port()
+        self.server, self.log = start_server(
+            workdir, database, workers, self.port, os.path.join(workdir, f"{self.name}.log"),
+            extra_env={"REQUEST_RECORDING_PATH": ""}, backend_dir=os.path.abspath(self.spec),
+        )
+
+    def stop(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait(timeout=15)
+            self.log.close()
+
+
+def replay(target: Target, records, users: int, speed: float, concurrency: int):
+    "Replay the trace once; returns (stats, per-record results)."
+    stats = Stats()
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def unique():
+        with counter_lock:
+            return f"{target.name}-{next(counter)}-{time.time_ns()}"
+
+    # Log every recorded user in once, outside the measurement
+    tokens = {}
+    setup = Client(target.host, target.port, Stats())
+    for pseudonym in sorted({r["user"] for r in records if r.get("user")}):
+        result = setup.request("POST", "/users/login", "/users/login", form={
+            "username": f"user{dataset_user(pseudonym, users)}@example.com", "password": synthetic.BENCH_PASSWORD,
+        })
+        tokens[pseudonym] = result["access_token"] if result else None
+    setup.close()
+
+    local = threading.local()
+    results = [None] * len(records)
+
+    def send(index: int, record: dict):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = Client(target.host, target.port, stats)
+        method, path, body, form, user = build_request(record, users, unique)
+        client.token = tokens.get(user)
+        payload = client.request(method, path, record["route"], json_body=body, form=form, expect=(record["status"],))
+        results[index] = {
+            "status": client.last_status,
+            "response": normalize_ai(payload) if record["route"] == AI_ROUTE else None,
+        }
+
+    start = time.perf_counter()
+    origin = records[0]["ts"] if records else 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, record in enumerate(records):
+            if speed > 0:
+                delay = (record["ts"] - origin) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, index, record)
+    return stats, results, time.perf_counter() - start
+
+
+def latency_rows(stats: Stats):
+    rows = {}
+    for endpoint, values in stats.latencies.items():
+        values = sorted(values)
+        rows[endpoint] = {
+            "count": len(values),
+            "errors": stats.errors.get(endpoint, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    return rows
+
+
+def diff(records, baseline, candidate) -> dict:
+    base_rows, cand_rows = latency_rows(baseline[0]), latency_rows(candidate[0])
+    endpoints = {}
+    for endpoint in sorted(set(base_rows) | set(cand_rows)):
+        old, new = base_rows.get(endpoint), cand_rows.get(endpoint)
+        row = {"baseline": old, "candidate": new}
+        if old and new and old["p50_ms"]:
+            row["p50_change"] = round((new["p50_ms"] - old["p50_ms"]) / old["p50_ms"], 4)
+            row["p95_change"] = round((new["p95_ms"] - old["p95_ms"]) / old["p95_ms"], 4) if old["p95_ms"] else None
+        endpoints[endpoint] = row
+
+    status_mismatches, ai_total, ai_differences = [], 0, []
+    for index, record in enumerate(records):
+        old, new = baseline[1][index], candidate[1][index]
+        if old is None or new is None:
+            continue
+        if old["status"] != new["status"]:
+            status_mismatches.append({"index": index, "route": record["route"], "recorded": record["status"],
+                                      "baseline": old["status"], "candidate": new["status"]})
+        if record["route"] == AI_ROUTE and old["status"] == new["status"] == 200:
+            ai_total += 1
+            if old["response"] != new["response"]:
+                ai_differences.append({
+                    "index": index,
+                    "query": (record.get("body") or {}).get("query"),
+                    "baseline": old["response"],
+                    "candidate": new["response"],
+                })
+    return {
+        "requests": len(records),
+        "elapsed_s": {"baseline": round(baseline[2], 2), "candidate": round(candidate[2], 2)},
+        "endpoints": endpoints,
+        "status_mismatches": status_mismatches,
+        "ai_equivalence": {
+            "compared": ai_total,
+            "identical": ai_total - len(ai_differences),
+            "differences": ai_differences,
+        },
+    }
+
+
+def print_diff(result: dict, show: int = 5) -> None:
+    print(f"{result['requests']} requests replayed; baseline {result['elapsed_s']['baseline']}s, "
+          f"candidate {result['elapsed_s']['candidate']}s")
+    print(f"{'endpoint':<34} {'count':>6} {'base p50':>9} {'cand p50':>9} {'change':>8} {'base p95':>9} {'cand p95':>9} {'change':>8}")
+    for endpoint, row in result["endpoints"].items():
+        old, new = row["baseline"] or {}, row["candidate"] or {}
+        p50_change = f"{row['p50_change']:+.1%}" if row.get("p50_change") is not None else "-"
+        p95_change = f"{row['p95_change']:+.1%}" if row.get("p95_change") is not None else "-"
+        print(f"{endpoint:<34} {new.get('count', old.get('count', 0)):>6} {old.get('p50_ms', '-'):>9} {new.get('p50_ms', '-'):>9} "
+              f"{p50_change:>8} {old.get('p95_ms', '-'):>9} {new.get('p95_ms', '-'):>9} {p95_change:>8}")
+    mismatches = result["status_mismatches"]
+    print(f"{len(mismatches)} request(s) with different status between builds")
+    for mismatch in mismatches[:show]:
+        print(f"  #{mismatch['index']} {mismatch['route']}: recorded {mismatch['recorded']}, "
+              f"baseline {mismatch['baseline']}, candidate {mismatch['candidate']}")
+    ai = result["ai_equivalence"]
+    print(f"AI responses: {ai['identical']}/{ai['compared']} identical")
+    for difference in ai["differences"][:show]:
+        print(f"  #{difference['index']} {difference['query']!r}")
+        print(f"    baseline:  {json.dumps(difference['baseline'])[:300]}")
+        print(f"    candidate: {json.dumps(difference['candidate'])[:300]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded trace against two builds")
+    parser.add_argument("trace", help="JSONL written by REQUEST_RECORDING_PATH")
+    parser.add_argument("--baseline", required=True, help="backend directory or URL")
+    parser.add_argument("--candidate", required=True, help="backend directory or URL")
+    parser.add_argument("--dataset", help="synthetic dataset the builds are started on; generated if missing")
+    parser.add_argument("--rows", type=int, default=20_000, help="expense rows when generating the dataset")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16, help="max requests in flight")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn workers for directory builds")
+    parser.add_argument("--output", help="write the diff as JSON")
+    args = parser.parse_args()
+
+    records = load_trace(args.trace)
+    if not records:
+        parser.error(f"{args.trace} has no replayable requests")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        dataset = args.dataset or os.path.join(workdir, "dataset.db")
+        if not os.path.exists(dataset):
+            print(f"Generating {args.rows:,} expense rows", file=sys.stderr)
+            synthetic.generate(dataset, args.rows, seed=args.seed)
+        users = (synthetic.load_meta(dataset) or {}).get("users") or 1
+
+        runs = {}
+        for name, spec in (("baseline", args.baseline), ("candidate", args.candidate)):
+            target = Target(name, spec)
+            try:
+                target.start(workdir, dataset, args.workers)
+                print(f"Replaying {len(records)} requests against {name} ({spec})", file=sys.stderr)
+                runs[name] = replay(target, records, users, args.speed, args.concurrency)
+            finally:
+                target.stop()
+
+    result = diff(records, runs["baseline"], runs["candidate"])
+    print_diff(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import synthetic
+
+"""
+Benchmark suite for the crud functions, the AI processor handlers, intent
+parsing and the main HTTP endpoints (in-process TestClient), run against a
+synthetic dataset from benchmarks/synthetic.py.
+
+Run from the backend directory:
+
+    # generate (or reuse) a dataset and write results
+    python -m benchmarks.suite run --dataset bench.db --rows 100000 --output baseline.json
+
+    # after a change: run again and compare against the baseline
+    python -m benchmarks.suite run --dataset bench.db --output current.json --compare baseline.json
+
+    # or compare two result files
+    python -m benchmarks.suite compare baseline.json current.json
+
+The dataset is copied to a temporary file before every run (unless
+--in-place), so write benchmarks never change it and runs stay comparable.
+A case counts as a regression when its median is more than --threshold
+slower than the baseline and the difference is above NOISE_FLOOR_MS.
+"""
+
+GROUPS = ("crud", "ai", "parse", "http")
+NOISE_FLOOR_MS = 0.05
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def _summary(timings, queries, ops) -> dict:
+    ordered = sorted(timings)
+    ms = lambda seconds: round(seconds * 1000, 4)
+    return {
+        "iterations": len(ordered),
+        "ops": ops,
+        "min_ms": ms(ordered[0]),
+        "median_ms": ms(statistics.median(ordered)),
+        "mean_ms": ms(statistics.fmean(ordered)),
+        "p95_ms": ms(_percentile(ordered, 0.95)),
+        "max_ms": ms(ordered[-1]),
+        "queries": round(queries / len(ordered), 1),
+    }
+
+
+def measure(case, ctx, repeat: int, warmup: int) -> dict:
+    from monitoring.sql import add_observer, remove_observer
+
+    issued = [0]
+
+    def count(statement, parameters, duration, context):
+        issued[0] += 1
+
+    timings, queries, status = [], 0, None
+    add_observer(count)
+    try:
+        for i in range(warmup + repeat):
+            db = ctx.Session()
+            try:
+                arg = case.setup(ctx, db) if case.setup else None
+                issued[0] = 0
+                start = time.perf_counter()
+                status = case.fn(ctx, db, arg)
+                elapsed = time.perf_counter() - start
+            finally:
+                db.close()
+            if i >= warmup:
+                timings.append(elapsed)
+                queries += issued[0]
+    finally:
+        remove_observer(count)
+    result = {"group": case.group, **_summary(timings, queries, case.ops)}
+    if status is not None:
+        result["status"] = status
+    return result
+
+
+def prepare_dataset(args, workdir: str):
+    "Return (working copy path, metadata), generating the dataset first if needed."
+    source = args.dataset or os.path.join(workdir, "dataset.db")
+    if not os.path.exists(source):
+        print(f"Generating {args.rows:,} expense rows into {source}", file=sys.stderr)
+        synthetic.generate(source, args.rows, seed=args.seed, verbose=True)
+    meta = synthetic.load_meta(source) or {}
+    if args.in_place:
+        return source, meta
+    working = os.path.join(workdir, "working.db")
+    shutil.copyfile(source, working)
+    return working, meta
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        path, meta = prepare_dataset(args, workdir)
+        # The app modules bind their engine and limiter at import time, so
+        # point them at the dataset before the cases are imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+        os.environ.setdefault("RATE_LIMIT_STORAGE_URI", f"sqlite:///{os.path.join(workdir, 'ratelimit.db')}")
+        os.environ.setdefault("CATEGORY_MODEL_PATH", os.path.join(workdir, "category_model.bin"))
+
+        from ai import recurring
+        from ai.categorizer import train
+        from benchmarks.cases import CASES, Context
+        from database.database import SessionLocal, engine
+        from database.migrate import migrate
+        from monitoring.sql import install_query_hooks
+
+        # Datasets generated by older builds lack newer tables (e.g. the search index)
+        migrate(engine)
+        with SessionLocal() as db:
+            train(db)
+            anchor = meta.get("anchor")
+            recurring.run(db, full=True, now=datetime.fromisoformat(anchor) if anchor else None)
+        install_query_hooks(engine)
+        ctx = Context(SessionLocal, meta)
+        groups = set(args.groups.split(",")) if args.groups else set(GROUPS)
+        pattern = re.compile(args.match) if args.match else None
+
+        results = {}
+        for case in CASES:
+            if case.group not in groups or (pattern and not pattern.search(case.name)):
+                continue
+            if case.max_rows and ctx.rows > case.max_rows:
+                results[case.name] = {"group": case.group, "skipped": f"dataset larger than {case.max_rows:,} rows"}
+                continue
+            try:
+                result = results[case.name] = measure(case, ctx, args.repeat, args.warmup)
+            except Exception as exc:
+                # Record broken code paths instead of aborting the whole run
+                results[case.name] = {"group": case.group, "error": f"{type(exc).__name__}: {exc}"}
+                print(f"{case.name:<45} error {results[case.name]['error']}", file=sys.stderr)
+                continue
+            status = f"  [{result['status']}]" if "status" in result else ""
+            print(f"{case.name:<45} median {result['median_ms']:>10.3f} ms  p95 {result['p95_ms']:>10.3f} ms"
+                  f"  queries {result['queries']:>6}{status}", file=sys.stderr)
+
+        if ctx._client is not None:
+            ctx._client.close()
+        engine.dispose()
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "dataset": meta,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    "Print a comparison table and return the number of regressions."
+    base_meta, current_meta = baseline["meta"].get("dataset", {}), current["meta"].get("dataset", {})
+    for key in ("rows", "seed", "anchor"):
+        if base_meta.get(key) != current_meta.get(key):
+            print(f"warning: datasets differ in {key}: {base_meta.get(key)} vs {current_meta.get(key)}")
+    print(f"baseline {baseline['meta'].get('git_commit')}  current {current['meta'].get('git_commit')}")
+    print(f"{'case':<45} {'baseline ms':>12} {'current ms':>12} {'change':>8}  queries")
+
+    regressions = 0
+    # Cases missing from the current run are ignored, so a --groups/--match
+    # subset can be compared against a full baseline
+    for name in sorted(current["results"]):
+        old, new = baseline["results"].get(name), current["results"][name]
+        if old is None:
+            print(f"{name:<45} {'new':>12}")
+            continue
+        if "median_ms" not in old or "median_ms" not in new:
+            state = lambda r: "ok" if "median_ms" in r else r.get("error") or r.get("skipped")
+            if state(old) != state(new):
+                print(f"{name:<45} {state(old)} -> {state(new)}")
+            continue
+        change = (new["median_ms"] - old["median_ms"]) / old["median_ms"] if old["median_ms"] else 0.0
+        flag = ""
+        if abs(new["median_ms"] - old["median_ms"]) >= NOISE_FLOOR_MS:
+            if change > threshold:
+                flag = "REGRESSION"
+                regressions += 1
+            elif change < -threshold:
+                flag = "improved"
+        queries = f"{old['queries']:g}" if old["queries"] == new["queries"] else f"{old['queries']:g} -> {new['queries']:g}"
+        if old.get("status") != new.get("status"):
+            flag += f" status {old.get('status')} -> {new.get('status')}"
+        print(f"{name:<45} {old['median_ms']:>12.3f} {new['median_ms']:>12.3f} {change:>+8.1%}  {queries:<10} {flag}")
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpendSense benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--dataset", help="SQLite dataset; generated here if it does not exist")
+    run_parser.add_argument("--rows", type=int, default=10_000, help="expense rows when generating")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--in-place", action="store_true", help="run against the dataset instead of a copy")
+    run_parser.add_argument("--groups", help=f"comma separated subset of {','.join(GROUPS)}")
+    run_parser.add_argument("--match", help="only cases whose name matches this regex")
+    run_parser.add_argument("--repeat", type=int, default=10)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--output", help="write results as JSON")
+    run_parser.add_argument("--compare", help="baseline results JSON to compare against")
+    run_parser.add_argument("--threshold", type=float, default=0.10)
+    run_parser.add_argument("--fail-on-regression", action="store_true")
+
+    compare_parser = sub.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.add_argument("--fail-on-regression", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        results = run(args)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, default=str)
+        regressions = compare(_load(args.compare), results, args.threshold) if args.compare else 0
+    else:
+        regressions = compare(_load(args.baseline), _load(args.current), args.threshold)
+
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
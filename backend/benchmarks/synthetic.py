@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, insert
+
+from auth import hash_password
+from database import compaction, models, search, stats
+
+"""
+Deterministic synthetic dataset for benchmarks.
+
+Generates users, categories, budgets, expenses and chat history into a
+SQLite file. The same --rows, --seed and --anchor always produce the same
+data, and every user is generated from its own seeded stream, so the
+output does not depend on batch size.
+
+The data is shaped like real usage rather than uniform noise:
+
+- user activity is log-normal, so a few heavy users own a large share of rows
+- amounts are log-normal per category with a Pareto tail (rare big purchases)
+- dates follow a seasonal curve (December peak, January dip, busier weekends)
+- roughly 1% of expenses are soft-deleted
+- most users have a few subscriptions (SUBSCRIPTIONS) charged on a schedule
+
+Every user can log in with BENCH_PASSWORD. A <dataset>.json sidecar records
+the parameters and a heavy and a typical user id for the benchmark suite.
+
+Run from the backend directory (1k to 50M rows):
+    python -m benchmarks.synthetic --rows 1000000 --out bench.db
+"""
+
+BENCH_PASSWORD = "Bench-password-1"
+EXPENSES_PER_USER = 500
+
+# name, share of expenses, median amount, log-normal sigma, chance of a Pareto-tail purchase
+CATEGORY_PROFILES = [
+    ("Food", 0.32, 18.0, 0.7, 0.002),
+    ("Transportation", 0.15, 25.0, 0.8, 0.005),
+    ("Entertainment", 0.12, 30.0, 0.9, 0.005),
+    ("Shopping", 0.20, 45.0, 1.1, 0.02),
+    ("Health", 0.06, 40.0, 1.2, 0.03),
+    ("Utilities", 0.15, 90.0, 0.35, 0.0),
+]
+
+DESCRIPTIONS = {
+    "Food": ["Groceries", "Coffee", "Lunch", "Dinner out", "Takeaway", "Bakery", "Supermarket run"],
+    "Transportation": ["Fuel", "Train ticket", "Bus pass", "Taxi", "Parking", "Car service"],
+    "Entertainment": ["Cinema", "Concert tickets", "Streaming subscription", "Video game", "Museum"],
+    "Shopping": ["Clothes", "Electronics", "Home goods", "Books", "Gift", "Furniture"],
+    "Health": ["Pharmacy", "Dentist", "Gym membership", "Doctor visit", "Vitamins"],
+    "Utilities": ["Electricity bill", "Water bill", "Internet", "Phone bill", "Gas bill"],
+}
+
+# Recurring charges: (description, category, amount, interval in days)
+SUBSCRIPTIONS = [
+    ("Netflix", "Entertainment", 15.49, 30),
+    ("Spotify Premium", "Entertainment", 10.99, 30),
+    ("FitLife gym", "Health", 39.0, 30),
+    ("Mobile plan", "Utilities", 25.0, 30),
+    ("Cloud storage", "Shopping", 2.99, 30),
+    ("Meal kit delivery", "Food", 59.95, 7),
+    ("Car insurance", "Transportation", 310.0, 91),
+    ("Domain renewal", "Shopping", 14.0, 365),
+]
+
+# January .. December
+MONTH_WEIGHTS = [0.85, 0.85, 0.95, 1.0, 1.0, 1.05, 1.1, 1.05, 0.95, 1.0, 1.15, 1.4]
+WEEKEND_WEIGHT = 1.25
+
+EXPENSE_INSERT = (
+    "INSERT INTO expenses (user_id, category_id, amount, description, expense_date, created_at, updated_at, deleted_at)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+SAMPLE_QUERIES = [
+    "How much did I spend this month?",
+    "What is my monthly total for March 2024?",
+    "Show me my spending by category",
+    "category breakdown for last month",
+    "What is my spending trend?",
+    "How has my spending changed over time?",
+    "Where do I spend the most?",
+    "top spending category this year",
+    "compare months please",
+    "Give me a spending forecast",
+    "predict my food spending next month",
+    "detect anomalies in my expenses",
+    "any unusual spending on shopping?",
+    "budget suggestions for entertainment",
+    "budget tips",
+    "What was my biggest expense?",
+    "highest expense in December",
+    "any advice on saving money?",
+    "total spending on transportation in 2024",
+    "give me a report of my utilities",
+]
+
+AI_REPLIES = [
+    "Your total spending for this period is ${amount:.2f}.",
+    "You spent the most on {category} (${amount:.2f}).",
+    "Your spending is trending up compared to last month.",
+    "Consider setting a monthly limit of ${amount:.2f} for {category}.",
+]
+
+
+def _date_weight(day: datetime) -> float:
+    weight = MONTH_WEIGHTS[day.month - 1]
+    return weight * WEEKEND_WEIGHT if day.weekday() >= 5 else weight
+
+
+def _calendar(anchor: datetime, span_days: int):
+    "Days in the span with cumulative seasonal weights, for rng.choices."
+    days = [anchor - timedelta(days=offset) for offset in range(span_days)]
+    cumulative, total = [], 0.0
+    for day in days:
+        total += _date_weight(day)
+        cumulative.append(total)
+    return days, cumulative
+
+
+def _timestamp(day: datetime, seconds: int) -> str:
+    # SQLAlchemy's SQLite DateTime storage format, so filters compare correctly
+    return f"{day + timedelta(seconds=seconds):%Y-%m-%d %H:%M:%S}.000000"
+
+
+def _amount(rng: random.Random, median: float, sigma: float, tail: float, scale: float) -> float:
+    amount = rng.lognormvariate(0.0, sigma) * median * scale
+    if tail and rng.random() < tail:
+        amount *= min(rng.paretovariate(1.5), 50.0)
+    return round(max(amount, 0.5), 2)
+
+
+def _expense_counts(rng: random.Random, rows: int, users: int):
+    "Split `rows` across users with log-normal activity levels."
+    weights = [rng.lognormvariate(0.0, 1.0) for _ in range(users)]
+    total = sum(weights)
+    counts = [int(rows * w / total) for w in weights]
+    for i in range(rows - sum(counts)):
+        counts[i % users] += 1
+    return counts
+
+
+def _user_rows(seed: int, user_id: int, count: int, calendar, category_ids):
+    """
+    All expenses, budgets and chat messages for one user. Expenses are
+    tuples in EXPENSE_INSERT column order, the rest are dicts for Core inserts.
+    """
+    rng = random.Random(f"{seed}:{user_id}")
+    days, cumulative = calendar
+    scale = rng.lognormvariate(0.0, 0.4)
+    shares = [profile[1] * rng.uniform(0.5, 1.5) for profile in CATEGORY_PROFILES]
+
+    expenses = []
+    spent_by_category = [0.0] * len(CATEGORY_PROFILES)
+    profile_index = {profile[0]: i for i, profile in enumerate(CATEGORY_PROFILES)}
+
+    # Up to a quarter of the user's rows are subscriptions, charged every
+    # interval give or take a day
+    for description, name, amount, interval in rng.sample(SUBSCRIPTIONS, rng.randint(0, 3)):
+        day = days[-1] + timedelta(days=rng.randrange(interval))
+        while day <= days[0] and len(expenses) < count // 4:
+            charged_at = _timestamp(day + timedelta(days=rng.choice((-1, 0, 0, 0, 1))), rng.randrange(3 * 3600, 9 * 3600))
+            expenses.append((user_id, category_ids[name], amount, description, charged_at, charged_at, charged_at, None))
+            spent_by_category[profile_index[name]] += amount
+            day += timedelta(days=interval)
+    count -= len(expenses)
+
+    indexes = rng.choices(range(len(CATEGORY_PROFILES)), weights=shares, k=count)
+    dates = rng.choices(days, cum_weights=cumulative, k=count)
+    for index, day in zip(indexes, dates):
+        name, _, median, sigma, tail = CATEGORY_PROFILES[index]
+        amount = _amount(rng, median, sigma, tail, scale)
+        if name == "Shopping" and day.month == 12:
+            amount = round(amount * 1.3, 2)
+        spent_by_category[index] += amount
+        created_at = _timestamp(day, rng.randrange(7 * 3600, 23 * 3600))
+        deleted_at = _timestamp(day, 86400) if rng.random() < 0.01 else None
+        expenses.append((
+            user_id, category_ids[name], amount, rng.choice(DESCRIPTIONS[name]),
+            created_at, created_at, created_at, deleted_at,
+        ))
+
+    anchor, span_days = days[0], len(days)
+    months = max(span_days / 30.0, 1.0)
+    start = anchor - timedelta(days=span_days)
+    budgets = [{
+        "user_id": user_id,
+        "category_id": None,
+        "amount": round(max(sum(spent_by_category) / months, 50.0) * rng.uniform(0.9, 1.2), 2),
+        "period": "monthly",
+        "start_date": start,
+        "is_active": 1,
+        "alert_threshold": 0.8,
+        "created_at": start,
+        "updated_at": start,
+    }]
+    for index in rng.sample(range(len(CATEGORY_PROFILES)), rng.randint(1, 3)):
+        period = rng.choices(["monthly", "weekly", "yearly"], weights=[8, 1, 1])[0]
+        monthly = max(spent_by_category[index] / months, 10.0)
+        amount = {"monthly": monthly, "weekly": monthly / 4.3, "yearly": monthly * 12}[period]
+        budgets.append({
+            "user_id": user_id,
+            "category_id": category_ids[CATEGORY_PROFILES[index][0]],
+            "amount": round(amount * rng.uniform(0.8, 1.3), 2),
+            "period": period,
+            "start_date": start,
+            "is_active": 0 if rng.random() < 0.1 else 1,
+            "alert_threshold": rng.choice([0.7, 0.8, 0.9]),
+            "created_at": start,
+            "updated_at": start,
+        })
+
+    chats = []
+    for _ in range(rng.randint(0, 4)):
+        asked_at = rng.choices(days, cum_weights=cumulative)[0] + timedelta(seconds=rng.randrange(7 * 3600, 23 * 3600))
+        index = rng.randrange(len(CATEGORY_PROFILES))
+        chats.append({"user_id": user_id, "sender": "User", "message": rng.choice(SAMPLE_QUERIES), "created_at": asked_at})
+        chats.append({
+            "user_id": user_id,
+            "sender": "AI",
+            "message": rng.choice(AI_REPLIES).format(
+                amount=spent_by_category[index] / months, category=CATEGORY_PROFILES[index][0].lower()
+            ),
+            "created_at": asked_at + timedelta(seconds=2),
+        })
+    return expenses, budgets, chats
+
+
+def meta_path(path: str) -> str:
+    return f"{path}.json"
+
+
+def load_meta(path: str):
+    try:
+        with open(meta_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def generate(path: str, rows: int, seed: int = 42, anchor: datetime = None, months: int = 24,
+             users: int = None, batch_size: int = 50_000, verbose: bool = False) -> dict:
+    """
+    Write a synthetic dataset with `rows` expenses to a new SQLite file at
+    `path` and return its metadata.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    anchor = (anchor or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    users = users or max(1, rows // EXPENSES_PER_USER)
+    span_days = months * 30
+    rng = random.Random(seed)
+    counts = _expense_counts(rng, rows, users)
+    calendar = _calendar(anchor, span_days)
+
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _bulk_load_pragmas(dbapi_connection, connection_record):
+        # Bulk load only: nothing to recover if the process dies half way
+        dbapi_connection.execute("PRAGMA journal_mode=OFF")
+        dbapi_connection.execute("PRAGMA synchronous=OFF")
+
+    # Same file layout as a database made by database.migrate
+    compaction.enable_incremental_vacuum(engine)
+    models.Base.metadata.create_all(bind=engine)
+    category_ids = {name: i for i, (name, *_) in enumerate(CATEGORY_PROFILES, 1)}
+    password = hash_password(BENCH_PASSWORD)
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Category), [{"category_id": i, "name": name} for name, i in category_ids.items()])
+
+    expenses, budgets, chats, pending_users = [], [], [], []
+    written = 0
+
+    def flush():
+        nonlocal written
+        with engine.begin() as conn:
+            if pending_users:
+                conn.execute(insert(models.User), pending_users)
+            if expenses:
+                # Driver-level executemany: skips per-row bind processing, the
+                # main cost of loading tens of millions of rows
+                conn.exec_driver_sql(EXPENSE_INSERT, expenses)
+            if budgets:
+                conn.execute(insert(models.Budget), budgets)
+            if chats:
+                conn.execute(insert(models.ChatMessage), chats)
+        written += len(expenses)
+        for buffer in (pending_users, expenses, budgets, chats):
+            buffer.clear()
+        if verbose:
+            rate = written / (time.perf_counter() - started)
+            print(f"  {written:,}/{rows:,} expenses ({rate:,.0f} rows/s)", file=sys.stderr)
+
+    for user_id, count in enumerate(counts, 1):
+        pending_users.append({
+            "user_id": user_id,
+            "name": f"Bench User {user_id}",
+            "email": f"user{user_id}@example.com",
+            "password": password,
+            "deleted_at": None,
+        })
+        user_expenses, user_budgets, user_chats = _user_rows(seed, user_id, count, calendar, category_ids)
+        expenses.extend(user_expenses)
+        budgets.extend(user_budgets)
+        chats.extend(user_chats)
+        if len(expenses) >= batch_size:
+            flush()
+    flush()
+    # Indexing once after the load is much faster than through the triggers
+    search.install(engine)
+    stats.rebuild(engine)
+    engine.dispose()
+
+    ranked = sorted(range(users), key=lambda i: counts[i], reverse=True)
+    meta = {
+        "rows": rows,
+        "users": users,
+        "seed": seed,
+        "anchor": anchor.isoformat(),
+        "months": months,
+        "categories": len(category_ids),
+        "heavy_user_id": ranked[0] + 1,
+        "heavy_user_expenses": counts[ranked[0]],
+        "typical_user_id": ranked[users // 2] + 1,
+        "typical_user_expenses": counts[ranked[users // 2]],
+        "password": BENCH_PASSWORD,
+        "generated_in_s": round(time.perf_counter() - started, 2),
+    }
+    with open(meta_path(path), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic SpendSense dataset")
+    parser.add_argument("--rows", type=int, default=10_000, help="number of expenses (1k to 50M)")
+    parser.add_argument("--out", default="bench.db")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anchor", type=datetime.fromisoformat, default=None,
+                        help="date of the newest expense (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--months", type=int, default=24, help="months of history")
+    parser.add_argument("--users", type=int, default=None, help=f"defaults to rows / {EXPENSES_PER_USER}")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    meta = generate(args.out, args.rows, seed=args.seed, anchor=args.anchor, months=args.months,
+                    users=args.users, batch_size=args.batch_size, verbose=True)
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
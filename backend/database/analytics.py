@@ -0,0 +1,280 @@
+import argparse
+import glob
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Integer, func, literal_column, select, union
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import cold, models
+from database.category_cache import catalogue
+
+"""
+Cross-user analytics on a columnar copy of the expenses.
+
+Reports over every user (GET /admin/reports/spending) scan the whole
+expenses table, which SQLite's row engine does one row at a time. With
+ANALYTICS_BACKEND=duckdb they run in DuckDB instead, over Parquet
+snapshots: the live hot expenses written to ANALYTICS_DIR by the snapshot
+command, plus the cold tier's files (database/cold.py), which already are
+Parquet. API writes never touch the snapshot; it is as fresh as its last
+run, so schedule it as often as the reports need:
+
+    python -m database.analytics snapshot
+    python -m database.analytics report --months 12 --backend duckdb
+
+The SQLite path (the default, and the fallback when duckdb isn't
+installed, there is no snapshot or a cold file it lists is gone) reads the
+hot table and the cold rollups. Both paths return the same report for the
+same data; benchmarks/bench_analytics.py checks that and times them side
+by side. With sharding (database/sharding.py) both see one shard: the
+snapshot command and the admin request run against the default engine.
+
+Per-user aggregations (ai/processor.py's trend, forecast and budget
+suggestions) stay on SQLite: the user_id index reads a few hundred rows,
+which takes well under a millisecond, while a DuckDB query over a snapshot
+costs several milliseconds of planning and row-group filtering before it
+reads anything (see the benchmark).
+"""
+
+logger = logging.getLogger("spendsense.analytics")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sqlite")
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", os.path.join(BASE_DIR, "analytics"))
+MANIFEST = "manifest.json"
+SNAPSHOT_BATCH_SIZE = 100_000  # rows per Parquet row group
+KEEP_SNAPSHOTS = 2  # the previous one may still be read by a report in flight
+
+_expenses = models.Expense.__table__
+_rollups = models.ColdRollup.__table__
+_partitions = models.ColdPartition.__table__
+
+
+def available() -> bool:
+    return importlib.util.find_spec("duckdb") is not None and cold.available()
+
+
+#  Snapshots
+
+def snapshot(engine: Engine) -> dict:
+    "Write the live hot expenses to a new Parquet file and point the manifest at it. Returns counters."
+    pa, _, pq = cold._pyarrow()
+    started = time.perf_counter()
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    created_at = datetime.utcnow()
+    name = f"expenses-{created_at:%Y%m%dT%H%M%S%f}.parquet"
+    path = os.path.join(ANALYTICS_DIR, name)
+    schema = pa.schema([
+        ("user_id", pa.int64()),
+        ("category_id", pa.int64()),
+        ("amount", pa.float64()),
+        ("expense_date", pa.timestamp("us")),
+    ])
+    rows = 0
+    with engine.connect() as conn, pq.ParquetWriter(path + ".tmp", schema, compression=cold.COMPRESSION) as writer:
+        # One read transaction (pysqlite doesn't begin one for SELECTs), so the hot rows and the cold file list agree
+        conn.exec_driver_sql("BEGIN")
+        result = conn.execute(
+            select(_expenses.c.user_id, _expenses.c.category_id, _expenses.c.amount, _expenses.c.expense_date)
+            .where(_expenses.c.deleted_at.is_(None))
+            .execution_options(yield_per=SNAPSHOT_BATCH_SIZE)
+        )
+        for batch in result.partitions():
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema,
+            ))
+            rows += len(batch)
+        files = [list(row) for row in conn.execute(select(_partitions.c.file, _partitions.c.year))]
+    os.replace(path + ".tmp", path)
+
+    manifest = {"created_at": created_at.isoformat(), "hot": name, "cold": files, "rows": rows}
+    with open(os.path.join(ANALYTICS_DIR, MANIFEST + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(ANALYTICS_DIR, MANIFEST + ".tmp"), os.path.join(ANALYTICS_DIR, MANIFEST))
+    for old in sorted(glob.glob(os.path.join(ANALYTICS_DIR, "expenses-*.parquet")))[:-KEEP_SNAPSHOTS]:
+        os.remove(old)
+    return {"rows": rows, "cold_files": len(files), "bytes": os.path.getsize(path),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def load_manifest() -> Optional[dict]:
+    try:
+        with open(os.path.join(ANALYTICS_DIR, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+#  DuckDB
+
+_duckdb = None
+_duckdb_lock = threading.Lock()
+
+
+def _cursor():
+    "A cursor of the process's in-memory DuckDB database (one per query, they aren't shared between threads)."
+    global _duckdb
+    if _duckdb is None:
+        with _duckdb_lock:
+            if _duckdb is None:
+                import duckdb
+                _duckdb = duckdb.connect()
+    return _duckdb.cursor()
+
+
+def _duckdb_rows(manifest: dict, start: datetime, end: datetime) -> Tuple[list, list]:
+    "((year, month, category_id, total, expenses) rows, (year, month, users) rows) from the snapshot."
+    sources = ["SELECT user_id, category_id, amount, expense_date FROM read_parquet(?)"]
+    params: list = [os.path.join(ANALYTICS_DIR, manifest["hot"])]
+    # Only the cold years the window overlaps; each file holds one (user, year)
+    files = [file for file, year in manifest["cold"] if start.year <= year <= (end - timedelta(microseconds=1)).year]
+    if files:
+        # Cold files are <user_id>/<year>-<generation>.parquet
+        sources.append(
+            "SELECT CAST(split_part(filename, '/', -2) AS BIGINT), category_id, amount, expense_date "
+            "FROM read_parquet(?, filename = true)"
+        )
+        params.append([os.path.join(cold.COLD_STORE_DIR, file) for file in files])
+    rows = (f"(SELECT * FROM ({' UNION ALL '.join(sources)}) "
+            f"AS e(user_id, category_id, amount, expense_date) WHERE expense_date >= ? AND expense_date < ?)")
+    params += [start, end]
+    cursor = _cursor()
+    try:
+        totals = cursor.execute(
+            f"SELECT year(expense_date), month(expense_date), category_id, sum(amount), count(*) "
+            f"FROM {rows} GROUP BY ALL", params,
+        ).fetchall()
+        users = cursor.execute(
+            f"SELECT year(expense_date), month(expense_date), count(DISTINCT user_id) FROM {rows} GROUP BY ALL", params,
+        ).fetchall()
+    finally:
+        cursor.close()
+    return totals, users
+
+
+#  SQLite
+
+def _sqlite_rows(db: Session, start: datetime, end: datetime) -> Tuple[list, list]:
+    "The same rows from the hot table and the cold rollups."
+    year = func.cast(func.strftime("%Y", _expenses.c.expense_date), Integer)
+    month = func.cast(func.strftime("%m", _expenses.c.expense_date), Integer)
+    live = (_expenses.c.deleted_at.is_(None), _expenses.c.expense_date >= start, _expenses.c.expense_date < end)
+    # Whole months in [start, end), as in cold.month_totals
+    rollup_month = _rollups.c.year * 12 + _rollups.c.month - 1
+    cold_months = (rollup_month >= cold._first_month(start), rollup_month < cold._first_month(end))
+
+    totals = db.execute(
+        select(year, month, _expenses.c.category_id, func.sum(_expenses.c.amount), func.count())
+        .where(*live).group_by(year, month, _expenses.c.category_id)
+    ).all()
+    totals += db.execute(
+        select(_rollups.c.year, _rollups.c.month, _rollups.c.category_id, func.sum(_rollups.c.total),
+               func.sum(_rollups.c.count))
+        .where(*cold_months).group_by(_rollups.c.year, _rollups.c.month, _rollups.c.category_id)
+    ).all()
+
+    active = union(
+        select(year.label("year"), month.label("month"), _expenses.c.user_id).where(*live),
+        select(_rollups.c.year, _rollups.c.month, _rollups.c.user_id).where(*cold_months),
+    ).subquery()
+    users = db.execute(
+        select(active.c.year, active.c.month, func.count(literal_column("*")))
+        .group_by(active.c.year, active.c.month)
+    ).all()
+    return totals, users
+
+
+#  Report
+
+def backend(requested: Optional[str] = None) -> str:
+    "duckdb when asked for (or configured) and usable, else sqlite."
+    wanted = requested or ANALYTICS_BACKEND
+    return "duckdb" if wanted == "duckdb" and available() and load_manifest() is not None else "sqlite"
+
+
+def spending_report(db: Session, start: datetime, end: datetime, requested: Optional[str] = None) -> dict:
+    "Spending of every user per month in [start, end): total, expenses, active users and totals per category."
+    source = backend(requested)
+    manifest = load_manifest() if source == "duckdb" else None
+    if manifest is not None:
+        try:
+            totals, users = _duckdb_rows(manifest, start, end)
+        except Exception:
+            # e.g. a cold file of the snapshot was superseded and removed since
+            logger.warning("DuckDB report failed, falling back to SQLite", exc_info=True)
+            source, manifest = "sqlite", None
+    if manifest is None:
+        totals, users = _sqlite_rows(db, start, end)
+
+    names = catalogue.names(db)
+    months: Dict[Tuple[int, int], dict] = defaultdict(
+        lambda: {"total": 0.0, "expenses": 0, "active_users": 0, "by_category": defaultdict(float)})
+    for year, month, category_id, total, count in totals:
+        entry = months[(int(year), int(month))]
+        entry["total"] += float(total)
+        entry["expenses"] += int(count)
+        entry["by_category"][names.get(category_id, str(category_id))] += float(total)
+    for year, month, count in users:
+        months[(int(year), int(month))]["active_users"] = int(count)
+    return {
+        "source": "snapshot" if manifest else "live",
+        "snapshot_at": manifest["created_at"] if manifest else None,
+        "months": [
+            {
+                "year": year,
+                "month": month,
+                "total": round(entry["total"], 2),
+                "expenses": entry["expenses"],
+                "active_users": entry["active_users"],
+                "by_category": {name: round(total, 2) for name, total in sorted(entry["by_category"].items())},
+            }
+            for (year, month), entry in sorted(months.items())
+        ],
+    }
+
+
+def month_window(months: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    "[first day of the month `months - 1` months ago, first day of next month)."
+    now = now or datetime.utcnow()
+    index = now.year * 12 + now.month - 1
+    start, end = index - months + 1, index + 1
+    return datetime(start // 12, start % 12 + 1, 1), datetime(end // 12, end % 12 + 1, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar snapshots and cross-user reports")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshot", help="write the live expenses to a new Parquet snapshot")
+    report_parser = sub.add_parser("report", help="monthly spending of every user")
+    report_parser.add_argument("--months", type=int, default=12)
+    report_parser.add_argument("--backend", choices=("sqlite", "duckdb"))
+    args = parser.parse_args()
+
+    from database.database import SessionLocal, engine
+    if args.command == "snapshot":
+        if not cold.available():
+            parser.exit(1, "snapshots need pyarrow to be installed\n")
+        result = snapshot(engine)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        return
+    with SessionLocal() as db:
+        report = spending_report(db, *month_window(args.months), requested=args.backend)
+    print(f"source: {report['source']} {report['snapshot_at'] or ''}")
+    for month in report["months"]:
+        print(f"{month['year']}-{month['month']:02d}  {month['total']:>14,.2f}  "
+              f"{month['expenses']:>9,} expenses  {month['active_users']:>7,} users")
+
+
+if __name__ == "__main__":
+    main()
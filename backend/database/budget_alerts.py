@@ -0,0 +1,249 @@
+import argparse
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import crud, events, models, webhooks
+
+"""
+Precomputed budget alert state.
+
+GET /budgets/status and the check_budget_alerts intent work out a user's
+budgets when asked, so an overspent budget goes unnoticed until the user
+looks. This job computes the status of every active budget in its current
+period, with the same period and threshold rules (crud), and stores one
+row per budget in budget_alerts:
+
+  level            ok, approaching (alert_threshold reached) or over
+  changed_at       when the level last changed, or a new period began
+  computed_at      when this run saw it
+
+Spending is summed for CHUNK_SIZE budgets per statement, joined to the
+expenses through the user_id index. GET /budgets/alerts reads the stored
+rows, so it costs one indexed lookup however many budgets a user has.
+Rows of budgets that were deleted or deactivated are removed.
+
+    python -m database.budget_alerts run
+
+The scheduler (scheduler.py) runs it every few minutes. Expense writes keep
+the rows of the budgets they touch current in between (apply_changes), as
+do budget writes for the budget itself (apply_budget), and record the
+changes for GET /events (database/events.py) and queue them for the user's
+webhooks (database/webhooks.py).
+"""
+
+CHUNK_SIZE = 5000  # budgets per statement: 5 parameters each, under SQLite's 32766
+LEVELS = ("ok", "approaching", "over")
+
+_alerts = models.BudgetAlert.__table__
+_budgets = models.Budget.__table__
+
+
+def _timestamp(value: datetime) -> str:
+    # The text form SQLAlchemy stores, so comparisons in SQL are exact
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _spent(conn, periods: List[tuple]) -> Dict[int, float]:
+    "budget_id -> amount spent in (budget_id, user_id, category_id, start, end) periods."
+    placeholders = ", ".join(["(?, ?, ?, ?, ?)"] * len(periods))
+    rows = conn.exec_driver_sql(
+        f"WITH periods (budget_id, user_id, category_id, period_start, period_end) AS (VALUES {placeholders}) "
+        "SELECT periods.budget_id, sum(expenses.amount) FROM periods "
+        "JOIN expenses ON expenses.user_id = periods.user_id AND expenses.deleted_at IS NULL "
+        "AND expenses.expense_date >= periods.period_start AND expenses.expense_date < periods.period_end "
+        "AND (periods.category_id IS NULL OR expenses.category_id = periods.category_id) "
+        "GROUP BY periods.budget_id",
+        tuple(value for period in periods for value in period),
+    )
+    return dict(rows.all())
+
+
+def level_of(status: dict) -> str:
+    if status["is_over_budget"]:
+        return "over"
+    return "approaching" if status["should_alert"] else "ok"
+
+
+def run(engine: Engine, resident: Optional[Callable[[int], bool]] = None) -> dict:
+    """Recompute the alert state of every active budget. Returns counters for logging.
+    With sharding, `resident` tells which users' rows live in this engine's shard."""
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        budgets = conn.execute(
+            select(_budgets).where(_budgets.c.deleted_at.is_(None), _budgets.c.is_active == 1)
+            .order_by(_budgets.c.budget_id)
+        ).all()
+    if resident is not None:
+        budgets = [budget for budget in budgets if resident(budget.user_id)]
+
+    counts = dict.fromkeys(LEVELS, 0)
+    changed = 0
+    for first in range(0, len(budgets), CHUNK_SIZE):
+        chunk = budgets[first:first + CHUNK_SIZE]
+        periods = {budget.budget_id: crud.get_budget_period_dates(budget) for budget in chunk}
+        with engine.begin() as conn:
+            spent = _spent(conn, [
+                (budget.budget_id, budget.user_id, budget.category_id or None,
+                 _timestamp(periods[budget.budget_id][0]), _timestamp(periods[budget.budget_id][1]))
+                for budget in chunk
+            ])
+            previous = {row.budget_id: row for row in conn.execute(
+                select(_alerts.c.budget_id, _alerts.c.level, _alerts.c.period_start, _alerts.c.changed_at)
+                .where(_alerts.c.budget_id.in_(periods))
+            )}
+            now = datetime.utcnow()
+            rows = []
+            for budget in chunk:
+                start, end = periods[budget.budget_id]
+                status = crud._build_budget_status(budget, spent.get(budget.budget_id) or 0.0, end, None)
+                level = level_of(status)
+                counts[level] += 1
+                before = previous.get(budget.budget_id)
+                if before is None or before.level != level or before.period_start != start:
+                    changed += 1
+                    changed_at = now
+                else:
+                    changed_at = before.changed_at
+                rows.append({
+                    "budget_id": budget.budget_id, "user_id": budget.user_id, "level": level,
+                    "spent_amount": status["spent_amount"], "percentage_used": status["percentage_used"],
+                    "period_start": start, "period_end": end, "changed_at": changed_at, "computed_at": now,
+                })
+            upsert = insert(_alerts)
+            conn.execute(upsert.on_conflict_do_update(
+                index_elements=[_alerts.c.budget_id],
+                set_={name: upsert.excluded[name] for name in rows[0] if name != "budget_id"},
+            ), rows)
+
+    with engine.begin() as conn:
+        active = select(_budgets.c.budget_id).where(_budgets.c.deleted_at.is_(None), _budgets.c.is_active == 1)
+        removed = conn.execute(delete(_alerts).where(_alerts.c.budget_id.not_in(active))).rowcount
+    return {
+        "budgets": len(budgets),
+        **counts,
+        "changed": changed,
+        "removed": removed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def apply_changes(db: Session, user_id: int, changes: Iterable[Tuple[Optional[int], datetime]]) -> int:
+    """Update the state of the user's budgets that expense writes touch and record their events,
+    in the caller's transaction. `changes` are the (category_id, expense_date) of the expenses
+    written, before and after an edit. Returns the number of events recorded."""
+    changes = set(changes)
+    affected = {}
+    for budget in crud.get_user_budgets(db, user_id, active_only=True):
+        start, end = crud.get_budget_period_dates(budget)
+        if any(start <= date < end and (not budget.category_id or budget.category_id == category_id)
+               for category_id, date in changes):
+            affected[budget.budget_id] = (budget, start, end)
+    if not affected:
+        return 0
+    return _refresh(db, user_id, affected)
+
+
+def apply_budget(db: Session, budget: models.Budget) -> int:
+    """Bring the state of a budget that was just created, edited or deleted up to date, in the caller's
+    transaction: recomputed while it is active, removed once it is deleted or deactivated.
+    Returns the number of events recorded."""
+    if budget.deleted_at is not None or not budget.is_active:
+        db.execute(delete(_alerts).where(_alerts.c.budget_id == budget.budget_id))
+        return 0
+    start, end = crud.get_budget_period_dates(budget)
+    return _refresh(db, budget.user_id, {budget.budget_id: (budget, start, end)})
+
+
+def _refresh(db: Session, user_id: int, affected: Dict[int, tuple]) -> int:
+    "Recompute and store budget_id -> (budget, start, end) and record the events of what changed."
+    db.flush()  # _spent reads through the connection, past the session
+    conn = db.connection()
+    spent = _spent(conn, [
+        (budget.budget_id, user_id, budget.category_id or None, _timestamp(start), _timestamp(end))
+        for budget, start, end in affected.values()
+    ])
+    previous = {row.budget_id: row for row in conn.execute(
+        select(_alerts.c.budget_id, _alerts.c.level, _alerts.c.spent_amount, _alerts.c.period_start,
+               _alerts.c.changed_at).where(_alerts.c.budget_id.in_(affected))
+    )}
+    now = datetime.utcnow()
+    rows, changed = [], []
+    for budget_id, (budget, start, end) in affected.items():
+        status = crud._build_budget_status(budget, spent.get(budget_id) or 0.0, end,
+                                           crud.get_budget_category_name(db, budget.category_id))
+        level = level_of(status)
+        before = previous.get(budget_id)
+        # A budget the job hasn't seen yet, or one in a new period, starts from ok and nothing spent
+        current = before is not None and before.period_start == start
+        before_level, before_spent = (before.level, before.spent_amount) if current else ("ok", 0.0)
+        if status["spent_amount"] != before_spent:
+            changed.append(("budget_status", status))
+        if level != before_level:
+            changed.append(("budget_alert", {
+                **{key: status[key] for key in ("budget_id", "category_id", "category_name", "budget_amount",
+                                                "spent_amount", "percentage_used", "is_over_budget", "should_alert")},
+                "level": level,
+                "previous_level": before_level,
+            }))
+        rows.append({
+            "budget_id": budget_id, "user_id": user_id, "level": level,
+            "spent_amount": status["spent_amount"], "percentage_used": status["percentage_used"],
+            "period_start": start, "period_end": end,
+            "changed_at": before.changed_at if current and level == before_level else now, "computed_at": now,
+        })
+    upsert = insert(_alerts)
+    conn.execute(upsert.on_conflict_do_update(
+        index_elements=[_alerts.c.budget_id],
+        set_={name: upsert.excluded[name] for name in rows[0] if name != "budget_id"},
+    ), rows)
+    webhooks.enqueue(db, user_id, events.record(db, user_id, changed))
+    return len(changed)
+
+
+def user_alerts(db: Session, user_id: int, include_ok: bool = False) -> List[dict]:
+    "The user's stored alert states, over budget first."
+    rows = db.execute(
+        select(_alerts, _budgets.c.category_id, _budgets.c.amount, _budgets.c.period)
+        .join(_budgets, _budgets.c.budget_id == _alerts.c.budget_id)
+        .where(_alerts.c.user_id == user_id, _budgets.c.deleted_at.is_(None), _budgets.c.is_active == 1,
+               *([] if include_ok else [_alerts.c.level != "ok"]))
+    ).all()
+    rows.sort(key=lambda row: (-LEVELS.index(row.level), -row.percentage_used))
+    return [
+        {
+            "budget_id": row.budget_id,
+            "category_id": row.category_id,
+            "category_name": crud.get_budget_category_name(db, row.category_id),
+            "level": row.level,
+            "budget_amount": row.amount,
+            "spent_amount": row.spent_amount,
+            "percentage_used": row.percentage_used,
+            "period": row.period,
+            "period_start": row.period_start,
+            "period_end": row.period_end,
+            "changed_at": row.changed_at,
+            "computed_at": row.computed_at,
+        }
+        for row in rows
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the alert state of every active budget")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="recompute all budgets")
+    parser.parse_args()
+
+    from database.database import engine
+    for key, value in run(engine).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from database import models
+
+"""
+Process-wide catalogue of categories.
+
+Categories are a tiny table that almost never changes, but budget responses
+and the AI processor used to look them up once per row. The catalogue keeps
+id -> name, name -> id and normalized-name lookups in memory.
+
+Writes go through crud, which bumps the "categories" row in cache_versions
+and refreshes this process right away. Other worker processes notice the new
+version the next time they cross-check, at most every CHECK_INTERVAL seconds,
+so between checks a lookup issues no queries at all.
+"""
+
+CATEGORIES_VERSION = "categories"
+CHECK_INTERVAL = 5.0
+
+
+def normalize_category_name(name: str) -> str:
+    "Lowercase, drop punctuation and collapse whitespace."
+    name = re.sub(r"[^\w\s]", " ", name.lower())
+    return " ".join(name.split())
+
+
+class _Snapshot:
+    __slots__ = ("version", "by_id", "by_name", "by_normalized", "normalized_names")
+
+    def __init__(self, version: int, rows: List[Tuple[int, str]]):
+        self.version = version
+        self.by_id: Dict[int, str] = {category_id: name for category_id, name in rows}
+        self.by_name: Dict[str, int] = {name: category_id for category_id, name in rows}
+        self.by_normalized: Dict[str, int] = {normalize_category_name(name): category_id for category_id, name in rows}
+        # Sorted so substring matches are deterministic (shortest name first)
+        self.normalized_names = sorted(self.by_normalized, key=lambda n: (len(n), n))
+
+
+class CategoryCatalogue:
+    def __init__(self, check_interval: float = CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Version stamp
+    @staticmethod
+    def current_version(db: Session) -> int:
+        # A query rather than db.get, which could return a row the session loaded before a bump
+        version = db.execute(
+            select(models.CacheVersion.version).where(models.CacheVersion.name == CATEGORIES_VERSION)
+        ).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump_version(db: Session) -> None:
+        """Bump the version stamp inside the caller's transaction (commit is left to the caller).
+        One upsert, so concurrent bumps from several workers each add one."""
+        upsert = insert(models.CacheVersion).values(name=CATEGORIES_VERSION, version=1)
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=[models.CacheVersion.name],
+            set_={"version": models.CacheVersion.version + 1},
+        ))
+
+    # Loading
+    def refresh(self, db: Session) -> None:
+        "Reload every category and the current version stamp."
+        with self._lock:
+            self._load(db, self.current_version(db))
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+    def _load(self, db: Session, version: int) -> None:
+        rows = db.query(models.Category.category_id, models.Category.name).all()
+        self._snapshot = _Snapshot(version, [(category_id, name) for category_id, name in rows])
+        self._checked_at = time.monotonic()
+
+    def _get(self, db: Session) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            version = self.current_version(db)
+            if snapshot is None or snapshot.version != version:
+                self.misses += 1
+                self._load(db, version)
+            else:
+                self.hits += 1
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    # Lookups
+    def name_for(self, db: Session, category_id: int) -> Optional[str]:
+        return self._get(db).by_id.get(category_id)
+
+    def id_for(self, db: Session, name: str) -> Optional[int]:
+        "Exact name lookup."
+        return self._get(db).by_name.get(name)
+
+    def match(self, db: Session, text: str) -> Optional[int]:
+        """
+        Find a category id from free text, e.g. a category parsed out of an
+        AI query. Tries an exact normalized match, then the first category
+        whose normalized name contains the text (what ILIKE '%text%' did).
+        """
+        snapshot = self._get(db)
+        needle = normalize_category_name(text)
+        if not needle:
+            return None
+        if needle in snapshot.by_normalized:
+            return snapshot.by_normalized[needle]
+        for name in snapshot.normalized_names:
+            if needle in name:
+                return snapshot.by_normalized[name]
+        return None
+
+    def names(self, db: Session) -> Dict[int, str]:
+        return dict(self._get(db).by_id)
+
+
+catalogue = CategoryCatalogue()
@@ -0,0 +1,357 @@
+import argparse
+import importlib.util
+import os
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import models, stats
+
+"""
+Cold tier: expenses older than HORIZON_DAYS live in compressed Parquet
+files instead of the hot expenses table.
+
+    python -m database.cold move            # move whole years older than the horizon
+    python -m database.cold move --horizon-days 365
+
+The job moves whole calendar years, one (user, year) at a time, into
+COLD_STORE_DIR/<user_id>/<year>-<generation>.parquet (zstd). In the same
+transaction it deletes the rows from the hot table, records the file in
+cold_partitions and writes monthly per-category totals to cold_rollups,
+so readers see every expense exactly once. Expenses dated in a cold year
+later on stay hot until the next run merges them into a new generation
+of the year's file; superseded files are removed after ORPHAN_GRACE_SECONDS.
+
+Readers go through reads.iter_expense_batches (GET /expenses and the
+export), which merges in the cold years a query reaches, and through
+month_totals / category_totals (the monthly summary, spending trend and
+forecast), which read the rollups and never open a file. Cold expenses are
+read-only: they can't be edited or deleted through the API and are not in
+the search index or the per-category statistics.
+
+Writing and reading the files needs pyarrow. Without it the job refuses to
+run, so a database only has cold partitions where pyarrow is installed.
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_STORE_DIR = os.getenv("COLD_STORE_DIR", os.path.join(BASE_DIR, "cold_store"))
+HORIZON_DAYS = int(os.getenv("COLD_HORIZON_DAYS", "730"))
+COMPRESSION = "zstd"
+ORPHAN_GRACE_SECONDS = 3600  # readers may still hold the path of a superseded file
+DELETE_CHUNK_SIZE = 1000  # ids per DELETE statement
+MOVE_RETRIES = 3
+
+_partitions = models.ColdPartition.__table__
+_rollups = models.ColdRollup.__table__
+
+# Stored columns, in file order (user_id is in the path, deleted_at is always NULL)
+COLUMNS = ("expense_id", "category_id", "amount", "description", "expense_date", "created_at", "updated_at")
+FIELDS = ("expense_id", "user_id", "category_id", "amount", "description", "expense_date",
+          "created_at", "updated_at", "deleted_at")
+
+
+class ColdExpense:
+    """An expense read from the cold tier, with the attributes of a reads.EXPENSE_COLUMNS row."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, user_id: int, expense_id, category_id, amount, description, expense_date, created_at, updated_at):
+        self.expense_id = expense_id
+        self.user_id = user_id
+        self.category_id = category_id
+        self.amount = amount
+        self.description = description
+        self.expense_date = expense_date
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.deleted_at = None
+
+    def _asdict(self) -> dict:
+        return {name: getattr(self, name) for name in FIELDS}
+
+
+def available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    # Loaded on first use, like the Parquet export
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    return pa, pc, pq
+
+
+def _path(file: str) -> str:
+    return os.path.join(COLD_STORE_DIR, file)
+
+
+#  Files
+
+def _write(user_id: int, year: int, rows: Sequence[tuple]) -> str:
+    "Write rows (in COLUMNS order) as a new generation of the year's file. Returns its relative name."
+    pa, _, pq = _pyarrow()
+    rows = sorted(rows, key=lambda row: (row[4], row[0]), reverse=True)  # newest first, like the hot reads
+    columns = list(zip(*rows))
+    schema = pa.schema([
+        ("expense_id", pa.int64()),
+        ("category_id", pa.int64()),
+        ("amount", pa.float64()),
+        ("description", pa.string()),
+        ("expense_date", pa.timestamp("us")),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ])
+    table = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+    file = f"{user_id}/{year}-{uuid.uuid4().hex[:12]}.parquet"
+    path = _path(file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp", compression=COMPRESSION)
+    with open(path + ".tmp", "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return file
+
+
+def _read_columns(file: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                  category_id: Optional[int] = None) -> List[tuple]:
+    "Rows of one file (in COLUMNS order) matching the filters."
+    pa, pc, pq = _pyarrow()
+    # ParquetFile skips the dataset layer of read_table, which costs more than reading a small file
+    table = pq.ParquetFile(_path(file)).read(columns=list(COLUMNS))
+    conditions = []
+    if start_date is not None:
+        conditions.append(pc.greater_equal(table["expense_date"], pa.scalar(start_date, pa.timestamp("us"))))
+    if end_date is not None:
+        conditions.append(pc.less(table["expense_date"], pa.scalar(end_date, pa.timestamp("us"))))
+    if category_id is not None:
+        conditions.append(pc.equal(table["category_id"], category_id))
+    if conditions:
+        mask = conditions[0]
+        for condition in conditions[1:]:
+            mask = pc.and_(mask, condition)
+        table = table.filter(mask)
+    return list(zip(*(table.column(name).to_pylist() for name in COLUMNS)))
+
+
+def read_partition(user_id: int, file: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                   category_id: Optional[int] = None) -> List[ColdExpense]:
+    "Expenses of one cold file matching the filters, newest first."
+    return [ColdExpense(user_id, *row) for row in _read_columns(file, start_date, end_date, category_id)]
+
+
+#  Reads
+
+def hot_start(db: Session, user_id: int) -> Optional[datetime]:
+    "January 1st after the user's newest cold year, or None when nothing of the user is cold."
+    year = db.execute(select(func.max(_partitions.c.year)).where(_partitions.c.user_id == user_id)).scalar()
+    return datetime(year + 1, 1, 1) if year is not None else None
+
+
+def partitions(db: Session, user_id: int, start_date: Optional[datetime] = None,
+               end_date: Optional[datetime] = None) -> Dict[int, str]:
+    "year -> file of the user's cold years that overlap [start_date, end_date)."
+    stmt = select(_partitions.c.year, _partitions.c.file).where(_partitions.c.user_id == user_id)
+    if start_date is not None:
+        stmt = stmt.where(_partitions.c.year >= start_date.year)
+    if end_date is not None:
+        stmt = stmt.where(_partitions.c.year <= (end_date - timedelta(microseconds=1)).year)
+    return dict(db.execute(stmt).all())
+
+
+def _first_month(value: datetime) -> int:
+    "Index (year * 12 + month - 1) of the first month starting at or after `value`."
+    index = value.year * 12 + value.month - 1
+    return index if value == datetime(value.year, value.month, 1) else index + 1
+
+
+def _rollup_filter(user_id: int, start_date: datetime, end_date: datetime) -> tuple:
+    # Months whose first day falls in [start_date, end_date)
+    month_index = _rollups.c.year * 12 + _rollups.c.month - 1
+    return (_rollups.c.user_id == user_id, month_index >= _first_month(start_date), month_index < _first_month(end_date))
+
+
+def month_totals(db: Session, user_id: int, start_date: datetime, end_date: datetime) -> Dict[Tuple[int, int], float]:
+    "(year, month) -> cold total of the whole months in [start_date, end_date)."
+    rows = db.execute(
+        select(_rollups.c.year, _rollups.c.month, func.sum(_rollups.c.total))
+        .where(*_rollup_filter(user_id, start_date, end_date))
+        .group_by(_rollups.c.year, _rollups.c.month)
+    )
+    return {(year, month): total for year, month, total in rows}
+
+
+def category_totals(db: Session, user_id: int, start_date: datetime, end_date: datetime) -> Dict[int, float]:
+    "category_id -> cold total of the whole months in [start_date, end_date)."
+    rows = db.execute(
+        select(_rollups.c.category_id, func.sum(_rollups.c.total))
+        .where(*_rollup_filter(user_id, start_date, end_date))
+        .group_by(_rollups.c.category_id)
+    )
+    return dict(rows.all())
+
+
+#  Tiering job
+
+def boundary(now: Optional[datetime] = None, horizon_days: int = HORIZON_DAYS) -> datetime:
+    "Expenses dated before this (January 1st of the horizon's year) belong in the cold tier."
+    return datetime(((now or datetime.utcnow()) - timedelta(days=horizon_days)).year, 1, 1)
+
+
+def _hot_stmt(user_id: int, year: int):
+    expense = models.Expense
+    return select(*(getattr(expense, name) for name in COLUMNS)).where(
+        expense.user_id == user_id,
+        expense.deleted_at.is_(None),
+        expense.expense_date >= datetime(year, 1, 1),
+        expense.expense_date < datetime(year + 1, 1, 1),
+    )
+
+
+def _rollup_rows(user_id: int, year: int, rows: Sequence[tuple]) -> List[dict]:
+    totals = defaultdict(lambda: [0, 0.0])
+    for _, category_id, amount, _, expense_date, _, _ in rows:
+        total = totals[(expense_date.month, category_id)]
+        total[0] += 1
+        total[1] += amount
+    return [{"user_id": user_id, "year": year, "month": month, "category_id": category_id,
+             "count": count, "total": round(total, 2)}
+            for (month, category_id), (count, total) in totals.items()]
+
+
+def move_year(engine: Engine, user_id: int, year: int) -> Tuple[int, float]:
+    "Move the user's live expenses of one year to the cold tier. Returns (rows moved, seconds the write lock was held)."
+    for _ in range(MOVE_RETRIES):
+        # Read and write the file outside the transaction, then check nothing changed once the lock is held
+        with Session(engine) as db:
+            rows = [tuple(row) for row in db.execute(_hot_stmt(user_id, year))]
+            previous = db.get(models.ColdPartition, (user_id, year))
+            previous_file = previous.file if previous else None
+        if not rows:
+            return 0, 0.0
+        merged = rows + (_read_columns(previous_file) if previous_file else [])
+        file = _write(user_id, year, merged)
+
+        with Session(engine) as db:
+            started = time.perf_counter()
+            # The first write takes SQLite's write lock, so what is checked next can't change until commit
+            db.execute(delete(_rollups).where(_rollups.c.user_id == user_id, _rollups.c.year == year))
+            current = [tuple(row) for row in db.execute(_hot_stmt(user_id, year))]
+            current_file = db.execute(
+                select(_partitions.c.file).where(_partitions.c.user_id == user_id, _partitions.c.year == year)
+            ).scalar()
+            if sorted(current) != sorted(rows) or current_file != previous_file:
+                db.rollback()
+                os.remove(_path(file))
+                continue
+
+            total = round(sum(row[2] for row in merged), 2)
+            db.execute(
+                insert(_partitions)
+                .values(user_id=user_id, year=year, file=file, rows=len(merged), total=total, updated_at=datetime.utcnow())
+                .on_conflict_do_update(
+                    index_elements=[_partitions.c.user_id, _partitions.c.year],
+                    set_={"file": file, "rows": len(merged), "total": total, "updated_at": datetime.utcnow()},
+                )
+            )
+            db.execute(insert(_rollups), _rollup_rows(user_id, year, merged))
+            # Statistics describe the hot expenses only, as stats.rebuild computes them
+            stats.add_amounts(db, user_id, ((row[1], row[2]) for row in rows), weight=-1)
+            ids = [row[0] for row in rows]
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                db.execute(delete(models.Expense).where(models.Expense.expense_id.in_(ids[start:start + DELETE_CHUNK_SIZE])))
+            db.commit()
+            return len(rows), time.perf_counter() - started
+    raise RuntimeError(f"expenses of user {user_id} in {year} kept changing while being moved")
+
+
+def _remove_orphans(engine: Engine, resident: Optional[Callable[[int], bool]] = None) -> int:
+    "Delete files no partition refers to, once ORPHAN_GRACE_SECONDS old. Returns the number removed."
+    if not os.path.isdir(COLD_STORE_DIR):
+        return 0
+    with engine.connect() as conn:
+        referenced = set(conn.execute(select(_partitions.c.file)).scalars())
+    expired = time.time() - ORPHAN_GRACE_SECONDS
+    removed = 0
+    for user_dir in os.listdir(COLD_STORE_DIR):
+        directory = os.path.join(COLD_STORE_DIR, user_dir)
+        if not os.path.isdir(directory):
+            continue
+        if resident is not None and not (user_dir.isdigit() and resident(int(user_dir))):
+            # Another shard's user: their partitions are in that shard's database
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if f"{user_dir}/{name}" not in referenced and os.path.getmtime(path) < expired:
+                os.remove(path)
+                removed += 1
+        if not os.listdir(directory):
+            os.rmdir(directory)
+    return removed
+
+
+def remove_user(user_id: int) -> None:
+    "Delete a purged user's files (their partition rows go with the user's other rows)."
+    shutil.rmtree(os.path.join(COLD_STORE_DIR, str(user_id)), ignore_errors=True)
+
+
+def run(engine: Engine, horizon_days: int = HORIZON_DAYS, now: Optional[datetime] = None,
+        resident: Optional[Callable[[int], bool]] = None) -> dict:
+    """Move every (user, year) older than the horizon. Returns counters for logging.
+    With sharding, `resident` tells which users live in this engine's shard."""
+    if not available():
+        raise RuntimeError("The cold tier needs pyarrow to be installed")
+    started = time.perf_counter()
+    before = boundary(now, horizon_days)
+    year = func.cast(func.strftime("%Y", models.Expense.expense_date), Integer)
+    with engine.connect() as conn:
+        groups = conn.execute(
+            select(models.Expense.user_id, year)
+            .where(models.Expense.deleted_at.is_(None), models.Expense.expense_date < before)
+            .group_by(models.Expense.user_id, year)
+            .order_by(models.Expense.user_id, year)
+        ).all()
+    if resident is not None:
+        groups = [(user_id, group_year) for user_id, group_year in groups if resident(user_id)]
+
+    moved = 0
+    longest = 0.0
+    for user_id, group_year in groups:
+        rows, held = move_year(engine, user_id, group_year)
+        moved += rows
+        longest = max(longest, held)
+    return {
+        "boundary": before.date().isoformat(),
+        "partitions": len(groups),
+        "expenses": moved,
+        "removed_files": _remove_orphans(engine, resident),
+        "longest_lock_ms": round(longest * 1000, 1),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move aged expenses to the cold tier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    move_parser = sub.add_parser("move", help="move whole years older than the horizon into Parquet files")
+    move_parser.add_argument("--horizon-days", type=int, default=HORIZON_DAYS, help="keep expenses this recent hot")
+    move_parser.add_argument("--as-of", type=datetime.fromisoformat, help="date the horizon is counted from (default now)")
+    args = parser.parse_args()
+
+    from database.database import engine
+    result = run(engine, args.horizon_days, args.as_of)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
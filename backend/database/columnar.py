@@ -0,0 +1,370 @@
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+
+"""
+Memory-mapped column snapshot of the live expenses, for batch jobs that
+read every user's rows.
+
+A snapshot is a directory of NumPy .npy files, one fixed-width array per
+column, sorted by (user_id, expense_date, expense_id):
+
+  expense_id, user_id     int64
+  category_id             int32
+  expense_date            int64, microseconds since 1970-01-01 (NULL is 0)
+  amount                  float64
+  descriptions            uint8, the UTF-8 descriptions end to end (NULL is "")
+  description_offsets     int64, row i is descriptions[offsets[i]:offsets[i + 1]]
+  users, user_offsets     int64, the rows of users[j] are user_offsets[j]:user_offsets[j + 1]
+
+Jobs open it with `open_snapshot()`, which maps the files read-only, so a
+user's rows are array views (no copy) and worker processes share the same
+page cache pages. `map_users` splits the users into ranges of about equal
+row counts and runs a function over them in a process pool.
+
+    python -m database.columnar build          # refresh from the rows changed since the last build
+    python -m database.columnar build --full   # read the whole table again
+    python -m database.columnar status
+
+A refresh reads only the rows whose updated_at (indexed) is at or after
+the previous build's watermark minus OVERLAP, since writers' clocks and
+commits don't arrive in order, and replaces them by expense_id. Rows that
+left the table without an update (cold tier moves, purged users) are found
+by comparing row counts and, when those differ, the table's expense ids.
+The arrays are then sorted again and written as a new generation; the
+manifest is switched atomically and the previous generation is kept for
+jobs that still have it open.
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", os.path.join(BASE_DIR, "columnar"))
+OVERLAP = timedelta(seconds=int(os.getenv("COLUMNAR_OVERLAP_SECONDS", "300")))
+FETCH_SIZE = 100_000
+KEEP_GENERATIONS = 2
+MANIFEST = "manifest.json"
+
+# Fixed-width columns, one value per expense
+COLUMNS = {
+    "expense_id": "int64",
+    "user_id": "int64",
+    "category_id": "int32",
+    "expense_date": "int64",
+    "amount": "float64",
+}
+
+# expense_date as microseconds since the epoch, computed by SQLite from the stored text
+_SELECT = (
+    "SELECT expense_id, user_id, category_id, "
+    "COALESCE(CAST(strftime('%s', expense_date) AS INTEGER) * 1000000 "
+    "+ CAST(substr(expense_date || '.000000', 21, 6) AS INTEGER), 0), "
+    "amount, description FROM expenses"
+)
+
+
+def available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def _numpy():
+    # Loaded on first use, like pyarrow for the cold tier
+    import numpy
+    return numpy
+
+
+class _Table:
+    "Columns of some rows in memory, in no particular order."
+
+    def __init__(self, columns: Dict[str, object], descriptions: bytes, offsets):
+        self.columns = columns
+        self.descriptions = descriptions
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def take(self, rows) -> "_Table":
+        "The given rows, in that order."
+        np = _numpy()
+        starts, ends = self.offsets[rows].tolist(), self.offsets[rows + 1].tolist()
+        blob = self.descriptions
+        descriptions = b"".join([blob[start:end] for start, end in zip(starts, ends)])
+        offsets = np.zeros(len(rows) + 1, dtype="int64")
+        np.cumsum(np.subtract(ends, starts, dtype="int64"), out=offsets[1:])
+        return _Table({name: column[rows] for name, column in self.columns.items()}, descriptions, offsets)
+
+    @staticmethod
+    def concat(first: "_Table", second: "_Table") -> "_Table":
+        np = _numpy()
+        return _Table(
+            {name: np.concatenate([first.columns[name], second.columns[name]]) for name in COLUMNS},
+            first.descriptions + second.descriptions,
+            np.concatenate([first.offsets, second.offsets[1:] + first.offsets[-1]]),
+        )
+
+
+def _cursor(conn, sql: str, params: tuple = ()):
+    # The DBAPI cursor of the connection's transaction: Row objects cost more than the arrays here
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.execute(sql, params)
+    return cursor
+
+
+def _ids(conn, sql: str, params: tuple = ()):
+    return _numpy().fromiter((row[0] for row in _cursor(conn, sql, params)), dtype="int64")
+
+
+def _read(conn, where: str, params: tuple = ()) -> _Table:
+    "Rows of the expenses table matching `where`."
+    np = _numpy()
+    parts = {name: [] for name in COLUMNS}
+    descriptions: List[bytes] = []
+    result = _cursor(conn, f"{_SELECT} {where}", params)
+    while batch := result.fetchmany(FETCH_SIZE):
+        *values, texts = zip(*batch)
+        for name, column in zip(COLUMNS, values):
+            parts[name].append(np.array(column, dtype=COLUMNS[name]))
+        descriptions += [(text or "").encode() for text in texts]
+    offsets = np.zeros(len(descriptions) + 1, dtype="int64")
+    np.cumsum(np.fromiter(map(len, descriptions), dtype="int64", count=len(descriptions)), out=offsets[1:])
+    columns = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=COLUMNS[name])
+               for name, arrays in parts.items()}
+    return _Table(columns, b"".join(descriptions), offsets)
+
+
+#  Reading
+
+class Snapshot:
+    "One generation of the snapshot, memory-mapped read-only."
+
+    def __init__(self, path: str, info: dict):
+        np = _numpy()
+        self.path = path
+        self.info = info
+
+        def load(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self.columns = {name: load(name) for name in COLUMNS}
+        self.descriptions = load("descriptions")
+        self.description_offsets = load("description_offsets")
+        self.users = load("users")
+        self.user_offsets = load("user_offsets")
+
+    def __len__(self) -> int:
+        return len(self.description_offsets) - 1
+
+    def rows_at(self, index: int) -> slice:
+        "Rows of users[index]."
+        return slice(int(self.user_offsets[index]), int(self.user_offsets[index + 1]))
+
+    def rows(self, user_id: int) -> slice:
+        "Rows of a user (empty if the user has none)."
+        index = int(_numpy().searchsorted(self.users, user_id))
+        if index == len(self.users) or self.users[index] != user_id:
+            return slice(0, 0)
+        return self.rows_at(index)
+
+    def user(self, user_id: int) -> Dict[str, object]:
+        "A user's columns, as views of the mapped files."
+        rows = self.rows(user_id)
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def texts(self, rows: slice) -> List[str]:
+        "Descriptions of a range of rows."
+        offsets = self.description_offsets[rows.start:rows.stop + 1].tolist()
+        if not offsets:
+            return []
+        blob = self.descriptions[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [blob[start - base:end - base].decode() for start, end in zip(offsets, offsets[1:])]
+
+    def partitions(self, parts: int) -> List[Tuple[int, int]]:
+        "(first, last) ranges of user indexes with about the same number of rows each."
+        np = _numpy()
+        targets = np.linspace(0, len(self), parts + 1)[1:-1]
+        cuts = np.searchsorted(self.user_offsets[1:], targets, side="left") + 1
+        bounds = [0, *sorted(set(int(cut) for cut in cuts if 0 < cut < len(self.users))), len(self.users)]
+        return [(first, last) for first, last in zip(bounds, bounds[1:]) if first < last]
+
+
+def load_manifest(directory: Optional[str] = None) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory or COLUMNAR_DIR, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(directory: Optional[str] = None) -> Optional[Snapshot]:
+    "The current generation, or None before the first build."
+    directory = directory or COLUMNAR_DIR
+    manifest = load_manifest(directory)
+    if manifest is None:
+        return None
+    return Snapshot(os.path.join(directory, manifest["generation"]), manifest)
+
+
+_worker_snapshot: Optional[Snapshot] = None
+
+
+def _open_in_worker(path: str, info: dict) -> None:
+    global _worker_snapshot
+    _worker_snapshot = Snapshot(path, info)
+
+
+def _run_in_worker(function: Callable, first: int, last: int, args: tuple) -> list:
+    return function(_worker_snapshot, first, last, *args)
+
+
+def map_users(snapshot: Snapshot, function: Callable, workers: int = 1, *args) -> list:
+    """Concatenated results of `function(snapshot, first, last, *args)` over ranges of user indexes.
+    With more than one worker the ranges run in a process pool; each worker maps the same files,
+    and `function` must be importable (a module-level function)."""
+    if workers <= 1:
+        return function(snapshot, 0, len(snapshot.users), *args)
+    results = []
+    with ProcessPoolExecutor(workers, initializer=_open_in_worker, initargs=(snapshot.path, snapshot.info)) as pool:
+        # A few ranges per worker, so one heavy range doesn't leave the others idle
+        futures = [pool.submit(_run_in_worker, function, first, last, args)
+                   for first, last in snapshot.partitions(workers * 4)]
+        for future in futures:
+            results += future.result()
+    return results
+
+
+#  Building
+
+def _write(table: _Table, rows, directory: str, info: dict) -> str:
+    "Sort the `rows` of `table`, write them as a new generation and switch the manifest to it. Returns the generation."
+    np = _numpy()
+    columns = table.columns
+    order = np.lexsort((columns["expense_id"][rows], columns["expense_date"][rows], columns["user_id"][rows]))
+    table = table.take(rows[order])
+    users, starts = np.unique(table.columns["user_id"], return_index=True)
+
+    generation = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, generation)
+    os.makedirs(path + ".tmp")
+    arrays = {
+        **table.columns,
+        "descriptions": np.frombuffer(table.descriptions, dtype="uint8"),
+        "description_offsets": table.offsets,
+        "users": users.astype("int64"),
+        "user_offsets": np.append(starts, len(table)).astype("int64"),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path + ".tmp", name + ".npy"), array)
+    os.replace(path + ".tmp", path)
+
+    with open(os.path.join(directory, MANIFEST + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, **info}, f)
+    os.replace(os.path.join(directory, MANIFEST + ".tmp"), os.path.join(directory, MANIFEST))
+    generations = sorted(name for name in os.listdir(directory)
+                         if os.path.isdir(os.path.join(directory, name)) and not name.endswith(".tmp"))
+    for old in generations[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return generation
+
+
+def _same_rows(previous: Snapshot, rows, changed: _Table) -> bool:
+    "Whether the rows read again (the overlap) are exactly the snapshot's `rows`, so there is nothing to write."
+    np = _numpy()
+    if len(rows) != len(changed):
+        return False
+    ids = previous.columns["expense_id"]
+    old = rows[np.argsort(ids[rows])]
+    new = np.argsort(changed.columns["expense_id"])
+    if not all(np.array_equal(previous.columns[name][old], changed.columns[name][new]) for name in COLUMNS):
+        return False
+    offsets = previous.description_offsets
+    return all(
+        previous.descriptions[offsets[i]:offsets[i + 1]].tobytes()
+        == changed.descriptions[changed.offsets[j]:changed.offsets[j + 1]]
+        for i, j in zip(old.tolist(), new.tolist())
+    )
+
+
+def build(engine: Engine, full: bool = False, directory: Optional[str] = None) -> dict:
+    "Refresh the snapshot (or build it from scratch). Returns counters for logging."
+    np = _numpy()
+    started = time.perf_counter()
+    directory = directory or COLUMNAR_DIR
+    os.makedirs(directory, exist_ok=True)
+    previous = None if full else open_snapshot(directory)
+    result = {"full": previous is None, "changed": None, "removed": None}
+
+    with engine.connect() as conn:
+        # One read transaction (pysqlite doesn't begin one for SELECTs), so the counts and rows agree
+        conn.exec_driver_sql("BEGIN")
+        # The build's own clock, not max(updated_at): imported rows may carry timestamps ahead of it
+        watermark = datetime.utcnow().isoformat(" ", "microseconds")
+        if previous is None:
+            table = _read(conn, "WHERE deleted_at IS NULL")
+        else:
+            since = datetime.fromisoformat(previous.info["watermark"]) - OVERLAP
+            params = (since.isoformat(" ", "microseconds"),)
+            changed_ids = _ids(conn, "SELECT expense_id FROM expenses WHERE updated_at >= ?", params)
+            changed = _read(conn, "WHERE updated_at >= ? AND deleted_at IS NULL", params)
+            ids = previous.columns["expense_id"]
+            keep = ~np.isin(ids, changed_ids)
+            # Rows removed without an update: the live count is lower than the rows accounted for
+            live = conn.exec_driver_sql(
+                "SELECT (SELECT count(*) FROM expenses) - (SELECT count(*) FROM expenses WHERE deleted_at IS NOT NULL)"
+            ).scalar()
+            if live != int(keep.sum()) + len(changed):
+                present = _ids(conn, "SELECT expense_id FROM expenses")
+                keep &= np.isin(ids, present)
+            result["changed"] = len(changed_ids)
+            result["removed"] = int((~keep & ~np.isin(ids, changed.columns["expense_id"])).sum())
+            if keep.all() and len(changed) == 0 or _same_rows(previous, np.flatnonzero(~keep), changed):
+                result.update(rows=len(previous), generation=previous.info["generation"], written=False,
+                              seconds=round(time.perf_counter() - started, 3))
+                return result
+            # The kept rows of the previous generation and the changed ones, gathered once in _write
+            table = _Table.concat(
+                _Table(previous.columns, previous.descriptions.tobytes(), previous.description_offsets), changed)
+            rows = np.concatenate([np.flatnonzero(keep), len(ids) + np.arange(len(changed))])
+    if previous is None:
+        rows = np.arange(len(table))
+
+    info = {
+        "built_at": datetime.utcnow().isoformat(),
+        "watermark": watermark,
+        "rows": len(rows),
+        "max_expense_id": int(table.columns["expense_id"][rows].max()) if len(rows) else 0,
+    }
+    result.update(rows=len(rows), generation=_write(table, rows, directory, info), written=True,
+                  seconds=round(time.perf_counter() - started, 3))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped column snapshot of the expenses")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="refresh the snapshot from the rows changed since the last build")
+    build_parser.add_argument("--full", action="store_true", help="read the whole table again")
+    sub.add_parser("status", help="show the current generation")
+    args = parser.parse_args()
+
+    if not available():
+        parser.exit(1, "the column snapshot needs numpy to be installed\n")
+    if args.command == "status":
+        manifest = load_manifest()
+        print(json.dumps(manifest, indent=2) if manifest else "no snapshot yet")
+        return
+    from database.database import engine
+    for key, value in build(engine, full=args.full).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, insert, literal, select, text, update
+from sqlalchemy.engine import Engine
+
+from database import cold, models
+
+"""
+Compaction of soft-deleted rows out of the hot tables.
+
+Deleting an expense, budget or user only sets deleted_at, so the rows stay
+in the tables and their indexes, and every read filters them out. This job
+runs three steps, each in chunks of CHUNK_SIZE rows with one short
+transaction per chunk, so the SQLite write lock is never held for long:
+
+1. users: users deleted more than RETENTION_DAYS ago are purged for good,
+   with their expenses, budgets, chat messages, statistics, recurring
+   charges, category corrections, archived rows and cold-tier files,
+2. expenses: expenses deleted more than RETENTION_DAYS ago move to
+   expenses_archive (the search index drops them through its trigger),
+3. budgets: the same for budgets, into budgets_archive,
+
+and ends with an incremental vacuum that returns the freed pages to the
+file system.
+
+    python -m database.compaction run
+    python -m database.compaction run --retention-days 7
+    python -m database.compaction enable-incremental-vacuum   # once, on databases made before this job
+
+Each chunk also updates the step's row in compaction_progress, in the same
+transaction, so an interrupted run is resumed by the next one with the same
+cutoff; a step's row is removed when it finishes. Moving a chunk is
+idempotent, so two overlapping runs do no harm.
+
+The incremental vacuum needs auto_vacuum=INCREMENTAL, which SQLite only
+accepts before the first table is created or with a full VACUUM. New
+databases get it from `python -m database.migrate`; older ones need the
+one-off enable-incremental-vacuum command, which rewrites the whole file.
+"""
+
+RETENTION_DAYS = int(os.getenv("COMPACTION_RETENTION_DAYS", "30"))
+CHUNK_SIZE = int(os.getenv("COMPACTION_CHUNK_SIZE", "1000"))
+# Pause between chunks, so API writes waiting for the lock get their turn
+CHUNK_PAUSE = float(os.getenv("COMPACTION_CHUNK_PAUSE", "0.005"))
+VACUUM_PAGES = 4096  # pages returned per incremental_vacuum transaction
+
+_progress = models.CompactionProgress.__table__
+_expense_tables = (models.Expense.__tablename__, models.ArchivedExpense.__tablename__)
+
+# (step, hot table, archive table)
+MOVES = (
+    ("expenses", models.Expense.__table__, models.ArchivedExpense.__table__),
+    ("budgets", models.Budget.__table__, models.ArchivedBudget.__table__),
+)
+
+# Tables holding a purged user's data, deleted before the user row
+USER_TABLES = (
+    models.Expense.__tablename__,
+    models.ArchivedExpense.__tablename__,
+    models.BudgetAlert.__tablename__,
+    models.BudgetEvent.__tablename__,
+    models.WebhookDelivery.__tablename__,
+    models.WebhookDeadLetter.__tablename__,
+    models.Webhook.__tablename__,
+    models.Budget.__tablename__,
+    models.ArchivedBudget.__tablename__,
+    models.ChatMessage.__tablename__,
+    models.CategoryStatBucket.__tablename__,
+    models.CategoryStat.__tablename__,
+    models.RecurringCharge.__tablename__,
+    models.ColdRollup.__tablename__,
+    models.ColdPartition.__tablename__,
+)
+
+
+#  Checkpoints
+
+def _resume(engine: Engine, step: str, cutoff: datetime) -> Tuple[datetime, int, int]:
+    "(cutoff, position, rows) of an unfinished run of the step, or a new checkpoint."
+    with engine.begin() as conn:
+        row = conn.execute(select(_progress).where(_progress.c.step == step)).first()
+        if row is not None:
+            return row.cutoff, row.position, row.rows
+        now = datetime.utcnow()
+        conn.execute(insert(_progress).values(step=step, cutoff=cutoff, position=0, rows=0, started_at=now, updated_at=now))
+    return cutoff, 0, 0
+
+
+def _checkpoint(conn, step: str, position: int, rows: int) -> None:
+    conn.execute(
+        update(_progress).where(_progress.c.step == step)
+        .values(position=position, rows=rows, updated_at=datetime.utcnow())
+    )
+
+
+def _finish(engine: Engine, step: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(delete(_progress).where(_progress.c.step == step))
+
+
+class _Timer:
+    "Longest chunk transaction, as a measure of how long other writers may wait."
+
+    def __init__(self):
+        self.chunks = 0
+        self.longest = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.chunks += 1
+        self.longest = max(self.longest, time.perf_counter() - self.started)
+
+
+#  Steps
+
+def delete_user_rows(engine: Engine, user_id: int, chunk_size: int = CHUNK_SIZE, timer: Optional[_Timer] = None,
+                     checkpoint: Optional[Callable] = None) -> int:
+    """Delete a user's rows from USER_TABLES (and their category corrections) in chunks, leaving the user row.
+    `checkpoint(conn, rows)` runs inside each chunk's transaction. Returns the rows deleted."""
+    timer = timer or _Timer()
+    corrections = text(
+        f"DELETE FROM {models.CategoryCorrection.__tablename__} WHERE expense_id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    rows = 0
+    for table in USER_TABLES:
+        chunk = text(f"SELECT rowid FROM {table} WHERE user_id = :user_id LIMIT :limit")
+        remove = text(f"DELETE FROM {table} WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True))
+        while True:
+            with timer, engine.begin() as conn:
+                ids = conn.execute(chunk, {"user_id": user_id, "limit": chunk_size}).scalars().all()
+                if not ids:
+                    break
+                if table in _expense_tables:
+                    # rowid is expense_id in both expense tables
+                    conn.execute(corrections, {"ids": ids})
+                rows += conn.execute(remove, {"ids": ids}).rowcount
+                if checkpoint is not None:
+                    checkpoint(conn, rows)
+            time.sleep(CHUNK_PAUSE)
+    return rows
+
+
+def purge_users(engine: Engine, cutoff: datetime, chunk_size: int = CHUNK_SIZE, timer: Optional[_Timer] = None,
+                resident: Optional[Callable[[int], bool]] = None) -> dict:
+    """Hard-delete users soft-deleted before `cutoff` and everything they own.
+    With sharding, `resident` tells which users' rows live in this engine's shard."""
+    step = "users"
+    timer = timer or _Timer()
+    cutoff, position, rows = _resume(engine, step, cutoff)
+    with engine.connect() as conn:
+        user_ids = conn.execute(
+            select(models.User.user_id)
+            .where(models.User.deleted_at.is_not(None), models.User.deleted_at < cutoff,
+                   models.User.user_id > position)
+            .order_by(models.User.user_id)
+        ).scalars().all()
+    if resident is not None:
+        user_ids = [user_id for user_id in user_ids if resident(user_id)]
+
+    for user_id in user_ids:
+        done = rows
+        rows += delete_user_rows(engine, user_id, chunk_size, timer,
+                                 lambda conn, deleted: _checkpoint(conn, step, position, done + deleted))
+        with timer, engine.begin() as conn:
+            conn.execute(delete(models.UserShard.__table__).where(models.UserShard.user_id == user_id))
+            rows += conn.execute(delete(models.User.__table__).where(models.User.user_id == user_id)).rowcount
+            position = user_id
+            _checkpoint(conn, step, position, rows)
+        cold.remove_user(user_id)
+
+    _finish(engine, step)
+    return {"users": len(user_ids), "rows": rows}
+
+
+def archive(engine: Engine, step: str, hot, archived, cutoff: datetime, chunk_size: int = CHUNK_SIZE,
+            timer: Optional[_Timer] = None) -> int:
+    "Move rows of `hot` soft-deleted before `cutoff` into `archived`. Returns the rows moved."
+    timer = timer or _Timer()
+    cutoff, position, rows = _resume(engine, step, cutoff)
+    key = hot.primary_key.columns.values()[0]
+    columns = [column.name for column in archived.columns if column.name != "archived_at"]
+    expired = (hot.c.deleted_at.is_not(None), hot.c.deleted_at < cutoff)
+    while True:
+        with timer, engine.begin() as conn:
+            # Oldest deletions first: expenses have a partial index on deleted_at for this
+            ids = conn.execute(select(key).where(*expired).order_by(hot.c.deleted_at).limit(chunk_size)).scalars().all()
+            if not ids:
+                break
+            now = datetime.utcnow()
+            conn.execute(
+                insert(archived).prefix_with("OR IGNORE").from_select(
+                    columns + ["archived_at"],
+                    select(*[hot.c[name] for name in columns], literal(now)).where(key.in_(ids), *expired),
+                )
+            )
+            rows += conn.execute(delete(hot).where(key.in_(ids), *expired)).rowcount
+            position = max(position, max(ids))
+            _checkpoint(conn, step, position, rows)
+        time.sleep(CHUNK_PAUSE)
+    _finish(engine, step)
+    return rows
+
+
+#  Vacuum
+
+def enable_incremental_vacuum(engine: Engine) -> None:
+    "Switch the file to auto_vacuum=INCREMENTAL. Rewrites the whole database unless it is empty."
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+def incremental_vacuum(engine: Engine, pages: int = VACUUM_PAGES) -> Optional[int]:
+    "Return free pages to the file system, `pages` per transaction. None when auto_vacuum isn't incremental."
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return None
+        before = free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        while free:
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(pages)})")
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= free:
+                break
+            free = remaining
+        return before - free
+
+
+def run(engine: Engine, retention_days: int = RETENTION_DAYS, chunk_size: int = CHUNK_SIZE,
+        now: Optional[datetime] = None, vacuum: bool = True, resident: Optional[Callable[[int], bool]] = None) -> dict:
+    "One compaction pass. Returns counters for logging."
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    timer = _Timer()
+    result = {"purged_" + name: count for name, count in purge_users(engine, cutoff, chunk_size, timer, resident).items()}
+    for step, hot, archived in MOVES:
+        result[f"archived_{step}"] = archive(engine, step, hot, archived, cutoff, chunk_size, timer)
+    result["vacuumed_pages"] = incremental_vacuum(engine) if vacuum else None
+    result["chunks"] = timer.chunks
+    result["longest_chunk_ms"] = round(timer.longest * 1000, 1)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move or purge soft-deleted rows out of the hot tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="purge deleted users, archive deleted expenses and budgets, vacuum")
+    run_parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="keep soft-deleted rows this long")
+    run_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    run_parser.add_argument("--no-vacuum", action="store_true", help="skip the incremental vacuum")
+    sub.add_parser("enable-incremental-vacuum", help="one-off full VACUUM that enables incremental vacuum")
+    args = parser.parse_args()
+
+    from database.database import engine
+    if args.command == "enable-incremental-vacuum":
+        enable_incremental_vacuum(engine)
+        print("auto_vacuum set to incremental")
+        return
+    result = run(engine, args.retention_days, args.chunk_size, vacuum=not args.no_vacuum)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if result["vacuumed_pages"] is None and not args.no_vacuum:
+        print("incremental vacuum is off for this database; run enable-incremental-vacuum once")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import datetime
-from database import models
+from sqlalchemy import func, and_, case, insert
+from datetime import datetime, timedelta
+from database import budget_alerts, cold, models, stats
+from database.category_cache import catalogue
 from auth import hash_password, verify_password
 from typing import Dict, List
 
@@ -72,14 +73,51 @@ def create_category(db: Session, name: str):
     # Create a new category
     db_category = models.Category(name=name)
     db.add(db_category)
+    catalogue.bump_version(db)
     db.commit()
     db.refresh(db_category)
+    catalogue.refresh(db)
     return db_category
 
+def update_category(db: Session, category_id: int, name: str):
+    # Rename a category
+    category = get_category_by_id(db, category_id)
+    if not category:
+        return None
+    category.name = name
+    catalogue.bump_version(db)
+    db.commit()
+    db.refresh(category)
+    catalogue.refresh(db)
+    return category
+
+def delete_category(db: Session, category_id: int):
+    # Delete a category
+    category = get_category_by_id(db, category_id)
+    if not category:
+        return None
+    db.delete(category)
+    catalogue.bump_version(db)
+    db.commit()
+    catalogue.refresh(db)
+    return category
+
+def category_exists(db: Session, category_id: int) -> bool:
+    # Check a category id against the in-process catalogue (no query on a warm cache)
+    return catalogue.name_for(db, category_id) is not None
+
+def get_budget_category_name(db: Session, category_id: int = None):
+    # Display name for a budget's category; budgets without one are overall budgets
+    if not category_id:
+        return "Overall Budget"
+    return catalogue.name_for(db, category_id)
+
 #  EXPENSES 
 
 def create_expense(db: Session, user_id: int, category_id: int, amount: float, description: str, expense_date: datetime = None):
     # Create a new expense linked to a user and category
+    # Judged against the category's history before this expense joins it
+    history = stats.get_stats(db, user_id, category_id).get(category_id, stats.CategoryStats())
     db_expense = models.Expense(
         user_id=user_id,
         category_id=category_id,
@@ -89,10 +127,32 @@ def create_expense(db: Session, user_id: int, category_id: int, amount: float, d
         # created_at will be set automatically by default in the model
     )
     db.add(db_expense)
+    stats.add_amount(db, user_id, category_id, amount)
+    budget_alerts.apply_changes(db, user_id, [(category_id, db_expense.expense_date)])
     db.commit()
     db.refresh(db_expense)
+    # Not a column, returned by POST /expenses
+    db_expense.anomaly = history.assess(amount)
     return db_expense
 
+def bulk_create_expenses(db: Session, user_id: int, rows: List[dict]) -> int:
+    # Insert many expenses in one executemany; rows are dicts of category_id, amount, description, expense_date
+    now = datetime.utcnow()
+    db.execute(insert(models.Expense), [
+        {
+            "user_id": user_id,
+            "category_id": row["category_id"],
+            "amount": row["amount"],
+            "description": row["description"],
+            "expense_date": row.get("expense_date") or now,
+        }
+        for row in rows
+    ])
+    stats.add_amounts(db, user_id, ((row["category_id"], row["amount"]) for row in rows))
+    budget_alerts.apply_changes(db, user_id, ((row["category_id"], row.get("expense_date") or now) for row in rows))
+    db.commit()
+    return len(rows)
+
 def get_expense_by_id(db: Session, expense_id: int):
     # Retrieve an expense by its ID
     return db.query(models.Expense).filter(models.Expense.expense_id == expense_id).first()
@@ -102,12 +162,26 @@ def update_expense(db: Session, expense_id: int, amount: float = None, descripti
     expense = get_expense_by_id(db, expense_id)
     if not expense:
         return None
+    if category_id is not None and category_id != expense.category_id:
+        # Training signal for the categorizer
+        db.add(models.CategoryCorrection(
+            expense_id=expense.expense_id,
+            description=expense.description,
+            old_category_id=expense.category_id,
+            new_category_id=category_id
+        ))
+    old_category_id, old_amount = expense.category_id, expense.amount
     if amount is not None:
         expense.amount = amount
     if description is not None:
         expense.description = description
     if category_id is not None:
         expense.category_id = category_id
+    if expense.deleted_at is None and (expense.category_id, expense.amount) != (old_category_id, old_amount):
+        stats.add_amount(db, expense.user_id, old_category_id, old_amount, weight=-1)
+        stats.add_amount(db, expense.user_id, expense.category_id, expense.amount)
+        budget_alerts.apply_changes(db, expense.user_id, [(old_category_id, expense.expense_date),
+                                                          (expense.category_id, expense.expense_date)])
     db.commit()
     db.refresh(expense)
     return expense
@@ -117,7 +191,12 @@ def soft_delete_expense(db: Session, expense_id: int):
     expense = get_expense_by_id(db, expense_id)
     if not expense:
         return None
+    was_active = expense.deleted_at is None
+    if was_active:
+        stats.add_amount(db, expense.user_id, expense.category_id, expense.amount, weight=-1)
     expense.deleted_at = datetime.utcnow()
+    if was_active:
+        budget_alerts.apply_changes(db, expense.user_id, [(expense.category_id, expense.expense_date)])
     db.commit()
     db.refresh(expense)
     return expense
@@ -169,6 +248,16 @@ def get_monthly_expense_summary(db: Session, user_id: int, month: int, year: int
     # Format results as dictionary {category_name: total_amount}
     category_breakdown: Dict[str, float] = {name: round(total, 2) for name, total in category_data}
 
+    # Months moved to the cold tier are answered from their rollups
+    cold_totals = cold.category_totals(db, user_id, start_date, end_date)
+    if cold_totals:
+        names = catalogue.names(db)
+        for category_id, total in cold_totals.items():
+            name = names.get(category_id)
+            category_breakdown[name] = round(category_breakdown.get(name, 0.0) + total, 2)
+        total_expense += sum(cold_totals.values())
+        average_per_day = round(total_expense / total_days, 2) if total_days > 0 else 0.0
+
     # Return summary dictionary
     return {
         "total_expense": round(total_expense, 2),
@@ -196,6 +285,8 @@ def create_budget(db: Session, user_id: int, category_id: int = None, amount: fl
         is_active=1
     )
     db.add(db_budget)
+    db.flush()
+    budget_alerts.apply_budget(db, db_budget)
     db.commit()
     db.refresh(db_budget)
     return db_budget
@@ -246,6 +337,7 @@ def update_budget(db: Session, budget_id: int, amount: float = None,
         budget.alert_threshold = alert_threshold
     
     budget.updated_at = datetime.utcnow()
+    budget_alerts.apply_budget(db, budget)
     db.commit()
     db.refresh(budget)
     return budget
@@ -257,6 +349,7 @@ def soft_delete_budget(db: Session, budget_id: int):
         return None
     
     budget.deleted_at = datetime.utcnow()
+    budget_alerts.apply_budget(db, budget)
     db.commit()
     db.refresh(budget)
     return budget
@@ -279,9 +372,9 @@ def get_budget_period_dates(budget: models.Budget):
     elif budget.period == "weekly":
         # Start from Monday of current week
         days_since_monday = now.weekday()
-        start = now - datetime.timedelta(days=days_since_monday)
+        start = now - timedelta(days=days_since_monday)
         start = start.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = start + datetime.timedelta(days=7)
+        end = start + timedelta(days=7)
     elif budget.period == "monthly":
         start = datetime(now.year, now.month, 1)
         if now.month == 12:
@@ -309,28 +402,8 @@ def get_budget_period_dates(budget: models.Budget):
     
     return start, end
 
-def get_budget_status(db: Session, budget_id: int):
-    """Get spending status for a specific budget"""
-    budget = get_budget_by_id(db, budget_id)
-    if not budget:
-        return None
-    
-    start_date, end_date = get_budget_period_dates(budget)
-    
-    # Calculate total spent in current period
-    query = db.query(func.sum(models.Expense.amount)).filter(
-        models.Expense.user_id == budget.user_id,
-        models.Expense.deleted_at.is_(None),
-        models.Expense.expense_date >= start_date,
-        models.Expense.expense_date < end_date
-    )
-    
-    # Filter by category if budget is category-specific
-    if budget.category_id:
-        query = query.filter(models.Expense.category_id == budget.category_id)
-    
-    spent_amount = query.scalar() or 0.0
-    
+def _build_budget_status(budget: models.Budget, spent_amount: float, end_date: datetime, category_name: str):
+    """Assemble the status dict for a budget from its spent amount in the current period"""
     remaining_amount = budget.amount - spent_amount
     percentage_used = (spent_amount / budget.amount * 100) if budget.amount > 0 else 0
     is_over_budget = spent_amount > budget.amount
@@ -343,14 +416,6 @@ def get_budget_status(db: Session, budget_id: int):
     else:
         days_remaining = 0
     
-    # Get category name
-    category_name = None
-    if budget.category_id:
-        category = get_category_by_id(db, budget.category_id)
-        category_name = category.name if category else None
-    else:
-        category_name = "Overall Budget"
-    
     return {
         "budget_id": budget.budget_id,
         "category_id": budget.category_id,
@@ -365,14 +430,54 @@ def get_budget_status(db: Session, budget_id: int):
         "days_remaining": days_remaining
     }
 
+def get_budget_status(db: Session, budget_id: int):
+    """Get spending status for a specific budget"""
+    budget = get_budget_by_id(db, budget_id)
+    if not budget:
+        return None
+    
+    start_date, end_date = get_budget_period_dates(budget)
+    
+    # Calculate total spent in current period
+    query = db.query(func.sum(models.Expense.amount)).filter(
+        models.Expense.user_id == budget.user_id,
+        models.Expense.deleted_at.is_(None),
+        models.Expense.expense_date >= start_date,
+        models.Expense.expense_date < end_date
+    )
+    
+    # Filter by category if budget is category-specific
+    if budget.category_id:
+        query = query.filter(models.Expense.category_id == budget.category_id)
+    
+    spent_amount = query.scalar() or 0.0
+    
+    return _build_budget_status(budget, spent_amount, end_date, get_budget_category_name(db, budget.category_id))
+
 def get_all_budget_statuses(db: Session, user_id: int) -> List[Dict]:
-    """Get spending status for all active budgets of a user"""
+    """Get spending status for all active budgets of a user.
+    All budgets are summed in one query with a conditional SUM per budget."""
     budgets = get_user_budgets(db, user_id, active_only=True)
-    statuses = []
+    if not budgets:
+        return []
     
-    for budget in budgets:
-        status = get_budget_status(db, budget.budget_id)
-        if status:
-            statuses.append(status)
+    periods = [get_budget_period_dates(budget) for budget in budgets]
+    
+    sums = []
+    for budget, (start_date, end_date) in zip(budgets, periods):
+        in_period = and_(models.Expense.expense_date >= start_date, models.Expense.expense_date < end_date)
+        if budget.category_id:
+            in_period = and_(in_period, models.Expense.category_id == budget.category_id)
+        sums.append(func.sum(case((in_period, models.Expense.amount), else_=0.0)))
+    
+    totals = db.query(*sums).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.deleted_at.is_(None),
+        models.Expense.expense_date >= min(start for start, _ in periods),
+        models.Expense.expense_date < max(end for _, end in periods)
+    ).one()
     
-    return statuses
\ No newline at end of file
+    return [
+        _build_budget_status(budget, totals[i] or 0.0, end_date, get_budget_category_name(db, budget.category_id))
+        for i, (budget, (_, end_date)) in enumerate(zip(budgets, periods))
+    ]
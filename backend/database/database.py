@@ -5,7 +5,8 @@ from sqlalchemy.orm import sessionmaker
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "spendsense.db")
 
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+# DATABASE_URL overrides the default file, e.g. for benchmarks against a synthetic dataset
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
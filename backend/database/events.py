@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import models
+
+"""
+The budget event log behind GET /events (sse.py).
+
+An expense write records the changes it makes to the user's budgets in
+budget_events, in the write's own transaction (budget_alerts.apply_changes),
+so an event exists exactly when its write committed. The same transaction
+queues it for the user's webhooks (database/webhooks.py):
+
+  budget_status   a budget's status, the /budgets/status item, after its spending changed
+  budget_alert    its level changed: ok, approaching (alert_threshold reached) or over
+
+The event_id is the SSE event id. Ids are never reused (AUTOINCREMENT) and
+SQLite commits one write at a time, so they become visible in order and
+"every event after id N" is a complete resume point. Every app worker
+polls the log for new ids, which also carries the other workers' events.
+
+Events are kept RETENTION_HOURS; a client resuming from an older id, or
+more than REPLAY_LIMIT events behind, gets a snapshot of its budgets
+instead. The scheduler prunes the log every hour.
+
+    python -m database.events prune
+"""
+
+RETENTION_HOURS = float(os.getenv("EVENTS_RETENTION_HOURS", "24"))
+REPLAY_LIMIT = 1000
+
+_events = models.BudgetEvent.__table__
+
+
+def record(db: Session, user_id: int, events: List[Tuple[str, dict]]) -> List[Tuple[int, str, str]]:
+    "Add a user's (kind, payload) events in the session's transaction. Returns their (event_id, kind, payload JSON)."
+    if not events:
+        return []
+    now = datetime.utcnow()
+    rows = [
+        {"user_id": user_id, "kind": kind, "payload": json.dumps(payload, separators=(",", ":")), "created_at": now}
+        for kind, payload in events
+    ]
+    ids = db.execute(insert(_events).returning(_events.c.event_id, sort_by_parameter_order=True), rows).scalars().all()
+    return [(event_id, row["kind"], row["payload"]) for event_id, row in zip(ids, rows)]
+
+
+def latest_id(conn) -> int:
+    return conn.execute(select(func.max(_events.c.event_id))).scalar() or 0
+
+
+def since(conn, after: int, user_id: Optional[int] = None, limit: int = REPLAY_LIMIT) -> list:
+    "Rows (event_id, user_id, kind, payload) after `after`, of one user or all, oldest first."
+    query = select(_events.c.event_id, _events.c.user_id, _events.c.kind, _events.c.payload) \
+        .where(_events.c.event_id > after)
+    if user_id is not None:
+        query = query.where(_events.c.user_id == user_id)
+    return conn.execute(query.order_by(_events.c.event_id).limit(limit)).all()
+
+
+def resumable(conn, after: int) -> bool:
+    "Whether every event after `after` is still in the log."
+    first, last = conn.execute(select(func.min(_events.c.event_id), func.max(_events.c.event_id))).one()
+    if first is None:
+        return after == 0
+    # prune() deletes a prefix of the ids and keeps the newest event
+    return first - 1 <= after <= last
+
+
+def prune(engine: Engine, retention_hours: float = RETENTION_HOURS, now: Optional[datetime] = None) -> dict:
+    "Delete events older than the retention. Returns counters for logging."
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(hours=retention_hours)
+    with engine.begin() as conn:
+        # By id, so what remains is always "every event after some id"
+        keep = conn.execute(
+            select(func.min(_events.c.event_id)).where(_events.c.created_at >= cutoff)
+        ).scalar() or latest_id(conn)
+        deleted = conn.execute(delete(_events).where(_events.c.event_id < keep)).rowcount
+    return {"events": deleted, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the budget event log")
+    sub = parser.add_subparsers(dest="command", required=True)
+    prune_parser = sub.add_parser("prune", help="delete events older than the retention")
+    prune_parser.add_argument("--hours", type=float, default=RETENTION_HOURS)
+    args = parser.parse_args()
+
+    from database.database import engine
+    for key, value in prune(engine, args.hours).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import sys
+from typing import List
+
+from sqlalchemy import inspect
+
+from database import compaction, models, search, stats
+from database.database import engine as default_engine
+
+"""
+Explicit schema step, run before starting the API:
+
+    python -m database.migrate            # create missing tables
+    python -m database.migrate --check    # exit 1 if tables are missing
+
+With SHARD_COUNT set, both commands cover the global database and every
+shard (database/sharding.py).
+
+The app used to call create_all when mainmenu was imported, which cost every
+worker a round of schema queries at boot and failed on a read-only database.
+Now only this step writes DDL; the app checks for missing tables during
+warmup and logs a warning instead. AUTO_MIGRATE=1 restores the old
+create-on-startup behaviour for local development.
+"""
+
+
+def missing_tables(engine=default_engine) -> List[str]:
+    "Model tables (and the search index) that don't exist in the database (read-only check)."
+    existing = set(inspect(engine).get_table_names())
+    missing = [name for name in models.Base.metadata.tables if name not in existing]
+    if search.FTS_TABLE not in existing and search.supported(engine):
+        missing.append(search.FTS_TABLE)
+    return missing
+
+
+def migrate(engine=default_engine) -> List[str]:
+    "Create missing tables and return their names."
+    missing = missing_tables(engine)
+    if missing:
+        if engine.dialect.name == "sqlite" and not inspect(engine).get_table_names():
+            # New database: let the compaction job hand freed pages back to the OS
+            compaction.enable_incremental_vacuum(engine)
+        models.Base.metadata.create_all(bind=engine)
+        if models.CategoryStat.__tablename__ in missing:
+            # Running statistics of the expenses written before the table existed
+            stats.rebuild(engine)
+        # Full-text index over expense descriptions, filled from existing rows
+        search.install(engine)
+    # Indexes added to tables that already existed (create_all skips those tables)
+    for index in models.Expense.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the SpendSense tables")
+    parser.add_argument("--check", action="store_true", help="only report missing tables")
+    args = parser.parse_args()
+
+    from database import sharding
+    if sharding.enabled():
+        missing = sharding.missing_tables()
+        if args.check:
+            print(f"missing tables: {', '.join(missing)}" if missing else "schema up to date")
+            sys.exit(1 if missing else 0)
+        for name, created in sharding.migrate().items():
+            print(f"{name}: created tables: {', '.join(created)}" if created else f"{name}: schema up to date")
+        return
+
+    if args.check:
+        missing = missing_tables()
+        print(f"missing tables: {', '.join(missing)}" if missing else "schema up to date")
+        sys.exit(1 if missing else 0)
+
+    created = migrate()
+    print(f"created tables: {', '.join(created)}" if created else "schema up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
@@ -72,6 +72,13 @@ class Expense(Base):
     user = relationship("User", back_populates="expenses")
     category = relationship("Category", back_populates="expenses")
 
+    # Only soft-deleted rows are indexed, for the compaction job (database/compaction.py);
+    # updated_at for the column snapshot's refresh (database/columnar.py)
+    __table_args__ = (
+        Index("ix_expenses_deleted_at", "deleted_at", sqlite_where=deleted_at.isnot(None)),
+        Index("ix_expenses_updated_at", "updated_at"),
+    )
+
 class Budget(Base):
     __tablename__ = "budgets"
 
@@ -106,4 +113,268 @@ class Budget(Base):
 
     # Relationships
     user = relationship("User", back_populates="budgets")
-    category = relationship("Category", back_populates="budgets")
\ No newline at end of file
+    category = relationship("Category", back_populates="budgets")
+
+
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+
+    # Version stamps for in-process caches, bumped on every write to the cached table
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class CategoryCorrection(Base):
+    __tablename__ = "category_corrections"
+
+    # A user moved an expense to another category; the categorizer learns from these (ai/categorizer.py)
+    id = Column(Integer, primary_key=True)
+    expense_id = Column(Integer, ForeignKey("expenses.expense_id"), nullable=False)
+    description = Column(String, nullable=True)  # description before the update
+    old_category_id = Column(Integer, nullable=False)
+    new_category_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CategoryStat(Base):
+    __tablename__ = "category_stats"
+
+    # Running amount statistics per (user, category), maintained by database/stats.py
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    category_id = Column(Integer, ForeignKey("categories.category_id"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    m2 = Column(Float, nullable=False, default=0.0)  # sum of squared deviations from the mean (Welford)
+
+
+class CategoryStatBucket(Base):
+    __tablename__ = "category_stat_buckets"
+
+    # Quantile sketch of the same pairs: expenses per logarithmic amount bucket
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    category_id = Column(Integer, ForeignKey("categories.category_id"), primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class RecurringCharge(Base):
+    __tablename__ = "recurring_charges"
+    __table_args__ = (UniqueConstraint("user_id", "merchant_key"),)
+
+    # A subscription or other regular charge found by ai/recurring.py
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    merchant_key = Column(String, nullable=False)  # normalized description the charges share
+    description = Column(String, nullable=True)  # description of the latest charge
+    category_id = Column(Integer, ForeignKey("categories.category_id"), nullable=True)
+    amount = Column(Float, nullable=False)  # typical (median) charge
+    cadence = Column(String, nullable=False)  # weekly, biweekly, monthly, quarterly, yearly
+    interval_days = Column(Float, nullable=False)
+    occurrences = Column(Integer, nullable=False)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    next_expected = Column(DateTime, nullable=False)
+    confidence = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BatchWatermark(Base):
+    __tablename__ = "batch_watermarks"
+
+    # Last expense_id a batch pass has processed, so the next run only reads newer rows
+    name = Column(String, primary_key=True)
+    expense_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ArchivedExpense(Base):
+    __tablename__ = "expenses_archive"
+
+    # Expense soft-deleted longer than the retention window, moved out of the hot table by database/compaction.py
+    expense_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    category_id = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)
+    description = Column(String, nullable=True)
+    expense_date = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedBudget(Base):
+    __tablename__ = "budgets_archive"
+
+    # Budget soft-deleted longer than the retention window (database/compaction.py)
+    budget_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    category_id = Column(Integer, nullable=True)
+    amount = Column(Float, nullable=False)
+    period = Column(String, nullable=False)
+    start_date = Column(DateTime, nullable=False)
+    end_date = Column(DateTime, nullable=True)
+    is_active = Column(Integer, nullable=True)
+    alert_threshold = Column(Float, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CompactionProgress(Base):
+    __tablename__ = "compaction_progress"
+
+    # Checkpoint of an unfinished compaction step; the next run resumes it with the same cutoff
+    step = Column(String, primary_key=True)
+    cutoff = Column(DateTime, nullable=False)
+    position = Column(Integer, nullable=False, default=0)  # last id the step finished
+    rows = Column(Integer, nullable=False, default=0)  # rows moved or purged so far
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ColdPartition(Base):
+    __tablename__ = "cold_partitions"
+
+    # One user's expenses of one year, moved out of the hot table into a Parquet file by database/cold.py
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    file = Column(String, nullable=False)  # relative to COLD_STORE_DIR
+    rows = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ColdRollup(Base):
+    __tablename__ = "cold_rollups"
+
+    # Monthly totals per category of the cold expenses, so summaries don't open the files
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    category_id = Column(Integer, ForeignKey("categories.category_id"), primary_key=True)
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+
+
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    # Shard holding a user's rows when SHARD_COUNT is set (database/sharding.py), written on the user's first request
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MovedUser(Base):
+    __tablename__ = "moved_users"
+
+    # A user rebalanced to another shard; triggers in this shard refuse their writes from then on
+    user_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=False)  # where the user went
+    moved_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BudgetAlert(Base):
+    __tablename__ = "budget_alerts"
+
+    # Alert state of an active budget in its current period, precomputed by database/budget_alerts.py
+    budget_id = Column(Integer, ForeignKey("budgets.budget_id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    level = Column(String, nullable=False)  # ok, approaching, over
+    spent_amount = Column(Float, nullable=False)
+    percentage_used = Column(Float, nullable=False)
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    changed_at = Column(DateTime, nullable=False)  # level last changed, or a new period began
+    computed_at = Column(DateTime, nullable=False)
+
+
+class JobLease(Base):
+    __tablename__ = "job_leases"
+
+    # A scheduled job (scheduler.py): the worker running it until expires_at, its next slot and last run
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    next_run_at = Column(DateTime, nullable=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True)  # ok, failed
+    last_error = Column(String, nullable=True)
+    last_seconds = Column(Float, nullable=True)
+    runs = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+
+
+class BudgetEvent(Base):
+    __tablename__ = "budget_events"
+    # Ids are the SSE event ids of GET /events, so they are never reused
+    __table_args__ = (
+        Index("ix_budget_events_user_id_event_id", "user_id", "event_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    # A budget change pushed to the user's streams (database/events.py)
+    event_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    kind = Column(String, nullable=False)  # budget_status, budget_alert
+    payload = Column(String, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Webhook(Base):
+    __tablename__ = "webhooks"
+
+    # An endpoint a user registered for budget events (database/webhooks.py)
+    webhook_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)  # HMAC-SHA256 signing key, shown once at creation
+    events = Column(String, nullable=False, default="budget_alert")  # comma-separated kinds
+    is_active = Column(Integer, nullable=False, default=1)  # 0 after the endpoint answered 410 Gone
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_delivery_at = Column(DateTime, nullable=True)
+    last_status = Column(Integer, nullable=True)  # HTTP status of the last attempt, NULL on a network error
+
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+    __table_args__ = (
+        Index("ix_webhook_deliveries_next_attempt_at", "next_attempt_at"),
+        Index("ix_webhook_deliveries_leased_until", "leased_until"),
+        {"sqlite_autoincrement": True},
+    )
+
+    # One event still to be sent to one webhook; the id is the delivery id receivers deduplicate on
+    delivery_id = Column(Integer, primary_key=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.webhook_id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    event_id = Column(Integer, nullable=True)  # budget_events id, NULL for pings
+    kind = Column(String, nullable=False)
+    payload = Column(String, nullable=False)  # JSON
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    lease_owner = Column(String, nullable=True)  # the delivery worker sending it until leased_until
+    leased_until = Column(DateTime, nullable=True)
+    last_status = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class WebhookDeadLetter(Base):
+    __tablename__ = "webhook_dead_letters"
+
+    # A delivery given up on, kept under its delivery id so it can be retried
+    delivery_id = Column(Integer, primary_key=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.webhook_id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
+    event_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+    payload = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_status = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -0,0 +1,163 @@
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from database import cold, models
+from database.crud import get_budget_category_name
+
+"""
+Read-only query layer for the list endpoints.
+
+These helpers run SQLAlchemy Core select() statements and return the plain
+Row objects the driver produces. Rows are immutable named tuples: they
+skip ORM hydration, the identity map and change tracking, and the response
+models read them directly through from_attributes.
+
+Only use this for data that is serialized straight back to the client. Code
+that modifies objects should keep using crud.py.
+"""
+
+EXPENSE_COLUMNS = (
+    models.Expense.expense_id,
+    models.Expense.user_id,
+    models.Expense.category_id,
+    models.Expense.amount,
+    models.Expense.description,
+    models.Expense.expense_date,
+    models.Expense.created_at,
+    models.Expense.updated_at,
+    models.Expense.deleted_at,
+)
+
+BUDGET_COLUMNS = (
+    models.Budget.budget_id,
+    models.Budget.user_id,
+    models.Budget.category_id,
+    models.Budget.amount,
+    models.Budget.period,
+    models.Budget.start_date,
+    models.Budget.end_date,
+    models.Budget.is_active,
+    models.Budget.alert_threshold,
+    models.Budget.created_at,
+    models.Budget.updated_at,
+)
+
+CATEGORY_COLUMNS = (
+    models.Category.category_id,
+    models.Category.name,
+)
+
+CHAT_COLUMNS = (
+    models.ChatMessage.id,
+    models.ChatMessage.user_id,
+    models.ChatMessage.sender,
+    models.ChatMessage.message,
+    models.ChatMessage.created_at,
+)
+
+
+def _expenses_stmt(user_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                   category_id: Optional[int] = None):
+    # Non-deleted expenses for a user, newest first
+    stmt = (
+        select(*EXPENSE_COLUMNS)
+        .where(models.Expense.user_id == user_id, models.Expense.deleted_at.is_(None))
+        .order_by(models.Expense.expense_date.desc(), models.Expense.expense_id.desc())
+    )
+    if start_date is not None:
+        stmt = stmt.where(models.Expense.expense_date >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(models.Expense.expense_date < end_date)
+    if category_id is not None:
+        stmt = stmt.where(models.Expense.category_id == category_id)
+    return stmt
+
+
+def list_expenses(db: Session, user_id: int, limit: Optional[int] = None, offset: int = 0) -> Sequence[Row]:
+    hot_start = cold.hot_start(db, user_id)
+    stmt = _expenses_stmt(user_id, hot_start)
+    if limit is not None:
+        stmt = stmt.limit(limit).offset(offset)
+    rows = db.execute(stmt).all()
+    if hot_start is None or (limit is not None and len(rows) == limit):
+        return rows
+    # The page runs past the hot rows into the cold tier
+    return list(islice(iter_expenses(db, user_id), offset, None if limit is None else offset + limit))
+
+
+def iter_expense_batches(db: Session, user_id: int, batch_size: int = 1000, start_date: Optional[datetime] = None,
+                         end_date: Optional[datetime] = None, category_id: Optional[int] = None) -> Iterator[Sequence[Row]]:
+    """
+    Expenses fetched from the cursor batch_size rows at a time, so only one
+    batch is held in memory. Yields each batch as a list of rows.
+
+    When the range reaches the user's cold tier (database/cold.py), the
+    older years follow the hot rows, one year's file at a time, merged with
+    hot rows dated in that year.
+    """
+    hot_start = cold.hot_start(db, user_id)
+    reaches_cold = hot_start is not None and (start_date is None or start_date < hot_start)
+    if not reaches_cold or end_date is None or end_date > hot_start:
+        stmt = _expenses_stmt(user_id, hot_start if reaches_cold else start_date, end_date, category_id)
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        yield from result.partitions()
+    if not reaches_cold:
+        return
+
+    older_end = min(end_date, hot_start) if end_date is not None else hot_start
+    hot_rows = defaultdict(list)
+    for row in db.execute(_expenses_stmt(user_id, start_date, older_end, category_id)):
+        hot_rows[row.expense_date.year].append(row)
+    files = cold.partitions(db, user_id, start_date, older_end)
+    for year in sorted(files.keys() | hot_rows.keys(), reverse=True):
+        rows = hot_rows.get(year, [])
+        if year in files:
+            rows += cold.read_partition(user_id, files[year], start_date, older_end, category_id)
+        rows.sort(key=lambda row: (row.expense_date, row.expense_id), reverse=True)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+
+def iter_expenses(db: Session, user_id: int, batch_size: int = 1000, **filters) -> Iterator[Row]:
+    "Same rows as iter_expense_batches, one at a time."
+    for batch in iter_expense_batches(db, user_id, batch_size, **filters):
+        yield from batch
+
+
+def list_budgets(db: Session, user_id: int, active_only: bool = True) -> Sequence[Row]:
+    # Non-deleted budgets for a user
+    stmt = select(*BUDGET_COLUMNS).where(
+        models.Budget.user_id == user_id,
+        models.Budget.deleted_at.is_(None),
+    )
+    if active_only:
+        stmt = stmt.where(models.Budget.is_active == 1)
+    return db.execute(stmt).all()
+
+
+def list_categories(db: Session) -> Sequence[Row]:
+    return db.execute(select(*CATEGORY_COLUMNS)).all()
+
+
+def list_chat_messages(db: Session, user_id: int) -> Sequence[Row]:
+    # A user's chat history in the order it was written
+    stmt = (
+        select(*CHAT_COLUMNS)
+        .where(models.ChatMessage.user_id == user_id)
+        .order_by(models.ChatMessage.created_at)
+    )
+    return db.execute(stmt).all()
+
+
+def budget_rows_with_names(db: Session, user_id: int, active_only: bool = True) -> List[dict]:
+    """Budget rows as dicts with category_name filled from the category catalogue."""
+    return [
+        {**row._mapping, "category_name": get_budget_category_name(db, row.category_id)}
+        for row in list_budgets(db, user_id, active_only=active_only)
+    ]
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, validator
+import json
 from typing import Dict, List, Optional
 from datetime import datetime, date
 
@@ -40,7 +41,7 @@ class CategoryExpenseSummary(BaseModel):
 # Expense Schemas
 class ExpenseCreate(BaseModel):
     user_id: int
-    category_id: int
+    category_id: Optional[int] = None  # filled in by the categorizer when missing
     amount: float
     description: str
     created_at: Optional[datetime] = None
@@ -74,6 +75,79 @@ class ExpenseResponse(BaseModel):
         from_attributes = True
 
 
+class ExpenseAnomaly(BaseModel):
+    # How a new expense compares with the user's history in its category (database/stats.py)
+    is_anomaly: bool
+    severity: Optional[str] = None  # "medium" or "high" when is_anomaly
+    category_count: int
+    category_average: float
+    deviation_percent: float
+    z_score: Optional[float] = None
+    percentile: float
+    upper_bound: Optional[float] = None  # amounts above this are flagged; None until there is enough history
+
+
+class ExpenseCreateResponse(ExpenseResponse):
+    anomaly: Optional[ExpenseAnomaly] = None
+
+
+class ExpenseSearchResult(ExpenseResponse):
+    score: float  # BM25 relevance, higher is better
+
+
+class ExpenseSearchResponse(BaseModel):
+    query: str
+    sort: str
+    matches: int  # matching expenses that were ranked
+    truncated: bool  # True when older matches were left out (see database/search.py)
+    results: List[ExpenseSearchResult]
+
+
+class CategorySuggestionRequest(BaseModel):
+    descriptions: List[str]
+
+
+class CategorySuggestion(BaseModel):
+    description: str
+    category_id: Optional[int] = None  # None when the model has nothing to go on
+    category_name: Optional[str] = None
+    confidence: float = 0.0
+    confident: bool = False  # confidence >= CATEGORIZER_MIN_CONFIDENCE, would be used to fill a category
+
+
+class ExpenseImportItem(BaseModel):
+    category_id: Optional[int] = None
+    amount: float
+    description: str
+    expense_date: Optional[datetime] = None
+
+
+class ExpenseImportRequest(BaseModel):
+    expenses: List[ExpenseImportItem]
+
+
+class ExpenseImportResponse(BaseModel):
+    imported: int
+    auto_categorized: int
+
+
+class RecurringChargeResponse(BaseModel):
+    id: int
+    description: Optional[str] = None
+    merchant_key: str
+    category_id: Optional[int] = None
+    amount: float  # typical charge
+    cadence: str  # weekly, biweekly, monthly, quarterly, yearly
+    interval_days: float
+    occurrences: int
+    first_seen: datetime
+    last_seen: datetime
+    next_expected: datetime
+    confidence: float
+    monthly_cost: float
+    status: str  # active, or lapsed when a charge is overdue
+
+
 # Expense Summary Schemas
 class ExpenseSummaryResponse(BaseModel):
     user_id: int
@@ -216,4 +290,81 @@ class BudgetStatus(BaseModel):
     days_remaining: Optional[int] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class BudgetAlert(BaseModel):
+    """Schema for a budget's precomputed alert state"""
+    budget_id: int
+    category_id: Optional[int]
+    category_name: Optional[str]
+    level: str  # ok, approaching, over
+    budget_amount: float
+    spent_amount: float
+    percentage_used: float
+    period: str
+    period_start: datetime
+    period_end: datetime
+    changed_at: datetime
+    computed_at: datetime
+
+
+# Webhook Schemas
+class WebhookCreate(BaseModel):
+    """Schema for registering a webhook endpoint"""
+    url: str
+    events: List[str] = ["budget_alert"]
+
+    @validator("events")
+    @classmethod
+    def events_must_be_valid(cls, v):
+        valid_events = ["budget_alert", "budget_status"]
+        if not v or any(event not in valid_events for event in v):
+            raise ValueError(f"Events must be one or more of: {', '.join(valid_events)}")
+        return sorted(set(v))
+
+
+class WebhookResponse(BaseModel):
+    """Schema for a registered webhook (the secret is only returned at creation)"""
+    webhook_id: int
+    url: str
+    events: List[str]
+    is_active: bool
+    created_at: datetime
+    last_delivery_at: Optional[datetime] = None
+    last_status: Optional[int] = None
+
+    @validator("events", pre=True)
+    @classmethod
+    def split_events(cls, v):
+        return v.split(",") if isinstance(v, str) else v
+
+    class Config:
+        from_attributes = True
+
+
+class WebhookCreated(WebhookResponse):
+    """Schema for a new webhook, with the secret its deliveries are signed with"""
+    secret: str
+
+
+class WebhookDeadLetter(BaseModel):
+    """Schema for a delivery given up on"""
+    delivery_id: int
+    webhook_id: int
+    event_id: Optional[int]
+    kind: str
+    payload: dict
+    attempts: int
+    last_status: Optional[int]
+    last_error: Optional[str]
+    created_at: datetime
+    failed_at: datetime
+
+    @validator("payload", pre=True)
+    @classmethod
+    def parse_payload(cls, v):
+        return json.loads(v) if isinstance(v, str) else v
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,272 @@
+import math
+import re
+import unicodedata
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import column, or_, select, table, text
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session
+
+from database import models
+from database.reads import EXPENSE_COLUMNS, _expenses_stmt
+
+"""
+Full-text search over expense descriptions for GET /expenses/search.
+
+On SQLite the index is an FTS5 table over expenses.description (external
+content, so descriptions are not stored twice). user_id is indexed as a
+second column so a search only walks the caller's postings. Triggers on
+expenses keep it in sync with every write path, including raw bulk inserts;
+`python -m database.migrate` creates the table and triggers and fills it.
+
+Query syntax: words are ANDed, `coff*` is a prefix, "train ticket" is a
+phrase and OR separates alternatives. Anything else is treated as text, so
+user input can't produce an FTS5 syntax error.
+
+Matches are read most recently written first (by expense_id, the FTS5
+rowid) and at most SEARCH_WINDOW of them are ranked. Reading them by
+expense_date instead would walk every posting of a common word (over
+100 ms for a user with 1M expenses, against a 10 ms budget). Within the
+window, sort=recent orders by expense_date like the expense list, so a
+backdated expense is shown at its date. The trade-off: once a query has
+more than SEARCH_WINDOW matches, an old expense whose date was later moved
+forward can be left out of the window.
+
+FTS5's own bm25() counts every posting of every phrase to get its
+statistics, which for a user with 1M expenses also costs more than the
+whole request budget, so the window is ranked here with the same BM25
+weighting: term frequency, description length and each term's IDF. The
+IDF is taken within the window, so it weighs the terms of a query against
+each other but does nothing for a single-term query.
+
+Without FTS5 (another database, or an SQLite build without it) candidates
+come from LIKE filters instead and are ranked the same way.
+"""
+
+FTS_TABLE = "expenses_fts"
+SEARCH_WINDOW = 500
+MAX_TERMS = 16
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    " description, user_id,"
+    " content='expenses', content_rowid='expense_id',"
+    " tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON expenses BEGIN"
+    f" INSERT INTO {FTS_TABLE}(rowid, description, user_id) VALUES (new.expense_id, new.description, new.user_id);"
+    " END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON expenses BEGIN"
+    f" INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, user_id) VALUES ('delete', old.expense_id, old.description, old.user_id);"
+    " END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF description, user_id ON expenses BEGIN"
+    f" INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, user_id) VALUES ('delete', old.expense_id, old.description, old.user_id);"
+    f" INSERT INTO {FTS_TABLE}(rowid, description, user_id) VALUES (new.expense_id, new.description, new.user_id);"
+    " END",
+)
+
+_fts = table(FTS_TABLE, column("rowid"))
+
+# A term is (tokens, prefix): one token for a word, several for a phrase
+Term = Tuple[Tuple[str, ...], bool]
+
+_QUERY_PART = re.compile(r'"([^"]*)"?|(?<![^\W_])(OR)(?![^\W_])|([^\W_]+)(\*?)')
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+#  Index management
+
+def supported(engine: Engine) -> bool:
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as conn:
+        return bool(conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def install(engine: Engine) -> bool:
+    "Create the index and its triggers if missing, filling a new index. Returns True when it was created."
+    if not supported(engine):
+        return False
+    with engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+        for statement in FTS_DDL:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return not exists
+
+
+def rebuild(engine: Engine) -> None:
+    "Re-index every expense, e.g. after rows were written with the triggers missing."
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def index_available(db: Session) -> bool:
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    return db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+#  Query parsing
+
+def tokenize(value: str) -> List[str]:
+    "Lowercased tokens with diacritics removed, like FTS5's unicode61 tokenizer."
+    if not value.isascii():
+        value = unicodedata.normalize("NFKD", value)
+        value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return _TOKEN.findall(value.lower())
+
+
+def parse_query(query: str) -> List[List[Term]]:
+    "Split a search string into OR groups of ANDed terms."
+    groups: List[List[Term]] = [[]]
+    terms = 0
+    for phrase, or_keyword, word, star in _QUERY_PART.findall(query):
+        if or_keyword:
+            groups.append([])
+            continue
+        tokens = tuple(tokenize(phrase if phrase else word))
+        if tokens and terms < MAX_TERMS:
+            groups[-1].append((tokens, bool(star)))
+            terms += 1
+    return [group for group in groups if group]
+
+
+def match_expression(user_id: int, groups: List[List[Term]]) -> str:
+    "FTS5 MATCH expression for parsed groups, scoped to one user."
+    def phrase(term: Term) -> str:
+        tokens, prefix = term
+        return f'"{" ".join(tokens)}"' + (" *" if prefix else "")
+
+    alternatives = " OR ".join(f"({' AND '.join(phrase(t) for t in group)})" for group in groups)
+    return f'user_id : "{int(user_id)}" AND description : ({alternatives})'
+
+
+#  Search
+
+def _like_filters(groups: List[List[Term]]):
+    # Superset of the matches (substring, not token, match); rank() drops the rest
+    return or_(*[
+        models.Expense.description.ilike(f"%{' '.join(tokens)}%")
+        for group in groups for tokens, _ in group
+    ])
+
+
+def candidates(db: Session, user_id: int, groups: List[List[Term]], start_date: Optional[datetime] = None,
+               end_date: Optional[datetime] = None, category_id: Optional[int] = None,
+               window: int = SEARCH_WINDOW) -> Sequence[Row]:
+    "(expense_id, description, expense_date) of the user's `window` most recently written matches."
+    stmt = (
+        _expenses_stmt(user_id, start_date, end_date, category_id)
+        .with_only_columns(models.Expense.expense_id, models.Expense.description, models.Expense.expense_date)
+        .order_by(None)
+    )
+    if index_available(db):
+        # Rowid order lets FTS5 stop after `window` postings; by date it would walk them all
+        stmt = (
+            stmt.join(_fts, _fts.c.rowid == models.Expense.expense_id)
+            .where(text(f"{FTS_TABLE} MATCH :match").bindparams(match=match_expression(user_id, groups)))
+            .order_by(_fts.c.rowid.desc())
+        )
+    else:
+        stmt = stmt.where(_like_filters(groups)).order_by(models.Expense.expense_id.desc())
+    return db.execute(stmt.limit(window)).all()
+
+
+def _newest_first(pair: Tuple[Row, float]):
+    # The expense list's order; undated rows last, as in SQL
+    row = pair[0]
+    return row.expense_date is not None, row.expense_date or datetime.min, row.expense_id
+
+
+def _frequency(tokens: List[str], term: Term) -> int:
+    words, prefix = term
+    n = len(words)
+    count = 0
+    for i in range(len(tokens) - n + 1):
+        if tokens[i:i + n - 1] == list(words[:-1]) and (
+            tokens[i + n - 1].startswith(words[-1]) if prefix else tokens[i + n - 1] == words[-1]
+        ):
+            count += 1
+    return count
+
+
+def rank(rows: Sequence[Row], groups: List[List[Term]]) -> List[Tuple[Row, float]]:
+    """
+    (row, score) pairs for the rows matching the groups, best first. Scores
+    are BM25 over the given rows; ties go to the newest expense. The IDF is
+    also taken over the given rows, so with a single term it is the same for
+    every row and only term frequency and description length tell them apart.
+    """
+    terms = list({term for group in groups for term in group})
+    # Descriptions repeat a lot ("Coffee", "Groceries"), so each distinct one is tokenized once
+    analyzed = {}
+    matched = []
+    for row in rows:
+        description = row.description or ""
+        if description not in analyzed:
+            tokens = tokenize(description)
+            frequencies = {term: _frequency(tokens, term) for term in terms}
+            is_match = any(all(frequencies[term] for term in group) for group in groups)
+            analyzed[description] = (len(tokens), frequencies) if is_match else None
+        if analyzed[description] is not None:
+            matched.append(row)
+    if not matched:
+        return []
+
+    def doc(row):
+        return analyzed[row.description or ""]
+
+    average_length = sum(doc(row)[0] for row in matched) / len(matched)
+    idf = {}
+    for term in terms:
+        containing = sum(1 for row in matched if doc(row)[1][term])
+        idf[term] = math.log(1 + (len(matched) - containing + 0.5) / (containing + 0.5))
+
+    scores = {}
+    for description, analysis in analyzed.items():
+        if analysis is None:
+            continue
+        length, frequencies = analysis
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        scores[description] = round(sum(idf[t] * f * (BM25_K1 + 1) / (f + norm) for t, f in frequencies.items() if f), 6)
+
+    scored = [(row, scores[row.description or ""]) for row in matched]
+    scored.sort(key=lambda pair: (-pair[1], -pair[0].expense_id))
+    return scored
+
+
+def search_expenses(db: Session, user_id: int, query: str, sort: str = "relevance", limit: int = 20, offset: int = 0,
+                    **filters) -> dict:
+    """Search a user's expenses; `filters` are start_date, end_date and category_id."""
+    groups = parse_query(query)
+    if not groups:
+        return {"query": query, "sort": sort, "matches": 0, "truncated": False, "results": []}
+
+    rows = candidates(db, user_id, groups, **filters)
+    ranked = rank(rows, groups)
+    if sort == "recent":
+        ranked.sort(key=_newest_first, reverse=True)
+    page = ranked[offset:offset + limit]
+
+    # Full rows only for the page, not the whole window
+    scores = {row.expense_id: score for row, score in page}
+    full = {row.expense_id: row for row in db.execute(
+        select(*EXPENSE_COLUMNS).where(models.Expense.expense_id.in_(scores))
+    )} if scores else {}
+    return {
+        "query": query,
+        "sort": sort,
+        "matches": len(ranked),
+        # Older matches beyond the window were not considered
+        "truncated": len(rows) >= SEARCH_WINDOW,
+        "results": [{**full[expense_id]._mapping, "score": score} for expense_id, score in scores.items()],
+    }
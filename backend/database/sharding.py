@@ -0,0 +1,589 @@
+import argparse
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import MetaData, create_engine, delete, event, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import compaction, models, search
+from database.database import BASE_DIR, engine as global_engine
+
+"""
+Optional sharded storage: SQLite allows one writer per file, so with
+SHARD_COUNT set the rows users own are spread over that many database
+files and writes of users on different shards no longer wait for each
+other.
+
+    SHARD_COUNT=4 python -m database.sharding migrate
+    SHARD_COUNT=4 python -m database.sharding status
+    SHARD_COUNT=4 python -m database.sharding move-user 42 3
+    SHARD_COUNT=8 python -m database.sharding rebalance      # after raising SHARD_COUNT
+    SHARD_COUNT=4 python -m database.sharding run recurring  # batch job on every shard in parallel
+    SHARD_COUNT=4 python -m database.sharding import         # copy an unsharded database's rows into the shards
+
+The database at DATABASE_URL stays the global database: users,
+categories, cache_versions, job_leases (scheduler.py) and user_shards,
+the directory of which shard holds each user. Every other table lives in SHARD_DIR/shard-NNN.db, and
+shard connections ATTACH the global database, so the unchanged queries
+(the monthly summary joins categories, signup inserts into users) resolve
+the global tables by name.
+
+Routing: mainmenu.get_db binds each request's session to the shard of the
+request's user (from the bearer token, the user_id in the path or body, or
+the owner of the expense in the path). A request whose body names another
+user than its bearer token is refused, so it cannot write that user's rows
+into the token user's shard. A user without a directory row is
+placed on user_id % SHARD_COUNT and pinned there on their first request,
+so changing SHARD_COUNT only places new users; `rebalance` moves the
+existing ones.
+
+Ids: each shard allocates ids of its autoincrement tables from its own
+range (shard << ID_BITS upwards), so ids are unique across shards and a
+user's rows keep their ids when they move. The shard an expense id was
+created on is a first guess for routing, the others are searched when
+the owner moved since.
+
+Moving a user is online: their rows are copied to the new shard while
+they keep using the old one, then the old shard's write lock is taken
+for the rows changed in the meantime and the directory row is flipped in
+the same transaction. From then on triggers in the old shard refuse the
+user's writes (a request routed before the flip fails instead of writing
+to the old copy), and after MOVE_GRACE_SECONDS the old copy is deleted.
+The final step holds the lock for the time it takes to copy the changes,
+so moves are best run when the user is not importing thousands of rows.
+
+The per-database CLIs (python -m database.compaction, database.cold,
+ai.recurring) run against DATABASE_URL; with sharding use `run <job>`,
+which runs the job on every shard in FAN_OUT_WORKERS threads (SQLite
+releases the GIL while it works). The categorizer's training watermark
+is a single expense id, so it keeps training from an unsharded database.
+"""
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_DIR = os.getenv("SHARD_DIR", os.path.join(BASE_DIR, "shards"))
+FAN_OUT_WORKERS = int(os.getenv("SHARD_FAN_OUT_WORKERS", "0")) or None  # default: one per shard
+MOVE_CHUNK_SIZE = 5000
+MOVE_GRACE_SECONDS = float(os.getenv("SHARD_MOVE_GRACE_SECONDS", "5"))
+ID_BITS = 40  # a trillion ids per shard and table
+GLOBAL_SCHEMA = "global_db"  # name of the global database on shard connections
+
+GLOBAL_TABLES = (
+    models.User.__tablename__,
+    models.Category.__tablename__,
+    models.CacheVersion.__tablename__,
+    models.UserShard.__tablename__,
+    models.JobLease.__tablename__,
+)
+
+_directory = models.UserShard.__table__
+_moved = models.MovedUser.__table__
+_users = models.User.__table__
+
+# Shard copies of the model tables: autoincrement ids, so a deleted id is never
+# reused (compaction archives rows by id) and the sequence can start at the shard's range
+_metadata = MetaData()
+for _table in models.Base.metadata.sorted_tables:
+    _table.to_metadata(_metadata).dialect_options["sqlite"]["autoincrement"] = True
+SHARD_TABLES = [table for table in _metadata.sorted_tables if table.name not in GLOBAL_TABLES]
+
+# Tables whose rows belong to one user and move with them, in copy order
+_USER_TABLES = [table for table in SHARD_TABLES if "user_id" in table.c and table.name != _moved.name]
+# Copied in full again in the final step of a move (a few rows per user)
+_SMALL_TABLES = (
+    models.CategoryStat.__tablename__,
+    models.CategoryStatBucket.__tablename__,
+    models.RecurringCharge.__tablename__,
+    models.ColdPartition.__tablename__,
+    models.ColdRollup.__tablename__,
+    models.BudgetAlert.__tablename__,
+    models.Webhook.__tablename__,
+    models.WebhookDelivery.__tablename__,
+)
+# Changes to these since the bulk copy are found by this column
+_CHANGED_SINCE = {
+    models.Expense.__tablename__: "updated_at",
+    models.Budget.__tablename__: "updated_at",
+    models.ChatMessage.__tablename__: "created_at",
+    models.ArchivedExpense.__tablename__: "archived_at",
+    models.ArchivedBudget.__tablename__: "archived_at",
+    models.BudgetEvent.__tablename__: "created_at",
+    models.WebhookDeadLetter.__tablename__: "failed_at",
+}
+# A moved user's writes to the old shard: refused where a request writes, skipped where only batch jobs do
+_GUARDS = {
+    models.Expense.__tablename__: "ABORT, 'user moved to another shard'",
+    models.Budget.__tablename__: "ABORT, 'user moved to another shard'",
+    models.ChatMessage.__tablename__: "ABORT, 'user moved to another shard'",
+}
+
+
+def enabled() -> bool:
+    return SHARD_COUNT > 0
+
+
+def id_range(shard: int) -> Tuple[int, int]:
+    "(first, end) of the ids the shard allocates."
+    return shard << ID_BITS, (shard + 1) << ID_BITS
+
+
+def home(user_id: int, count: Optional[int] = None) -> int:
+    "Shard of a user without a directory row."
+    return user_id % (count or SHARD_COUNT)
+
+
+#  Engines
+
+_engines: Dict[int, Engine] = {}
+_sessions: Dict[int, sessionmaker] = {}
+_lock = threading.Lock()
+
+
+def shard_path(shard: int) -> str:
+    return os.path.join(SHARD_DIR, f"shard-{shard:03d}.db")
+
+
+def _attach_global(dbapi_connection, connection_record) -> None:
+    dbapi_connection.execute(f"ATTACH DATABASE ? AS {GLOBAL_SCHEMA}", (global_engine.url.database,))
+
+
+def _create_engine(path: str, **kwargs) -> Engine:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False}, **kwargs)
+    event.listen(engine, "connect", _attach_global)
+    return engine
+
+
+def engine_for(shard: int) -> Engine:
+    engine = _engines.get(shard)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(shard)
+            if engine is None:
+                os.makedirs(SHARD_DIR, exist_ok=True)
+                engine = _create_engine(shard_path(shard))
+                _sessions[shard] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engines[shard] = engine
+    return engine
+
+
+def session(shard: int) -> Session:
+    engine_for(shard)
+    return _sessions[shard]()
+
+
+def shards() -> List[int]:
+    "The configured shards, and any beyond SHARD_COUNT that already have a file (a rebalance to fewer shards)."
+    found = set(range(SHARD_COUNT))
+    if os.path.isdir(SHARD_DIR):
+        found.update(int(match.group(1)) for name in os.listdir(SHARD_DIR)
+                     if (match := re.fullmatch(r"shard-(\d+)\.db", name)))
+    return sorted(found)
+
+
+#  Routing
+
+def _placement(conn, condition) -> Optional[int]:
+    "Shard of the user matching `condition`, pinned on first use; None for an unknown user."
+    row = conn.execute(
+        select(_users.c.user_id, _directory.c.shard)
+        .outerjoin(_directory, _directory.c.user_id == _users.c.user_id)
+        .where(condition)
+    ).first()
+    if row is None:
+        return None
+    if row.shard is not None:
+        return row.shard
+    conn.execute(insert(_directory).values(user_id=row.user_id, shard=home(row.user_id)).on_conflict_do_nothing())
+    conn.commit()
+    return conn.execute(select(_directory.c.shard).where(_directory.c.user_id == row.user_id)).scalar()
+
+
+def shard_of(user_id: int) -> int:
+    with global_engine.connect() as conn:
+        shard = _placement(conn, _users.c.user_id == user_id)
+    return home(user_id) if shard is None else shard
+
+
+def user_id_of(email: str) -> Optional[int]:
+    "Id of the user with `email`, from the global database."
+    with global_engine.connect() as conn:
+        return conn.execute(select(_users.c.user_id).where(_users.c.email == email)).scalar()
+
+
+def _expense_owner(expense_id: int) -> Optional[int]:
+    "User id of an expense: first on the shard that allocated the id, then on the others."
+    known = shards()
+    first = expense_id >> ID_BITS
+    for shard in sorted(known, key=lambda shard: shard != first):
+        with engine_for(shard).connect() as conn:
+            owner = conn.execute(
+                select(models.Expense.user_id).where(models.Expense.expense_id == expense_id)
+            ).scalar()
+        if owner is not None:
+            return owner
+    return None
+
+
+def resolve(user_id: Optional[int] = None, email: Optional[str] = None, expense_id: Optional[int] = None) -> int:
+    "Shard of a request's user, by id, email (from the token) or expense; shard 0 when no user is known."
+    if user_id is None and email is None and expense_id is not None:
+        user_id = _expense_owner(expense_id)
+    if user_id is None and email is None:
+        return 0
+    with global_engine.connect() as conn:
+        shard = _placement(conn, _users.c.user_id == user_id if user_id is not None else _users.c.email == email)
+    return 0 if shard is None else shard
+
+
+def directory() -> Dict[int, int]:
+    "{user_id: shard} of every pinned user."
+    with global_engine.connect() as conn:
+        return dict(conn.execute(select(_directory.c.user_id, _directory.c.shard)).all())
+
+
+def resident_filter(shard: int) -> Callable[[int], bool]:
+    "Whether a user's rows live in `shard`, from a snapshot of the directory (for batch jobs)."
+    placed = directory()
+    return lambda user_id: placed.get(user_id, home(user_id)) == shard
+
+
+#  Schema
+
+def _install_guards(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for table in _USER_TABLES:
+            action = _GUARDS.get(table.name, "IGNORE")
+            for operation in ("INSERT", "UPDATE"):
+                conn.exec_driver_sql(
+                    f"CREATE TRIGGER IF NOT EXISTS {table.name}_moved_{operation.lower()} "
+                    f"BEFORE {operation} ON {table.name} "
+                    f"WHEN NEW.user_id IN (SELECT user_id FROM {_moved.name}) "
+                    f"BEGIN SELECT RAISE({action}); END"
+                )
+
+
+def migrate_shard(shard: int) -> List[str]:
+    "Create the shard's missing tables and return their names."
+    engine = engine_for(shard)
+    existing = set(inspect(engine).get_table_names())
+    missing = [table for table in SHARD_TABLES if table.name not in existing]
+    if missing:
+        if not existing:
+            compaction.enable_incremental_vacuum(engine)
+        _metadata.create_all(bind=engine, tables=missing)
+        first, _ = id_range(shard)
+        with engine.begin() as conn:
+            for table in missing:
+                if table.autoincrement_column is not None and first:
+                    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                                 {"name": table.name, "seq": first})
+        search.install(engine)
+    # Indexes added to tables that already existed, as in database.migrate
+    for index in _metadata.tables[models.Expense.__tablename__].indexes:
+        index.create(bind=engine, checkfirst=True)
+    _install_guards(engine)
+    return [table.name for table in missing]
+
+
+def migrate() -> Dict[str, List[str]]:
+    "Create the global tables in the global database and the others in every shard."
+    existing = set(inspect(global_engine).get_table_names())
+    tables = [models.Base.metadata.tables[name] for name in GLOBAL_TABLES]
+    models.Base.metadata.create_all(bind=global_engine, tables=tables)
+    created = {"global": [table.name for table in tables if table.name not in existing]}
+    for shard, names in fan_out(lambda shard, engine: migrate_shard(shard)).items():
+        created[f"shard {shard}"] = names
+    return created
+
+
+def missing_tables() -> List[str]:
+    "Tables missing from the global database or any shard (read-only check)."
+    missing = [name for name in GLOBAL_TABLES if name not in set(inspect(global_engine).get_table_names())]
+    for shard in range(SHARD_COUNT):
+        existing = set(inspect(engine_for(shard)).get_table_names()) if os.path.exists(shard_path(shard)) else set()
+        missing += [f"{table.name} (shard {shard})" for table in SHARD_TABLES if table.name not in existing]
+    return missing
+
+
+#  Fan-out
+
+def fan_out(job: Callable[[int, Engine], dict], targets: Optional[List[int]] = None,
+            workers: Optional[int] = FAN_OUT_WORKERS) -> Dict[int, dict]:
+    "Run job(shard, engine) on every shard in parallel. Returns {shard: result}."
+    targets = shards() if targets is None else targets
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(targets)), thread_name_prefix="shard") as pool:
+        futures = {shard: pool.submit(job, shard, engine_for(shard)) for shard in targets}
+        return {shard: future.result() for shard, future in futures.items()}
+
+
+def _run_recurring(full: bool) -> Callable[[int, Engine], dict]:
+    def job(shard: int, engine: Engine) -> dict:
+        from ai import recurring
+        with Session(engine) as db:
+            return recurring.run(db, full=full, id_range=id_range(shard))
+    return job
+
+
+def _run_compaction(shard: int, engine: Engine) -> dict:
+    return compaction.run(engine, resident=resident_filter(shard))
+
+
+def _run_cold(shard: int, engine: Engine) -> dict:
+    from database import cold
+    return cold.run(engine, resident=resident_filter(shard))
+
+
+def _run_budget_alerts(shard: int, engine: Engine) -> dict:
+    from database import budget_alerts
+    return budget_alerts.run(engine, resident=resident_filter(shard))
+
+
+def _run_events(shard: int, engine: Engine) -> dict:
+    from database import events
+    return events.prune(engine)
+
+
+def _run_webhooks(shard: int, engine: Engine) -> dict:
+    from database import webhooks
+    return webhooks.prune(engine)
+
+
+def _run_stats(shard: int, engine: Engine) -> dict:
+    from database import stats
+    return {"pairs": stats.rebuild(engine)}
+
+
+JOBS = {
+    "recurring": _run_recurring(full=False),
+    "recurring-full": _run_recurring(full=True),
+    "compaction": _run_compaction,
+    "cold": _run_cold,
+    "stats": _run_stats,
+    "budget-alerts": _run_budget_alerts,
+    "events": _run_events,
+    "webhooks": _run_webhooks,
+}
+
+
+#  Moving users
+
+def _columns(table) -> str:
+    return ", ".join(column.name for column in table.columns)
+
+
+def _copy(conn, table, user_id: int, where: str = "", params: Optional[dict] = None) -> int:
+    "Copy the user's rows of `table` from the attached source into this shard, in chunks. Returns rows copied."
+    names = _columns(table)
+    keys = [column.name for column in table.primary_key.columns]
+    updates = ", ".join(f"{column.name} = excluded.{column.name}" for column in table.columns if column.name not in keys)
+    upsert = f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}" if updates else "ON CONFLICT DO NOTHING"
+    owned = "user_id = :user_id" if "user_id" in table.c else (
+        # Corrections belong to the user through their expenses
+        "expense_id IN (SELECT expense_id FROM source.expenses WHERE user_id = :user_id"
+        " UNION ALL SELECT expense_id FROM source.expenses_archive WHERE user_id = :user_id)"
+    )
+    sequence = table.autoincrement_column is not None
+    copied = after = 0
+    while True:
+        with conn.begin():
+            rowids = conn.execute(
+                text(f"SELECT rowid FROM source.{table.name} WHERE {owned} {where} AND rowid > :after "
+                     f"ORDER BY rowid LIMIT :limit"),
+                {"user_id": user_id, "after": after, "limit": MOVE_CHUNK_SIZE, **(params or {})},
+            ).scalars().all()
+            if not rowids:
+                return copied
+            seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"),
+                               {"name": table.name}).scalar() if sequence else None
+            conn.execute(
+                text(f"INSERT INTO main.{table.name} ({names}) SELECT {names} FROM source.{table.name} "
+                     f"WHERE rowid BETWEEN :first AND :last AND {owned} {where} {upsert}"),
+                {"user_id": user_id, "first": rowids[0], "last": rowids[-1], **(params or {})},
+            )
+            if seq is not None:
+                # Ids from a higher shard's range must not move this shard's sequence into it
+                conn.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"),
+                             {"name": table.name, "seq": seq})
+            copied += len(rowids)
+            after = rowids[-1]
+
+
+def _move_engine(source_path: str, target: int) -> Engine:
+    "Connections to the target shard with the source attached as `source`."
+    engine = _create_engine(shard_path(target), poolclass=NullPool)
+
+    @event.listens_for(engine, "connect")
+    def attach_source(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS source", (source_path,))
+
+    return engine
+
+
+def copy_user(source_path: str, target: int, user_id: int, since: Optional[datetime] = None) -> int:
+    "Copy a user's rows from the database at `source_path` into `target` (only rows changed since `since`, if set)."
+    corrections = models.CategoryCorrection.__table__
+    engine = _move_engine(source_path, target)
+    copied = 0
+    try:
+        with engine.connect() as conn:
+            for table in _USER_TABLES + [corrections]:
+                where, params = "", None
+                if since is not None and table.name in _SMALL_TABLES:
+                    with conn.begin():
+                        conn.execute(text(f"DELETE FROM main.{table.name} WHERE user_id = :user_id"), {"user_id": user_id})
+                elif since is not None:
+                    column = "created_at" if table is corrections else _CHANGED_SINCE[table.name]
+                    where, params = f"AND {column} >= :since", {"since": since}
+                copied += _copy(conn, table, user_id, where, params)
+            if since is not None:
+                # Hot rows deleted from the source since (archived, moved to the cold tier)
+                with conn.begin():
+                    for table in (models.Expense.__table__, models.Budget.__table__):
+                        key = table.primary_key.columns.values()[0].name
+                        conn.execute(text(
+                            f"DELETE FROM main.{table.name} WHERE user_id = :user_id AND {key} NOT IN "
+                            f"(SELECT {key} FROM source.{table.name} WHERE user_id = :user_id)"
+                        ), {"user_id": user_id})
+    finally:
+        engine.dispose()
+    return copied
+
+
+def move_user(user_id: int, target: int, grace: float = MOVE_GRACE_SECONDS) -> dict:
+    "Move a user's rows to `target` while they keep using the app. Returns counters for logging."
+    started = time.perf_counter()
+    source = shard_of(user_id)
+    if source == target:
+        return {"user_id": user_id, "moved": False}
+    migrate_shard(target)
+    target_engine = engine_for(target)
+    with target_engine.begin() as conn:
+        # Moving back to a shard the user left before
+        conn.execute(delete(_moved).where(_moved.c.user_id == user_id))
+    compaction.delete_user_rows(target_engine, user_id, MOVE_CHUNK_SIZE)
+
+    # Bulk copy; `since` is early enough for the clock of the writes in flight
+    since = datetime.utcnow() - timedelta(seconds=1)
+    copied = copy_user(shard_path(source), target, user_id)
+
+    # Changes since the bulk copy, under the source's write lock, then the flip
+    with engine_for(source).connect() as lock:
+        lock.exec_driver_sql("BEGIN IMMEDIATE")
+        locked = time.perf_counter()
+        try:
+            changed = copy_user(shard_path(source), target, user_id, since=since)
+            now = datetime.utcnow()
+            lock.execute(insert(_moved).values(user_id=user_id, shard=target, moved_at=now)
+                         .on_conflict_do_update(index_elements=["user_id"], set_={"shard": target, "moved_at": now}))
+            lock.execute(insert(_directory).values(user_id=user_id, shard=target, updated_at=now)
+                         .on_conflict_do_update(index_elements=["user_id"], set_={"shard": target, "updated_at": now}))
+            lock.commit()
+        except BaseException:
+            lock.rollback()
+            raise
+        held = time.perf_counter() - locked
+
+    # Requests routed before the flip are done (or refused) by now
+    time.sleep(grace)
+    removed = compaction.delete_user_rows(engine_for(source), user_id)
+    return {
+        "user_id": user_id,
+        "moved": True,
+        "source": source,
+        "target": target,
+        "rows_copied": copied,
+        "rows_changed": changed,
+        "rows_removed": removed,
+        "lock_ms": round(held * 1000, 1),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def rebalance(count: int = 0, grace: float = MOVE_GRACE_SECONDS) -> List[dict]:
+    "Move every pinned user whose shard isn't user_id % count (default SHARD_COUNT)."
+    count = count or SHARD_COUNT
+    return [move_user(user_id, home(user_id, count), grace)
+            for user_id, shard in sorted(directory().items()) if shard != home(user_id, count)]
+
+
+def import_unsharded(source_path: str) -> dict:
+    "Copy every user's rows from an unsharded database into the shards (before the app runs sharded)."
+    source = create_engine(f"sqlite:///{source_path}")
+    with source.connect() as conn:
+        user_ids = conn.execute(select(_users.c.user_id).order_by(_users.c.user_id)).scalars().all()
+        highest = {table.name: conn.execute(text(f"SELECT max(rowid) FROM {table.name}")).scalar() or 0
+                   for table in SHARD_TABLES if table.autoincrement_column is not None}
+    source.dispose()
+    for shard in shards():
+        migrate_shard(shard)
+    # The imported ids are all in shard 0's range: its new ids start above every one of them
+    with engine_for(0).begin() as conn:
+        for name, seq in highest.items():
+            conn.execute(text("UPDATE sqlite_sequence SET seq = max(seq, :seq) WHERE name = :name"), {"name": name, "seq": seq})
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                              "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                         {"name": name, "seq": seq})
+    rows = 0
+    for user_id in user_ids:
+        rows += copy_user(source_path, shard_of(user_id), user_id)
+    return {"users": len(user_ids), "rows": rows}
+
+
+def status() -> Dict[int, dict]:
+    placed = directory()
+
+    def count(shard: int, engine: Engine) -> dict:
+        with engine.connect() as conn:
+            expenses = conn.execute(select(func.count()).select_from(models.Expense.__table__)).scalar()
+        return {
+            "pinned_users": sum(1 for value in placed.values() if value == shard),
+            "expenses": expenses,
+            "bytes": os.path.getsize(shard_path(shard)),
+        }
+
+    return fan_out(count, [shard for shard in shards() if os.path.exists(shard_path(shard))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded storage: schema, moves and jobs across shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate", help="create missing tables in the global database and every shard")
+    sub.add_parser("status", help="pinned users, expenses and file size per shard")
+    move_parser = sub.add_parser("move-user", help="move one user's rows to another shard")
+    move_parser.add_argument("user_id", type=int)
+    move_parser.add_argument("shard", type=int)
+    rebalance_parser = sub.add_parser("rebalance", help="move users to user_id %% count")
+    rebalance_parser.add_argument("--count", type=int, default=0, help="shard count to balance for (default SHARD_COUNT)")
+    run_parser = sub.add_parser("run", help="run a batch job on every shard in parallel")
+    run_parser.add_argument("job", choices=sorted(JOBS))
+    import_parser = sub.add_parser("import", help="copy an unsharded database's rows into the shards")
+    import_parser.add_argument("--source", default=global_engine.url.database, help="unsharded SQLite file")
+    args = parser.parse_args()
+
+    if not enabled():
+        parser.exit(1, "set SHARD_COUNT to the number of shards first\n")
+    if args.command == "migrate":
+        result = migrate()
+    elif args.command == "status":
+        result = status()
+    elif args.command == "move-user":
+        result = move_user(args.user_id, args.shard)
+    elif args.command == "rebalance":
+        result = {move["user_id"]: move for move in rebalance(args.count)}
+    elif args.command == "import":
+        result = import_unsharded(args.source)
+    else:
+        result = fan_out(JOBS[args.job])
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
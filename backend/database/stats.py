@@ -0,0 +1,244 @@
+import argparse
+import math
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import models
+
+"""
+Running amount statistics per (user, category), kept up to date by the
+expense writes in crud and read by the anomaly checks.
+
+Each pair stores count, mean and M2 (Welford), so the variance is M2 /
+(count - 1), plus a quantile sketch: amounts are counted in logarithmic
+buckets `ceil(log(amount) / log(GAMMA))`, so any quantile read back is
+within SKETCH_ACCURACY (2%) of the true value. A user with 50 distinct
+price levels in a category stores about 50 bucket rows, whatever the
+number of expenses.
+
+Writes are merges of a batch (n, mean, M2, buckets) into the stored row
+(Chan et al.'s parallel update), done in one upsert so concurrent writers
+don't lose updates. Removing an expense merges it with n = -1, which is the
+exact inverse of adding it, so update and delete are O(1) as well.
+
+The table is filled from existing expenses when `python -m database.migrate`
+creates it; `python -m database.stats rebuild` recomputes it from scratch.
+"""
+
+SKETCH_ACCURACY = 0.02
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+MIN_AMOUNT = 0.01  # smaller amounts (and refunds) share the lowest bucket
+# Fewer expenses than this in a category and nothing is flagged
+MIN_SAMPLES = 5
+REBUILD_BATCH_SIZE = 50_000
+
+_stats = models.CategoryStat.__table__
+_buckets = models.CategoryStatBucket.__table__
+
+
+#  Sketch
+
+def bucket_of(amount: float) -> int:
+    return math.ceil(math.log(max(amount, MIN_AMOUNT)) / _LOG_GAMMA)
+
+
+def bucket_value(bucket: int) -> float:
+    "Representative amount of a bucket (relative error at most SKETCH_ACCURACY)."
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+class CategoryStats:
+    """Stored statistics of one (user, category) pair."""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0, buckets: Optional[Dict[int, int]] = None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.buckets = dict(sorted((buckets or {}).items()))
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = sum(self.buckets.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for bucket, n in self.buckets.items():
+            seen += n
+            if seen > rank:
+                return bucket_value(bucket)
+        return bucket_value(bucket)
+
+    def rank(self, amount: float) -> float:
+        "Fraction of the amounts in a lower bucket than `amount`."
+        total = sum(self.buckets.values())
+        target = bucket_of(amount)
+        return sum(n for bucket, n in self.buckets.items() if bucket < target) / total if total else 0.0
+
+    def bounds(self) -> Optional[Tuple[float, float]]:
+        "(medium, high) anomaly thresholds: Q3 + 1.5 and 3 IQR, or None with too few expenses."
+        if self.count < MIN_SAMPLES:
+            return None
+        q1, q3 = self.quantile(0.25), self.quantile(0.75)
+        iqr = q3 - q1
+        if iqr <= 0:
+            return None
+        return q3 + 1.5 * iqr, q3 + 3 * iqr
+
+    def assess(self, amount: float) -> dict:
+        "How unusual `amount` is for this category (before it is added)."
+        bounds = self.bounds()
+        is_anomaly = bool(bounds) and amount > bounds[0]
+        return {
+            "is_anomaly": is_anomaly,
+            "severity": ("high" if amount > bounds[1] else "medium") if is_anomaly else None,
+            "category_count": self.count,
+            "category_average": round(self.mean, 2),
+            "deviation_percent": round((amount - self.mean) / self.mean * 100, 1) if self.mean > 0 else 0.0,
+            "z_score": round((amount - self.mean) / self.stdev, 2) if self.stdev else None,
+            "percentile": round(self.rank(amount) * 100, 1),
+            "upper_bound": round(bounds[0], 2) if bounds else None,
+        }
+
+
+#  Reads
+
+def get_stats(db: Session, user_id: int, category_id: Optional[int] = None) -> Dict[int, CategoryStats]:
+    "Statistics of a user's categories (or one category), keyed by category_id."
+    stats_stmt = select(_stats.c.category_id, _stats.c.count, _stats.c.mean, _stats.c.m2).where(_stats.c.user_id == user_id)
+    buckets_stmt = select(_buckets.c.category_id, _buckets.c.bucket, _buckets.c.count).where(_buckets.c.user_id == user_id)
+    if category_id is not None:
+        stats_stmt = stats_stmt.where(_stats.c.category_id == category_id)
+        buckets_stmt = buckets_stmt.where(_buckets.c.category_id == category_id)
+    buckets = defaultdict(dict)
+    for cat_id, bucket, n in db.execute(buckets_stmt):
+        buckets[cat_id][bucket] = n
+    return {
+        cat_id: CategoryStats(count, mean, m2, buckets.get(cat_id))
+        for cat_id, count, mean, m2 in db.execute(stats_stmt)
+        if count > 0
+    }
+
+
+#  Writes (flushed with the caller's transaction, not committed)
+
+def merge(db: Session, user_id: int, category_id: int, n: int, mean: float, m2: float, buckets: Dict[int, int]) -> None:
+    "Merge a batch of n amounts (negative n removes them) into the stored statistics."
+    if n == 0:
+        return
+    total = _stats.c.count + n
+    delta = mean - _stats.c.mean
+    merged = {
+        "count": total,
+        "mean": case((total > 0, _stats.c.mean + delta * n / total), else_=0.0),
+        # Products keep the float operand first, so SQLite doesn't divide integers
+        "m2": case((total > 0, _stats.c.m2 + m2 + delta * delta * _stats.c.count * n / total), else_=0.0),
+    }
+    if n > 0:
+        db.execute(
+            insert(_stats).values(user_id=user_id, category_id=category_id, count=n, mean=mean, m2=m2)
+            .on_conflict_do_update(index_elements=[_stats.c.user_id, _stats.c.category_id], set_=merged)
+        )
+    else:
+        db.execute(update(_stats).where(_stats.c.user_id == user_id, _stats.c.category_id == category_id).values(**merged))
+
+    rows = [{"user_id": user_id, "category_id": category_id, "bucket": bucket, "count": count}
+            for bucket, count in buckets.items() if count]
+    if rows:
+        stmt = insert(_buckets)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[_buckets.c.user_id, _buckets.c.category_id, _buckets.c.bucket],
+            set_={"count": _buckets.c.count + stmt.excluded.count},
+        ), rows)
+    if n < 0:
+        db.execute(delete(_buckets).where(
+            _buckets.c.user_id == user_id, _buckets.c.category_id == category_id, _buckets.c.count <= 0,
+        ))
+
+
+def add_amount(db: Session, user_id: int, category_id: int, amount: float, weight: int = 1) -> None:
+    "Add (weight=1) or remove (weight=-1) one amount."
+    merge(db, user_id, category_id, weight, amount, 0.0, {bucket_of(amount): weight})
+
+
+def add_amounts(db: Session, user_id: int, amounts: Iterable[Tuple[int, float]], weight: int = 1) -> None:
+    "Add (weight=1) or remove (weight=-1) (category_id, amount) pairs, one merge per category."
+    for category_id, accumulator in _accumulate(amounts).items():
+        n, mean, m2, buckets = accumulator.summary()
+        # Merging (-n, mean, -M2) is the exact inverse of merging (n, mean, M2)
+        merge(db, user_id, category_id, weight * n, mean, weight * m2,
+              {bucket: weight * count for bucket, count in buckets.items()})
+
+
+class _Accumulator:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.buckets = Counter()
+
+    def add(self, amount: float) -> None:
+        self.n += 1
+        delta = amount - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (amount - self.mean)
+        self.buckets[bucket_of(amount)] += 1
+
+    def summary(self):
+        return self.n, self.mean, self.m2, self.buckets
+
+
+def _accumulate(pairs: Iterable[Tuple[object, float]]) -> Dict[object, _Accumulator]:
+    accumulators = defaultdict(_Accumulator)
+    for key, amount in pairs:
+        accumulators[key].add(float(amount))
+    return accumulators
+
+
+def rebuild(engine: Engine) -> int:
+    "Recompute every pair from the live expenses. Returns the number of pairs."
+    with Session(engine) as db:
+        rows = db.execute(
+            select(models.Expense.user_id, models.Expense.category_id, models.Expense.amount)
+            .where(models.Expense.deleted_at.is_(None))
+            .execution_options(yield_per=REBUILD_BATCH_SIZE)
+        )
+        accumulators = _accumulate(((user_id, category_id), amount) for user_id, category_id, amount in rows)
+        db.execute(delete(_buckets))
+        db.execute(delete(_stats))
+        stats_rows: List[dict] = []
+        bucket_rows: List[dict] = []
+        for (user_id, category_id), accumulator in accumulators.items():
+            stats_rows.append({"user_id": user_id, "category_id": category_id, "count": accumulator.n,
+                               "mean": accumulator.mean, "m2": accumulator.m2})
+            bucket_rows += [{"user_id": user_id, "category_id": category_id, "bucket": bucket, "count": count}
+                            for bucket, count in accumulator.buckets.items()]
+        if stats_rows:
+            db.execute(insert(_stats), stats_rows)
+        if bucket_rows:
+            db.execute(insert(_buckets), bucket_rows)
+        db.commit()
+    return len(accumulators)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-category expense statistics")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="recompute the statistics from the expenses table")
+    parser.parse_args()
+
+    from database.database import engine
+    print(f"rebuilt statistics for {rebuild(engine)} (user, category) pairs")
+
+
+if __name__ == "__main__":
+    main()
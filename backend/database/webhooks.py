@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import models
+
+"""
+The outbound webhook queue: endpoints users register to receive their
+budget events (database/events.py) as signed HTTP POSTs, sent by
+webhook_delivery.py.
+
+  webhooks               the endpoint, its signing secret and the event kinds it wants
+  webhook_deliveries     one row per (webhook, event) still to send: attempts, when
+                         the next one is due and the lease of the worker sending it
+  webhook_dead_letters   deliveries given up on after MAX_ATTEMPTS, or because the
+                         endpoint answered 410 Gone; a user can queue them again
+
+Deliveries are queued in the transaction of the expense write that caused
+the event (budget_alerts.apply_changes), so a delivery exists exactly when
+its write committed, even if the process dies right after. Workers claim
+due deliveries in batches with an UPDATE that leases them, at most
+PER_WEBHOOK of one webhook and only of webhooks with none in flight, so a
+slow endpoint holds up its own deliveries and nobody else's. A worker that
+dies leaves leases that expire after LEASE_SECONDS. Sending is therefore at
+least once: receivers should ignore a delivery id they have already seen.
+
+    python -m database.webhooks status
+    python -m database.webhooks retry DELIVERY_ID
+    python -m database.webhooks prune
+"""
+
+KINDS = ("budget_alert", "budget_status")
+MAX_WEBHOOKS_PER_USER = 10
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "10"))
+LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "120"))
+PER_WEBHOOK = int(os.getenv("WEBHOOK_PER_WEBHOOK_BATCH", "25"))
+DEAD_LETTER_RETENTION_DAYS = float(os.getenv("WEBHOOK_DEAD_LETTER_DAYS", "30"))
+
+_hooks = models.Webhook.__table__
+_deliveries = models.WebhookDelivery.__table__
+_dead = models.WebhookDeadLetter.__table__
+
+
+def _json(payload: dict) -> str:
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def create(db: Session, user_id: int, url: str, kinds: Iterable[str]) -> models.Webhook:
+    "Register an endpoint with a new signing secret."
+    webhook = models.Webhook(user_id=user_id, url=url, secret=secrets.token_hex(32), events=",".join(sorted(set(kinds))))
+    db.add(webhook)
+    db.commit()
+    db.refresh(webhook)
+    return webhook
+
+
+def user_webhooks(db: Session, user_id: int) -> List[models.Webhook]:
+    return db.query(models.Webhook).filter(models.Webhook.user_id == user_id) \
+        .order_by(models.Webhook.webhook_id).all()
+
+
+def get_webhook(db: Session, webhook_id: int) -> Optional[models.Webhook]:
+    return db.query(models.Webhook).filter(models.Webhook.webhook_id == webhook_id).first()
+
+
+def delete_webhook(db: Session, webhook_id: int) -> None:
+    "Remove an endpoint with its queued and dead deliveries."
+    db.execute(delete(_deliveries).where(_deliveries.c.webhook_id == webhook_id))
+    db.execute(delete(_dead).where(_dead.c.webhook_id == webhook_id))
+    db.execute(delete(_hooks).where(_hooks.c.webhook_id == webhook_id))
+    db.commit()
+
+
+def enqueue(db: Session, user_id: int, recorded: List[Tuple[int, str, str]]) -> int:
+    """Queue recorded (event_id, kind, payload JSON) events for the user's active webhooks that
+    subscribe to their kind, in the session's transaction. Returns the number of deliveries."""
+    if not recorded:
+        return 0
+    hooks = db.execute(select(_hooks.c.webhook_id, _hooks.c.events)
+                       .where(_hooks.c.user_id == user_id, _hooks.c.is_active == 1)).all()
+    now = datetime.utcnow()
+    rows = [
+        {"webhook_id": hook.webhook_id, "user_id": user_id, "event_id": event_id, "kind": kind, "payload": payload,
+         "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for hook in hooks
+        for event_id, kind, payload in recorded
+        if kind in hook.events.split(",")
+    ]
+    if rows:
+        db.execute(insert(_deliveries), rows)
+    return len(rows)
+
+
+def ping(db: Session, webhook: models.Webhook) -> int:
+    "Queue a test delivery to an endpoint, whatever kinds it subscribes to. Returns the delivery id."
+    now = datetime.utcnow()
+    delivery_id = db.execute(insert(_deliveries).returning(_deliveries.c.delivery_id), {
+        "webhook_id": webhook.webhook_id, "user_id": webhook.user_id, "event_id": None, "kind": "ping",
+        "payload": _json({"webhook_id": webhook.webhook_id}), "attempts": 0, "next_attempt_at": now, "created_at": now,
+    }).scalar_one()
+    db.commit()
+    return delivery_id
+
+
+def claim(engine: Engine, owner: str, limit: int, per_webhook: int = PER_WEBHOOK,
+          lease_seconds: float = LEASE_SECONDS, now: Optional[datetime] = None) -> List[dict]:
+    """Lease up to `limit` due deliveries to `owner`, oldest first, each with its webhook's
+    url and secret. Webhooks with a delivery leased already are skipped."""
+    now = now or datetime.utcnow()
+    busy = _deliveries.alias("busy")
+    due = select(
+        _deliveries.c.delivery_id, _deliveries.c.next_attempt_at,
+        func.row_number().over(partition_by=_deliveries.c.webhook_id,
+                               order_by=(_deliveries.c.next_attempt_at, _deliveries.c.delivery_id)).label("position"),
+    ).where(
+        _deliveries.c.next_attempt_at <= now,
+        or_(_deliveries.c.leased_until.is_(None), _deliveries.c.leased_until < now),
+        _deliveries.c.webhook_id.not_in(select(busy.c.webhook_id).where(busy.c.leased_until >= now)),
+        _deliveries.c.webhook_id.in_(select(_hooks.c.webhook_id).where(_hooks.c.is_active == 1)),
+    ).subquery()
+    chosen = select(due.c.delivery_id).where(due.c.position <= per_webhook) \
+        .order_by(due.c.next_attempt_at, due.c.delivery_id).limit(limit)
+    with engine.begin() as conn:
+        claimed = conn.execute(
+            update(_deliveries).where(_deliveries.c.delivery_id.in_(chosen))
+            .values(lease_owner=owner, leased_until=now + timedelta(seconds=lease_seconds))
+            .returning(_deliveries.c.delivery_id, _deliveries.c.webhook_id, _deliveries.c.event_id,
+                       _deliveries.c.kind, _deliveries.c.payload, _deliveries.c.attempts, _deliveries.c.created_at)
+        ).all()
+        if not claimed:
+            return []
+        hooks = {row.webhook_id: row for row in conn.execute(
+            select(_hooks.c.webhook_id, _hooks.c.url, _hooks.c.secret)
+            .where(_hooks.c.webhook_id.in_({row.webhook_id for row in claimed}))
+        )}
+    return [
+        {**row._asdict(), "url": hooks[row.webhook_id].url, "secret": hooks[row.webhook_id].secret}
+        for row in sorted(claimed, key=lambda row: row.delivery_id)
+    ]
+
+
+def next_due(engine: Engine) -> Optional[datetime]:
+    "When the earliest queued delivery is due, None when the queue is empty."
+    with engine.connect() as conn:
+        return conn.execute(select(func.min(_deliveries.c.next_attempt_at))).scalar()
+
+
+def _bury(conn, condition, now: datetime) -> int:
+    "Move the deliveries matching `condition` to the dead letters."
+    columns = [column.name for column in _dead.c if column.name != "failed_at"]
+    conn.execute(insert(_dead).from_select(
+        columns + ["failed_at"],
+        select(*(_deliveries.c[name] for name in columns), bindparam("failed_at", now)).where(condition),
+    ))
+    return conn.execute(delete(_deliveries).where(condition)).rowcount
+
+
+def finish(engine: Engine, owner: str, results: List[dict], now: Optional[datetime] = None) -> dict:
+    """Record the outcome of a claimed batch in one transaction. Each result has the
+    delivery_id, webhook_id, outcome (delivered, retry, dead or gone), status, error and,
+    for retries, retry_at. Deliveries whose lease passed to another worker are left alone."""
+    now = now or datetime.utcnow()
+    counts = {"delivered": 0, "retry": 0, "dead": 0, "gone": 0}
+    mine = and_(_deliveries.c.delivery_id == bindparam("b_delivery_id"), _deliveries.c.lease_owner == owner)
+    with engine.begin() as conn:
+        delivered = [{"b_delivery_id": r["delivery_id"]} for r in results if r["outcome"] == "delivered"]
+        if delivered:
+            counts["delivered"] = conn.execute(delete(_deliveries).where(mine), delivered).rowcount
+        failed = [r for r in results if r["outcome"] != "delivered"]
+        if failed:
+            conn.execute(update(_deliveries).where(mine).values(
+                attempts=_deliveries.c.attempts + 1, leased_until=None,
+                next_attempt_at=bindparam("b_retry_at"), last_status=bindparam("b_status"), last_error=bindparam("b_error"),
+            ), [
+                {"b_delivery_id": r["delivery_id"], "b_retry_at": r.get("retry_at") or now,
+                 "b_status": r["status"], "b_error": r["error"]}
+                for r in failed
+            ])
+            counts["retry"] = sum(1 for r in failed if r["outcome"] == "retry")
+        dead = [r["delivery_id"] for r in failed if r["outcome"] == "dead"]
+        if dead:
+            counts["dead"] = _bury(conn, and_(_deliveries.c.delivery_id.in_(dead), _deliveries.c.lease_owner == owner), now)
+        gone = {r["webhook_id"] for r in failed if r["outcome"] == "gone"}
+        if gone:
+            # The endpoint asked to be removed: stop sending to it until the user retries a delivery
+            conn.execute(update(_hooks).where(_hooks.c.webhook_id.in_(gone)).values(is_active=0))
+            counts["gone"] = _bury(conn, _deliveries.c.webhook_id.in_(gone), now)
+        latest = {r["webhook_id"]: r["status"] for r in results}
+        if latest:
+            conn.execute(update(_hooks).where(_hooks.c.webhook_id == bindparam("b_webhook_id")).values(
+                last_delivery_at=now, last_status=bindparam("b_status"),
+            ), [{"b_webhook_id": webhook_id, "b_status": status} for webhook_id, status in latest.items()])
+    return counts
+
+
+def dead_letters(db: Session, user_id: int, limit: int = 100) -> list:
+    "The user's dead deliveries, newest first."
+    return db.execute(select(_dead).where(_dead.c.user_id == user_id)
+                      .order_by(_dead.c.failed_at.desc(), _dead.c.delivery_id.desc()).limit(limit)).all()
+
+
+def get_dead_letter(db: Session, delivery_id: int):
+    return db.execute(select(_dead).where(_dead.c.delivery_id == delivery_id)).first()
+
+
+def retry(db: Session, delivery_id: int) -> bool:
+    "Queue a dead delivery again from its first attempt, reactivating its webhook. False when there is none."
+    row = get_dead_letter(db, delivery_id)
+    if row is None:
+        return False
+    now = datetime.utcnow()
+    db.execute(insert(_deliveries), {
+        **{name: getattr(row, name) for name in ("delivery_id", "webhook_id", "user_id", "event_id", "kind",
+                                                 "payload", "created_at")},
+        "attempts": 0, "next_attempt_at": now,
+    })
+    db.execute(delete(_dead).where(_dead.c.delivery_id == delivery_id))
+    db.execute(update(_hooks).where(_hooks.c.webhook_id == row.webhook_id).values(is_active=1))
+    db.commit()
+    return True
+
+
+def status(engine: Engine, now: Optional[datetime] = None) -> dict:
+    "Queue depth for logging and the CLI."
+    now = now or datetime.utcnow()
+    with engine.connect() as conn:
+        queued, due, leased, oldest = conn.execute(select(
+            func.count(),
+            func.count().filter(_deliveries.c.next_attempt_at <= now),
+            func.count().filter(_deliveries.c.leased_until >= now),
+            func.min(_deliveries.c.created_at),
+        )).one()
+        dead = conn.execute(select(func.count()).select_from(_dead)).scalar()
+    return {
+        "queued": queued, "due": due, "leased": leased, "dead_letters": dead,
+        "oldest_queued_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
+
+
+def prune(engine: Engine, retention_days: float = DEAD_LETTER_RETENTION_DAYS, now: Optional[datetime] = None) -> dict:
+    "Delete dead letters older than the retention. Returns counters for logging."
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    with engine.begin() as conn:
+        deleted = conn.execute(delete(_dead).where(_dead.c.failed_at < cutoff)).rowcount
+    return {"dead_letters": deleted, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the webhook delivery queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="queued, due, leased and dead deliveries")
+    retry_parser = sub.add_parser("retry", help="queue a dead delivery again")
+    retry_parser.add_argument("delivery_id", type=int)
+    prune_parser = sub.add_parser("prune", help="delete dead letters older than the retention")
+    prune_parser.add_argument("--days", type=float, default=DEAD_LETTER_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    from database import sharding
+    from database.database import engine, SessionLocal
+    if args.command == "retry":
+        # Ids keep their shard's range when a user moves, so look in every shard
+        targets = [lambda shard=shard: sharding.session(shard) for shard in sharding.shards()] \
+            if sharding.enabled() else [SessionLocal]
+        for make_session in targets:
+            with make_session() as db:
+                if retry(db, args.delivery_id):
+                    print("queued")
+                    return
+        print(f"no dead delivery {args.delivery_id}")
+        return
+    run = status if args.command == "status" else lambda e: prune(e, args.days)
+    engines = {f"shard {shard}": sharding.engine_for(shard) for shard in sharding.shards()} \
+        if sharding.enabled() else {"database": engine}
+    for name, target in engines.items():
+        print(f"{name}: " + ", ".join(f"{key} {value}" for key, value in run(target).items()))
+
+
+if __name__ == "__main__":
+    main()
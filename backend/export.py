@@ -0,0 +1,170 @@
+import csv
+import importlib.util
+import io
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence
+
+from sqlalchemy.engine import Row
+
+import serialization
+
+"""
+Streaming encoders for GET /expenses/export.
+
+Each encoder takes batches of expense rows (see reads.iter_expense_batches)
+and yields bytes as soon as a batch is encoded, so memory use depends on the
+batch size and not on how long the user's history is.
+"""
+
+EXPORT_COLUMNS = (
+    "expense_id",
+    "expense_date",
+    "category_id",
+    "category_name",
+    "amount",
+    "description",
+    "created_at",
+    "updated_at",
+)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _export_record(row: Row, category_names: Dict[int, str]) -> dict:
+    return {
+        "expense_id": row.expense_id,
+        "expense_date": row.expense_date,
+        "category_id": row.category_id,
+        "category_name": category_names.get(row.category_id),
+        "amount": row.amount,
+        "description": row.description,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
+
+
+def iter_csv(batches: Iterable[Sequence[Row]], category_names: Dict[int, str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for row in batch:
+            record = _export_record(row, category_names)
+            writer.writerow([
+                value.isoformat() if hasattr(value, "isoformat") else value
+                for value in record.values()
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(batches: Iterable[Sequence[Row]], category_names: Dict[int, str]) -> Iterator[bytes]:
+    for batch in batches:
+        yield b"".join(serialization.dumps(_export_record(row, category_names)) + b"\n" for row in batch)
+
+
+class _ChunkSink:
+    """
+    Write-only file object for ParquetWriter. Written bytes are handed out
+    by drain() while tell() keeps counting from the start of the file, which
+    the writer needs for the offsets in the footer.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _pyarrow():
+    # pyarrow is only needed for Parquet exports and takes ~60 ms to import,
+    # so it is loaded on the first Parquet export instead of at startup
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    return pa, pq
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ("expense_id", pa.int64()),
+        ("expense_date", pa.timestamp("us")),
+        ("category_id", pa.int64()),
+        ("category_name", pa.string()),
+        ("amount", pa.float64()),
+        ("description", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ])
+
+
+def iter_parquet(batches: Iterable[Sequence[Row]], category_names: Dict[int, str]) -> Iterator[bytes]:
+    """
+    Write one Parquet row group per batch. Each batch is transposed into
+    column arrays before it is written, then the finished bytes are yielded.
+    """
+    pa, pq = _pyarrow()
+    schema = _parquet_schema(pa)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for batch in batches:
+            if not batch:
+                continue
+            columns = {
+                "expense_id": [row.expense_id for row in batch],
+                "expense_date": [row.expense_date for row in batch],
+                "category_id": [row.category_id for row in batch],
+                "category_name": [category_names.get(row.category_id) for row in batch],
+                "amount": [row.amount for row in batch],
+                "description": [row.description for row in batch],
+                "created_at": [row.created_at for row in batch],
+                "updated_at": [row.updated_at for row in batch],
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+EXPORTERS: Dict[str, Callable[[Iterable[Sequence[Row]], Dict[int, str]], Iterator[bytes]]] = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+    "parquet": iter_parquet,
+}
+
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
@@ -1,53 +1,130 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, status
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Query, status
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime
-from typing import List
+from typing import List, Literal, Optional
 import os
 from dotenv import load_dotenv
 
 # Rate limiting
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from fastapi import Request
+from starlette.concurrency import run_in_threadpool
 
 
 import auth  # Import the module, not individual functions yet
-from database import models, database, schemas, crud
+from database import models, database, schemas, crud, reads, search, sharding, analytics, budget_alerts, webhooks
 from database.database import engine, SessionLocal
-
-from ai.processor import process_ai_query
-from ai.intents import parse_intent_from_query
+from database.migrate import migrate
+from rate_limit import limiter
+from serialization import FastJSONResponse, iter_json_array, iter_ndjson
+import export
+import warmup
+import scheduler
+import sse
+import webhook_delivery
+from database.category_cache import catalogue
+from monitoring import metrics
+from monitoring.sql import install_query_hooks, add_observer
+from monitoring.slow_queries import slow_query_log
+from monitoring.query_counter import NPlusOneMiddleware, N_PLUS_ONE_DETECTION
+from monitoring import profiling
+from monitoring.recorder import RecordingMiddleware, request_recorder
+from ai.categorizer import categorizer, CATEGORIZER_MIN_CONFIDENCE
+from ai import recurring
+
+# Only the request/response models are imported here; the processor and
+# intent parser load on the first AI query (or during warmup)
 from ai.schemas import AIRequest, AIResponse, ParsedIntent, TimeRange, IntentType, QueryType
 from fastapi.middleware.cors import CORSMiddleware
 
-# Define the FastAPI app
-app = FastAPI(title="SpendSense AI")
+# Create missing tables on startup (local development only, see database/migrate.py)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
+# Largest batch accepted by /expenses/import and /expenses/categorize
+EXPENSE_IMPORT_MAX_ROWS = int(os.getenv("EXPENSE_IMPORT_MAX_ROWS", "10000"))
+
+router = APIRouter()
 
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    metrics.RATE_LIMIT_REJECTIONS.inc(metrics.route_label(request.scope))
+    return _rate_limit_exceeded_handler(request, exc)
 
-# CORS config
-origins = [
-    "http://localhost:5173",
-    "http://127.0.0.1:5173",
-    "*",
-]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        if sharding.enabled():
+            sharding.migrate()
+        else:
+            migrate(engine)
+    warmup.start()
+    stop_scheduler = scheduler.start()
+    stop_webhooks = webhook_delivery.start()
+    yield
+    if stop_scheduler:
+        stop_scheduler()
+    if stop_webhooks:
+        await stop_webhooks()
+
+# App factory: `uvicorn mainmenu:app` or `uvicorn --factory mainmenu:create_app`.
+# Nothing here touches the database, schema changes live in database/migrate.py
+def create_app() -> FastAPI:
+    # routes= reuses the APIRoute objects built at import; include_router
+    # would rebuild every route's dependency and response models again
+    app = FastAPI(title="SpendSense AI", lifespan=lifespan, routes=router.routes)
+
+    # Rate limiter (counters shared by all workers, see rate_limit.py)
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+
+    # Metrics (GET /metrics)
+    app.add_middleware(metrics.MetricsMiddleware)
+    install_query_hooks(engine)
+    for shard in range(sharding.SHARD_COUNT):
+        install_query_hooks(sharding.engine_for(shard))
+    add_observer(metrics.record_query)
+    metrics.register_pool_gauges(engine)
+    metrics.register_cache_gauges("category", catalogue)
+
+    # On-demand profiling of single requests (X-Profile: <admin token>)
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+    # N+1 query detection for development (N_PLUS_ONE_DETECTION=log|raise)
+    if N_PLUS_ONE_DETECTION in ("log", "raise"):
+        app.add_middleware(NPlusOneMiddleware, mode=N_PLUS_ONE_DETECTION)
+
+    # Anonymized request recording for benchmarks/replay.py (opt-in with REQUEST_RECORDING_PATH)
+    if request_recorder is not None:
+        app.add_middleware(RecordingMiddleware, recorder=request_recorder)
+
+    # Slow-query log (opt-in with SLOW_QUERY_LOG_MS)
+    if slow_query_log is not None:
+        add_observer(slow_query_log)
+
+    # CORS config
+    origins = [
+        "http://localhost:5173",
+        "http://127.0.0.1:5173",
+        "*",
+    ]
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    # Optional gzip compression for large responses (RESPONSE_COMPRESSION=1)
+    if os.getenv("RESPONSE_COMPRESSION", "0") == "1":
+        app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024")))
 
-# Create all tables
-models.Base.metadata.create_all(bind=engine)
+    return app
 
 # Dependency: get DB session
 def get_db():
@@ -57,13 +134,54 @@ def get_db():
     finally:
         db.close()
 
+def _request_shard(request: Request, body_user_id: Optional[int]) -> int:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    payload = auth.decode_access_token(token) if scheme.lower() == "bearer" and token else None
+    email = payload.get("sub") if payload else None
+    body_user_id = int(body_user_id) if body_user_id is not None and str(body_user_id).isdigit() else None
+    if email and body_user_id is not None and sharding.user_id_of(email) != body_user_id:
+        # The row would be written for the body's user in the token user's shard
+        raise HTTPException(status_code=403, detail="Not authorized")
+    user_id = request.path_params.get("user_id") or body_user_id
+    expense_id = request.path_params.get("expense_id")
+    return sharding.resolve(
+        user_id=int(user_id) if user_id is not None and str(user_id).isdigit() else None,
+        email=email,
+        expense_id=int(expense_id) if expense_id is not None and str(expense_id).isdigit() else None,
+    )
+
+# Sharded mode (SHARD_COUNT, database/sharding.py): the session is bound to the
+# shard of the request's user; a user_id in the body must be the token's user
+async def get_sharded_db(request: Request):
+    body_user_id = None
+    if request.headers.get("content-type", "").startswith("application/json") \
+            and "user_id" not in request.path_params:
+        try:
+            body = await request.json()
+            body_user_id = body.get("user_id") if isinstance(body, dict) else None
+        except ValueError:
+            pass
+    db = sharding.session(await run_in_threadpool(_request_shard, request, body_user_id))
+    try:
+        yield db
+    finally:
+        db.close()
+
+if sharding.enabled():
+    get_db = get_sharded_db
+
+# After an expense or budget write: this worker's event streams and webhook deliveries go out now, not at their next poll
+def _budgets_changed():
+    sse.broker.notify()
+    webhook_delivery.deliverer.notify()
+
 # root endpoint
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Welcome to SpendSense AI, your personal AI powered expense tracker!"}
 
 #  USERS 
-@app.post("/users", response_model=schemas.UserResponse)
+@router.post("/users", response_model=schemas.UserResponse)
 @limiter.limit("3/minute")  # Rate limit: 3 signups per minute
 def create_user(request: Request, user: schemas.UserCreate, db: Session = Depends(get_db)):
     auth.validate_email(user.email)
@@ -75,7 +193,7 @@ def create_user(request: Request, user: schemas.UserCreate, db: Session = Depend
     return crud.create_user(db, user.name, user.email, user.password)
 
 
-@app.post("/users/login")
+@router.post("/users/login")
 @limiter.limit("5/minute")  # Rate limit: 5 login attempts per minute
 def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = crud.verify_user_credentials(db, form_data.username, form_data.password)
@@ -88,7 +206,7 @@ def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.put("/users/{user_id}", response_model=schemas.UserResponse)
+@router.put("/users/{user_id}", response_model=schemas.UserResponse)
 def update_user_endpoint(user_id: int, user_update: schemas.UserCreate, db: Session = Depends(get_db)):
     updated_user = crud.update_user(db, user_id, user_update.name, user_update.email, user_update.password)
     if not updated_user:
@@ -96,7 +214,7 @@ def update_user_endpoint(user_id: int, user_update: schemas.UserCreate, db: Sess
     return updated_user
 
 
-@app.delete("/users/{user_id}", response_model=schemas.UserResponse)
+@router.delete("/users/{user_id}", response_model=schemas.UserResponse)
 def delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
     deleted_user = crud.soft_delete_user(db, user_id)
     if not deleted_user:
@@ -104,41 +222,106 @@ def delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
     return deleted_user
 
 #  CATEGORIES 
-@app.post("/categories", response_model=schemas.CategoryResponse)
+@router.post("/categories", response_model=schemas.CategoryResponse)
 def create_category_endpoint(category: schemas.CategoryCreate, db: Session = Depends(get_db)):
     if crud.get_category_by_name(db, category.name):
         raise HTTPException(status_code=400, detail="Category already exists")
     return crud.create_category(db, category.name)
 
-@app.put("/categories/{category_id}", response_model=schemas.CategoryResponse)
+@router.put("/categories/{category_id}", response_model=schemas.CategoryResponse)
 def update_category_endpoint(category_id: int, category_update: schemas.CategoryCreate, db: Session = Depends(get_db)):
-    category = crud.get_category_by_id(db, category_id)
+    category = crud.update_category(db, category_id, category_update.name)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    category.name = category_update.name
-    db.commit()
-    db.refresh(category)
     return category
 
-@app.delete("/categories/{category_id}", response_model=schemas.CategoryResponse)
+@router.delete("/categories/{category_id}", response_model=schemas.CategoryResponse)
 def delete_category_endpoint(category_id: int, db: Session = Depends(get_db)):
-    category = crud.get_category_by_id(db, category_id)
+    category = crud.delete_category(db, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    db.delete(category)
-    db.commit()
     return category
 
 #  EXPENSES 
-@app.post("/expenses", response_model=schemas.ExpenseResponse)
+def _fill_categories(db: Session, descriptions: List[str]) -> List[Optional[int]]:
+    # Confident categorizer suggestions that still name an existing category
+    return [
+        category_id if category_id is not None and crud.category_exists(db, category_id) else None
+        for category_id in categorizer.fill(descriptions)
+    ]
+
+@router.post("/expenses", response_model=schemas.ExpenseCreateResponse)
 def create_expense_endpoint(expense: schemas.ExpenseCreate, db: Session = Depends(get_db)):
     if not crud.get_user_by_id(db, expense.user_id):
         raise HTTPException(status_code=404, detail="User not found")
-    if not crud.get_category_by_id(db, expense.category_id):
+    category_id = expense.category_id
+    if category_id is None:
+        category_id = _fill_categories(db, [expense.description])[0]
+        if category_id is None:
+            raise HTTPException(status_code=400, detail="category_id is required, the description could not be categorized")
+    elif not crud.category_exists(db, category_id):
         raise HTTPException(status_code=404, detail="Category not found")
-    return crud.create_expense(db, expense.user_id, expense.category_id, expense.amount, expense.description, expense_date=expense.created_at)
+    created = crud.create_expense(db, expense.user_id, category_id, expense.amount, expense.description, expense_date=expense.created_at)
+    _budgets_changed()
+    return created
 
-@app.put("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
+@router.post("/expenses/categorize", response_model=List[schemas.CategorySuggestion])
+def categorize_expenses(
+    request: schemas.CategorySuggestionRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Suggest a category for each description (batches of up to EXPENSE_IMPORT_MAX_ROWS)"""
+    if len(request.descriptions) > EXPENSE_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {EXPENSE_IMPORT_MAX_ROWS} descriptions per request")
+    names = catalogue.names(db)
+    suggestions = []
+    for description, suggestion in zip(request.descriptions, categorizer.suggest(request.descriptions)):
+        category_id, confidence = suggestion if suggestion and suggestion[0] in names else (None, 0.0)
+        suggestions.append({
+            "description": description,
+            "category_id": category_id,
+            "category_name": names.get(category_id),
+            "confidence": confidence,
+            "confident": category_id is not None and confidence >= CATEGORIZER_MIN_CONFIDENCE,
+        })
+    return FastJSONResponse(suggestions)
+
+@router.post("/expenses/import", response_model=schemas.ExpenseImportResponse)
+def import_expenses(
+    request: schemas.ExpenseImportRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Import expenses for authenticated user; rows without category_id are categorized.
+    Nothing is imported unless every row ends up with a valid category."""
+    rows = request.expenses
+    if len(rows) > EXPENSE_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {EXPENSE_IMPORT_MAX_ROWS} expenses per import")
+    unknown = [i for i, row in enumerate(rows) if row.category_id is not None and not crud.category_exists(db, row.category_id)]
+    if unknown:
+        raise HTTPException(status_code=422, detail={"message": "Category not found", "rows": unknown})
+
+    # One batch through the model for all rows that need a category
+    missing = [i for i, row in enumerate(rows) if row.category_id is None]
+    filled = dict(zip(missing, _fill_categories(db, [rows[i].description for i in missing])))
+    uncategorized = [i for i in missing if filled[i] is None]
+    if uncategorized:
+        raise HTTPException(status_code=422, detail={"message": "category_id is required, the description could not be categorized", "rows": uncategorized})
+
+    imported = crud.bulk_create_expenses(db, current_user['user_id'], [
+        {
+            "category_id": filled.get(i, row.category_id),
+            "amount": row.amount,
+            "description": row.description,
+            "expense_date": row.expense_date,
+        }
+        for i, row in enumerate(rows)
+    ])
+    _budgets_changed()
+    return {"imported": imported, "auto_categorized": len(missing)}
+
+@router.put("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
 def update_expense_endpoint(expense_id: int, expense_update: schemas.ExpenseCreate, db: Session = Depends(get_db)):
     updated_expense = crud.update_expense(
         db,
@@ -149,17 +332,21 @@ def update_expense_endpoint(expense_id: int, expense_update: schemas.ExpenseCrea
     )
     if not updated_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    _budgets_changed()
+    # Category corrections are training data; retrains in the background once enough are pending
+    categorizer.maybe_retrain(db)
     return updated_expense
 
-@app.delete("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
+@router.delete("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
 def delete_expense_endpoint(expense_id: int, db: Session = Depends(get_db)):
     deleted_expense = crud.soft_delete_expense(db, expense_id)
     if not deleted_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    _budgets_changed()
     return deleted_expense
 
 # BUDGETS
-@app.post("/budgets", response_model=schemas.BudgetResponse)
+@router.post("/budgets", response_model=schemas.BudgetResponse)
 def create_budget(
     budget: schemas.BudgetCreate,
     db: Session = Depends(get_db),
@@ -170,10 +357,8 @@ def create_budget(
     if not user or user.deleted_at:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if budget.category_id:
-        category = crud.get_category_by_id(db, budget.category_id)
-        if not category:
-            raise HTTPException(status_code=404, detail="Category not found")
+    if budget.category_id and not crud.category_exists(db, budget.category_id):
+        raise HTTPException(status_code=404, detail="Category not found")
     
     db_budget = crud.create_budget(
         db=db,
@@ -186,17 +371,14 @@ def create_budget(
         alert_threshold=budget.alert_threshold
     )
 
+    _budgets_changed()
     response = schemas.BudgetResponse.from_orm(db_budget)
-    if db_budget.category_id:
-        category = crud.get_category_by_id(db, db_budget.category_id)
-        response.category_name = category.name if category else None
-    else:
-        response.category_name = "Overall Budget"
+    response.category_name = crud.get_budget_category_name(db, db_budget.category_id)
     
     return response
 
 
-@app.get("/budgets", response_model=List[schemas.BudgetResponse])
+@router.get("/budgets", response_model=List[schemas.BudgetResponse])
 def get_budgets(
     active_only: bool = True,
     db: Session = Depends(get_db),
@@ -207,22 +389,10 @@ def get_budgets(
     if not user or user.deleted_at:
         raise HTTPException(status_code=404, detail="User not found")
     
-    budgets = crud.get_user_budgets(db, user.user_id, active_only=active_only)
-    
-    responses = []
-    for budget in budgets:
-        response = schemas.BudgetResponse.from_orm(budget)
-        if budget.category_id:
-            category = crud.get_category_by_id(db, budget.category_id)
-            response.category_name = category.name if category else None
-        else:
-            response.category_name = "Overall Budget"
-        responses.append(response)
-    
-    return responses
+    return reads.budget_rows_with_names(db, user.user_id, active_only=active_only)
 
 
-@app.get("/budgets/status", response_model=List[schemas.BudgetStatus])
+@router.get("/budgets/status", response_model=List[schemas.BudgetStatus])
 def get_budget_statuses(
     db: Session = Depends(get_db),
     current_user: dict = Depends(auth.get_current_user)
@@ -232,10 +402,129 @@ def get_budget_statuses(
     if not user or user.deleted_at:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return crud.get_all_budget_statuses(db, user.user_id)
+    return FastJSONResponse(crud.get_all_budget_statuses(db, user.user_id))
+
+
+# Budget status changes and threshold crossings as Server-Sent Events (see sse.py)
+@router.get("/events")
+async def get_events(
+    request: Request,
+    last_event_id: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    header = request.headers.get("last-event-id", "")
+    if header.isdigit():
+        last_event_id = int(header)
+    user_id = current_user['user_id']
+    queue = await sse.broker.subscribe(user_id)
+    try:
+        frames, seen = await run_in_threadpool(sse.opening, db, user_id, last_event_id)
+    except Exception:
+        sse.broker.unsubscribe(user_id, queue)
+        raise
+    return StreamingResponse(
+        sse.stream(db, user_id, queue, frames, seen),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Webhooks (database/webhooks.py, sent by webhook_delivery.py)
+@router.post("/webhooks", response_model=schemas.WebhookCreated, status_code=status.HTTP_201_CREATED)
+def create_webhook(
+    webhook: schemas.WebhookCreate,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Register an endpoint for budget events; the response holds the signing secret, shown only once"""
+    try:
+        webhook_delivery.check_url(webhook.url)
+    except webhook_delivery.InvalidURL as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if len(webhooks.user_webhooks(db, current_user['user_id'])) >= webhooks.MAX_WEBHOOKS_PER_USER:
+        raise HTTPException(status_code=409, detail=f"At most {webhooks.MAX_WEBHOOKS_PER_USER} webhooks per user")
+    return webhooks.create(db, current_user['user_id'], webhook.url, webhook.events)
+
+
+@router.get("/webhooks", response_model=List[schemas.WebhookResponse])
+def get_webhooks(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    return webhooks.user_webhooks(db, current_user['user_id'])
+
+
+@router.get("/webhooks/dead-letters", response_model=List[schemas.WebhookDeadLetter])
+def get_webhook_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Deliveries given up on, newest first"""
+    return webhooks.dead_letters(db, current_user['user_id'], limit=limit)
+
+
+@router.post("/webhooks/dead-letters/{delivery_id}/retry")
+def retry_webhook_dead_letter(
+    delivery_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Queue a dead delivery again, reactivating its webhook"""
+    dead = webhooks.get_dead_letter(db, delivery_id)
+    if not dead:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    if dead.user_id != current_user['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    webhooks.retry(db, delivery_id)
+    webhook_delivery.deliverer.notify()
+    return {"message": "Delivery queued"}
+
+
+def _own_webhook(db: Session, webhook_id: int, current_user: dict) -> models.Webhook:
+    webhook = webhooks.get_webhook(db, webhook_id)
+    if not webhook:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    if webhook.user_id != current_user['user_id']:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return webhook
+
+
+@router.post("/webhooks/{webhook_id}/ping", status_code=status.HTTP_202_ACCEPTED)
+def ping_webhook(
+    webhook_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Queue a test delivery of type ping"""
+    delivery_id = webhooks.ping(db, _own_webhook(db, webhook_id, current_user))
+    webhook_delivery.deliverer.notify()
+    return {"delivery_id": delivery_id}
+
 
+@router.delete("/webhooks/{webhook_id}")
+def delete_webhook(
+    webhook_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Delete a webhook with its queued and dead deliveries"""
+    webhooks.delete_webhook(db, _own_webhook(db, webhook_id, current_user).webhook_id)
+    return {"message": "Webhook deleted successfully"}
 
-@app.get("/budgets/{budget_id}", response_model=schemas.BudgetResponse)
+
+@router.get("/budgets/alerts", response_model=List[schemas.BudgetAlert])
+def get_budget_alerts(
+    include_ok: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Get the precomputed alert state of the user's budgets (approaching or over, unless include_ok)"""
+    return FastJSONResponse(budget_alerts.user_alerts(db, current_user['user_id'], include_ok=include_ok))
+
+
+@router.get("/budgets/{budget_id}", response_model=schemas.BudgetResponse)
 def get_budget(
     budget_id: int,
     db: Session = Depends(get_db),
@@ -249,16 +538,12 @@ def get_budget(
         raise HTTPException(status_code=403, detail="Not authorized")
     
     response = schemas.BudgetResponse.from_orm(budget)
-    if budget.category_id:
-        category = crud.get_category_by_id(db, budget.category_id)
-        response.category_name = category.name if category else None
-    else:
-        response.category_name = "Overall Budget"
+    response.category_name = crud.get_budget_category_name(db, budget.category_id)
     
     return response
 
 
-@app.put("/budgets/{budget_id}", response_model=schemas.BudgetResponse)
+@router.put("/budgets/{budget_id}", response_model=schemas.BudgetResponse)
 def update_budget(
     budget_id: int,
     budget_update: schemas.BudgetUpdate,
@@ -282,17 +567,14 @@ def update_budget(
         alert_threshold=budget_update.alert_threshold
     )
     
+    _budgets_changed()
     response = schemas.BudgetResponse.from_orm(updated)
-    if updated.category_id:
-        category = crud.get_category_by_id(db, updated.category_id)
-        response.category_name = category.name if category else None
-    else:
-        response.category_name = "Overall Budget"
+    response.category_name = crud.get_budget_category_name(db, updated.category_id)
     
     return response
 
 
-@app.delete("/budgets/{budget_id}")
+@router.delete("/budgets/{budget_id}")
 def delete_budget(
     budget_id: int,
     db: Session = Depends(get_db),
@@ -308,29 +590,80 @@ def delete_budget(
     crud.soft_delete_budget(db, budget_id)
     return {"message": "Budget deleted successfully"}
 
-# Debug endpoint
-@app.get("/debug")
-def debug(db: Session = Depends(get_db)):
+# Prometheus metrics
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(request: Request):
+    token = metrics.metrics_token()
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Slow queries aggregated by statement shape, with plans and index advice
+@router.get("/admin/slow-queries")
+def get_slow_queries(
+    top: int = Query(20, ge=1, le=200),
+    admin: dict = Depends(auth.get_current_admin)
+):
+    if slow_query_log is None:
+        return {"enabled": False, "queries": []}
     return {
-        "users": db.query(models.User).all(),
-        "categories": db.query(models.Category).all(),
-        "expenses": db.query(models.Expense).all()
+        "enabled": True,
+        "threshold_ms": slow_query_log.threshold * 1000,
+        "queries": slow_query_log.report(top)
     }
 
+# Monthly spending of every user, from the columnar snapshot when ANALYTICS_BACKEND=duckdb
+@router.get("/admin/reports/spending")
+def get_spending_report(
+    months: int = Query(12, ge=1, le=120),
+    backend: Optional[Literal["sqlite", "duckdb"]] = None,
+    db: Session = Depends(get_db),
+    admin: dict = Depends(auth.get_current_admin)
+):
+    return FastJSONResponse(analytics.spending_report(db, *analytics.month_window(months), requested=backend))
+
+# Scheduled jobs: schedule, lease and last run of each
+@router.get("/admin/jobs")
+def get_jobs(admin: dict = Depends(auth.get_current_admin)):
+    return FastJSONResponse(scheduler.status())
+
+# Stored request profiles
+@router.get("/admin/profiles")
+def get_profiles(admin: dict = Depends(auth.get_current_admin)):
+    return profiling.list_profiles()
+
+@router.get("/admin/profiles/{request_id}")
+def get_profile(request_id: str, admin: dict = Depends(auth.get_current_admin)):
+    path = profiling.profile_path(request_id, "json")
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json")
+
+@router.get("/admin/profiles/{request_id}/folded")
+def get_profile_stacks(request_id: str, admin: dict = Depends(auth.get_current_admin)):
+    """Collapsed stacks for flamegraph.pl / speedscope"""
+    path = profiling.profile_path(request_id, "folded")
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{request_id}.folded")
+
 # AI query endpoint
-@app.post("/ai/query", response_model=AIResponse)
+@router.post("/ai/query", response_model=AIResponse)
 @limiter.limit("20/minute")  # Rate limit AI queries
-def ai_query(request: AIRequest, db: Session = Depends(get_db)):
-    current_user = crud.get_user_by_id(db, request.user_id)
+def ai_query(request: Request, ai_request: AIRequest, db: Session = Depends(get_db)):
+    current_user = crud.get_user_by_id(db, ai_request.user_id)
     if current_user is None or current_user.deleted_at:
         raise HTTPException(status_code=404, detail="User not found or inactive")
 
-    parsed_intent = parse_intent_from_query(request.query)
+    from ai.intents import parse_intent_from_query
+    from ai.processor import process_ai_query
+
+    parsed_intent = parse_intent_from_query(ai_request.query)
     result = process_ai_query(parsed_intent=parsed_intent, db=db, user_id=current_user.user_id)
-    return result 
+    return FastJSONResponse(result)
 
 # Monthly Expense Summary
-@app.get("/users/{user_id}/expenses/summary", response_model=schemas.ExpenseSummaryResponse)
+@router.get("/users/{user_id}/expenses/summary", response_model=schemas.ExpenseSummaryResponse)
 def monthly_summary(
     user_id: int,
     month: int = Query(..., ge=1, le=12),
@@ -344,7 +677,7 @@ def monthly_summary(
     return schemas.ExpenseSummaryResponse(user_id=user_id, month=month, year=year, **summary)
 
 # Get current authenticated user's profile
-@app.get("/users/me", response_model=schemas.UserResponse)
+@router.get("/users/me", response_model=schemas.UserResponse)
 def get_current_user_profile(
     db: Session = Depends(get_db),
     current_user: dict = Depends(auth.get_current_user)
@@ -358,7 +691,7 @@ def get_current_user_profile(
     return user
 
 # Save a chat message
-@app.post("/users/{user_id}/chat", response_model=schemas.ChatMessageResponse)
+@router.post("/users/{user_id}/chat", response_model=schemas.ChatMessageResponse)
 def save_chat_message(chat: schemas.ChatMessageCreate, db: Session = Depends(get_db)):
     db_chat = models.ChatMessage(
         user_id=chat.user_id,
@@ -371,40 +704,105 @@ def save_chat_message(chat: schemas.ChatMessageCreate, db: Session = Depends(get
     return db_chat
 
 # Get chat history
-@app.get("/users/{user_id}/chat", response_model=list[schemas.ChatMessageResponse])
+@router.get("/users/{user_id}/chat", response_model=list[schemas.ChatMessageResponse])
 def get_chat_history(user_id: int, db: Session = Depends(get_db), current_user: dict = Depends(auth.get_current_user)):
     if user_id != current_user['user_id']:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return db.query(models.ChatMessage)\
-             .filter(models.ChatMessage.user_id == user_id)\
-             .order_by(models.ChatMessage.created_at)\
-             .all()
+    return reads.list_chat_messages(db, user_id)
 
 # Get all categories
-@app.get("/categories", response_model=List[schemas.CategoryResponse])
+@router.get("/categories", response_model=List[schemas.CategoryResponse])
 def get_all_categories(db: Session = Depends(get_db)):
-    categories = db.query(models.Category).all()
-    return categories
+    return reads.list_categories(db)
 
-@app.get("/expenses", response_model=List[schemas.ExpenseResponse])
+@router.get("/expenses", response_model=List[schemas.ExpenseResponse])
 def get_user_expenses(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: dict = Depends(auth.get_current_user)
 ):
-    """Get all expenses for authenticated user"""
+    """Get all expenses for authenticated user, streamed from the DB cursor.
+    Send `Accept: application/x-ndjson` for one expense per line."""
     user = crud.get_user_by_id(db, current_user['user_id'])
     if not user or user.deleted_at:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    expenses = db.query(models.Expense)\
-        .filter(models.Expense.user_id == current_user['user_id'])\
-        .filter(models.Expense.deleted_at == None)\
-        .order_by(models.Expense.expense_date.desc())\
-        .all()
-    
-    return expenses
 
-@app.get("/expenses/summary", response_model=schemas.ExpenseSummaryResponse)
+    rows = reads.iter_expenses(db, current_user['user_id'])
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(iter_ndjson(rows), media_type="application/x-ndjson")
+    return StreamingResponse(iter_json_array(rows), media_type="application/json")
+
+@router.get("/expenses/export")
+def export_expenses(
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Export the authenticated user's expense history, streamed in batches from the DB cursor"""
+    user = crud.get_user_by_id(db, current_user['user_id'])
+    if not user or user.deleted_at:
+        raise HTTPException(status_code=404, detail="User not found")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+
+    batches = reads.iter_expense_batches(
+        db,
+        user.user_id,
+        batch_size=5000,
+        start_date=start_date,
+        end_date=end_date,
+        category_id=category_id
+    )
+    return StreamingResponse(
+        export.EXPORTERS[format](batches, catalogue.names(db)),
+        media_type=export.EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="expenses.{format}"'}
+    )
+
+@router.get("/expenses/search", response_model=schemas.ExpenseSearchResponse)
+def search_expenses(
+    q: str = Query(..., min_length=1, max_length=200),
+    sort: Literal["relevance", "recent"] = "relevance",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=search.SEARCH_WINDOW),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Search the authenticated user's expense descriptions.
+    Supports prefixes (`coff*`), phrases (`"train ticket"`) and OR."""
+    user = crud.get_user_by_id(db, current_user['user_id'])
+    if not user or user.deleted_at:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return FastJSONResponse(search.search_expenses(
+        db,
+        user.user_id,
+        q,
+        sort=sort,
+        limit=limit,
+        offset=offset,
+        start_date=start_date,
+        end_date=end_date,
+        category_id=category_id
+    ))
+
+@router.get("/expenses/recurring", response_model=List[schemas.RecurringChargeResponse])
+def get_recurring_charges(
+    include_lapsed: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(auth.get_current_user)
+):
+    """Subscriptions and other recurring charges of authenticated user, next due first.
+    Found by the batch detector (`python -m ai.recurring detect`)."""
+    return FastJSONResponse(recurring.list_recurring(db, current_user['user_id'], include_lapsed=include_lapsed))
+
+@router.get("/expenses/summary", response_model=schemas.ExpenseSummaryResponse)
 def get_expense_summary(
     month: int = Query(..., ge=1, le=12),
     year: int = Query(..., ge=2000, le=2100),
@@ -422,4 +820,7 @@ def get_expense_summary(
         month=month, 
         year=year, 
         **summary
-    )
\ No newline at end of file
+    )
+
+
+app = create_app()
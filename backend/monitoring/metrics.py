@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+"""
+Minimal Prometheus metrics for SpendSense.
+
+Metrics live in a per-process registry and are rendered in the Prometheus
+text exposition format by GET /metrics. Recording a sample is a dict lookup
+and a couple of additions under a lock, cheap enough to leave on in
+production. With several workers, each process reports its own numbers.
+"""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(label_values)
+            if counts is None:
+                counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+            counts[index] += 1
+            self._sums[label_values] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            samples = self.collect()
+        except Exception:
+            samples = {}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in samples.items()
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]]) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "spendsense_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+REQUESTS_TOTAL = REGISTRY.counter(
+    "spendsense_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+INTENT_DURATION = REGISTRY.histogram(
+    "spendsense_ai_intent_duration_seconds", "process_ai_query latency by intent", ("intent", "execution_status"))
+SQL_QUERIES_TOTAL = REGISTRY.counter(
+    "spendsense_sql_queries_total", "SQL statements executed")
+SQL_SECONDS_TOTAL = REGISTRY.counter(
+    "spendsense_sql_seconds_total", "Time spent executing SQL statements")
+SQL_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    "spendsense_sql_queries_per_request", "SQL statements per HTTP request", ("route",), buckets=QUERY_COUNT_BUCKETS)
+SQL_SECONDS_PER_REQUEST = REGISTRY.histogram(
+    "spendsense_sql_seconds_per_request", "SQL time per HTTP request", ("route",))
+RATE_LIMIT_REJECTIONS = REGISTRY.counter(
+    "spendsense_rate_limit_rejections_total", "Requests rejected by the rate limiter", ("route",))
+
+
+# Per-request SQL accounting. The middleware sets a fresh RequestStats for
+# each request; the SQL hooks add to whatever is current.
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+def record_query(statement: str, parameters, duration: float, context) -> None:
+    "SQL observer (see monitoring.sql) feeding the global and per-request SQL metrics."
+    SQL_QUERIES_TOTAL.inc()
+    SQL_SECONDS_TOTAL.inc(amount=duration)
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += duration
+
+
+def route_label(scope) -> str:
+    # Use the route template (/budgets/{budget_id}) to keep label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency, status and SQL usage per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            current_request_stats.reset(token)
+            route = route_label(scope)
+            method = scope.get("method", "")
+            REQUEST_DURATION.observe(duration, method, route)
+            REQUESTS_TOTAL.inc(method, route, str(status_holder["status"]))
+            SQL_QUERIES_PER_REQUEST.observe(stats.queries, route)
+            SQL_SECONDS_PER_REQUEST.observe(stats.sql_seconds, route)
+
+
+def register_pool_gauges(engine) -> None:
+    pool = engine.pool
+
+    def collect():
+        samples = {}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                samples[(name,)] = getattr(pool, name)()
+        return samples
+
+    REGISTRY.gauge("spendsense_db_pool", "SQLAlchemy connection pool state", ("stat",), collect)
+
+
+def register_cache_gauges(name: str, cache) -> None:
+    "Expose a cache's hits/misses attributes (e.g. the category catalogue)."
+    REGISTRY.gauge(
+        f"spendsense_{name}_cache_lookups", f"{name} cache lookups by result", ("result",),
+        lambda: {("hit",): cache.hits, ("miss",): cache.misses},
+    )
+
+
+def metrics_token() -> Optional[str]:
+    "Optional bearer token required by GET /metrics (METRICS_TOKEN)."
+    return os.getenv("METRICS_TOKEN") or None
@@ -0,0 +1,267 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import auth
+
+"""
+On-demand profiling of single requests.
+
+An admin adds `X-Profile: <admin access token>` to any request. The token
+is only read from the header, never the query string, so it does not end up
+in access logs or browser history. That one request is then run under:
+
+- a sampling CPU profiler that snapshots the stacks of the threads working
+  on the request every PROFILE_INTERVAL_MS and stores them in collapsed
+  ("folded") format, readable by flamegraph.pl, speedscope and similar tools
+- tracemalloc, keeping the top allocation sites
+
+Results are written to PROFILE_DIR as <request_id>.folded and
+<request_id>.json. The request id is returned in the X-Profile-Id response
+header. The JSON is tagged with the AI intent (see tag()) and the number of
+rows the request's queries returned.
+
+Sync endpoints run in a threadpool, so a thread is sampled once it runs a
+query or calls tag() on behalf of the profiled request. Under heavy
+concurrency, a pooled thread that moves on to another request can add a few
+unrelated samples. Only one request is profiled at a time; others run
+normally.
+"""
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles"),
+)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+TOP_ALLOCATIONS = 25
+
+current_profile: ContextVar[Optional["ProfileSession"]] = ContextVar("current_profile", default=None)
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    def __init__(self, request_id: str, method: str, path: str, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.thread_ids = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.tags: Dict[str, object] = {}
+        self.rows = 0
+        self.queries = 0
+        self.allocations: List[dict] = []
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{request_id}", daemon=True)
+        self._started_tracemalloc = False
+
+    def register_thread(self) -> None:
+        self.thread_ids.add(threading.get_ident())
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        self._started_at = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self._started_at
+        self._stop.set()
+        self._sampler.join()
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            self.allocations = [
+                {
+                    "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_kib": round(stat.size / 1024, 1),
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+            ]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+    def summary(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round(self.duration * 1000, 2),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "tags": self.tags,
+            "sql_queries": self.queries,
+            "rows": self.rows,
+            "top_allocations": self.allocations,
+        }
+
+    def save(self, directory: Optional[str] = None) -> None:
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.request_id}.folded"), "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, f"{self.request_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, default=str)
+
+
+def tag(**tags) -> None:
+    "Attach tags (e.g. intent) to the current profile; a no-op when not profiling."
+    session = current_profile.get()
+    if session is not None:
+        session.register_thread()
+        session.tags.update(tags)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _count_rows(orm_execute_state):
+    # Only while profiling: buffer the result so its rows can be counted
+    session = current_profile.get()
+    if session is None:
+        return None
+    session.register_thread()
+    session.queries += 1
+    if not orm_execute_state.is_select:
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    session.rows += len(frozen.data)
+    return frozen()
+
+
+def _admin_email(token: str) -> Optional[str]:
+    "The token's email if it is an admin's; checks the signature only, no database."
+    payload = auth.decode_access_token(token)
+    email = (payload or {}).get("sub")
+    return email if email and email.lower() in auth.ADMIN_EMAILS else None
+
+
+def _admin_exists(email: str) -> bool:
+    # Same check as auth.get_current_user: the admin must still exist and not be soft-deleted
+    from database import crud
+    from database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return crud.get_user_by_email(db, email) is not None
+    finally:
+        db.close()
+
+
+def _is_admin_token(token: str) -> bool:
+    email = _admin_email(token)
+    return email is not None and _admin_exists(email)
+
+
+def _requested_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """Runs requests carrying an admin X-Profile token under the profiler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # The database lookup and the file writes block, so they run in the threadpool, and the
+        # lookup only once the token is an admin's and no other request is being profiled
+        token = _requested_token(scope)
+        email = _admin_email(token) if token else None
+        if email is None or not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        try:
+            is_admin = await run_in_threadpool(_admin_exists, email)
+        except BaseException:
+            _profile_lock.release()
+            raise
+        if not is_admin:
+            _profile_lock.release()
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(uuid.uuid4().hex, scope.get("method", ""), scope.get("path", ""))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", session.request_id.encode())]
+            await send(message)
+
+        context_token = current_profile.set(session)
+        session.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            try:
+                await run_in_threadpool(session.stop)  # joins the sampler and snapshots tracemalloc
+            finally:
+                current_profile.reset(context_token)
+                _profile_lock.release()
+            await run_in_threadpool(session.save)
+
+
+def list_profiles(directory: Optional[str] = None) -> List[dict]:
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                summary = json.load(f)
+            profiles.append({key: summary.get(key) for key in ("request_id", "method", "path", "duration_ms", "tags")})
+    return profiles
+
+
+def profile_path(request_id: str, extension: str, directory: Optional[str] = None) -> Optional[str]:
+    directory = directory or PROFILE_DIR
+    # Request ids are uuid4 hex; reject anything else so ids cannot escape the directory
+    if not request_id.isalnum():
+        return None
+    path = os.path.join(directory, f"{request_id}.{extension}")
+    return path if os.path.exists(path) else None
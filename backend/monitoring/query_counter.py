@@ -0,0 +1,175 @@
+import logging
+import os
+import sys
+from collections import defaultdict
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from monitoring.slow_queries import normalize_statement
+from monitoring.sql import add_observer, install_query_hooks
+
+"""
+Query recorder and N+1 detector.
+
+QueryRecorder collects every statement run while it is active, together
+with the application frames that issued it. Statements with the same
+normalized shape that repeat with different parameters are reported as a
+likely N+1 (a query inside a Python loop).
+
+In tests, use max_queries as a context manager or decorator:
+
+    with max_queries(3):
+        client.get("/budgets", headers=headers)
+
+    @max_queries(5, n_plus_one=False)
+    def test_budget_status(): ...
+
+With N_PLUS_ONE_DETECTION=log (or raise) the app wraps every request in a
+recorder and logs (or fails on) the N+1 patterns it finds.
+"""
+
+logger = logging.getLogger("spendsense.n_plus_one")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MONITORING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+N_PLUS_ONE_DETECTION = os.getenv("N_PLUS_ONE_DETECTION", "").lower()
+N_PLUS_ONE_THRESHOLD = 3
+
+_active: ContextVar[Tuple["QueryRecorder", ...]] = ContextVar("active_query_recorders", default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _call_site(depth: int = 3) -> str:
+    # Innermost backend frames that are not monitoring code or a dependency,
+    # e.g. "database/crud.py:244 in get_budget_by_id <- database/crud.py:380 in get_budget_status"
+    sites = []
+    frame = sys._getframe(2)
+    while frame is not None and len(sites) < depth:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(BACKEND_DIR) and not filename.startswith(MONITORING_DIR) and "site-packages" not in filename:
+            sites.append(f"{os.path.relpath(filename, BACKEND_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(sites) or "<unknown>"
+
+
+def _record(statement: str, parameters, duration: float, context) -> None:
+    "SQL observer (see monitoring.sql) feeding every active recorder."
+    recorders = _active.get()
+    if not recorders:
+        return
+    entry = (normalize_statement(statement), statement, parameters, duration, _call_site())
+    for recorder in recorders:
+        recorder.queries.append(entry)
+
+
+class QueryRecorder:
+    def __init__(self, threshold: int = N_PLUS_ONE_THRESHOLD, engine=None):
+        self.threshold = threshold
+        self.engine = engine
+        self.queries: List[tuple] = []
+        self._token = None
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    def __enter__(self):
+        if self.engine is None:
+            from database.database import engine
+            self.engine = engine
+        install_query_hooks(self.engine)
+        add_observer(_record)
+        self.queries = []
+        self._token = _active.set(_active.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.reset(self._token)
+        return False
+
+    def n_plus_one(self) -> List[dict]:
+        """
+        Shapes run at least `threshold` times with more than one distinct
+        parameter set, most repeated first.
+        """
+        by_shape: Dict[str, List[tuple]] = defaultdict(list)
+        for entry in self.queries:
+            by_shape[entry[0]].append(entry)
+
+        findings = []
+        for shape, entries in by_shape.items():
+            distinct = {repr(entry[2]) for entry in entries}
+            if len(entries) >= self.threshold and len(distinct) > 1:
+                call_sites = sorted({entry[4] for entry in entries})
+                findings.append({
+                    "shape": shape,
+                    "count": len(entries),
+                    "distinct_parameters": len(distinct),
+                    "total_ms": round(sum(entry[3] for entry in entries) * 1000, 3),
+                    "call_sites": call_sites,
+                })
+        findings.sort(key=lambda f: f["count"], reverse=True)
+        return findings
+
+    def report(self) -> str:
+        lines = [f"{self.count} queries"]
+        for finding in self.n_plus_one():
+            lines.append(
+                f"  N+1: {finding['count']}x ({finding['distinct_parameters']} parameter sets) {finding['shape']}"
+            )
+            for site in finding["call_sites"]:
+                lines.append(f"       at {site}")
+        return "\n".join(lines)
+
+
+class max_queries(QueryRecorder, ContextDecorator):
+    """
+    Assert that the block runs at most `limit` queries and, unless
+    n_plus_one=False, that no statement shape repeats per row.
+    """
+
+    def __init__(self, limit: Optional[int] = None, n_plus_one: bool = True, threshold: int = N_PLUS_ONE_THRESHOLD, engine=None):
+        super().__init__(threshold=threshold, engine=engine)
+        self.limit = limit
+        self.check_n_plus_one = n_plus_one
+
+    def _recreate_cm(self):
+        # Fresh recorder for every call when used as a decorator
+        return max_queries(self.limit, self.check_n_plus_one, self.threshold, self.engine)
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            return False
+        if self.limit is not None and self.count > self.limit:
+            raise QueryBudgetExceeded(f"Expected at most {self.limit} queries, got {self.report()}")
+        if self.check_n_plus_one and self.n_plus_one():
+            raise QueryBudgetExceeded(f"N+1 query pattern detected: {self.report()}")
+        return False
+
+
+class NPlusOneMiddleware:
+    """Development middleware: record each request and log or raise on N+1 patterns."""
+
+    def __init__(self, app, mode: str = "log", threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.app = app
+        self.mode = mode
+        self.threshold = threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with QueryRecorder(threshold=self.threshold) as recorder:
+            await self.app(scope, receive, send)
+        findings = recorder.n_plus_one()
+        if findings:
+            message = f"{scope.get('method')} {scope.get('path')}: {recorder.report()}"
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
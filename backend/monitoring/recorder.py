@@ -0,0 +1,193 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from starlette.concurrency import run_in_threadpool
+
+import auth
+from monitoring.metrics import route_label
+
+"""
+Opt-in recorder of anonymized request shapes, replayed by benchmarks/replay.py.
+
+With REQUEST_RECORDING_PATH set, every API request is appended to that file
+as one JSON line: time, method, route template, path and query parameters,
+a scrubbed copy of the body, response status and duration. Nothing in the
+log identifies a person:
+
+- users (bearer token subject, user_id in the path or body, login username)
+  become stable pseudonyms "u<hash>" of their user id: an HMAC keyed with
+  SECRET_KEY, so every worker maps a user to the same pseudonym and the log
+  keeps the real user cardinality
+- passwords and tokens are dropped; emails and names are replaced
+- free text (AI queries, expense descriptions, chat messages) keeps its
+  wording but emails and long digit runs (phone, card, account numbers)
+  are masked
+
+REQUEST_RECORDING_SAMPLE (0..1, default 1) records a fraction of requests.
+"""
+
+REQUEST_RECORDING_PATH = os.getenv("REQUEST_RECORDING_PATH")
+REQUEST_RECORDING_SAMPLE = float(os.getenv("REQUEST_RECORDING_SAMPLE", "1"))
+MAX_BODY_BYTES = 64 * 1024
+
+SKIPPED_PREFIXES = ("/metrics", "/admin", "/docs", "/openapi.json", "/redoc")
+DROPPED_FIELDS = {"password", "access_token", "token", "profile"}
+USER_FIELDS = {"user_id", "username"}
+REPLACED_FIELDS = {"email": "<email>", "name": "<name>"}
+TEXT_FIELDS = {"query", "description", "message", "context"}
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_LONG_NUMBER = re.compile(r"\d[\d -]{4,}\d")
+
+
+def pseudonym(user) -> str:
+    digest = hmac.new(str(auth.SECRET_KEY).encode(), str(user).lower().encode(), hashlib.sha256).hexdigest()
+    return f"u{digest[:12]}"
+
+
+def scrub_text(text: str) -> str:
+    return _LONG_NUMBER.sub("<number>", _EMAIL.sub("<email>", text))
+
+
+def anonymize(value, key: Optional[str] = None):
+    if isinstance(value, dict):
+        return {k: anonymize(v, k) for k, v in value.items() if k not in DROPPED_FIELDS}
+    if isinstance(value, list):
+        return [anonymize(v, key) for v in value]
+    if value is None:
+        return None
+    if key in USER_FIELDS:
+        return pseudonym(value)
+    if key in REPLACED_FIELDS:
+        return REPLACED_FIELDS[key]
+    if key in TEXT_FIELDS and isinstance(value, str):
+        return scrub_text(value)
+    return value
+
+
+def _parse_body(body: bytes, content_type: str):
+    if not body:
+        return None
+    if len(body) > MAX_BODY_BYTES:
+        return {"<truncated>": len(body)}
+    try:
+        if "application/json" in content_type:
+            return json.loads(body)
+        if "application/x-www-form-urlencoded" in content_type:
+            return dict(parse_qsl(body.decode("utf-8")))
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return {"<opaque>": len(body)}
+
+
+def _token_email(headers) -> Optional[str]:
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    payload = auth.decode_access_token(token)
+    return payload.get("sub") if payload else None
+
+
+class RequestRecorder:
+    def __init__(self, path: str, sample: float = 1.0, max_cached_users: int = 10_000):
+        self.path = path
+        self.sample = sample
+        self.max_cached_users = max_cached_users
+        self._lock = threading.Lock()
+        self._user_ids = {}
+
+    def user_id(self, email: str):
+        "User id for an email (tokens and logins carry emails), or the email if unknown."
+        user_id = self._user_ids.get(email)
+        if user_id is None:
+            from database import crud
+            from database.database import SessionLocal
+            with SessionLocal() as db:
+                user = crud.get_user_by_email(db, email)
+            user_id = user.user_id if user else email
+            if len(self._user_ids) >= self.max_cached_users:
+                self._user_ids.clear()
+            self._user_ids[email] = user_id
+        return user_id
+
+    def record(self, scope, body: bytes, status: int, started_at: float, duration: float) -> None:
+        headers = dict(scope.get("headers", []))
+        email = _token_email(headers)
+        parsed = _parse_body(body, headers.get(b"content-type", b"").decode("latin-1"))
+        if isinstance(parsed, dict) and "username" in parsed:
+            parsed["username"] = self.user_id(parsed["username"])
+        self.write({
+            "ts": round(started_at, 6),
+            "method": scope["method"],
+            "route": route_label(scope),
+            "path_params": anonymize(dict(scope.get("path_params", {}))),
+            "query": anonymize(dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))),
+            "body": anonymize(parsed),
+            "user": pseudonym(self.user_id(email)) if email else None,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+        })
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+
+class RecordingMiddleware:
+    """Pure ASGI middleware appending one anonymized line per request."""
+
+    def __init__(self, app, recorder: RequestRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith(SKIPPED_PREFIXES)
+                or random.random() >= self.recorder.sample):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        size = 0
+        response_status = [500]
+
+        async def receive_wrapper():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size <= MAX_BODY_BYTES:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response_status[0] = message["status"]
+            await send(message)
+
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            # User lookups and the file write stay off the event loop
+            await run_in_threadpool(
+                self.recorder.record, scope, b"".join(chunks), response_status[0], started_at, duration
+            )
+
+
+request_recorder: Optional[RequestRecorder] = (
+    RequestRecorder(REQUEST_RECORDING_PATH, REQUEST_RECORDING_SAMPLE) if REQUEST_RECORDING_PATH else None
+)
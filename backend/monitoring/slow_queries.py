@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+"""
+Opt-in slow-query log.
+
+When SLOW_QUERY_LOG_MS is set, every statement slower than that many
+milliseconds is recorded with its bound parameters. The first time a
+statement shape is seen, its EXPLAIN QUERY PLAN is captured on the same
+connection. Plans that scan a hot table instead of searching an index are
+flagged and given an index suggestion.
+
+Entries are aggregated in memory by normalized statement shape for
+GET /admin/slow-queries. They are also appended as JSON lines to
+SLOW_QUERY_LOG_PATH so the CLI can report across restarts and workers:
+
+    python -m monitoring.slow_queries report --top 20
+"""
+
+HOT_TABLES = ("expenses", "budgets", "chat_messages")
+
+SLOW_QUERY_LOG_MS = os.getenv("SLOW_QUERY_LOG_MS")
+SLOW_QUERY_LOG_PATH = os.getenv(
+    "SLOW_QUERY_LOG_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "slow_queries.jsonl"),
+)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?! USING (?:COVERING )?INDEX)", re.IGNORECASE)
+_PREDICATE = re.compile(r"\b(\w+)\.(\w+)\s*(?:=|>=|<=|<|>|\bIS\b|\bIN\b|\bLIKE\b)", re.IGNORECASE)
+
+
+def normalize_statement(statement: str) -> str:
+    "Statement shape with literals replaced by ? and IN lists collapsed."
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    "Hot tables the plan reads with a full scan."
+    tables = []
+    for detail in plan:
+        match = _SCAN.match(detail.strip())
+        if match and match.group(1) in HOT_TABLES:
+            tables.append(match.group(1))
+    return tables
+
+
+def index_advice(statement: str, tables: Iterable[str]) -> List[str]:
+    "Suggest an index over the columns the statement filters each scanned table by."
+    advice = []
+    for table in tables:
+        columns = []
+        for owner, column in _PREDICATE.findall(statement):
+            if owner == table and column not in columns:
+                columns.append(column)
+        if columns:
+            advice.append(f"CREATE INDEX ix_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+        else:
+            advice.append(f"{table} is scanned without a filter; add a WHERE clause or LIMIT")
+    return advice
+
+
+def explain(dbapi_connection, statement: str, parameters) -> List[str]:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+        # rows are (id, parent, notused, detail)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float, path: Optional[str] = SLOW_QUERY_LOG_PATH):
+        self.threshold = threshold_ms / 1000.0
+        self.path = path
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, dict] = {}
+
+    def __call__(self, statement: str, parameters, duration: float, context) -> None:
+        "SQL observer (see monitoring.sql)."
+        if duration < self.threshold:
+            return
+        shape = normalize_statement(statement)
+        with self._lock:
+            entry = self._shapes.get(shape)
+        if entry is None:
+            plan = self._explain(statement, parameters, context)
+            scans = full_scans(plan)
+            entry = {
+                "shape": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": plan,
+                "full_scans": scans,
+                "advice": index_advice(statement, scans),
+                "last_parameters": None,
+            }
+        duration_ms = duration * 1000
+        with self._lock:
+            entry = self._shapes.setdefault(shape, entry)
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_parameters"] = _jsonable(parameters)
+        self._append({
+            "ts": time.time(),
+            "shape": shape,
+            "statement": statement,
+            "parameters": _jsonable(parameters),
+            "duration_ms": round(duration_ms, 3),
+            "plan": entry["plan"],
+            "full_scans": entry["full_scans"],
+            "advice": entry["advice"],
+        })
+
+    def _explain(self, statement: str, parameters, context) -> List[str]:
+        if context is None or context.executemany:
+            return []
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            return []
+        try:
+            return explain(context.root_connection.connection.dbapi_connection, statement, parameters)
+        except Exception as exc:
+            return [f"EXPLAIN failed: {exc}"]
+
+    def _append(self, record: dict) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError:
+            pass
+
+    def report(self, top: int = 20) -> List[dict]:
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values()]
+        return _rank(entries, top)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+
+
+def _jsonable(parameters):
+    if parameters is None:
+        return None
+    if isinstance(parameters, (list, tuple)):
+        return [_jsonable(p) if isinstance(p, (list, tuple, dict)) else _scalar(p) for p in parameters]
+    if isinstance(parameters, dict):
+        return {k: _scalar(v) for k, v in parameters.items()}
+    return _scalar(parameters)
+
+
+def _scalar(value):
+    return value if isinstance(value, (int, float, str, type(None))) else str(value)
+
+
+def _rank(entries: List[dict], top: int) -> List[dict]:
+    for entry in entries:
+        entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 3) if entry["count"] else 0.0
+        entry["total_ms"] = round(entry["total_ms"], 3)
+        entry["max_ms"] = round(entry["max_ms"], 3)
+    entries.sort(key=lambda e: e["total_ms"], reverse=True)
+    return entries[:top]
+
+
+slow_query_log: Optional[SlowQueryLog] = SlowQueryLog(float(SLOW_QUERY_LOG_MS)) if SLOW_QUERY_LOG_MS else None
+
+
+# CLI report
+def aggregate_file(path: str) -> List[dict]:
+    shapes: Dict[str, dict] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            entry = shapes.setdefault(record["shape"], {
+                "shape": record["shape"],
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": record.get("plan", []),
+                "full_scans": record.get("full_scans", []),
+                "advice": record.get("advice", []),
+                "last_parameters": None,
+            })
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"]
+            entry["max_ms"] = max(entry["max_ms"], record["duration_ms"])
+            entry["last_parameters"] = record.get("parameters")
+    return list(shapes.values())
+
+
+def print_report(entries: List[dict]) -> None:
+    if not entries:
+        print("No slow queries recorded.")
+        return
+    for i, entry in enumerate(entries, 1):
+        flag = "  [FULL SCAN: " + ", ".join(entry["full_scans"]) + "]" if entry["full_scans"] else ""
+        print(f"{i:2d}. {entry['count']}x  total {entry['total_ms']:.1f} ms  avg {entry['avg_ms']:.1f} ms  max {entry['max_ms']:.1f} ms{flag}")
+        print(f"    {entry['shape']}")
+        for detail in entry["plan"]:
+            print(f"      plan: {detail}")
+        for advice in entry["advice"]:
+            print(f"      advice: {advice}")
+        if entry["last_parameters"] is not None:
+            print(f"      last parameters: {entry['last_parameters']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slow query log report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Aggregate the slow query log by statement shape")
+    report.add_argument("--path", default=SLOW_QUERY_LOG_PATH)
+    report.add_argument("--top", type=int, default=20)
+    report.add_argument("--full-scans-only", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"No slow query log at {args.path}")
+        return
+    entries = aggregate_file(args.path)
+    if args.full_scans_only:
+        entries = [e for e in entries if e["full_scans"]]
+    print_report(_rank(entries, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import time
+from typing import Callable, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+SQLAlchemy engine hooks shared by the monitoring tools.
+
+install_query_hooks() times every statement an engine runs and passes
+(statement, parameters, duration, context) to each registered observer.
+Metrics, the slow-query log and the N+1 detector are all observers, so
+timing happens once no matter how many of them are enabled.
+"""
+
+Observer = Callable[[str, object, float, object], None]
+
+_observers: List[Observer] = []
+
+
+def add_observer(observer: Observer) -> None:
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_observer(observer: Observer) -> None:
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start_time"].pop()
+    for observer in _observers:
+        observer(statement, parameters, duration, context)
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute; drop their start time
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def install_query_hooks(engine: Engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+
+from fastapi import Request
+from limits.storage.base import Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+import auth
+
+"""
+Rate limiting shared by every worker process on the host.
+
+slowapi's default in-memory storage keeps one set of counters per process,
+so running uvicorn/gunicorn with N workers multiplies every limit by N.
+This module registers a `sqlite://` storage backend for the `limits`
+library that keeps counters in a small SQLite file all workers open, and
+builds the app's Limiter on top of it using the sliding window counter
+strategy.
+"""
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STORAGE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'ratelimit.db')}"
+
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", DEFAULT_STORAGE_URI)
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+# Set RATE_LIMIT_ENABLED=0 to switch limits off, e.g. for benchmarks and load tests
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Rate limit storage backed by a local SQLite file.
+
+    Every read-modify-write runs inside a `BEGIN IMMEDIATE` transaction, so
+    the check and the increment are atomic across threads and processes.
+    Connections are kept per thread and re-opened after a fork.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str | None = None, wrap_exceptions: bool = False, timeout: float = 5.0, **options):
+        self.path = self._path_from_uri(uri or DEFAULT_STORAGE_URI)
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._create_table()
+
+    @staticmethod
+    def _path_from_uri(uri: str) -> str:
+        # Same convention as SQLAlchemy: sqlite:///relative.db, sqlite:////abs/path.db
+        path = uri.split("://", 1)[1] if "://" in uri else uri
+        if path.startswith("/"):
+            path = path[1:]
+        return path or ":memory:"
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, re-created in forked worker processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_table(self):
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_counters ("
+            " key TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def _read(self, conn: sqlite3.Connection, key: str, now: float):
+        row = conn.execute(
+            "SELECT value, expires_at FROM rate_limit_counters WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, now)
+
+    def _incr(self, conn: sqlite3.Connection, key: str, expiry: float, amount: int, now: float) -> int:
+        # Upsert that restarts the counter when the stored row has expired
+        conn.execute(
+            "INSERT INTO rate_limit_counters (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            " value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,"
+            " expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END",
+            (key, amount, now + expiry, now, now),
+        )
+        return self._read(conn, key, now)[0]
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = self._incr(conn, key, expiry, amount, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def get(self, key: str) -> int:
+        return self._read(self._connection(), key, time.time())[0]
+
+    def get_expiry(self, key: str) -> float:
+        return self._read(self._connection(), key, time.time())[1]
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int | None:
+        cursor = self._connection().execute("DELETE FROM rate_limit_counters")
+        return cursor.rowcount
+
+    def clear(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limit_counters WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        """Delete expired counters so the file does not grow without bound."""
+        cursor = self._connection().execute(
+            "DELETE FROM rate_limit_counters WHERE expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def _window(self, conn: sqlite3.Connection, key: str, expiry: int, now: float):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._read(conn, previous_key, now)[0]
+        current_count = self._read(conn, current_key, now)[0]
+        if previous_count == 0:
+            previous_ttl = 0.0
+        else:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        conn = self._connection()
+        now = time.time()
+        # The write lock is taken before reading, so no other worker can
+        # slip a hit in between the check and the increment.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous_count, previous_ttl, current_count, _ = self._window(conn, key, expiry, now)
+            weighted_count = previous_count * previous_ttl / expiry + current_count
+            if floor(weighted_count) + amount > limit:
+                conn.execute("ROLLBACK")
+                return False
+            _, current_key = self.sliding_window_keys(key, expiry, now)
+            self._incr(conn, current_key, 2 * expiry, amount, now)
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_sliding_window(self, key: str, expiry: int) -> tuple[int, float, int, float]:
+        return self._window(self._connection(), key, expiry, time.time())
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
+
+
+def rate_limit_key(request: Request) -> str:
+    """
+    Key requests by the authenticated user when a valid bearer token is
+    present, otherwise by client address. Only the token signature is
+    checked here, no database lookup.
+    """
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        payload = auth.decode_access_token(token)
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}"
+    return f"ip:{get_remote_address(request)}"
+
+
+def create_limiter(storage_uri: str = RATE_LIMIT_STORAGE_URI, strategy: str = RATE_LIMIT_STRATEGY,
+                   enabled: bool = RATE_LIMIT_ENABLED) -> Limiter:
+    return Limiter(key_func=rate_limit_key, storage_uri=storage_uri, strategy=strategy, enabled=enabled)
+
+
+limiter = create_limiter()
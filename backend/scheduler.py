@@ -0,0 +1,442 @@
+import argparse
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+
+from database import models, sharding
+from database.database import engine as default_engine
+from monitoring import metrics
+
+"""
+Periodic jobs: precomputation and maintenance that used to need a cron
+entry per CLI command.
+
+Each job has a schedule, either an interval in seconds ("300") or a
+five-field cron expression in UTC ("30 3 * * *": minute, hour, day of
+month, month, weekday with 0 = Sunday; *, */n, a-b, a-b/n and lists), and
+a jitter: up to that many seconds are added to every next run, so workers
+started together don't all hit the database at the same moment.
+
+Any number of processes can run the scheduler. A row per job in
+job_leases holds its next run and a lease: a worker runs a job only after
+an UPDATE that claims a due, unleased row succeeds, which SQLite makes
+atomic, so each run happens once. The lease is renewed while the job runs
+and expires LEASE_SECONDS after a worker dies, when another one takes over.
+
+    SCHEDULER_ENABLED=1 uvicorn mainmenu:app   # a thread in every app worker
+    python -m scheduler run                    # or a separate worker process
+    python -m scheduler status
+    python -m scheduler run-job budget-alerts  # now, if no one else is running it
+
+SCHEDULER_JOBS picks the jobs (default DEFAULT_JOBS); SCHEDULE_<JOB> (e.g.
+SCHEDULE_BUDGET_ALERTS=120) replaces a job's schedule, "off" disables it.
+Run times are exported on /metrics as spendsense_job_duration_seconds and
+GET /admin/jobs shows the table.
+"""
+
+logger = logging.getLogger("spendsense.scheduler")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "15"))
+DEFAULT_JOBS = ("budget-alerts", "events", "webhooks", "recurring", "recurring-full", "compaction", "categorizer")
+# host:pid:random, so two processes never share a lease
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_leases = models.JobLease.__table__
+
+JOB_DURATION = metrics.REGISTRY.histogram(
+    "spendsense_job_duration_seconds", "Scheduled job run time", ("job", "status"),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+JOB_RUNS = metrics.REGISTRY.counter("spendsense_job_runs_total", "Scheduled job runs", ("job", "status"))
+
+
+#  Schedules
+
+class Interval:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime) -> datetime:
+        return moment + timedelta(seconds=self.seconds)
+
+    def __str__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class Cron:
+    # (low, high) of minute, hour, day of month, month, weekday (7 is Sunday too)
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        self.weekdays = {day % 7 for day in weekdays}
+        # As in cron, a restricted day of month and weekday match when either does
+        self.any_day, self.any_weekday = fields[2] == "*", fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start, end = (int(value) for value in spec.split("-", 1))
+            else:
+                start = end = int(spec)
+                if step:
+                    end = high
+            if not low <= start <= end <= high or (step and int(step) < 1):
+                raise ValueError(f"cron field {part!r} is outside {low}-{high}")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day, weekday = moment.day in self.days, (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        "The first matching minute after `moment`."
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=5 * 366)  # e.g. February 29th on a Monday
+        while candidate < limit:
+            if candidate.month not in self.months:
+                month = candidate.year * 12 + candidate.month  # index of the next month
+                candidate = datetime(month // 12, month % 12 + 1, 1)
+            elif not self._day_matches(candidate):
+                candidate = datetime(candidate.year, candidate.month, candidate.day) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression never matches: {self.expression!r}")
+
+    def __str__(self) -> str:
+        return self.expression
+
+
+def parse_schedule(text: str):
+    "Interval for a number of seconds, Cron for an expression, None for off."
+    text = text.strip()
+    if text == "off":
+        return None
+    try:
+        return Interval(float(text))
+    except ValueError:
+        return Cron(text)
+
+
+class Job:
+    def __init__(self, name: str, run: Callable[[], dict], schedule: str, jitter: float = 0.0,
+                 available: Callable[[], bool] = lambda: True):
+        self.name = name
+        self.run = run
+        self.schedule = parse_schedule(os.getenv("SCHEDULE_" + name.upper().replace("-", "_"), schedule))
+        self.jitter = jitter
+        self.available = available
+
+    def next_run(self, after: datetime) -> datetime:
+        return self.schedule.next_after(after) + timedelta(seconds=random.uniform(0, self.jitter))
+
+
+#  Jobs
+
+def _on_engines(name: str, run: Callable[[Engine], dict]) -> Callable[[], dict]:
+    "Run on the database, or on every shard with SHARD_COUNT set (sharding.JOBS[name])."
+    def job() -> dict:
+        if sharding.enabled():
+            return {f"shard {shard}": result for shard, result in sharding.fan_out(sharding.JOBS[name]).items()}
+        return run(default_engine)
+    return job
+
+
+def _budget_alerts(engine: Engine) -> dict:
+    from database import budget_alerts
+    return budget_alerts.run(engine)
+
+
+def _events(engine: Engine) -> dict:
+    from database import events
+    return events.prune(engine)
+
+
+def _webhooks(engine: Engine) -> dict:
+    from database import webhooks
+    return webhooks.prune(engine)
+
+
+def _recurring(engine: Engine) -> dict:
+    from sqlalchemy.orm import Session
+    from ai import recurring
+    with Session(engine) as db:
+        return recurring.run(db)
+
+
+def _recurring_full(engine: Engine) -> dict:
+    """Re-detect every user. The incremental run only sees expenses written since its
+    expense_id watermark, so edited amounts and deleted expenses below it wait for this pass."""
+    from sqlalchemy.orm import Session
+    from ai import recurring
+    with Session(engine) as db:
+        return recurring.run(db, full=True)
+
+
+def _compaction(engine: Engine) -> dict:
+    from database import compaction
+    return compaction.run(engine)
+
+
+def _cold(engine: Engine) -> dict:
+    from database import cold
+    return cold.run(engine)
+
+
+def _categorizer() -> dict:
+    from sqlalchemy.orm import Session
+    from ai.categorizer import train
+    with Session(default_engine) as db:
+        return train(db)
+
+
+def _columnar() -> dict:
+    from database import columnar
+    return columnar.build(default_engine)
+
+
+def _analytics_snapshot() -> dict:
+    from database import analytics
+    return analytics.snapshot(default_engine)
+
+
+def _installed(module: str) -> Callable[[], bool]:
+    def check() -> bool:
+        import importlib
+        return importlib.import_module(module).available()
+    return check
+
+
+JOBS: Dict[str, Job] = {job.name: job for job in (
+    Job("budget-alerts", _on_engines("budget-alerts", _budget_alerts), "300", jitter=30),
+    Job("events", _on_engines("events", _events), "3600", jitter=300),
+    Job("webhooks", _on_engines("webhooks", _webhooks), "45 3 * * *", jitter=600),
+    Job("recurring", _on_engines("recurring", _recurring), "1800", jitter=120),
+    Job("recurring-full", _on_engines("recurring-full", _recurring_full), "15 3 * * *", jitter=600),
+    Job("compaction", _on_engines("compaction", _compaction), "30 3 * * *", jitter=600),
+    Job("cold", _on_engines("cold", _cold), "0 4 * * 0", jitter=600, available=_installed("database.cold")),
+    # These read one database; sharded deployments run them per shard with the CLIs
+    Job("categorizer", _categorizer, "3600", jitter=300, available=lambda: not sharding.enabled()),
+    Job("columnar", _columnar, "15 2 * * *", jitter=300,
+        available=lambda: not sharding.enabled() and _installed("database.columnar")()),
+    Job("analytics-snapshot", _analytics_snapshot, "0 * * * *", jitter=300,
+        available=lambda: not sharding.enabled() and _installed("database.analytics")()),
+)}
+
+
+def selected_jobs(names: Optional[str] = None) -> List[Job]:
+    "Jobs named in SCHEDULER_JOBS (or DEFAULT_JOBS) that have a schedule and their dependencies."
+    names = names if names is not None else os.getenv("SCHEDULER_JOBS", ",".join(DEFAULT_JOBS))
+    jobs = []
+    for name in filter(None, (name.strip() for name in names.split(","))):
+        if name not in JOBS:
+            raise ValueError(f"unknown job {name!r}, expected one of {', '.join(JOBS)}")
+        job = JOBS[name]
+        if job.schedule is None:
+            continue
+        if not job.available():
+            logger.warning("Job %s is not available here (missing dependency or sharded storage)", name)
+            continue
+        jobs.append(job)
+    return jobs
+
+
+#  Scheduler
+
+class Scheduler:
+    def __init__(self, jobs: List[Job], engine: Optional[Engine] = None, owner: str = OWNER):
+        self.jobs = jobs
+        # With sharding, job_leases is one of the global tables, in this same database
+        self.engine = engine or default_engine
+        self.owner = owner
+
+    def register(self) -> None:
+        "Add the jobs' rows; a new job first runs after one jitter (interval jobs) or at its next slot."
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            for job in self.jobs:
+                first = now + timedelta(seconds=random.uniform(0, job.jitter)) \
+                    if isinstance(job.schedule, Interval) else job.next_run(now)
+                conn.execute(insert(_leases).values(name=job.name, next_run_at=first, runs=0, failures=0)
+                             .on_conflict_do_nothing(index_elements=["name"]))
+
+    def _claim(self, job: Job, due: bool = True) -> bool:
+        "Take the job's lease if it is due (or `due` is False) and no live lease exists."
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            return conn.execute(
+                update(_leases)
+                .where(_leases.c.name == job.name, or_(_leases.c.expires_at.is_(None), _leases.c.expires_at < now),
+                       *([_leases.c.next_run_at <= now] if due else []))
+                .values(owner=self.owner, expires_at=now + timedelta(seconds=LEASE_SECONDS), last_started_at=now)
+            ).rowcount == 1
+
+    def _heartbeat(self, job: Job, done: threading.Event) -> None:
+        while not done.wait(LEASE_SECONDS / 3):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(update(_leases).where(_leases.c.name == job.name, _leases.c.owner == self.owner)
+                                 .values(expires_at=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)))
+            except Exception:
+                logger.warning("Could not renew the lease of job %s", job.name, exc_info=True)
+
+    def _release(self, job: Job, started: datetime, status: str, error: Optional[str], seconds: float) -> None:
+        now = datetime.utcnow()
+        if isinstance(job.schedule, Interval):
+            # From the start, so runs don't drift by their own duration
+            next_run = max(job.next_run(started), now)
+        else:
+            next_run = job.next_run(now)
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(_leases).where(_leases.c.name == job.name, _leases.c.owner == self.owner)
+                .values(owner=None, expires_at=None, next_run_at=next_run, last_finished_at=now, last_status=status,
+                        last_error=error, last_seconds=round(seconds, 3), runs=_leases.c.runs + 1,
+                        failures=_leases.c.failures + (status == "failed"))
+            )
+
+    def run_job(self, job: Job, due: bool = True) -> Optional[dict]:
+        "Run the job if this worker gets its lease. Returns its result, None when it didn't run."
+        if not self._claim(job, due):
+            return None
+        started, clock = datetime.utcnow(), time.perf_counter()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), name=f"lease-{job.name}", daemon=True)
+        heartbeat.start()
+        result, status, error = None, "ok", None
+        try:
+            result = job.run()
+        except Exception as exc:
+            logger.exception("Job %s failed", job.name)
+            status, error = "failed", f"{type(exc).__name__}: {exc}"[:1000]
+        finally:
+            done.set()
+            heartbeat.join()
+        seconds = time.perf_counter() - clock
+        JOB_DURATION.observe(seconds, job.name, status)
+        JOB_RUNS.inc(job.name, status)
+        self._release(job, started, status, error, seconds)
+        logger.info("Job %s %s in %.2fs: %s", job.name, status, seconds, result)
+        return result if result is not None else {}
+
+    def run_due(self) -> List[str]:
+        "Run every job that is due and not leased by another worker. Returns the names run."
+        return [job.name for job in self.jobs if self.run_job(job) is not None]
+
+    def _wait_seconds(self) -> float:
+        "Until the next job is due, between 1 second and POLL_SECONDS."
+        with self.engine.connect() as conn:
+            due = conn.execute(
+                select(_leases.c.next_run_at).where(_leases.c.name.in_([job.name for job in self.jobs]))
+            ).scalars().all()
+        upcoming = [(moment - datetime.utcnow()).total_seconds() for moment in due if moment is not None]
+        return min(max(min(upcoming, default=POLL_SECONDS), 1.0), POLL_SECONDS)
+
+    def run_forever(self, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        self.register()
+        logger.info("Scheduler %s running %s", self.owner,
+                    ", ".join(f"{job.name} ({job.schedule})" for job in self.jobs))
+        while not stop.is_set():
+            wait = POLL_SECONDS
+            try:
+                self.run_due()
+                wait = self._wait_seconds()
+            except Exception:
+                # e.g. the database is locked or the table is missing: try again later
+                logger.warning("Scheduler pass failed", exc_info=True)
+            stop.wait(wait)
+
+
+def status(engine: Optional[Engine] = None) -> List[dict]:
+    "Every job's row of job_leases with its schedule."
+    with (engine or default_engine).connect() as conn:
+        rows = {row.name: row._asdict() for row in conn.execute(select(_leases))}
+    return [
+        {"name": name, "schedule": str(job.schedule) if job.schedule else "off", **rows.get(name, {"name": name})}
+        for name, job in JOBS.items()
+    ]
+
+
+def start() -> Optional[Callable[[], None]]:
+    "Start the scheduler thread when SCHEDULER_ENABLED=1. Returns a function that stops it."
+    if not SCHEDULER_ENABLED:
+        return None
+    jobs = selected_jobs()
+    if not jobs:
+        return None
+    stop = threading.Event()
+    thread = threading.Thread(target=Scheduler(jobs).run_forever, args=(stop,), name="scheduler", daemon=True)
+    thread.start()
+    return stop.set
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Run the periodic jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="run due jobs until interrupted")
+    run_parser.add_argument("--jobs", help="comma-separated jobs (default SCHEDULER_JOBS or DEFAULT_JOBS)")
+    sub.add_parser("status", help="show every job's schedule, lease and last run")
+    job_parser = sub.add_parser("run-job", help="run one job now, unless another worker holds its lease")
+    job_parser.add_argument("name", choices=sorted(JOBS))
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for row in status():
+            if row.get("next_run_at") is None:
+                print(f"{row['name']:<20} {row['schedule']:<16} not registered yet")
+                continue
+            print(f"{row['name']:<20} {row['schedule']:<16} next {row['next_run_at']:%Y-%m-%d %H:%M:%S}  "
+                  f"last {row['last_status'] or '-'} ({row['last_seconds'] or 0:.1f}s)  runs {row['runs']}  "
+                  f"failures {row['failures']}  owner {row['owner'] or '-'}")
+        return
+    if args.command == "run-job":
+        job = JOBS[args.name]
+        scheduler = Scheduler([job])
+        scheduler.register()
+        result = scheduler.run_job(job, due=False)
+        if result is None:
+            sys.exit(f"job {job.name} is running in another worker")
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        return
+    try:
+        Scheduler(selected_jobs(args.jobs)).run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, Iterator
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+"""
+JSON encoding for hot responses.
+
+FastAPI's default path validates the return value against the response
+model, runs jsonable_encoder over it and then calls json.dumps. For
+AIResponse, ExpenseResponse rows and BudgetStatus dicts we already know the
+shape, so endpoints can return FastJSONResponse and skip straight to a fast
+encoder. orjson is used when it is installed; set JSON_ENCODER=stdlib to
+force the standard library encoder.
+
+iter_json_array and iter_ndjson encode an iterable lazily in chunks, so a
+StreamingResponse can send a large list straight from a DB cursor without
+building the whole body in memory.
+"""
+
+STREAM_CHUNK_SIZE = 500
+
+
+def _default(obj: Any) -> Any:
+    # Types neither encoder handles on its own
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if hasattr(obj, "_asdict"):  # SQLAlchemy Row / namedtuple
+        return obj._asdict()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default)
+
+
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = _orjson_dumps
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "orjson" if orjson is not None else "stdlib")
+dumps: Callable[[Any], bytes] = ENCODERS.get(JSON_ENCODER, _stdlib_dumps)
+
+
+def set_encoder(name: str) -> None:
+    "Swap the process-wide encoder, e.g. for benchmarks."
+    global dumps
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JSON encoder '{name}', available: {', '.join(ENCODERS)}")
+    dumps = ENCODERS[name]
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def iter_json_array(items: Iterable[Any], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    "Encode items as one JSON array, yielding a chunk every chunk_size items."
+    buffer = [b"["]
+    count = 0
+    for item in items:
+        if count:
+            buffer.append(b",")
+        buffer.append(dumps(item))
+        count += 1
+        if count % chunk_size == 0:
+            yield b"".join(buffer)
+            buffer = []
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+
+def iter_ndjson(items: Iterable[Any], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    "Encode items as newline-delimited JSON, yielding a chunk every chunk_size items."
+    buffer = []
+    for item in items:
+        buffer.append(dumps(item))
+        buffer.append(b"\n")
+        if len(buffer) >= 2 * chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+    if buffer:
+        yield b"".join(buffer)
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import crud, events, sharding
+from database.database import engine as default_engine
+from monitoring import metrics
+from serialization import dumps
+
+"""
+GET /events: a Server-Sent Events stream of the user's budget changes, so
+the frontend can stop polling /budgets/status.
+
+    event: snapshot        every active budget's status, when the stream opens
+    id: 1234
+    event: budget_status   one budget's status after an expense write changed its spending
+    id: 1235
+    event: budget_alert    a threshold crossing: level, previous_level, should_alert, is_over_budget
+
+Events come from the log in database/events.py. Each worker runs one
+Broker task for all its streams. Every POLL_SECONDS it checks PRAGMA
+data_version on a connection of its own, which changes when any other
+connection commits, and only then reads the new events of the log (right
+away after a write in this worker). It hands them to the queues of the
+users they belong to, so other workers' writes arrive within about
+POLL_SECONDS and an idle database costs no queries. An open stream is a
+coroutine waiting on its queue, so idle connections cost no thread and no
+database connection; a comment line goes out every HEARTBEAT_SECONDS to
+keep proxies from closing them.
+
+Resuming: a client sending Last-Event-ID (or ?last_event_id=) gets the
+events it missed, then the live ones. When those are gone from the log it
+gets a new snapshot instead. A stream whose queue fills up (a client not
+reading) is sent a new snapshot rather than being closed.
+
+EventSource cannot send the bearer token, so clients read the stream with
+fetch() or an EventSource polyfill that sets headers.
+"""
+
+logger = logging.getLogger("spendsense.sse")
+
+POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "0.1"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+RETRY_MILLISECONDS = 3000  # how long browsers wait before reconnecting
+POLL_LIMIT = 1000
+
+RESYNC = object()  # queued in place of the events a full queue dropped
+
+
+def _frame(kind: str, data: bytes, event_id: Optional[int] = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {kind}\ndata: ".encode() + data + b"\n\n"
+
+
+class Broker:
+    "Hands new events of the log to this worker's open streams."
+
+    def __init__(self):
+        self._streams: Dict[int, Set[asyncio.Queue]] = {}
+        self._after: Dict[int, int] = {}  # shard (0 when unsharded) -> last event id seen
+        self._watchers: Dict[int, object] = {}  # shard -> DBAPI connection checking data_version
+        self._versions: Dict[int, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connections(self) -> int:
+        return sum(len(queues) for queues in self._streams.values())
+
+    @staticmethod
+    def _engines() -> dict:
+        if sharding.enabled():
+            return {shard: sharding.engine_for(shard) for shard in sharding.shards()}
+        return {0: default_engine}
+
+    def _committed(self, shard: int, engine) -> bool:
+        "Whether another connection committed to the shard's database since the last check."
+        try:
+            if shard not in self._watchers:
+                self._watchers[shard] = engine.raw_connection()
+            cursor = self._watchers[shard].cursor()
+            try:
+                version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            finally:
+                cursor.close()
+        except Exception:
+            self._watchers.pop(shard, None)
+            return True
+        changed = self._versions.get(shard) != version
+        self._versions[shard] = version
+        return changed
+
+    def _fetch(self, woken: bool) -> List:
+        "New events of every shard with commits; a shard seen for the first time starts at its latest event."
+        rows = []
+        for shard, engine in self._engines().items():
+            if not self._committed(shard, engine) and not woken and shard in self._after:
+                continue
+            with engine.connect() as conn:
+                if shard not in self._after:
+                    self._after[shard] = events.latest_id(conn)
+                    continue
+                batch = events.since(conn, self._after[shard], limit=POLL_LIMIT)
+            if batch:
+                self._after[shard] = batch[-1].event_id
+                rows.extend(batch)
+        return rows
+
+    def _dispatch(self, row) -> None:
+        for queue in self._streams.get(row.user_id, ()):
+            try:
+                queue.put_nowait(row)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                woken = await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                woken = False
+            self._wake.clear()
+            try:
+                rows = await run_in_threadpool(self._fetch, woken)
+            except Exception:
+                logger.warning("Polling the event log failed", exc_info=True)
+                continue
+            # The first pass only sets the starting points
+            self._ready.set()
+            for row in rows:
+                self._dispatch(row)
+            if len(rows) >= POLL_LIMIT:
+                self._wake.set()
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        "A queue of the user's new events: everything committed after this returns."
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._loop is not loop:
+            self._loop, self._streams, self._after, self._watchers, self._versions = loop, {}, {}, {}, {}
+            self._wake, self._ready = asyncio.Event(), asyncio.Event()
+            # Outside the request's context, so its SQL isn't counted against the first stream
+            self._task = self._loop.create_task(self._run(), context=contextvars.Context())
+            self._wake.set()
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self._streams.setdefault(user_id, set()).add(queue)
+        await self._ready.wait()
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._streams.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._streams[user_id]
+
+    def notify(self) -> None:
+        "Poll now instead of at the next interval; safe to call from any thread."
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:  # the loop is closed
+                pass
+
+
+broker = Broker()
+
+metrics.REGISTRY.gauge(
+    "spendsense_sse_connections", "Open GET /events streams in this worker", (),
+    lambda: {(): broker.connections},
+)
+
+
+def _shard_range(user_id: int) -> Optional[tuple]:
+    return sharding.id_range(sharding.shard_of(user_id)) if sharding.enabled() else None
+
+
+def opening(db: Session, user_id: int, last_event_id: Optional[int]) -> tuple:
+    """Frames a stream starts with and the last event id they cover: the missed events
+    when `last_event_id` can be resumed from, otherwise a snapshot. Closes the session,
+    so an open stream holds no database connection."""
+    try:
+        return _opening(db, user_id, last_event_id)
+    finally:
+        db.close()
+
+
+def _opening(db: Session, user_id: int, last_event_id: Optional[int]) -> tuple:
+    conn = db.connection()
+    id_range = _shard_range(user_id)
+    if last_event_id is not None and (id_range is None or id_range[0] <= last_event_id < id_range[1]) \
+            and events.resumable(conn, last_event_id):
+        missed = events.since(conn, last_event_id, user_id, limit=events.REPLAY_LIMIT + 1)
+        if len(missed) <= events.REPLAY_LIMIT:
+            frames = [_frame(row.kind, row.payload.encode(), row.event_id) for row in missed]
+            return frames, missed[-1].event_id if missed else last_event_id
+    # One read transaction, so the snapshot and the id it is tagged with agree
+    conn.exec_driver_sql("BEGIN")
+    latest = events.latest_id(conn)
+    statuses = crud.get_all_budget_statuses(db, user_id)
+    return [_frame("snapshot", dumps(statuses), latest)], latest
+
+
+async def stream(db: Session, user_id: int, queue: asyncio.Queue, frames: List[bytes], seen: int) -> AsyncIterator[bytes]:
+    "The stream of a subscribed queue, after its opening frames."
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n".encode()
+        for frame in frames:
+            yield frame
+        while True:
+            try:
+                row = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if row is RESYNC:
+                frames, seen = await run_in_threadpool(opening, db, user_id, None)
+                for frame in frames:
+                    yield frame
+            elif row.event_id > seen:  # not already in the opening frames
+                seen = row.event_id
+                yield _frame(row.kind, row.payload.encode(), row.event_id)
+    finally:
+        broker.unsubscribe(user_id, queue)
@@ -0,0 +1,79 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+"""
+Shared fixtures. Every test session runs against a fresh SQLite file and
+fresh data directories, set up here before the app modules are imported:
+
+    cd backend && python -m pytest -q
+"""
+
+_tmp = tempfile.mkdtemp(prefix="spendsense-tests-")
+atexit.register(shutil.rmtree, _tmp, ignore_errors=True)
+for name, value in {
+    "SECRET_KEY": "test-secret",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmp, 'spendsense.db')}",
+    "RATE_LIMIT_ENABLED": "0",
+    "WARMUP": "off",
+    "AUTO_MIGRATE": "1",
+    "SHARD_DIR": os.path.join(_tmp, "shards"),
+    "COLD_STORE_DIR": os.path.join(_tmp, "cold_store"),
+    "COLUMNAR_DIR": os.path.join(_tmp, "columnar"),
+    "ANALYTICS_DIR": os.path.join(_tmp, "analytics"),
+    "PROFILE_DIR": os.path.join(_tmp, "profiles"),
+    "CATEGORY_MODEL_PATH": os.path.join(_tmp, "category_model.bin"),
+}.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    "TestClient for the app; entering it runs the lifespan, which migrates the database."
+    from fastapi.testclient import TestClient
+    from mainmenu import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db(client):
+    from database.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    "Create a user and return (user, Authorization headers)."
+    from auth import create_access_token
+    from database import models
+
+    def make(email=None, **fields):
+        email = email or f"user-{uuid.uuid4().hex[:12]}@example.com"
+        user = models.User(name=fields.pop("name", "test"), email=email, password="x", **fields)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user, {"Authorization": f"Bearer {create_access_token({'sub': email})}"}
+
+    return make
+
+
+@pytest.fixture
+def category(db):
+    "A category row, shared by the tests that need one."
+    from database import crud
+
+    return crud.get_category_by_name(db, "Food") or crud.create_category(db, "Food")
@@ -0,0 +1,109 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import auth
+from database import analytics, cold, crud, database, models
+from database.category_cache import catalogue
+from database.migrate import migrate
+
+"""GET /admin/reports/spending gives the same report from SQLite and from DuckDB over a snapshot."""
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def dataset(client, tmp_path, monkeypatch):
+    "A database of its own with hot and cold expenses and a snapshot of it, with the app pointed at it."
+    monkeypatch.setattr(cold, "COLD_STORE_DIR", str(tmp_path / "cold_store"))
+    monkeypatch.setattr(analytics, "ANALYTICS_DIR", str(tmp_path / "analytics"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'analytics.db'}")
+    migrate(engine)
+    Session = sessionmaker(bind=engine)
+
+    rng = random.Random(46)
+    now = datetime.utcnow()
+    with Session() as db:
+        categories = [crud.create_category(db, name).category_id for name in ("Food", "Travel", "Rent")]
+        db.execute(insert(models.User), [
+            {"user_id": user_id, "name": "report", "email": f"report{user_id}@example.com", "password": "x"}
+            for user_id in range(1, 6)
+        ])
+        db.add(models.User(name="admin", email="admin@example.com", password="x"))
+        db.execute(insert(models.Expense), [
+            {
+                "user_id": rng.randint(1, 5),
+                "category_id": rng.choice(categories),
+                "amount": round(rng.uniform(1, 300), 2),
+                "description": "expense",
+                "expense_date": now - timedelta(days=rng.randrange(1000), minutes=rng.randrange(1440)),
+                "deleted_at": now if i % 17 == 0 else None,
+            }
+            for i in range(1500)
+        ])
+        db.commit()
+    moved = cold.run(engine, horizon_days=365)
+    assert moved["expenses"] and moved["partitions"]
+    analytics.snapshot(engine)
+
+    # Requests (and the admin's token check) open their sessions through database.SessionLocal
+    monkeypatch.setattr(database, "SessionLocal", Session)
+    monkeypatch.setattr(auth, "ADMIN_EMAILS", {"admin@example.com"})
+    client.headers["Authorization"] = f"Bearer {auth.create_access_token({'sub': 'admin@example.com'})}"
+    catalogue.invalidate()
+    yield analytics.load_manifest()
+    del client.headers["Authorization"]
+    catalogue.invalidate()
+    engine.dispose()
+
+
+def _report(client, backend):
+    response = client.get("/admin/reports/spending", params={"months": 36, "backend": backend})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _assert_same_months(expected, actual):
+    # Totals are rounded to the cent after summing in different orders
+    assert [(m["year"], m["month"], m["expenses"], m["active_users"]) for m in actual] == \
+        [(m["year"], m["month"], m["expenses"], m["active_users"]) for m in expected]
+    for a, b in zip(actual, expected):
+        assert a["total"] == pytest.approx(b["total"], abs=0.011)
+        assert a["by_category"].keys() == b["by_category"].keys()
+        for name, total in a["by_category"].items():
+            assert total == pytest.approx(b["by_category"][name], abs=0.011)
+
+
+def test_backends_agree(client, dataset):
+    live = _report(client, "sqlite")
+    snapshot = _report(client, "duckdb")
+
+    assert live["source"] == "live"
+    assert snapshot["source"] == "snapshot"
+    assert snapshot["snapshot_at"] == dataset["created_at"]
+    assert len(live["months"]) >= 30 and sum(m["expenses"] for m in live["months"]) > 1000
+    _assert_same_months(live["months"], snapshot["months"])
+
+
+@pytest.mark.parametrize("missing", ["hot", "cold"])
+def test_missing_snapshot_file_falls_back_to_sqlite(client, dataset, missing):
+    if missing == "hot":
+        os.remove(os.path.join(analytics.ANALYTICS_DIR, dataset["hot"]))
+    else:
+        os.remove(os.path.join(cold.COLD_STORE_DIR, dataset["cold"][0][0]))
+
+    report = _report(client, "duckdb")
+    assert report["source"] == "live"
+    assert report["snapshot_at"] is None
+    _assert_same_months(_report(client, "sqlite")["months"], report["months"])
+
+
+def test_no_snapshot_uses_sqlite(client, dataset):
+    os.remove(os.path.join(analytics.ANALYTICS_DIR, analytics.MANIFEST))
+    assert _report(client, "duckdb")["source"] == "live"
+
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from database import models
+
+"""GET /budgets/alerts follows budget writes without waiting for the scheduled job."""
+
+
+@pytest.fixture
+def spender(db, make_user, category):
+    "A user who has spent 150 on Food this month."
+    user, headers = make_user()
+    db.add(models.Expense(user_id=user.user_id, category_id=category.category_id, amount=150.0,
+                          expense_date=datetime.utcnow()))
+    db.commit()
+    return user, headers
+
+
+def _budget(client, headers, user, category, amount):
+    response = client.post("/budgets", headers=headers, json={
+        "user_id": user.user_id, "category_id": category.category_id, "amount": amount,
+        "start_date": "01/01/2020",
+    })
+    assert response.status_code == 200
+    return response.json()["budget_id"]
+
+
+def _alerts(client, headers, include_ok=False):
+    response = client.get("/budgets/alerts", headers=headers, params={"include_ok": include_ok})
+    assert response.status_code == 200
+    return {alert["budget_id"]: alert["level"] for alert in response.json()}
+
+
+def test_new_budget_is_alerted(client, spender, category):
+    user, headers = spender
+    over = _budget(client, headers, user, category, 100.0)
+    fine = _budget(client, headers, user, category, 1000.0)
+
+    assert _alerts(client, headers) == {over: "over"}
+    assert _alerts(client, headers, include_ok=True) == {over: "over", fine: "ok"}
+
+
+def test_lowered_budget_is_alerted(client, spender, category):
+    user, headers = spender
+    budget_id = _budget(client, headers, user, category, 1000.0)
+    assert _alerts(client, headers) == {}
+
+    assert client.put(f"/budgets/{budget_id}", headers=headers, json={"amount": 160.0}).status_code == 200
+    assert _alerts(client, headers) == {budget_id: "approaching"}
+    assert client.put(f"/budgets/{budget_id}", headers=headers, json={"amount": 100.0}).status_code == 200
+    assert _alerts(client, headers) == {budget_id: "over"}
+
+
+def test_deleted_and_deactivated_budgets_are_not_alerted(client, spender, category):
+    user, headers = spender
+    deleted = _budget(client, headers, user, category, 100.0)
+    deactivated = _budget(client, headers, user, category, 50.0)
+    assert _alerts(client, headers) == {deleted: "over", deactivated: "over"}
+
+    assert client.delete(f"/budgets/{deleted}", headers=headers).status_code == 200
+    assert client.put(f"/budgets/{deactivated}", headers=headers, json={"is_active": False}).status_code == 200
+    assert _alerts(client, headers, include_ok=True) == {}
+
+
+def test_stale_rows_of_inactive_budgets_are_hidden(db, client, spender, category):
+    # Rows the job wrote before a budget was deactivated elsewhere, e.g. straight in the database
+    user, headers = spender
+    budget_id = _budget(client, headers, user, category, 100.0)
+    db.query(models.Budget).filter(models.Budget.budget_id == budget_id).update({"is_active": 0})
+    db.commit()
+
+    assert _alerts(client, headers) == {}
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import crud, models
+from monitoring.query_counter import max_queries
+
+"""Budget statuses are summed in one query, whatever the number of budgets."""
+
+
+def _week_start(now):
+    return (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def budgets(db, make_user, category):
+    user, headers = make_user()
+    now = datetime.utcnow()
+    week_start = _week_start(now)
+    db.add_all([
+        models.Budget(user_id=user.user_id, amount=100.0, period="weekly", category_id=category.category_id,
+                      start_date=datetime(2020, 1, 1)),
+        models.Budget(user_id=user.user_id, amount=1000.0, period="monthly", start_date=datetime(2020, 1, 1)),
+        models.Budget(user_id=user.user_id, amount=5000.0, period="yearly", start_date=datetime(2020, 1, 1)),
+    ])
+    dates = [
+        week_start,                          # first second of the week
+        now,
+        week_start - timedelta(seconds=1),   # last second of the previous week
+        week_start - timedelta(days=8),
+    ]
+    db.add_all(
+        models.Expense(user_id=user.user_id, category_id=category.category_id, amount=10.0 * (i + 1), expense_date=date)
+        for i, date in enumerate(dates)
+    )
+    db.add(models.Expense(user_id=user.user_id, category_id=category.category_id, amount=999.0, expense_date=now,
+                          deleted_at=now))
+    db.commit()
+
+    def expected(start, end):
+        return round(sum(10.0 * (i + 1) for i, date in enumerate(dates) if start <= date < end), 2)
+
+    month_start = datetime(now.year, now.month, 1)
+    next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    return user, headers, {
+        "weekly": expected(week_start, week_start + timedelta(days=7)),
+        "monthly": expected(month_start, next_month),
+        "yearly": expected(datetime(now.year, 1, 1), datetime(now.year + 1, 1, 1)),
+    }
+
+
+def test_statuses_are_one_query(db, budgets):
+    user, _, expected = budgets
+    user_id = user.user_id
+    with max_queries(2):  # the budgets, then one conditional SUM for all of them
+        statuses = crud.get_all_budget_statuses(db, user_id)
+
+    assert {status["period"]: status["spent_amount"] for status in statuses} == expected
+    # The weekly period runs from Monday 00:00 for seven days, across month ends too
+    assert expected["weekly"] == 30.0
+    weekly = next(status for status in statuses if status["period"] == "weekly")
+    assert weekly["category_name"] == "Food"
+    assert 0 <= weekly["days_remaining"] <= 6
+
+
+def test_statuses_match_per_budget_query(db, budgets):
+    user, _, _ = budgets
+    statuses = crud.get_all_budget_statuses(db, user.user_id)
+    for status in statuses:
+        assert status == crud.get_budget_status(db, status["budget_id"])
+
+
+def test_status_endpoint_query_count(client, budgets):
+    _, headers, expected = budgets
+    with max_queries(4):
+        response = client.get("/budgets/status", headers=headers)
+
+    assert response.status_code == 200
+    assert {status["period"]: status["spent_amount"] for status in response.json()} == expected
+
+
+def test_query_count_does_not_grow_with_budgets(db, client, budgets):
+    user, headers, _ = budgets
+    db.add_all(
+        models.Budget(user_id=user.user_id, amount=50.0 + i, period="monthly", start_date=datetime(2020, 1, 1))
+        for i in range(20)
+    )
+    db.commit()
+    with max_queries(4):
+        response = client.get("/budgets/status", headers=headers)
+    assert len(response.json()) == 23
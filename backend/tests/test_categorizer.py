@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+from ai import categorizer as categorizer_module
+from ai.categorizer import Categorizer, Model, train
+from database import models
+
+"""Training runs one at a time per process and saves through a unique temp file."""
+
+
+@pytest.fixture
+def labelled(db, make_user, category):
+    user, _ = make_user()
+    db.add_all(
+        models.Expense(user_id=user.user_id, category_id=category.category_id, amount=4.0, description=description)
+        for description in ["coffee", "coffee beans", "lunch", "coffee shop"] * 5
+    )
+    db.commit()
+    return user
+
+
+def test_train_saves_model_without_leftovers(db, labelled, tmp_path):
+    path = str(tmp_path / "model.bin")
+    result = train(db, path, full=True)
+
+    assert result["documents"] >= 20
+    assert os.listdir(tmp_path) == ["model.bin"]
+    model = Model(path)
+    assert model.predict("coffee")[0] == labelled.expenses[0].category_id
+    model.close()
+
+
+def test_train_is_skipped_while_another_run_holds_the_lock(db, labelled, tmp_path):
+    path = str(tmp_path / "model.bin")
+    with categorizer_module._training:
+        assert train(db, path)["skipped"]
+    assert not os.path.exists(path)
+
+
+def test_concurrent_maybe_retrain_starts_one_run(db, labelled, tmp_path, monkeypatch):
+    path = str(tmp_path / "model.bin")
+    train(db, path, full=True)
+    expense = labelled.expenses[0]
+    db.add_all(
+        models.CategoryCorrection(expense_id=expense.expense_id, description="coffee",
+                                  old_category_id=expense.category_id, new_category_id=expense.category_id)
+        for _ in range(3)
+    )
+    db.commit()
+    monkeypatch.setattr(categorizer_module, "CATEGORY_RETRAIN_AFTER", 3)
+
+    runs = []
+    release = threading.Event()
+
+    def slow_train(db, path, full):
+        runs.append(path)
+        release.wait(5)
+        return {}
+
+    monkeypatch.setattr(categorizer_module, "_train", slow_train)
+    instance = Categorizer(path)
+    started = [instance.maybe_retrain(db) for _ in range(5)]
+    assert train(db, path)["skipped"]
+    release.set()
+
+    assert started.count(True) == 1
+    for thread in threading.enumerate():
+        if thread.name == "categorizer-retrain":
+            thread.join(5)
+    assert runs == [path]
+    assert not categorizer_module._training.locked()
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import auth
+from monitoring import profiling
+
+"""Only a live admin's token in the X-Profile header turns profiling on."""
+
+
+def _token(headers):
+    return headers["Authorization"].split(" ", 1)[1]
+
+
+def _admin(make_user, monkeypatch):
+    admin, headers = make_user()
+    monkeypatch.setattr(auth, "ADMIN_EMAILS", {admin.email})
+    return admin, headers
+
+
+def test_header_token_profiles_request(client, make_user, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    _, headers = _admin(make_user, monkeypatch)
+
+    response = client.get("/budgets/status", headers={**headers, "X-Profile": _token(headers)})
+    assert "x-profile-id" in response.headers
+    request_id = response.headers["x-profile-id"]
+    assert (tmp_path / f"{request_id}.folded").exists()
+    assert [profile["request_id"] for profile in profiling.list_profiles()] == [request_id]
+
+    response = client.get(f"/budgets/status?profile={_token(headers)}", headers=headers)
+    assert "x-profile-id" not in response.headers
+
+
+def test_non_admin_and_deleted_admin_are_ignored(db, make_user, monkeypatch):
+    _, headers = make_user()
+    assert not profiling._is_admin_token(_token(headers))
+
+    admin, headers = _admin(make_user, monkeypatch)
+    assert profiling._is_admin_token(_token(headers))
+    admin.deleted_at = datetime.utcnow()
+    db.commit()
+    assert not profiling._is_admin_token(_token(headers))
@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import models, search
+
+"""Search reads the most recently written matches, and sort=recent shows them in the expense list's order."""
+
+
+@pytest.fixture
+def expenses(db, make_user, category):
+    user, _ = make_user()
+    rng = random.Random(39)
+    start = datetime(2024, 1, 1)
+    # Dates out of step with ids, like backdated expenses, with a few ties
+    db.add_all(
+        models.Expense(user_id=user.user_id, category_id=category.category_id, amount=1.0,
+                       description=rng.choice(["coffee beans", "coffee", "train ticket", "lunch"]),
+                       expense_date=start + timedelta(days=rng.randrange(60)))
+        for _ in range(300)
+    )
+    db.commit()
+    rows = db.query(models.Expense).filter_by(user_id=user.user_id).all()
+    return user.user_id, rows
+
+
+def _matching(rows, word):
+    return [row for row in rows if word in search.tokenize(row.description)]
+
+
+def _by_date(rows):
+    return [row.expense_id for row in sorted(rows, key=lambda row: (row.expense_date, row.expense_id), reverse=True)]
+
+
+@pytest.mark.parametrize("fts", [True, False])
+@pytest.mark.parametrize("window", [5, 40, 1000])
+def test_candidates_are_most_recently_written(db, expenses, monkeypatch, fts, window):
+    user_id, rows = expenses
+    if not fts:
+        monkeypatch.setattr(search, "index_available", lambda db: False)
+    elif not search.index_available(db):
+        pytest.skip("SQLite built without FTS5")
+
+    found = search.candidates(db, user_id, search.parse_query("coffee"), window=window)
+    expected = sorted((row.expense_id for row in _matching(rows, "coffee")), reverse=True)[:window]
+    assert [row.expense_id for row in found] == expected
+
+
+def test_recent_sort_uses_expense_date(db, expenses):
+    user_id, rows = expenses
+    result = search.search_expenses(db, user_id, "train", sort="recent", limit=50)
+    # Every match fits in the window, so the page is the expense list's first 50
+    assert [row["expense_id"] for row in result["results"]] == _by_date(_matching(rows, "train"))[:50]
+
+    relevance = search.search_expenses(db, user_id, "coffee", limit=300)
+    scores = [row["score"] for row in relevance["results"]]
+    assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import mainmenu
+from database import sharding
+
+"""A sharded request is routed to its user's shard and may not write for another user."""
+
+
+def _request(headers, path_params=None):
+    return Request({
+        "type": "http", "method": "POST", "path": "/expenses", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "path_params": path_params or {},
+    })
+
+
+def test_body_user_must_be_token_user(client, make_user, monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_COUNT", 4)
+    user, headers = make_user()
+    other, _ = make_user()
+
+    assert mainmenu._request_shard(_request(headers), user.user_id) == sharding.shard_of(user.user_id)
+    assert mainmenu._request_shard(_request(headers), str(user.user_id)) == sharding.shard_of(user.user_id)
+    with pytest.raises(HTTPException) as refused:
+        mainmenu._request_shard(_request(headers), other.user_id)
+    assert refused.value.status_code == 403
+
+    # Without a token the body's user is the request's user
+    assert mainmenu._request_shard(_request({}), other.user_id) == sharding.shard_of(other.user_id)
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import ssl
+import threading
+import time
+from datetime import datetime, timedelta
+
+import h11
+import pytest
+from sqlalchemy import select, update
+
+import webhook_delivery
+from database import models, webhooks
+from database.database import engine
+
+"""Webhook delivery against a local receiver: signatures, retries, dead letters, 410 and keep-alive."""
+
+_deliveries = models.WebhookDelivery.__table__
+
+
+class Receiver:
+    """
+    HTTP/1.1 endpoint on 127.0.0.1, served from a thread of its own. Each
+    request is answered with the next (status, headers) of `responses`, then
+    with `default`.
+    """
+
+    def __init__(self):
+        self.requests = []  # (headers, body)
+        self.responses = []
+        self.default = (200, [])
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._serve, "127.0.0.1", 0), self.loop).result()
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/hook"
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        conn = h11.Connection(h11.SERVER)
+        try:
+            while True:
+                event = conn.next_event()
+                if event is h11.NEED_DATA:
+                    conn.receive_data(await reader.read(65536))
+                elif isinstance(event, h11.Request):
+                    headers, body = {k.decode().lower(): v.decode() for k, v in event.headers}, b""
+                elif isinstance(event, h11.Data):
+                    body += event.data
+                elif isinstance(event, h11.EndOfMessage):
+                    self.requests.append((headers, body))
+                    status, extra = self.responses.pop(0) if self.responses else self.default
+                    writer.write(conn.send(h11.Response(status_code=status, headers=[("Content-Length", "0"), *extra])))
+                    writer.write(conn.send(h11.EndOfMessage()))
+                    await writer.drain()
+                    conn.start_next_cycle()
+                else:
+                    break
+        except (ConnectionError, h11.ProtocolError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    monkeypatch.setattr(webhook_delivery, "ALLOW_HTTP", True)
+    monkeypatch.setattr(webhook_delivery, "ALLOW_PRIVATE", True)
+    receiver = Receiver()
+    yield receiver
+    receiver.stop()
+
+
+@pytest.fixture
+def hook(db, make_user, receiver):
+    user, _ = make_user()
+    webhook = webhooks.create(db, user.user_id, receiver.url, ["budget_alert"])
+    yield webhook
+    webhooks.delete_webhook(db, webhook.webhook_id)
+
+
+def run(*steps):
+    """
+    Run one Deliverer's run_once per step in a single event loop, so its
+    connections carry over, calling each step (when not None) first.
+    Returns the outcome counts of each run and the deliverer.
+    """
+    deliverer = webhook_delivery.Deliverer()
+
+    async def main():
+        try:
+            results = []
+            for step in steps:
+                if step is not None:
+                    step()
+                results.append(await deliverer.run_once())
+            return results
+        finally:
+            deliverer.close()
+            await asyncio.sleep(0)
+
+    return asyncio.run(main()), deliverer
+
+
+def queued(webhook_id):
+    with engine.connect() as conn:
+        return conn.execute(select(_deliveries).where(_deliveries.c.webhook_id == webhook_id)).all()
+
+
+def make_due(webhook_id):
+    with engine.begin() as conn:
+        conn.execute(update(_deliveries).where(_deliveries.c.webhook_id == webhook_id)
+                     .values(next_attempt_at=datetime.utcnow()))
+
+
+def test_delivery_is_signed(db, hook, receiver):
+    delivery_id = webhooks.ping(db, hook)
+    (counts,), _ = run(None)
+
+    assert counts == {"delivered": 1}
+    assert queued(hook.webhook_id) == []
+    (headers, body), = receiver.requests
+    assert headers["x-spendsense-event"] == "ping"
+    assert headers["x-spendsense-delivery"] == str(delivery_id)
+    assert json.loads(body)["data"] == {"webhook_id": hook.webhook_id}
+
+    signature = headers["x-spendsense-signature"]
+    assert webhook_delivery.verify(hook.secret, signature, body)
+    assert not webhook_delivery.verify(hook.secret, signature, body + b" ")
+    assert not webhook_delivery.verify("another secret", signature, body)
+    assert not webhook_delivery.verify(hook.secret, signature, body, now=time.time() + 600)
+
+
+def test_retry_with_backoff_and_retry_after(db, hook, receiver, monkeypatch):
+    monkeypatch.setattr(webhook_delivery, "RETRY_BASE_SECONDS", 30)
+    receiver.responses = [(503, [("Retry-After", "120")]), (500, [])]
+    webhooks.ping(db, hook)
+
+    started = datetime.utcnow()
+    (counts,), _ = run(None)
+    assert counts == {"retry": 1}
+    row, = queued(hook.webhook_id)
+    assert (row.attempts, row.last_status, row.last_error) == (1, 503, "HTTP 503")
+    # The first backoff is 15-30 s; Retry-After asks for longer
+    assert timedelta(seconds=119) <= row.next_attempt_at - started <= timedelta(seconds=125)
+    assert run(None)[0] == [{}]  # not due yet
+
+    make_due(hook.webhook_id)
+    started = datetime.utcnow()
+    run(None)
+    row, = queued(hook.webhook_id)
+    assert (row.attempts, row.last_status) == (2, 500)
+    # Second failure: 60 s with half of it jittered
+    assert timedelta(seconds=29) <= row.next_attempt_at - started <= timedelta(seconds=65)
+
+    make_due(hook.webhook_id)
+    assert run(None)[0] == [{"delivered": 1}]
+    assert len(receiver.requests) == 3
+
+    for attempt in range(1, 30):
+        delay = webhook_delivery.retry_delay(attempt)
+        cap = min(webhook_delivery.RETRY_MAX_SECONDS, 30 * 2 ** (attempt - 1))
+        assert cap / 2 <= delay <= cap
+
+
+def test_dead_letter_after_max_attempts(db, hook, receiver, monkeypatch):
+    monkeypatch.setattr(webhooks, "MAX_ATTEMPTS", 3)
+    receiver.default = (500, [])
+    delivery_id = webhooks.ping(db, hook)
+
+    counts, _ = run(None, lambda: make_due(hook.webhook_id), lambda: make_due(hook.webhook_id))
+    assert counts == [{"retry": 1}, {"retry": 1}, {"dead": 1}]
+    assert queued(hook.webhook_id) == []
+    letter, = webhooks.dead_letters(db, hook.user_id)
+    assert (letter.delivery_id, letter.attempts, letter.last_status, letter.last_error) == (delivery_id, 3, 500, "HTTP 500")
+
+    # Retrying a dead letter queues it again from the first attempt
+    receiver.default = (200, [])
+    assert webhooks.retry(db, delivery_id)
+    assert run(None)[0] == [{"delivered": 1}]
+    assert webhooks.dead_letters(db, hook.user_id) == []
+
+
+def test_gone_deactivates_webhook(db, hook, receiver):
+    receiver.default = (410, [])
+    for _ in range(3):
+        webhooks.ping(db, hook)
+
+    (counts,), _ = run(None)
+    assert counts["gone"] == 3
+    assert queued(hook.webhook_id) == []
+    assert len(webhooks.dead_letters(db, hook.user_id)) == 3
+    db.refresh(hook)
+    assert (hook.is_active, hook.last_status) == (0, 410)
+
+    # Nothing more is sent to it
+    webhooks.ping(db, hook)
+    requests = len(receiver.requests)
+    assert run(None)[0] == [{}]
+    assert len(receiver.requests) == requests
+
+
+def test_connections_are_reused(db, hook, receiver, monkeypatch):
+    monkeypatch.setattr(webhook_delivery, "CONNECTIONS_PER_ENDPOINT", 2)
+
+    def queue_pings():
+        for _ in range(10):
+            webhooks.ping(db, hook)
+
+    counts, _ = run(queue_pings, queue_pings, queue_pings)
+    assert counts == [{"delivered": 10}] * 3
+    assert len(receiver.requests) == 30
+    assert receiver.connections <= 2
+
+
+def test_tls_errors_are_retried(db, hook, monkeypatch):
+    # ssl.SSLCertVerificationError is a ValueError as well as an OSError
+    async def post(self, target, headers, body):
+        raise ssl.SSLCertVerificationError("certificate verify failed")
+
+    monkeypatch.setattr(webhook_delivery.Endpoint, "post", post)
+    webhooks.ping(db, hook)
+    (counts,), _ = run(None)
+
+    assert counts == {"retry": 1}
+    row, = queued(hook.webhook_id)
+    assert row.last_error.startswith("SSLCertVerificationError")
+
+
+def test_disallowed_url_is_dead_lettered(db, hook, receiver, monkeypatch):
+    monkeypatch.setattr(webhook_delivery, "ALLOW_PRIVATE", False)
+    webhooks.ping(db, hook)
+    (counts,), _ = run(None)
+
+    assert counts == {"dead": 1}
+    assert receiver.requests == []
+    letter, = webhooks.dead_letters(db, hook.user_id)
+    assert letter.last_error == "webhook URLs may not point to a private address"
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from database.database import SessionLocal, engine
+from database.category_cache import catalogue, normalize_category_name
+from monitoring import metrics
+
+"""
+Warmup hooks run once per worker after the app starts.
+
+The app factory keeps imports lazy so workers boot fast, which moves some
+one-off costs onto the first requests: importing the AI subsystem, passlib
+and jose, compiling the parser regexes, loading the category catalogue,
+compiling the hot SQL statements into SQLAlchemy's statement cache and
+mapping the categorizer model. The hooks below pay those costs up front.
+
+WARMUP selects when they run:
+
+    background  (default) in a thread, the worker accepts requests right away
+    blocking    before the worker accepts requests (startup waits for it)
+    off         never; everything is loaded by the first request that needs it
+
+A failing hook is logged and skipped, warmup never stops a worker starting.
+When tables are missing the schema check logs a warning and the hooks that
+query the database are skipped.
+Durations are exported on /metrics as spendsense_warmup_seconds.
+"""
+
+logger = logging.getLogger("spendsense.warmup")
+
+WARMUP = os.getenv("WARMUP", "background")
+
+# One query per intent and time expression the parsers know about
+SAMPLE_QUERIES = (
+    "how much did i spend this month",
+    "category breakdown for march 2024",
+    "spending trend over the last week",
+    "where do i spend the most",
+    "compare months january and february",
+    "forecast my spending",
+    "detect anomalies in food",
+    "budget suggestions",
+    "what was my biggest expense on 12 june 2024",
+    "give me a summary report for week 3",
+    "which subscriptions do i have",
+)
+
+# Hooks and how long they took in this process
+_durations: Dict[str, float] = {}
+
+
+def warm_imports() -> None:
+    import auth
+    import ai.intents
+    import ai.parser
+    import ai.processor  # noqa: F401
+    from jose import jwt  # noqa: F401
+    auth._pwd_context()
+
+
+def warm_regexes() -> None:
+    from ai.intents import parse_intent_from_query
+    from ai.parser import parse_intent
+
+    for query in SAMPLE_QUERIES:
+        parse_intent_from_query(query)
+        parse_intent(query)
+    normalize_category_name("Food & Dining")
+
+
+def _session():
+    "A session like the requests': on shard 0 when the storage is sharded."
+    from database import sharding
+
+    return sharding.session(0) if sharding.enabled() else SessionLocal()
+
+
+def warm_categories() -> None:
+    with _session() as db:
+        catalogue.names(db)
+
+
+def warm_statements() -> None:
+    "Compile the statements behind the hot endpoints (user id 0 matches no rows)."
+    from database import crud, reads, search
+
+    with _session() as db:
+        crud.get_user_by_id(db, 0)
+        crud.get_user_by_email(db, "")
+        crud.get_all_budget_statuses(db, 0)
+        crud.get_monthly_expense_summary(db, 0, 1, 2000)
+        reads.budget_rows_with_names(db, 0)
+        reads.list_categories(db)
+        reads.list_chat_messages(db, 0)
+        list(reads.iter_expenses(db, 0))
+        search.search_expenses(db, 0, "warmup")
+
+
+def warm_categorizer() -> None:
+    "Map the categorizer model, if one has been trained."
+    from ai.categorizer import categorizer
+
+    categorizer.model()
+
+
+def check_schema() -> bool:
+    from database import sharding
+    from database.migrate import missing_tables
+
+    missing = sharding.missing_tables() if sharding.enabled() else missing_tables(engine)
+    if missing:
+        logger.warning("Missing tables %s, run `python -m database.migrate`", ", ".join(missing))
+    return not missing
+
+
+# (name, hook, needs the schema)
+HOOKS: List[Tuple[str, Callable[[], None], bool]] = [
+    ("imports", warm_imports, False),
+    ("regexes", warm_regexes, False),
+    ("categories", warm_categories, True),
+    ("statements", warm_statements, True),
+    ("categorizer", warm_categorizer, False),
+]
+
+
+def _run(name: str, hook: Callable):
+    start = time.perf_counter()
+    try:
+        return hook()
+    except Exception:
+        logger.warning("Warmup hook %s failed", name, exc_info=True)
+    finally:
+        _durations[name] = time.perf_counter() - start
+
+
+def run_hooks() -> Dict[str, float]:
+    schema_ok = _run("schema", check_schema)
+    for name, hook, needs_schema in HOOKS:
+        if schema_ok or not needs_schema:
+            _run(name, hook)
+    return dict(_durations)
+
+
+def start(mode: str = WARMUP) -> None:
+    if mode == "blocking":
+        run_hooks()
+    elif mode == "background":
+        threading.Thread(target=run_hooks, name="warmup", daemon=True).start()
+
+
+metrics.REGISTRY.gauge(
+    "spendsense_warmup_seconds", "Time spent in each warmup hook", ("hook",),
+    lambda: {(name,): round(seconds, 6) for name, seconds in _durations.items()},
+)
@@ -0,0 +1,538 @@
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import ssl
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import h11
+from starlette.concurrency import run_in_threadpool
+
+from database import sharding, webhooks
+from database.database import engine as default_engine
+from monitoring import metrics
+
+"""
+Sends the webhook queue (database/webhooks.py): each delivery is one POST
+of a JSON body to the user's endpoint.
+
+    {"delivery_id": 812, "event_id": 1235, "type": "budget_alert",
+     "created_at": "2026-10-19T10:41:11.204511Z", "data": {...the event...}}
+
+    X-SpendSense-Signature: t=1760870471,v1=<hex HMAC-SHA256 of "<t>.<body>" with the webhook secret>
+    X-SpendSense-Event: budget_alert
+    X-SpendSense-Delivery: 812
+
+Receivers should check the signature with verify() (or the same few lines
+in their language), reject old timestamps and skip delivery ids they have
+seen, since a delivery can arrive twice.
+
+A Deliverer claims due deliveries in batches of up to BATCH_SIZE, keeping
+at most MAX_IN_FLIGHT in flight, and sends them concurrently. It keeps up
+to CONNECTIONS_PER_ENDPOINT HTTP/1.1 keep-alive connections per endpoint
+(scheme, host, port), so consecutive deliveries to one receiver reuse
+their connections. A webhook's deliveries in a batch are recorded once
+they are all answered, so a slow endpoint holds up no other; outcomes
+that come in while a write is running go out together in the next one:
+
+  2xx       delivered, removed from the queue
+  410       the endpoint is gone: the webhook is deactivated and its deliveries dead-lettered
+  other     retried after RETRY_BASE_SECONDS * 2^(attempts - 1), capped at RETRY_MAX_SECONDS,
+            half of it jittered, or after Retry-After if that is longer; dead-lettered
+            after webhooks.MAX_ATTEMPTS attempts
+
+Redirects are not followed. URLs must be https (WEBHOOK_ALLOW_HTTP=1 allows
+http) and may not resolve to loopback, private or link-local addresses
+(WEBHOOK_ALLOW_PRIVATE=1 allows them, for local receivers); the address is
+checked when connecting, not only at registration.
+
+    WEBHOOK_DELIVERY_ENABLED=1 uvicorn mainmenu:app   # a task in every app worker
+    python -m webhook_delivery run                    # or a separate worker process
+
+Expense writes wake the deliverer of their own worker; the others find new
+deliveries within POLL_SECONDS. Exported on /metrics:
+spendsense_webhook_delivery_latency_seconds (event to delivered, retries
+included), spendsense_webhook_request_seconds and
+spendsense_webhook_deliveries_total.
+"""
+
+logger = logging.getLogger("spendsense.webhooks")
+
+WEBHOOK_DELIVERY_ENABLED = os.getenv("WEBHOOK_DELIVERY_ENABLED", "0") == "1"
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "800"))
+CONNECTIONS_PER_ENDPOINT = int(os.getenv("WEBHOOK_CONNECTIONS_PER_ENDPOINT", "4"))
+TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1"))
+RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "21600"))
+ALLOW_HTTP = os.getenv("WEBHOOK_ALLOW_HTTP", "0") == "1"
+ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "0") == "1"
+IDLE_SECONDS = 30.0  # keep-alive connections unused this long are closed
+MAX_RESPONSE_BYTES = 64 * 1024  # read of a response body; a longer one closes the connection
+MAX_URL_LENGTH = 2048
+SIGNATURE_TOLERANCE_SECONDS = 300
+USER_AGENT = "SpendSense-Webhooks/1.0"
+
+DELIVERY_LATENCY = metrics.REGISTRY.histogram(
+    "spendsense_webhook_delivery_latency_seconds", "Time from an event to its delivery, retries included", (),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0, 60.0, 300.0, 3600.0, 21600.0))
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "spendsense_webhook_request_seconds", "Webhook POST time, connecting included", ("outcome",))
+DELIVERIES = metrics.REGISTRY.counter(
+    "spendsense_webhook_deliveries_total", "Webhook delivery attempts by outcome", ("outcome",))
+
+
+#  Signing
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    "The X-SpendSense-Signature header of a body sent at `timestamp`."
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify(secret: str, header: str, body: bytes, tolerance: float = SIGNATURE_TOLERANCE_SECONDS,
+           now: Optional[float] = None) -> bool:
+    "Whether a received signature header matches the body and is recent, for receivers."
+    fields = dict(part.split("=", 1) for part in header.split(",") if "=" in part)
+    try:
+        timestamp = int(fields["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs((now or time.time()) - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), f"t={timestamp},v1={fields.get('v1', '')}")
+
+
+def body_of(delivery: dict) -> bytes:
+    envelope = json.dumps({
+        "delivery_id": delivery["delivery_id"], "event_id": delivery["event_id"], "type": delivery["kind"],
+        "created_at": delivery["created_at"].isoformat() + "Z",
+    }, separators=(",", ":"))
+    # The payload is stored as JSON already
+    return (envelope[:-1] + ',"data":' + delivery["payload"] + "}").encode()
+
+
+#  Addresses
+
+def _public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast
+                or ip.is_reserved or ip.is_unspecified)
+
+
+class InvalidURL(ValueError):
+    pass
+
+
+def check_url(url: str) -> None:
+    "Raise InvalidURL for a URL deliveries may not be sent to."
+    if len(url) > MAX_URL_LENGTH:
+        raise InvalidURL(f"webhook URLs are limited to {MAX_URL_LENGTH} characters")
+    parts = urlsplit(url)
+    if parts.scheme not in (("https", "http") if ALLOW_HTTP else ("https",)):
+        raise InvalidURL("webhook URLs must use https")
+    if not parts.hostname:
+        raise InvalidURL("webhook URL has no host")
+    if parts.username or parts.password:
+        raise InvalidURL("webhook URLs may not contain credentials")
+    try:
+        parts.port
+    except ValueError:
+        raise InvalidURL("webhook URL has an invalid port")
+    if ALLOW_PRIVATE:
+        return
+    if parts.hostname == "localhost" or parts.hostname.endswith(".localhost"):
+        raise InvalidURL("webhook URLs may not point to a private address")
+    try:
+        literal = ipaddress.ip_address(parts.hostname)
+    except ValueError:
+        return  # a name: checked again when connecting
+    if not _public(str(literal)):
+        raise InvalidURL("webhook URLs may not point to a private address")
+
+
+class BlockedAddress(ConnectionError):
+    pass
+
+
+#  HTTP/1.1 client
+
+class _Connection:
+    "One keep-alive connection, sending a request at a time."
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader, self.writer = reader, writer
+        self.h11 = h11.Connection(h11.CLIENT)
+        self.idle_since = time.monotonic()
+
+    def usable(self) -> bool:
+        return not self.reader.at_eof() and time.monotonic() - self.idle_since < IDLE_SECONDS
+
+    async def post(self, target: str, headers: List[Tuple[str, str]], body: bytes) -> Tuple[int, dict, bool]:
+        "(status, response headers, whether the connection can be reused)."
+        data = self.h11.send(h11.Request(method="POST", target=target, headers=headers))
+        data += self.h11.send(h11.Data(data=body)) + self.h11.send(h11.EndOfMessage())
+        self.writer.write(data)
+        await self.writer.drain()
+        response, received = None, 0
+        while True:
+            event = self.h11.next_event()
+            if event is h11.NEED_DATA:
+                self.h11.receive_data(await self.reader.read(65536))
+            elif isinstance(event, h11.Response):
+                response = event
+            elif isinstance(event, h11.Data):
+                received += len(event.data)
+                if received > MAX_RESPONSE_BYTES:
+                    return response.status_code, self._headers(response), False
+            elif isinstance(event, h11.EndOfMessage):
+                break
+            elif isinstance(event, h11.ConnectionClosed):
+                raise ConnectionResetError("connection closed before the response")
+        reusable = self.h11.our_state is h11.DONE and self.h11.their_state is h11.DONE
+        if reusable:
+            self.h11.start_next_cycle()
+            self.idle_since = time.monotonic()
+        return response.status_code, self._headers(response), reusable
+
+    @staticmethod
+    def _headers(response: h11.Response) -> dict:
+        return {name.decode().lower(): value.decode("latin-1") for name, value in response.headers}
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def _tls() -> ssl.SSLContext:
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class Endpoint:
+    "Keep-alive connections to one (scheme, host, port), at most CONNECTIONS_PER_ENDPOINT in use."
+
+    def __init__(self, scheme: str, host: str, port: int):
+        self.scheme, self.host, self.port = scheme, host, port
+        default = 443 if scheme == "https" else 80
+        self.host_header = host if port == default else f"{host}:{port}"
+        if ":" in host:  # IPv6 literal
+            self.host_header = f"[{host}]" if port == default else f"[{host}]:{port}"
+        self.idle: List[_Connection] = []
+        self.slots = asyncio.Semaphore(CONNECTIONS_PER_ENDPOINT)
+        self.opened = 0
+
+    async def _connect(self) -> _Connection:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        addresses = [info[4][0] for info in infos if ALLOW_PRIVATE or _public(info[4][0])]
+        if not addresses:
+            raise BlockedAddress(f"{self.host} resolves to no public address")
+        tls = self.scheme == "https"
+        reader, writer = await asyncio.open_connection(
+            addresses[0], self.port, ssl=_tls() if tls else None, server_hostname=self.host if tls else None)
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    async def _send(self, connection: _Connection, target: str, headers: list, body: bytes) -> Tuple[int, dict]:
+        try:
+            status, response_headers, reusable = await connection.post(target, headers, body)
+        except BaseException:
+            connection.close()
+            raise
+        if reusable:
+            self.idle.append(connection)
+        else:
+            connection.close()
+        return status, response_headers
+
+    async def post(self, target: str, headers: list, body: bytes) -> Tuple[int, dict]:
+        "(status, response headers) of a POST, on an idle connection when there is one."
+        headers = [("Host", self.host_header), ("Content-Length", str(len(body))), *headers]
+        async with self.slots:
+            while self.idle:
+                connection = self.idle.pop()
+                if not connection.usable():
+                    connection.close()
+                    continue
+                try:
+                    return await asyncio.wait_for(self._send(connection, target, headers, body), TIMEOUT_SECONDS)
+                except (ConnectionError, h11.RemoteProtocolError):
+                    # The server closed the idle connection meanwhile: once more on a new one
+                    break
+            async def fresh() -> Tuple[int, dict]:
+                return await self._send(await self._connect(), target, headers, body)
+            return await asyncio.wait_for(fresh(), TIMEOUT_SECONDS)
+
+    def sweep(self) -> None:
+        "Close connections idle longer than IDLE_SECONDS."
+        for connection in [connection for connection in self.idle if not connection.usable()]:
+            connection.close()
+            self.idle.remove(connection)
+
+    def close(self) -> None:
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+
+#  Delivering
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    "Seconds before the attempt after `attempt` (1 for the first failure)."
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_SECONDS))
+    return delay
+
+
+def _retry_after(headers: dict) -> Optional[float]:
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None  # absent, or an HTTP date
+
+
+class Deliverer:
+    "Claims and sends due deliveries of the database, or of every shard."
+
+    def __init__(self, owner: Optional[str] = None):
+        # host:pid:random, so two processes never share a lease
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._endpoints: Dict[Tuple[str, str, int], Endpoint] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.counts: Counter = Counter()  # outcomes recorded since start
+
+    @staticmethod
+    def _engines() -> list:
+        if sharding.enabled():
+            return [sharding.engine_for(shard) for shard in sharding.shards()]
+        return [default_engine]
+
+    def _endpoint(self, url: str) -> Tuple[Endpoint, str]:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = Endpoint(*key)
+        return endpoint, (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    async def deliver(self, delivery: dict) -> dict:
+        "Send one claimed delivery. Returns its result for webhooks.finish."
+        result = {"delivery_id": delivery["delivery_id"], "webhook_id": delivery["webhook_id"],
+                  "status": None, "error": None}
+        retry_after = None
+        started = time.perf_counter()
+        try:
+            check_url(delivery["url"])
+            endpoint, target = self._endpoint(delivery["url"])
+            body = body_of(delivery)
+            status, headers = await endpoint.post(target, [
+                ("Content-Type", "application/json"),
+                ("User-Agent", USER_AGENT),
+                ("X-SpendSense-Event", delivery["kind"]),
+                ("X-SpendSense-Delivery", str(delivery["delivery_id"])),
+                ("X-SpendSense-Signature", sign(delivery["secret"], int(time.time()), body)),
+            ], body)
+            result["status"] = status
+            if 200 <= status < 300:
+                result["outcome"] = "delivered"
+            elif status == 410:
+                result["outcome"], result["error"] = "gone", "410 Gone"
+            else:
+                result["error"] = f"HTTP {status}"
+                retry_after = _retry_after(headers) if status in (429, 503) else None
+        # Only check_url's own error: ssl.SSLCertVerificationError is a ValueError too, and is retried
+        except InvalidURL as exc:  # the URL is no longer allowed
+            result["outcome"], result["error"] = "dead", str(exc)
+        except asyncio.TimeoutError:
+            result["error"] = f"no response in {TIMEOUT_SECONDS:g} s"
+        except (OSError, h11.ProtocolError) as exc:
+            result["error"] = f"{type(exc).__name__}: {exc}"[:500]
+        elapsed = time.perf_counter() - started
+
+        attempt = delivery["attempts"] + 1
+        if "outcome" not in result:
+            if attempt >= webhooks.MAX_ATTEMPTS:
+                result["outcome"] = "dead"
+            else:
+                result["outcome"] = "retry"
+                result["retry_at"] = datetime.utcnow() + timedelta(seconds=retry_delay(attempt, retry_after))
+        REQUEST_SECONDS.observe(elapsed, "ok" if result["outcome"] == "delivered" else "failed")
+        DELIVERIES.inc(result["outcome"])
+        if result["outcome"] == "delivered":
+            DELIVERY_LATENCY.observe((datetime.utcnow() - delivery["created_at"]).total_seconds())
+        elif result["outcome"] != "retry":
+            logger.warning("Webhook delivery %s to webhook %s given up: %s", delivery["delivery_id"],
+                           delivery["webhook_id"], result["error"])
+        return result
+
+    def _begin(self) -> None:
+        "State bound to the running event loop."
+        self._loop, self._wake, self._recording = asyncio.get_running_loop(), asyncio.Event(), asyncio.Lock()
+        self._unrecorded, self._in_flight = {}, 0
+
+    def _claim(self, limit: int) -> List[tuple]:
+        "(engine, deliveries) batches of up to `limit` due deliveries in all, across the shards."
+        claimed = []
+        for engine in self._engines():
+            while limit > 0:
+                batch = webhooks.claim(engine, self.owner, min(limit, BATCH_SIZE))
+                if not batch:
+                    break
+                claimed.append((engine, batch))
+                limit -= len(batch)
+        return claimed
+
+    def _dispatch(self, claimed: List[tuple]) -> List[asyncio.Task]:
+        "A task per webhook of the claimed batches."
+        tasks = []
+        for engine, batch in claimed:
+            groups: Dict[int, List[dict]] = {}
+            for delivery in batch:
+                groups.setdefault(delivery["webhook_id"], []).append(delivery)
+            for group in groups.values():
+                self._in_flight += len(group)
+                task = self._loop.create_task(self._group(engine, group))
+                self._tasks.add(task)
+                task.add_done_callback(self._done)
+                tasks.append(task)
+        return tasks
+
+    async def _group(self, engine, group: List[dict]) -> None:
+        "Send one webhook's claimed deliveries and record them, which lets the next claim take the webhook again."
+        try:
+            results = await asyncio.gather(*(self.deliver(delivery) for delivery in group))
+            await self._record(engine, results)
+        finally:
+            self._in_flight -= len(group)
+            self._wake.set()
+
+    async def _record(self, engine, results: List[dict]) -> None:
+        "Write results in one transaction with those of any webhook that finished meanwhile."
+        self._unrecorded.setdefault(engine, []).extend(results)
+        async with self._recording:
+            # Empty when the previous holder of the lock wrote them already
+            pending = self._unrecorded.pop(engine, None)
+            if pending:
+                self.counts.update(await run_in_threadpool(webhooks.finish, engine, self.owner, pending))
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Recording webhook deliveries failed, their leases expire in %s s", webhooks.LEASE_SECONDS,
+                           exc_info=task.exception())
+
+    async def run_once(self) -> Dict[str, int]:
+        "Claim and send what is due now, until nothing is. Returns outcome counts."
+        self._begin()
+        before = Counter(self.counts)
+        while True:
+            claimed = await run_in_threadpool(self._claim, MAX_IN_FLIGHT)
+            if not claimed:
+                return dict(self.counts - before)
+            await asyncio.gather(*self._dispatch(claimed))
+
+    async def run_forever(self, stop: asyncio.Event) -> None:
+        self._begin()
+        try:
+            while not stop.is_set():
+                claimed = []
+                if self._in_flight < MAX_IN_FLIGHT:
+                    try:
+                        claimed = await run_in_threadpool(self._claim, MAX_IN_FLIGHT - self._in_flight)
+                    except Exception:
+                        logger.warning("Claiming webhook deliveries failed", exc_info=True)
+                    self._dispatch(claimed)
+                for endpoint in self._endpoints.values():
+                    endpoint.sweep()
+                if claimed and self._in_flight < MAX_IN_FLIGHT:
+                    continue  # there may be more due
+                self._wake.clear()
+                waiters = [asyncio.ensure_future(self._wake.wait()), asyncio.ensure_future(stop.wait())]
+                await asyncio.wait(waiters, timeout=POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+        finally:
+            # Deliveries not recorded keep their leases, which expire and are claimed again
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self.close()
+
+    def notify(self) -> None:
+        "Claim now instead of at the next interval; safe to call from any thread."
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:  # the loop is closed
+                pass
+
+    def close(self) -> None:
+        for endpoint in self._endpoints.values():
+            endpoint.close()
+        self._endpoints = {}
+
+
+deliverer = Deliverer()
+
+
+def start() -> Optional[Callable[[], Awaitable[None]]]:
+    "Start the deliverer task when WEBHOOK_DELIVERY_ENABLED=1. Returns a coroutine function that stops it."
+    if not WEBHOOK_DELIVERY_ENABLED:
+        return None
+    stop = asyncio.Event()
+    # Outside the lifespan's context, so its SQL isn't counted against a request
+    task = asyncio.get_running_loop().create_task(deliverer.run_forever(stop), context=contextvars.Context())
+
+    async def stopper() -> None:
+        stop.set()
+        await task
+
+    return stopper
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Send queued webhook deliveries")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="send deliveries as they become due, until interrupted")
+    sub.add_parser("once", help="send what is due now and exit")
+    args = parser.parse_args()
+
+    if args.command == "once":
+        async def once() -> dict:
+            try:
+                return await deliverer.run_once()
+            finally:
+                deliverer.close()
+        print(", ".join(f"{key} {value}" for key, value in asyncio.run(once()).items()) or "nothing due")
+        return
+    try:
+        asyncio.run(deliverer.run_forever(asyncio.Event()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()